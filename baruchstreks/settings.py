@@ -47,8 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'trips.timing.RequestTimingMiddleware',  # First, so its total covers the other middleware
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Added for static file serving
+    'django.middleware.gzip.GZipMiddleware',  # Compress pages; WhiteNoise compresses static files itself
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -143,6 +145,99 @@ AZURE_STORAGE_CONNECTION_STRING = os.environ.get('BARUCHSTREKS_STORAGE_CONNECTIO
 AZURE_STORAGE_ACCOUNT_NAME = 'baruchstreks'
 AZURE_TABLE_NAME = 'Trips'
 
+# How trips are spread over table partitions: 'single' (all in 'Trips'), 'year' (the
+# year the trip was created) or 'hash:N' (N buckets); see trips/partitions.py. After
+# changing it, run `manage.py migrate_trip_partitions`, then set the previous scheme to
+# the new one so point reads stop looking in the old partitions.
+TRIPS_PARTITION_SCHEME = os.environ.get('TRIPS_PARTITION_SCHEME', 'single')
+TRIPS_PARTITION_PREVIOUS_SCHEME = os.environ.get('TRIPS_PARTITION_PREVIOUS_SCHEME', 'single')
+TRIPS_PARTITION_FIRST_YEAR = int(os.environ.get('TRIPS_PARTITION_FIRST_YEAR', '2015'))
+
+# Secondary index of trips by completion date, class and participant, in the
+# <AZURE_TABLE_NAME>Index table (see trips/trip_index.py). Build it, or repair it,
+# with `manage.py rebuild_trip_index`.
+TRIPS_INDEX_ENABLED = os.environ.get('TRIPS_INDEX_ENABLED', 'True').lower() == 'true'
+
+# Where trips and photos are stored: 'azure' (the connection string above), 'local'
+# (a SQLite file and photo files under TRIPS_LOCAL_STORAGE_DIR), 'memory' (lost on
+# restart, for tests) or the dotted path of a trips.storage_backends.StorageBackend
+TRIPS_STORAGE_BACKEND = os.environ.get('TRIPS_STORAGE_BACKEND', 'azure')
+TRIPS_LOCAL_STORAGE_DIR = os.environ.get('TRIPS_LOCAL_STORAGE_DIR') or str(BASE_DIR / 'local_storage')
+# URL the local and memory backends serve photos from (the trips storage_media view)
+TRIPS_STORAGE_MEDIA_URL = '/trips/media/'
+
+# Azure client connection pooling (shared by table and blob clients in each worker)
+AZURE_POOL_CONNECTIONS = int(os.environ.get('AZURE_POOL_CONNECTIONS', '4'))
+AZURE_POOL_MAXSIZE = int(os.environ.get('AZURE_POOL_MAXSIZE', '16'))
+AZURE_CONNECTION_TIMEOUT = float(os.environ.get('AZURE_CONNECTION_TIMEOUT', '10'))
+AZURE_READ_TIMEOUT = float(os.environ.get('AZURE_READ_TIMEOUT', '30'))
+
+# In-process trip catalog cache: delta refresh interval and full resync interval (seconds).
+# Full resyncs pick up trips deleted by other workers.
+TRIP_CATALOG_CACHE_ENABLED = os.environ.get('TRIP_CATALOG_CACHE_ENABLED', 'True').lower() == 'true'
+TRIP_CATALOG_REFRESH_SECONDS = int(os.environ.get('TRIP_CATALOG_REFRESH_SECONDS', '30'))
+TRIP_CATALOG_FULL_SYNC_SECONDS = int(os.environ.get('TRIP_CATALOG_FULL_SYNC_SECONDS', '900'))
+
+# Local SQLite mirror of the Trips table (trips.Trip), kept current by a background
+# thread in each worker and by `manage.py sync_trip_mirror`. Once loaded, listings are
+# read from it instead of Azure, and trip pages fall back to it when Azure fails.
+TRIP_MIRROR_ENABLED = os.environ.get('TRIP_MIRROR_ENABLED', 'True').lower() == 'true'
+TRIP_MIRROR_REFRESH_SECONDS = int(os.environ.get('TRIP_MIRROR_REFRESH_SECONDS', '60'))
+TRIP_MIRROR_FULL_SYNC_SECONDS = int(os.environ.get('TRIP_MIRROR_FULL_SYNC_SECONDS', '900'))
+
+# All trips page size (?page_size= is clamped to TRIPS_MAX_PAGE_SIZE)
+TRIPS_PAGE_SIZE = int(os.environ.get('TRIPS_PAGE_SIZE', '20'))
+TRIPS_MAX_PAGE_SIZE = 100
+
+# Seconds anonymous readers may reuse the index, all trips and detail pages before
+# revalidating them with their ETag (signed-in users always revalidate)
+TRIPS_PAGE_MAX_AGE = int(os.environ.get('TRIPS_PAGE_MAX_AGE', '60'))
+
+# Rendered pages (anonymous readers) and trip card fragments are cached per catalog
+# version, so edits show up immediately; 0 turns both caches off
+TRIPS_PAGE_CACHE_SECONDS = int(os.environ.get('TRIPS_PAGE_CACHE_SECONDS', '3600'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'baruchstreks',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    }
+}
+
+# Parallel storage calls within one request (thread pool shared by the worker)
+STORAGE_FANOUT_MAX_WORKERS = int(os.environ.get('STORAGE_FANOUT_MAX_WORKERS', '8'))
+STORAGE_FANOUT_TIMEOUT = float(os.environ.get('STORAGE_FANOUT_TIMEOUT', '10'))
+# Parallel queries over the trip partitions (see TRIPS_PARTITION_SCHEME) and point reads of index lookups
+STORAGE_PARTITION_MAX_WORKERS = int(os.environ.get('STORAGE_PARTITION_MAX_WORKERS', '8'))
+# Time limit of one photo upload, counted from when that upload starts
+PHOTO_UPLOAD_TIMEOUT = float(os.environ.get('PHOTO_UPLOAD_TIMEOUT', '120'))
+
+# Photo uploads: files uploaded at once (own thread pool), parallel blocks per file,
+# and the size above which a file is sent as staged blocks instead of a single put
+PHOTO_UPLOAD_MAX_WORKERS = int(os.environ.get('PHOTO_UPLOAD_MAX_WORKERS', '4'))
+PHOTO_UPLOAD_BLOCK_CONCURRENCY = int(os.environ.get('PHOTO_UPLOAD_BLOCK_CONCURRENCY', '4'))
+AZURE_BLOB_MAX_SINGLE_PUT_SIZE = 4 * 1024 * 1024
+AZURE_BLOB_MAX_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Let the edit page upload photos straight to blob storage with short-lived SAS URLs
+# (needs CORS on the storage account, see README)
+PHOTO_DIRECT_UPLOADS = os.environ.get('PHOTO_DIRECT_UPLOADS', 'True').lower() == 'true'
+PHOTO_UPLOAD_SAS_MINUTES = 15
+
+# Make resized card/gallery/lightbox variants of uploaded photos
+PHOTO_VARIANTS_ENABLED = os.environ.get('PHOTO_VARIANTS_ENABLED', 'True').lower() == 'true'
+
+# Serve index, all trips, detail and edit from the async views (ASGI deployments only)
+TRIPS_ASYNC_VIEWS = os.environ.get('TRIPS_ASYNC_VIEWS', 'False').lower() == 'true'
+
+# Add a Server-Timing header (request total and time per storage call) to every response,
+# and log requests slower than TRIPS_SLOW_REQUEST_MS with their storage calls (0 = never)
+TRIPS_SERVER_TIMING = os.environ.get('TRIPS_SERVER_TIMING', 'True').lower() == 'true'
+TRIPS_SLOW_REQUEST_MS = int(os.environ.get('TRIPS_SLOW_REQUEST_MS', '1000'))
+
 # Mapy.cz API Key
 MAPY_CZ_API_KEY = os.environ.get('MAPY_CZ_API_KEY', '')
 
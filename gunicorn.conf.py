@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration for baruchstreks.
+
+Gunicorn picks this file up automatically when started from the project root.
+"""
+
+
+def post_worker_init(worker):
+    """Keep the local trip mirror current from a background thread in each worker
+
+    The workers share one sync lease (see TripMirror), so only one of them
+    syncs at a time.
+    """
+    from trips.views import get_data_service
+    get_data_service().start_mirror_refresher()
+
+
+def worker_exit(server, worker):
+    """Close the pooled Azure Storage clients when a worker shuts down"""
+    from trips.azure_clients import close_client_registry
+    close_client_registry()
@@ -0,0 +1,7 @@
+#!/bin/sh
+# Startup command of the Azure Web App (Configuration > General settings > Startup Command: startup.sh).
+# Migrations run once here, before gunicorn forks its workers, instead of in every process.
+set -e
+
+python manage.py migrate --noinput
+exec gunicorn baruchstreks.wsgi:application --bind=0.0.0.0:${PORT:-8000}
@@ -0,0 +1,808 @@
+import asyncio
+import io
+import logging
+
+from asgiref.sync import sync_to_async
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+from azure.storage.blob import ContentSettings
+
+from .azure_service import (
+    MANIFEST_UPDATE_ATTEMPTS,
+    TRIP_CHANGED,
+    TRIP_FILTERS,
+    catalog_page,
+    decode_cursor,
+    entity_query,
+    facet_page,
+    if_match,
+    indexed_page,
+    indexed_page_request,
+    latest_trips,
+    mirror_page,
+    mirror_search_results,
+    participant_results,
+    table_page,
+    table_token,
+)
+from .catalog_cache import sort_trips
+from .blob_service import PHOTO_HEADER_BYTES, photo_sources_from_url, upload_result, upload_stream
+from .fanout import DEFAULT_UPLOAD_WORKERS
+from .image_variants import VARIANT_CACHE_CONTROL, generate_variants
+from .photo_manifest import PhotoManifest, read_image_dimensions
+from .row_keys import is_legacy
+from .timing import timed_service
+from .trip_index import intersect_keys, indexed_values, lookup_queries, matching_entities, patched_values
+
+logger = logging.getLogger(__name__)
+
+# Size of the reads that stream an upload from its file
+UPLOAD_READ_BYTES = 4 * 1024 * 1024
+
+
+async def read_in_thread(stream, chunk_size=UPLOAD_READ_BYTES):
+    """Stream a file's contents for an aio upload, reading it in a thread so the event loop never blocks on disk"""
+    while True:
+        chunk = await asyncio.to_thread(stream.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+@timed_service('table', exclude=('get_table_client', 'get_index_table_client', 'get_cached_trip'))
+class AsyncAzureTableService:
+    """Async version of AzureTableService built on ``azure.data.tables.aio``.
+
+    Entity mapping, entity building and the catalog cache are shared with the
+    wrapped sync service, so both view stacks see the same trips. Only the
+    storage round trips differ: they are awaited on the event loop instead of
+    blocking a worker thread.
+    """
+
+    def __init__(self, table_service):
+        self.table_service = table_service
+
+    @property
+    def is_configured(self):
+        return self.table_service.is_configured
+
+    @property
+    def catalog(self):
+        return self.table_service.catalog
+
+    def get_table_client(self):
+        """Get the shared aio table client (on Azure, the one of the running event loop)"""
+        return self.table_service.storage.get_async_table_client(self.table_service.table_name)
+
+    def get_index_table_client(self):
+        """Get the shared aio client of the trip index table"""
+        return self.table_service.storage.get_async_table_client(self.table_service.index_table_name)
+
+    def _query_trip_entities(self, since=None):
+        """Query every trip partition; returns an async iterable of entities"""
+        if since is None:
+            return self._query_partitions()
+        return self._query_partitions("Timestamp ge @since", {'since': since})
+
+    async def _query_partitions(self, query_filter=None, parameters=None, select=None):
+        """Run a query on every trip partition, concurrently when there are several
+
+        Yields:
+            The entities of all partitions, partition by partition
+        """
+        table_client = self.get_table_client()
+
+        def query(partition):
+            partition_filter, partition_parameters = entity_query(partition, query_filter, parameters)
+            return table_client.query_entities(
+                query_filter=partition_filter,
+                parameters=partition_parameters,
+                select=select,
+            )
+
+        async def read(partition):
+            return [entity async for entity in query(partition)]
+
+        partitions = self.table_service.partitions.partitions()
+        if len(partitions) == 1:
+            async for entity in query(partitions[0]):
+                yield entity
+            return
+        for entities in await asyncio.gather(*(read(partition) for partition in partitions)):
+            for entity in entities:
+                yield entity
+
+    async def get_trip_entity(self, row_key):
+        """Read a trip entity from whichever partition holds it, see AzureTableService.get_trip_entity"""
+        table_client = self.get_table_client()
+        return await self._at_trip(
+            row_key, lambda partition: table_client.get_entity(partition_key=partition, row_key=row_key)
+        )
+
+    async def _at_trip(self, row_key, operation):
+        """Await a point operation in the trip's partition, then in its previous one, see AzureTableService._at_trip"""
+        locations = self.table_service.partitions.locations(row_key)
+        for partition in locations[:-1]:
+            try:
+                return await operation(partition)
+            except ResourceNotFoundError:
+                logger.debug(f"Trip {row_key} is not in partition {partition}")
+        return await operation(locations[-1])
+
+    async def _refresh_catalog(self):
+        """Refresh the catalog cache if it is stale; True if it holds data"""
+        try:
+            await self.catalog.arefresh(self._query_trip_entities, self.table_service._map_list_entity)
+        except Exception as e:
+            logger.error(f"Error refreshing trip catalog from Azure: {str(e)}", exc_info=True)
+        return self.catalog.is_loaded
+
+    async def _from_mirror(self, read):
+        """Serve a read from the local mirror, see AzureTableService._from_mirror
+
+        The mirror is queried through the Django ORM, which is sync-only.
+        """
+        if self.table_service.mirror is None:
+            return None
+        return await sync_to_async(self.table_service._from_mirror)(read)
+
+    async def _record_write(self, entity, result):
+        """Patch the catalog cache and the mirror after a write, see AzureTableService._record_write"""
+        if self.table_service.mirror is None:
+            self.table_service._record_write(entity, result)
+        else:
+            await sync_to_async(self.table_service._record_write)(entity, result)
+
+    async def _record_patch(self, patch, result, original=None):
+        """Patch the catalog cache and the mirror after a MERGE, see AzureTableService._record_patch"""
+        if self.table_service.mirror is None:
+            self.table_service._record_patch(patch, result, original)
+        else:
+            await sync_to_async(self.table_service._record_patch)(patch, result, original)
+
+    async def get_all_trips(self):
+        """Get all trips, newest first"""
+        if not self.is_configured:
+            logger.warning("No connection string available, returning empty list")
+            return []
+
+        trips = await self._from_mirror(lambda mirror: self.table_service._map_list_entities(mirror.get_entities()))
+        if trips is not None:
+            return trips
+
+        if self.catalog is not None:
+            if not await self._refresh_catalog():
+                return []
+            return self.catalog.get_trips()
+
+        try:
+            entities = [entity async for entity in self._query_trip_entities()]
+            return sort_trips(self.table_service._map_list_entities(entities))
+        except Exception as e:
+            logger.error(f"Error fetching trips from Azure: {str(e)}", exc_info=True)
+            return []
+
+    async def get_latest_trips(self, count):
+        """Get the newest trips with a $top query, see AzureTableService.get_latest_trips"""
+        if not self.is_configured:
+            logger.warning("No connection string available, returning empty list")
+            return []
+
+        trips = await self._from_mirror(
+            lambda mirror: self.table_service._map_list_entities(mirror.get_page(0, count)[0])
+        )
+        if trips is not None:
+            return trips
+
+        if self.catalog is not None:
+            if not await self._refresh_catalog():
+                return []
+            return self.catalog.get_page(0, count)[0]
+
+        try:
+            partitions = self.table_service.partitions.partitions()
+            pages = await asyncio.gather(*(self._first_entities(partition, count) for partition in partitions))
+            trips = latest_trips(self.table_service._map_list_entities([entity for page in pages for entity in page]), count)
+            if trips is not None:
+                return trips
+            entities = [entity async for entity in self._query_trip_entities()]
+            return sort_trips(self.table_service._map_list_entities(entities))[:count]
+        except Exception as e:
+            logger.error(f"Error fetching latest trips from Azure: {str(e)}", exc_info=True)
+            return []
+
+    async def _first_entities(self, partition, count):
+        """The first count entities of a partition, in key order"""
+        # Skip empty server pages (the service may return them mid-scan)
+        entities = []
+        async for entities, next_token in self.iter_entity_pages(partition_key=partition, page_size=count):
+            if entities or not next_token:
+                break
+        return entities
+
+    async def find_rekeyed_trip(self, row_key):
+        """Get the current row key of a re-keyed trip, see AzureTableService.find_rekeyed_trip"""
+        if not self.is_configured or not is_legacy(row_key):
+            return None
+
+        try:
+            entities = self._query_partitions("PreviousRowKey eq @key", {'key': row_key}, select=['RowKey'])
+            async for entity in entities:
+                return entity['RowKey']
+            return None
+        except Exception as e:
+            logger.error(f"Error looking up the new row key of trip {row_key}: {str(e)}", exc_info=True)
+            return None
+
+    async def iter_entity_pages(self, partition_key=None, page_size=1000, continuation_token=None,
+                                query_filter=None, parameters=None, select=None):
+        """Stream raw entities one server page at a time, see AzureTableService.iter_entity_pages"""
+        table_client = self.get_table_client()
+        query_filter, parameters = entity_query(partition_key, query_filter, parameters)
+        if query_filter is None:
+            entities = table_client.list_entities(results_per_page=page_size, select=select)
+        else:
+            entities = table_client.query_entities(
+                query_filter=query_filter,
+                parameters=parameters,
+                results_per_page=page_size,
+                select=select,
+            )
+        pager = entities.by_page(continuation_token=continuation_token)
+
+        async for page in pager:
+            yield [entity async for entity in page], pager.continuation_token
+
+    def iter_trip_entity_pages(self, page_size=1000, continuation_token=None,
+                               query_filter=None, parameters=None, select=None):
+        """iter_entity_pages over every trip partition, see AzureTableService.iter_trip_entity_pages"""
+        query_filter, parameters = self.table_service.partitions.scan_query(query_filter, parameters)
+        return self.iter_entity_pages(
+            page_size=page_size,
+            continuation_token=continuation_token,
+            query_filter=query_filter,
+            parameters=parameters,
+            select=select,
+        )
+
+    async def get_trips_page(self, page_size=20, cursor=None, trip_filter=None):
+        """Get one page of the trip listing, see AzureTableService.get_trips_page
+
+        Returns:
+            tuple: (list of trips, cursor for the next page or None)
+        """
+        if not self.is_configured:
+            logger.warning("No connection string available, returning empty page")
+            return [], None
+
+        predicate = TRIP_FILTERS.get(trip_filter)
+        token = decode_cursor(cursor)
+
+        page = await self._from_mirror(lambda mirror: mirror_page(mirror, page_size, token, trip_filter))
+        if page is not None:
+            return page
+
+        if self.catalog is not None:
+            if not await self._refresh_catalog():
+                return [], None
+            return catalog_page(self.catalog, page_size, token, predicate)
+
+        try:
+            pages = self.iter_trip_entity_pages(page_size=page_size, continuation_token=table_token(token))
+            async for entities, next_token in pages:
+                page = table_page(self.table_service._map_list_entities(entities), next_token, predicate)
+                if page is not None:
+                    return page
+            return [], None
+
+        except Exception as e:
+            logger.error(f"Error fetching trip page from Azure: {str(e)}", exc_info=True)
+            return [], None
+
+    async def get_faceted_page(self, selection, page_size=20, cursor=None, version=None):
+        """Get one page of a facet selection with facet counts, see AzureTableService.get_faceted_page"""
+        if version is None:
+            version, _ = await self.get_catalog_version()
+        if version is None:
+            return None
+
+        facets = self.table_service.facets
+        index = facets.get(version)
+        if index is None:
+            index = facets.build(version, await self.get_all_trips())
+        return facet_page(index, selection, page_size, decode_cursor(cursor))
+
+    async def get_map_features(self, bbox, zoom, version=None):
+        """Get the trips map features within a bounding box, see AzureTableService.get_map_features"""
+        if version is None:
+            version, _ = await self.get_catalog_version()
+        if version is None:
+            return None
+
+        geo = self.table_service.geo
+        index = geo.get(version)
+        if index is None:
+            index = geo.build(version, await self.get_all_trips())
+        return index.query(bbox, zoom)
+
+    async def search_trips(self, query, page_size=20, offset=0):
+        """Full-text search over the mirrored trips, or a participant lookup in the trip index, see AzureTableService.search_trips"""
+        results = await self._from_mirror(
+            lambda mirror: mirror_search_results(*mirror.search(query, page_size, offset))
+        )
+        if results is not None or self.table_service.index_table_name is None:
+            return results
+
+        try:
+            trips, has_more = await self.find_trips([('participant', query, None)], offset, page_size)
+        except Exception as e:
+            logger.error(f"Error looking up participant {query} in the trip index: {str(e)}", exc_info=True)
+            return None
+        return participant_results(trips, query), has_more
+
+    async def find_trip_keys(self, index, value, until=None):
+        """Row keys of the trips an index lookup finds, newest first, see AzureTableService.find_trip_keys"""
+        index_client = self.get_index_table_client()
+
+        async def query(lookup):
+            query_filter, parameters = lookup
+            entities = index_client.query_entities(query_filter=query_filter, parameters=parameters, select=['TripRowKey'])
+            return [entity['TripRowKey'] async for entity in entities]
+
+        found = await asyncio.gather(*(query(lookup) for lookup in lookup_queries(index, value, until)))
+        return sorted({key for keys in found for key in keys})
+
+    async def find_trips(self, lookups, offset=0, limit=20):
+        """Trips found by index lookups, newest first, see AzureTableService.find_trips
+
+        Returns:
+            tuple: (list of trips, True if more trips follow)
+        """
+        keys = intersect_keys(await asyncio.gather(
+            *(self.find_trip_keys(index, value, until) for index, value, until in lookups)
+        ))
+
+        async def read(row_key):
+            try:
+                return await self.get_trip_entity(row_key)
+            except ResourceNotFoundError:
+                return None
+
+        entities = await asyncio.gather(*(read(row_key) for row_key in keys[offset:offset + limit]))
+        trips = [self.table_service._map_list_entity(entity) for entity in matching_entities(entities, lookups)]
+        return trips, len(keys) > offset + limit
+
+    async def get_indexed_page(self, selection, page_size=20, cursor=None):
+        """Get one page of the trips of a category and/or year through the trip index, see AzureTableService.get_indexed_page"""
+        if not self.is_configured or self.table_service.index_table_name is None:
+            return None
+        request = indexed_page_request(selection, cursor)
+        if request is None:
+            return None
+        lookups, offset = request
+        try:
+            trips, has_more = await self.find_trips(lookups, offset, page_size)
+        except Exception as e:
+            logger.error(f"Error reading trips through the trip index: {str(e)}", exc_info=True)
+            return None
+        return indexed_page(selection, trips, has_more, offset, page_size)
+
+    async def _update_index(self, row_key, old_properties, new_properties):
+        """Write the index entities of a created or changed trip, see AzureTableService._update_index"""
+        changes = self.table_service._index_changes(row_key, old_properties, new_properties)
+        if changes is None:
+            return
+        upserts, deletes = changes
+        try:
+            index_client = self.get_index_table_client()
+            for entity in upserts:
+                await index_client.upsert_entity(entity, mode=UpdateMode.REPLACE)
+            for partition, key in deletes:
+                await index_client.delete_entity(partition_key=partition, row_key=key)
+            logger.debug(f"Trip index of {row_key}: {len(upserts)} written, {len(deletes)} deleted")
+        except Exception as e:
+            logger.error(f"Error updating the trip index of {row_key} (run rebuild_trip_index): {str(e)}")
+
+    async def _indexed_before(self, row_key, patch, original):
+        """The indexed properties of a trip before a MERGE, see AzureTableService._indexed_before"""
+        if not self.table_service._indexes_patch(patch):
+            return None
+        if original is None:
+            try:
+                original = await self.get_trip_entity(row_key)
+            except ResourceNotFoundError:
+                original = None
+        return indexed_values(original)
+
+    async def get_trip_counts(self):
+        """Get total/completed/future trip counts, or None without the mirror and the catalog"""
+        if not self.is_configured:
+            return None
+
+        counts = await self._from_mirror(lambda mirror: mirror.get_counts())
+        if counts is not None or self.catalog is None:
+            return counts
+
+        if not await self._refresh_catalog():
+            return None
+
+        return self.catalog.get_counts()
+
+    async def get_catalog_version(self):
+        """Get (version, last modified) of the trip listing, or (None, None) without the mirror and the catalog"""
+        if not self.is_configured:
+            return None, None
+
+        version = await self._from_mirror(lambda mirror: mirror.get_version())
+        if version is not None:
+            return version
+
+        if self.catalog is None:
+            return None, None
+
+        if not await self._refresh_catalog():
+            return None, None
+
+        return self.catalog.version, self.catalog.last_modified
+
+    async def get_trip_version(self, row_key):
+        """Get the ETag of a trip from the mirror or catalog cache, or None when it is not known"""
+        if self.table_service.mirror is not None:
+            known, etag = await sync_to_async(self.table_service._mirrored_trip_version)(row_key)
+            if known:
+                return etag
+
+        # The listing version may come from the mirror, so check the catalog itself
+        if self.catalog is None or not self.is_configured or not await self._refresh_catalog():
+            return None
+        return self.catalog.get_etag(row_key)
+
+    def get_cached_trip(self, row_key):
+        """Get the list view of a trip from the catalog cache without any storage call
+
+        Unlike the sync service this never reads the mirror, which would need a
+        database query on the event loop.
+        """
+        return self.catalog.get(row_key) if self.catalog is not None else None
+
+    async def get_trip_by_id(self, row_key):
+        """Get a specific trip by its row key"""
+        logger.info(f"Fetching trip with row_key: {row_key}")
+
+        if not self.is_configured:
+            logger.warning("No connection string available, returning None")
+            return None
+
+        try:
+            entity = await self.get_trip_entity(row_key)
+            return self.table_service._map_detail_entity(entity)
+        except ResourceNotFoundError:
+            logger.warning(f"Trip {row_key} not found in Azure")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching trip {row_key} from Azure: {str(e)}", exc_info=True)
+            if self.table_service.mirror is None:
+                return None
+            return await sync_to_async(self.table_service.get_mirrored_trip)(row_key)
+
+    async def update_trip(self, row_key, trip_data, etag=None, original=None):
+        """Update a trip with a single MERGE of the changed properties, see AzureTableService.update_trip
+
+        Returns:
+            tuple: (success, error message); TRIP_CHANGED when the etag no longer matches
+        """
+        logger.info(f"Updating trip with row_key: {row_key}")
+
+        if not self.is_configured:
+            logger.warning("No connection string available, cannot update trip")
+            return False, "No connection string available"
+
+        patch = self.table_service._build_trip_patch(row_key, trip_data, original)
+        if patch is None:
+            logger.info(f"Trip {row_key} has no changes to save")
+            return True, ""
+
+        try:
+            table_client = self.get_table_client()
+            indexed = await self._indexed_before(row_key, patch, original)
+
+            async def merge(partition):
+                written = dict(patch, PartitionKey=partition)
+                return written, await table_client.update_entity(entity=written, mode=UpdateMode.MERGE, **if_match(etag))
+
+            patch, result = await self._at_trip(row_key, merge)
+            logger.info(f"Successfully updated trip with row_key: {row_key} ({len(patch) - 2} properties)")
+
+            await self._record_patch(patch, result, original)
+            if indexed is not None:
+                await self._update_index(row_key, indexed, patched_values(indexed, patch))
+
+            return True, ""
+
+        except ResourceModifiedError:
+            logger.info(f"Trip {row_key} changed since the edit started, not overwriting it")
+            return False, TRIP_CHANGED
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error updating trip: {error_msg}", exc_info=True)
+            return False, error_msg
+
+    async def create_trip(self, trip_data):
+        """Create a new trip in Azure Table Storage
+
+        Returns:
+            tuple: (success, error message, new row key)
+        """
+        logger.info("Creating new trip")
+
+        if not self.is_configured:
+            logger.warning("No connection string available, cannot create trip")
+            return False, "No connection string available", None
+
+        try:
+            row_key, new_entity = self.table_service._build_new_entity(trip_data)
+
+            result = await self.get_table_client().create_entity(new_entity)
+            logger.info(f"Successfully created trip with row key: {row_key}")
+
+            await self._record_write(new_entity, result)
+            await self._update_index(row_key, None, new_entity)
+
+            return True, None, row_key
+
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error creating trip: {error_msg}", exc_info=True)
+            return False, error_msg, None
+
+    async def update_photo_manifest(self, row_key, update, seed=None):
+        """Apply a change to a trip's photo manifest, see AzureTableService.update_photo_manifest
+
+        Args:
+            row_key (str): The trip's row key
+            update (callable): Called with the PhotoManifest to modify it in place
+            seed (callable, optional): Coroutine function that builds the
+                starting manifest for trips that do not have one yet
+
+        Returns:
+            tuple: (success, PhotoManifest or error message)
+        """
+        if not self.is_configured:
+            logger.warning("No connection string available, cannot update photo manifest")
+            return False, "No connection string available"
+
+        try:
+            table_client = self.get_table_client()
+
+            for attempt in range(MANIFEST_UPDATE_ATTEMPTS):
+                entity = await self.get_trip_entity(row_key)
+                manifest = self.table_service._manifest_of(entity)
+                if manifest is None:
+                    manifest = await seed() if seed else PhotoManifest()
+
+                update(manifest)
+                patch = self.table_service._build_manifest_patch(entity, manifest)
+
+                try:
+                    result = await table_client.update_entity(
+                        entity=patch,
+                        mode=UpdateMode.MERGE,
+                        etag=entity.metadata.get('etag'),
+                        match_condition=MatchConditions.IfNotModified,
+                    )
+                except ResourceModifiedError:
+                    logger.info(f"Trip {row_key} changed during manifest update, retrying ({attempt + 1})")
+                    continue
+
+                await self._record_write(self.table_service._manifest_written(entity, patch), result)
+
+                logger.info(f"Updated photo manifest for trip {row_key} ({len(manifest.photos)} photos)")
+                return True, manifest
+
+            return False, "Trip kept changing during the photo manifest update"
+
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error updating photo manifest for trip {row_key}: {error_msg}", exc_info=True)
+            return False, error_msg
+
+
+@timed_service('blob', exclude=('get_container_client', 'get_photo_url', 'get_photo_sources', 'supports_direct_uploads'))
+class AsyncAzureBlobService:
+    """Async version of AzureBlobService built on ``azure.storage.blob.aio``.
+
+    Blob naming, URLs and content types come from the wrapped sync service.
+    """
+
+    def __init__(self, blob_service, table_service=None):
+        self.blob_service = blob_service
+        # When set, uploads keep the trip's photo manifest up to date
+        self.table_service = table_service
+
+    @property
+    def is_configured(self):
+        return self.blob_service.is_configured
+
+    def get_container_client(self):
+        """Get the shared aio container client (on Azure, the one of the running event loop)"""
+        if not self.is_configured:
+            logger.warning("No connection string available")
+            return None
+
+        try:
+            return self.blob_service.storage.get_async_container_client(self.blob_service.container_name)
+        except Exception as e:
+            logger.error(f"Error getting container client: {str(e)}", exc_info=True)
+            return None
+
+    def get_photo_url(self, blob_name):
+        """Build the public URL of a photo blob without a storage round trip"""
+        return self.blob_service.get_photo_url(blob_name)
+
+    def supports_direct_uploads(self):
+        """True if SAS URLs can be issued, see AzureBlobService.supports_direct_uploads"""
+        return self.blob_service.supports_direct_uploads()
+
+    async def list_photos(self, trip_id):
+        """List the photo URLs of a trip
+
+        Returns:
+            list: List of photo URLs
+        """
+        container_client = self.get_container_client()
+        if not container_client:
+            return []
+
+        try:
+            photo_urls = []
+            async for blob in container_client.list_blobs(name_starts_with=f"{trip_id}/"):
+                photo_urls.append(self.get_photo_url(blob.name))
+            logger.info(f"Found {len(photo_urls)} photos for trip {trip_id}")
+            return photo_urls
+        except Exception as e:
+            logger.error(f"Error listing photos: {str(e)}", exc_info=True)
+            return []
+
+    def get_photo_sources(self, name, variants=None):
+        """Build the URLs a template needs to show one photo, see AzureBlobService.get_photo_sources"""
+        return self.blob_service.get_photo_sources(name, variants)
+
+    async def get_trip_photos(self, trip_id, manifest=None):
+        """Get the photo sources of a trip in manifest order, listing blobs when there is no manifest"""
+        if manifest is None:
+            return [photo_sources_from_url(url) for url in await self.list_photos(trip_id)]
+        return self.blob_service.get_trip_photos(trip_id, manifest)
+
+    async def upload_photo(self, trip_id, photo_file, filename=None):
+        """Upload a photo to Azure Blob Storage
+
+        Returns:
+            tuple: (success, url or error message)
+        """
+        if not photo_file:
+            logger.warning("No photo file provided")
+            return False, "No photo file provided"
+
+        container_client = self.get_container_client()
+        if not container_client:
+            return False, "Could not connect to blob container"
+
+        try:
+            blob_name, file_extension = self.blob_service._make_blob_name(trip_id, filename or photo_file.name)
+            blob_client = container_client.get_blob_client(blob_name)
+            content_settings = ContentSettings(
+                content_type=self.blob_service._get_content_type(file_extension)
+            )
+
+            # Read dimensions from the image header before uploading; file reads
+            # block, so they run in a thread like the rest of the upload's reads
+            width, height = await asyncio.to_thread(read_image_dimensions, photo_file)
+
+            await asyncio.to_thread(photo_file.seek, 0)
+            await blob_client.upload_blob(
+                read_in_thread(upload_stream(photo_file)),
+                length=getattr(photo_file, 'size', None),
+                content_settings=content_settings,
+                overwrite=True,
+                max_concurrency=self.blob_service.block_concurrency,
+            )
+            logger.info(f"Successfully uploaded photo to {blob_name}")
+
+            variants = await self.create_variants(blob_name, photo_file) if self.blob_service.make_variants else {}
+
+            if self.table_service is not None:
+                size = getattr(photo_file, 'size', None)
+                success, result = await self.table_service.update_photo_manifest(
+                    trip_id,
+                    lambda manifest: manifest.add(blob_name, size=size, width=width, height=height, variants=variants),
+                    seed=lambda: self.build_manifest(trip_id),
+                )
+                if not success:
+                    logger.warning(f"Photo {blob_name} uploaded but not added to the manifest: {result}")
+
+            return True, blob_client.url
+
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error uploading photo: {error_msg}", exc_info=True)
+            return False, error_msg
+
+    async def upload_photos(self, trip_id, photo_files):
+        """Upload several photos concurrently, see AzureBlobService.upload_photos
+
+        Returns:
+            list: One dict per file, in order, with 'filename', 'success' and
+            either 'url' or 'error'
+        """
+        from django.conf import settings
+        limit = asyncio.Semaphore(getattr(settings, 'PHOTO_UPLOAD_MAX_WORKERS', DEFAULT_UPLOAD_WORKERS))
+        timeout = getattr(settings, 'PHOTO_UPLOAD_TIMEOUT', None)
+
+        async def upload(photo_file):
+            async with limit:
+                try:
+                    success, result = await asyncio.wait_for(self.upload_photo(trip_id, photo_file), timeout)
+                except asyncio.TimeoutError:
+                    success, result = False, "Upload did not finish in time"
+            return upload_result(photo_file.name, success, result)
+
+        results = await asyncio.gather(*(upload(photo_file) for photo_file in photo_files))
+        uploaded = sum(1 for result in results if result['success'])
+        logger.info(f"Uploaded {uploaded} of {len(results)} photos for trip {trip_id}")
+        return list(results)
+
+    async def create_variants(self, blob_name, photo_file):
+        """Make and upload the resized variants of a photo, see AzureBlobService.create_variants
+
+        Resizing is CPU work, so it runs in a thread to keep the event loop free.
+        """
+        container_client = self.get_container_client()
+        if not container_client:
+            return {}
+
+        try:
+            generated = await asyncio.to_thread(generate_variants, photo_file, blob_name)
+            variants = {}
+            for variant, variant_name, content_type, data, width, height in generated:
+                variants[variant] = {'name': variant_name, 'width': width, 'height': height}
+                if data is None:
+                    continue
+                await container_client.get_blob_client(variant_name).upload_blob(
+                    data,
+                    content_settings=ContentSettings(content_type=content_type, cache_control=VARIANT_CACHE_CONTROL),
+                    overwrite=True,
+                )
+        except Exception as e:
+            logger.error(f"Error creating variants of {blob_name}: {str(e)}", exc_info=True)
+            return {}
+
+        logger.info(f"Created {len(variants)} variants of {blob_name}")
+        return variants
+
+    async def build_manifest(self, trip_id, read_dimensions=False):
+        """Build a photo manifest for a trip from its blob listing, see AzureBlobService.build_manifest"""
+        manifest = PhotoManifest()
+        container_client = self.get_container_client()
+        if not container_client:
+            return manifest
+
+        blobs = [blob async for blob in container_client.list_blobs(name_starts_with=f"{trip_id}/")]
+        for blob in sorted(blobs, key=lambda b: b.name):
+            width, height = None, None
+            if read_dimensions:
+                width, height = await self._read_blob_dimensions(container_client, blob.name)
+            manifest.add(blob.name, size=blob.size, width=width, height=height)
+
+        logger.info(f"Built photo manifest for trip {trip_id} from {len(manifest.photos)} blobs")
+        return manifest
+
+    async def _read_blob_dimensions(self, container_client, blob_name):
+        """Read image dimensions from the first bytes of a blob"""
+        try:
+            downloader = await container_client.download_blob(blob_name, offset=0, length=PHOTO_HEADER_BYTES)
+            header = await downloader.readall()
+            return read_image_dimensions(io.BytesIO(header))
+        except Exception as e:
+            logger.warning(f"Could not read dimensions of {blob_name}: {str(e)}")
+            return None, None
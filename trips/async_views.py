@@ -0,0 +1,350 @@
+"""Async versions of the storage-heavy views, for running under ASGI.
+
+Enabled with ``TRIPS_ASYNC_VIEWS=True`` (see trips/urls.py). Storage calls are
+awaited on the event loop through the aio services, so one worker process
+serves many requests that wait on Azure at the same time. Template rendering
+touches the session and user, which are sync-only, so it runs via
+``sync_to_async``.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseServerError, JsonResponse
+from django.shortcuts import redirect, render
+
+from .aio_services import AsyncAzureBlobService, AsyncAzureTableService
+from .azure_service import TRIP_CHANGED
+from .blob_service import photo_sources_from_url
+from .fanout import AsyncStorageFanout
+from .forms import TripEditForm
+from .http_cache import finish_response, not_modified, page_etag
+from .page_cache import acache_rendered_page, aget_cached_page, fragment_cache_context
+from .trip_facets import parse_selection
+from .trip_pages import (
+    INDEX_TRIP_COUNT,
+    all_trips_context,
+    all_trips_params,
+    direct_uploads_enabled,
+    edit_context,
+    edited_fields_changed,
+    export_params,
+    export_response,
+    lists_photos_with_trip,
+    map_features_response,
+    map_params,
+    may_retry_save,
+    report_uploads,
+    search_context,
+    search_json,
+    search_params,
+    set_cover_photos,
+    set_listed_photo,
+    trip_conflict_context,
+    trip_data_from_form,
+    trip_detail_context,
+    trip_edit_initial,
+    upload_results_response,
+)
+from .trip_transfer import EXPORT_PAGE_SIZE, aiter_export_chunks
+from .views import admin_required, get_blob_service, get_data_service
+
+logger = logging.getLogger(__name__)
+
+arender = sync_to_async(render)
+# Reads the session (user, flash messages), which is sync-only
+apage_etag = sync_to_async(page_etag)
+
+_async_data_service = None
+_async_blob_service = None
+
+def get_async_data_service():
+    """Get the shared async Azure Table service"""
+    global _async_data_service
+    if _async_data_service is None:
+        _async_data_service = AsyncAzureTableService(get_data_service())
+    return _async_data_service
+
+def get_async_blob_service():
+    """Get the shared async Azure Blob service"""
+    global _async_blob_service
+    if _async_blob_service is None:
+        _async_blob_service = AsyncAzureBlobService(get_blob_service(), table_service=get_async_data_service())
+    return _async_blob_service
+
+async def index(request):
+    """Landing page with trip previews"""
+    try:
+        service = get_async_data_service()
+        blob_service = get_async_blob_service()
+
+        version, last_modified = await service.get_catalog_version()
+        etag = await apage_etag(request, version)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = await aget_cached_page(etag)
+        if response is not None:
+            return finish_response(request, response, etag, last_modified)
+
+        featured_trips = await service.get_latest_trips(INDEX_TRIP_COUNT)
+
+        # Cover photos come from the manifest; trips without one are listed concurrently
+        async with AsyncStorageFanout() as fanout:
+            unlisted = set_cover_photos(featured_trips, blob_service)
+            for trip in unlisted:
+                fanout.submit(trip.row_key, blob_service.list_photos(trip.row_key), default=[])
+
+            for trip in unlisted:
+                set_listed_photo(trip, await fanout.result(trip.row_key))
+
+        response = await arender(request, 'trips/index.html', {
+            'trips': featured_trips,
+            **fragment_cache_context(version),
+        })
+        return finish_response(request, await acache_rendered_page(etag, response), etag, last_modified)
+    except Exception as e:
+        import traceback
+        logger.error(f"Error in index view: {e}", exc_info=True)
+        return await arender(request, 'trips/error.html', {
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        })
+
+async def _load_trip_with_photos(trip_id):
+    """Load a trip and its photos, like the sync views do
+
+    Returns:
+        tuple: (TripRecord or None, list of photo source dicts)
+    """
+    service = get_async_data_service()
+    blob_service = get_async_blob_service()
+    list_in_parallel = lists_photos_with_trip(service.get_cached_trip(trip_id))
+
+    async with AsyncStorageFanout() as fanout:
+        fanout.submit('trip', service.get_trip_by_id(trip_id))
+        if list_in_parallel:
+            fanout.submit('photos', blob_service.list_photos(trip_id), default=[])
+
+        trip = await fanout.result('trip')
+        if not trip:
+            return None, []
+
+        if trip.photo_manifest is None and list_in_parallel:
+            return trip, [photo_sources_from_url(url) for url in await fanout.result('photos')]
+        return trip, await blob_service.get_trip_photos(trip_id, trip.photo_manifest)
+
+async def trip_detail(request, trip_id):
+    """Detail page for a specific trip"""
+    etag = await apage_etag(request, await get_async_data_service().get_trip_version(trip_id))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    response = await aget_cached_page(etag)
+    if response is not None:
+        return finish_response(request, response, etag)
+
+    trip, trip_photos = await _load_trip_with_photos(trip_id)
+
+    if not trip:
+        new_trip_id = await get_async_data_service().find_rekeyed_trip(trip_id)
+        if new_trip_id:
+            return redirect('trips:trip_detail', trip_id=new_trip_id, permanent=True)
+        return finish_response(request, await arender(request, 'trips/not_found.html'))
+
+    etag = await apage_etag(request, trip.etag)
+    response = await arender(request, 'trips/detail.html', trip_detail_context(trip, trip_photos))
+    return finish_response(request, await acache_rendered_page(etag, response), etag, trip.last_modified)
+
+@admin_required
+async def trip_edit(request, trip_id=None):
+    """View function for creating or editing a trip"""
+    try:
+        azure_service = get_async_data_service()
+        blob_service = get_async_blob_service()
+
+        is_new_trip = trip_id is None
+        trip = None
+        trip_photos = []
+
+        # A save does not read the trip: the form carries its etag and original values
+        if not is_new_trip and request.method != 'POST':
+            trip, trip_photos = await _load_trip_with_photos(trip_id)
+
+            if not trip:
+                logger.warning(f"Trip with ID {trip_id} not found")
+                return HttpResponse("Trip not found", status=404)
+
+        if request.method == 'POST':
+            form = TripEditForm(request.POST, request.FILES)
+
+            if form.is_valid():
+                trip_data = trip_data_from_form(form)
+                photo_files = request.FILES.getlist('photos')
+
+                if is_new_trip:
+                    success, message, new_trip_id = await azure_service.create_trip(trip_data)
+
+                    if not success:
+                        logger.error(f"Error creating trip: {message}")
+                        return await arender(request, 'trips/edit.html', edit_context(
+                            form, True, error=f"Error creating trip: {message}",
+                        ))
+
+                    trip_id = new_trip_id
+                else:
+                    # Save the fields before the uploads write the trip's manifest, and wait for the real outcome
+                    success, message = await azure_service.update_trip(
+                        trip_id, trip_data,
+                        etag=form.cleaned_data['etag'] or None,
+                        original=form.cleaned_data['original'],
+                    )
+                    attempts = 1
+                    while may_retry_save(message, attempts):
+                        current = await azure_service.get_trip_by_id(trip_id)
+                        if not current or edited_fields_changed(form, current):
+                            break
+                        # Only the manifest or cover changed, e.g. by this edit's own uploads
+                        attempts += 1
+                        success, message = await azure_service.update_trip(
+                            trip_id, trip_data,
+                            etag=current.etag,
+                            original=form.cleaned_data['original'],
+                        )
+
+                upload_results = await blob_service.upload_photos(trip_id, photo_files)
+
+                report_uploads(request, upload_results)
+
+                if message == TRIP_CHANGED:
+                    # Someone else saved the trip since the form was opened
+                    current = await azure_service.get_trip_by_id(trip_id)
+                    if not current:
+                        return HttpResponse("Trip not found", status=404)
+                    return await arender(request, 'trips/edit_conflict.html', trip_conflict_context(form, current),
+                                         status=409)
+
+                if not success:
+                    logger.error(f"Error updating trip {trip_id}: {message}")
+                    trip, trip_photos = await _load_trip_with_photos(trip_id)
+                    if not trip:
+                        return HttpResponse("Trip not found", status=404)
+                    return await arender(request, 'trips/edit.html', edit_context(
+                        form, False, trip, trip_photos, error=f"Error updating trip: {message}",
+                    ))
+
+                return redirect('trips:trip_detail', trip_id=trip_id)
+            else:
+                logger.warning(f"Form validation failed: {form.errors}")
+                if not is_new_trip:
+                    trip, trip_photos = await _load_trip_with_photos(trip_id)
+                    if not trip:
+                        return HttpResponse("Trip not found", status=404)
+        else:
+            form = TripEditForm(initial=trip_edit_initial(trip) if not is_new_trip else {})
+
+        return await arender(request, 'trips/edit.html', edit_context(
+            form, is_new_trip, trip, trip_photos,
+            direct_uploads=direct_uploads_enabled(blob_service, is_new_trip),
+        ))
+    except Exception as e:
+        logger.error(f"Error editing trip: {str(e)}", exc_info=True)
+        return HttpResponseServerError("An error occurred while editing the trip.")
+
+@admin_required
+async def trip_photos_upload(request, trip_id):
+    """Upload several photos to a trip and report the outcome of each file as JSON"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST photos as multipart form data'}, status=405)
+
+    photo_files = request.FILES.getlist('photos')
+    if not photo_files:
+        return JsonResponse({'error': 'No photos provided'}, status=400)
+
+    return upload_results_response(trip_id, await get_async_blob_service().upload_photos(trip_id, photo_files))
+
+async def all_trips(request):
+    """Page showing all trips, one page at a time"""
+    service = get_async_data_service()
+    trip_filter, page_size, cursor, page_number = all_trips_params(request)
+
+    version, last_modified = await service.get_catalog_version()
+    etag = await apage_etag(request, version)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+    response = await aget_cached_page(etag)
+    if response is not None:
+        return finish_response(request, response, etag, last_modified)
+
+    selection = parse_selection(request.GET)
+    counts = facet_counts = None
+    page = await service.get_faceted_page(selection, page_size=page_size, cursor=cursor, version=version)
+    if page is not None:
+        trips, next_cursor, facet_counts = page
+    else:
+        async with AsyncStorageFanout() as fanout:
+            fanout.submit('counts', service.get_trip_counts())
+            page = await service.get_indexed_page(selection, page_size=page_size, cursor=cursor)
+            if page is None:
+                fanout.submit('page', service.get_trips_page(
+                    page_size=page_size,
+                    cursor=cursor,
+                    trip_filter=trip_filter,
+                ), default=([], None))
+                page = await fanout.result('page')
+            trips, next_cursor = page
+            counts = await fanout.result('counts')
+
+    context = all_trips_context(trips, next_cursor, counts, trip_filter, page_size, page_number,
+                                 selection, facet_counts)
+    context.update(fragment_cache_context(version))
+    response = await arender(request, 'trips/all_trips.html', context)
+    return finish_response(request, await acache_rendered_page(etag, response), etag, last_modified)
+
+async def trip_search(request):
+    """Full-text search over trip titles, descriptions, participants and locations"""
+    query, page_size, page_number = search_params(request)
+    results = ([], False)
+    if query:
+        results = await get_async_data_service().search_trips(query, page_size, (page_number - 1) * page_size)
+
+    if request.GET.get('format') == 'json':
+        return search_json(query, results, page_number)
+    return await arender(request, 'trips/search.html', search_context(query, results, page_size, page_number))
+
+async def trip_map_features(request):
+    """Trips within ?bbox=west,south,east,north as GeoJSON, clustered at low ?zoom= levels"""
+    bbox, zoom = map_params(request)
+    if bbox is None:
+        return JsonResponse({'error': 'bbox must be west,south,east,north'}, status=400)
+
+    service = get_async_data_service()
+    version, last_modified = await service.get_catalog_version()
+    etag = await apage_etag(request, version)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    response = map_features_response(await service.get_map_features(bbox, zoom, version=version))
+    return finish_response(request, response, etag, last_modified)
+
+@admin_required
+async def trip_export(request):
+    """Download every trip as NDJSON or CSV, streamed one table page at a time
+
+    The chunks come from an async iterator: under ASGI Django would read a
+    sync iterator to the end in a thread before sending anything.
+    """
+    try:
+        fmt, fields, query_filter, parameters = export_params(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    pages = get_async_data_service().iter_trip_entity_pages(
+        page_size=EXPORT_PAGE_SIZE,
+        query_filter=query_filter,
+        parameters=parameters,
+        select=fields,
+    )
+    logger.info(f"Exporting trips as {fmt} (fields: {fields or 'all'}, filter: {query_filter or 'none'})")
+    return export_response(aiter_export_chunks(pages, fmt, fields), fmt)
@@ -0,0 +1,310 @@
+import asyncio
+import atexit
+import logging
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from azure.core.pipeline.transport import RequestsTransport
+from azure.data.tables import TableServiceClient
+from azure.storage.blob import BlobServiceClient
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the matching Django settings are not defined
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECTION_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+
+# Blob uploads larger than the single-put size go up as staged blocks. Blocks
+# above the large-block threshold are read straight from the source file
+# instead of being copied into memory first.
+DEFAULT_BLOB_MAX_SINGLE_PUT_SIZE = 4 * 1024 * 1024
+DEFAULT_BLOB_MAX_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_BLOB_MIN_LARGE_BLOCK_SIZE = 1024 * 1024 + 1
+
+
+class AzureClientRegistry:
+    """Process-wide registry of long-lived Azure Storage clients.
+
+    Every client handed out by the registry shares one ``requests.Session``,
+    so table and blob calls reuse keep-alive connections instead of parsing
+    the connection string and opening a new TLS connection on every call.
+    The registry is thread-safe and is meant to live for the whole lifetime
+    of a gunicorn worker; call ``close()`` when the worker shuts down.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 connection_timeout=DEFAULT_CONNECTION_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 blob_options=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connection_timeout = connection_timeout
+        self.read_timeout = read_timeout
+        # Extra keyword arguments for BlobServiceClient (upload block sizes)
+        self.blob_options = blob_options or {}
+
+        self._lock = threading.RLock()
+        self._session = None
+        self._table_service_clients = {}
+        self._table_clients = {}
+        self._blob_service_clients = {}
+        self._container_clients = {}
+
+    def _get_session(self):
+        """Get the shared HTTP session, creating it on first use"""
+        if self._session is None:
+            session = requests.Session()
+            # Retries are handled by the Azure SDK pipeline, not by urllib3
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+                max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            logger.info(f"Created shared Azure HTTP session (pool_maxsize={self.pool_maxsize})")
+        return self._session
+
+    def _make_transport(self):
+        """Create a transport bound to the shared session.
+
+        The transport does not own the session, so closing a single client
+        never tears down the connection pool used by the others.
+        """
+        return RequestsTransport(
+            session=self._get_session(),
+            session_owner=False,
+            connection_timeout=self.connection_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+    def get_table_service_client(self, connection_string):
+        """Get the shared TableServiceClient for a connection string"""
+        with self._lock:
+            client = self._table_service_clients.get(connection_string)
+            if client is None:
+                client = TableServiceClient.from_connection_string(
+                    connection_string, transport=self._make_transport()
+                )
+                self._table_service_clients[connection_string] = client
+            return client
+
+    def get_table_client(self, connection_string, table_name):
+        """Get the shared TableClient for a table"""
+        key = (connection_string, table_name)
+        with self._lock:
+            client = self._table_clients.get(key)
+            if client is None:
+                service_client = self.get_table_service_client(connection_string)
+                client = service_client.get_table_client(table_name=table_name)
+                self._table_clients[key] = client
+            return client
+
+    def get_blob_service_client(self, connection_string):
+        """Get the shared BlobServiceClient for a connection string"""
+        with self._lock:
+            client = self._blob_service_clients.get(connection_string)
+            if client is None:
+                client = BlobServiceClient.from_connection_string(
+                    connection_string, transport=self._make_transport(), **self.blob_options
+                )
+                self._blob_service_clients[connection_string] = client
+            return client
+
+    def get_container_client(self, connection_string, container_name):
+        """Get the shared ContainerClient for a blob container"""
+        key = (connection_string, container_name)
+        with self._lock:
+            client = self._container_clients.get(key)
+            if client is None:
+                service_client = self.get_blob_service_client(connection_string)
+                client = service_client.get_container_client(container_name)
+                self._container_clients[key] = client
+            return client
+
+    def close(self):
+        """Close all clients and the shared connection pool"""
+        with self._lock:
+            clients = (
+                list(self._table_clients.values())
+                + list(self._table_service_clients.values())
+                + list(self._container_clients.values())
+                + list(self._blob_service_clients.values())
+            )
+            for client in clients:
+                try:
+                    client.close()
+                except Exception as e:
+                    logger.warning(f"Error closing Azure client: {str(e)}")
+
+            self._table_clients.clear()
+            self._table_service_clients.clear()
+            self._container_clients.clear()
+            self._blob_service_clients.clear()
+
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                logger.info("Closed shared Azure HTTP session")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry():
+    """Get the registry for the current process, creating it on first use"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from django.conf import settings
+                _registry = AzureClientRegistry(
+                    pool_connections=getattr(settings, 'AZURE_POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS),
+                    pool_maxsize=getattr(settings, 'AZURE_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE),
+                    connection_timeout=getattr(settings, 'AZURE_CONNECTION_TIMEOUT', DEFAULT_CONNECTION_TIMEOUT),
+                    read_timeout=getattr(settings, 'AZURE_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+                    blob_options=_blob_options(settings),
+                )
+    return _registry
+
+
+def _blob_options(settings):
+    """BlobServiceClient upload settings from Django settings"""
+    return {
+        'max_single_put_size': getattr(settings, 'AZURE_BLOB_MAX_SINGLE_PUT_SIZE', DEFAULT_BLOB_MAX_SINGLE_PUT_SIZE),
+        'max_block_size': getattr(settings, 'AZURE_BLOB_MAX_BLOCK_SIZE', DEFAULT_BLOB_MAX_BLOCK_SIZE),
+        'min_large_block_upload_threshold': DEFAULT_BLOB_MIN_LARGE_BLOCK_SIZE,
+    }
+
+
+def close_client_registry():
+    """Close the registry for the current process, if one was created"""
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+            _registry = None
+
+
+atexit.register(close_client_registry)
+
+
+class AsyncAzureClientRegistry:
+    """Async counterpart of AzureClientRegistry for the aio Azure SDKs.
+
+    aiohttp sessions are bound to the event loop that created them, so there
+    is one registry per running loop (one per ASGI worker). Clients share one
+    ``aiohttp.ClientSession`` whose connector caps the pool size.
+    """
+
+    def __init__(self, pool_maxsize=DEFAULT_POOL_MAXSIZE, connection_timeout=DEFAULT_CONNECTION_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, blob_options=None):
+        self.pool_maxsize = pool_maxsize
+        self.connection_timeout = connection_timeout
+        self.read_timeout = read_timeout
+        self.blob_options = blob_options or {}
+
+        self._session = None
+        self._table_service_clients = {}
+        self._table_clients = {}
+        self._blob_service_clients = {}
+        self._container_clients = {}
+
+    def _make_transport(self):
+        """Create an aio transport bound to the shared aiohttp session"""
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_maxsize))
+            logger.info(f"Created shared async Azure HTTP session (pool_maxsize={self.pool_maxsize})")
+        return AioHttpTransport(
+            session=self._session,
+            session_owner=False,
+            connection_timeout=self.connection_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+    def get_table_client(self, connection_string, table_name):
+        """Get the shared aio TableClient for a table"""
+        from azure.data.tables.aio import TableServiceClient as AsyncTableServiceClient
+
+        key = (connection_string, table_name)
+        client = self._table_clients.get(key)
+        if client is None:
+            service_client = self._table_service_clients.get(connection_string)
+            if service_client is None:
+                service_client = AsyncTableServiceClient.from_connection_string(
+                    connection_string, transport=self._make_transport()
+                )
+                self._table_service_clients[connection_string] = service_client
+            client = service_client.get_table_client(table_name=table_name)
+            self._table_clients[key] = client
+        return client
+
+    def get_container_client(self, connection_string, container_name):
+        """Get the shared aio ContainerClient for a blob container"""
+        from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+        key = (connection_string, container_name)
+        client = self._container_clients.get(key)
+        if client is None:
+            service_client = self._blob_service_clients.get(connection_string)
+            if service_client is None:
+                service_client = AsyncBlobServiceClient.from_connection_string(
+                    connection_string, transport=self._make_transport(), **self.blob_options
+                )
+                self._blob_service_clients[connection_string] = service_client
+            client = service_client.get_container_client(container_name)
+            self._container_clients[key] = client
+        return client
+
+    async def aclose(self):
+        """Close all clients and the shared aiohttp session"""
+        clients = (
+            list(self._table_clients.values())
+            + list(self._table_service_clients.values())
+            + list(self._container_clients.values())
+            + list(self._blob_service_clients.values())
+        )
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"Error closing async Azure client: {str(e)}")
+
+        self._table_clients.clear()
+        self._table_service_clients.clear()
+        self._container_clients.clear()
+        self._blob_service_clients.clear()
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.info("Closed shared async Azure HTTP session")
+
+
+_async_registries = weakref.WeakKeyDictionary()
+
+
+def get_async_client_registry():
+    """Get the async registry for the running event loop, creating it on first use"""
+    from django.conf import settings
+
+    loop = asyncio.get_running_loop()
+    registry = _async_registries.get(loop)
+    if registry is None:
+        registry = AsyncAzureClientRegistry(
+            pool_maxsize=getattr(settings, 'AZURE_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE),
+            connection_timeout=getattr(settings, 'AZURE_CONNECTION_TIMEOUT', DEFAULT_CONNECTION_TIMEOUT),
+            read_timeout=getattr(settings, 'AZURE_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+            blob_options=_blob_options(settings),
+        )
+        _async_registries[loop] = registry
+    return registry
@@ -1,324 +1,1113 @@
-from azure.data.tables import TableServiceClient, TableClient
 import os
 import json
+import base64
 import logging
 from datetime import datetime, date
 
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import UpdateMode
+from django.utils.html import conditional_escape, format_html
+
+from .catalog_cache import get_listing_index_cache, get_trip_catalog, sort_trips
+from .fanout import map_parallel
+from .partitions import get_trip_partitions
+from .photo_manifest import PhotoManifest
+from .row_keys import is_legacy, is_newest_first, new_row_key
+from .storage_backends import AzureStorageBackend
+from .timing import timed_service
+from .trip_facets import FacetIndex
+from .trip_geo import TripGeoIndex
+from .trip_index import (
+    get_index_table_name,
+    index_changes,
+    indexed_values,
+    intersect_keys,
+    lookup_queries,
+    matching_entities,
+    patched_values,
+    selection_lookups,
+    touches_index,
+)
+from .trip_mirror import get_trip_mirror
+from .trip_record import patch_summary, record_from_entity, summaries_from_entities, summary_from_entity
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Attempts made when a concurrent write changes the trip during a manifest update
+MANIFEST_UPDATE_ATTEMPTS = 5
+
+# Error message of update_trip when the trip changed after the edit started
+TRIP_CHANGED = "The trip was changed by someone else after you opened it"
+
+# trip_data fields update_trip writes, and the entity property of each
+TRIP_PROPERTIES = {
+    'title': 'Title',
+    'description': 'Description',
+    'trip_completed_on': 'TripCompletedOn',
+    'length_hours': 'LengthHours',
+    'location': 'Location',
+    'elevation_gain': 'ElevationGain',
+    'difficulty': 'Difficulty',
+    'map_url': 'MapUrl',
+    'image_url': 'ImageUrl',
+    'participants': 'Participants',
+    'meters_ascend': 'MetersAscend',
+    'meters_descend': 'MetersDescend',
+    'uiaa_grade': 'UiaaGrade',
+    'alpine_grade': 'AlpineGrade',
+    'trip_class': 'TripClass',
+    'ferata_grade': 'FerataGrade',
+    'parking_json': 'ParkingJson',
+    'high_point_json': 'HighPointJson',
+}
+
+# Fields an empty value does not overwrite: a blank date or point keeps the stored one
+KEEP_WHEN_EMPTY = ('trip_completed_on', 'parking_json', 'high_point_json')
+
+# Properties holding blob names (or URLs) under the trip's row key, rewritten when a trip is re-keyed
+BLOB_PROPERTIES = ('PhotoManifest', 'CoverPhoto', 'CoverVariants', 'ImageUrl')
+
+# Filters supported by the trip listing, keyed by the ?filter= value
+TRIP_FILTERS = {
+    'completed': lambda trip: bool(trip.trip_completed_on),
+    'future': lambda trip: not trip.trip_completed_on,
+}
+
+def participant_results(trips, name):
+    """Mark up trips found by participant like full-text search results"""
+    for trip in trips:
+        trip.search_title = conditional_escape(trip.title)
+        trip.search_snippet = format_html('With <mark>{}</mark>', ' '.join(name.split()))
+    return trips
+
+def encode_cursor(token):
+    """Encode a listing continuation token as an opaque, URL-safe cursor"""
+    if not token:
+        return None
+    raw = json.dumps(token, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor; invalid cursors restart the listing"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        token = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return token if isinstance(token, dict) else None
+    except (ValueError, TypeError):
+        logger.warning(f"Ignoring invalid listing cursor: {cursor}")
+        return None
+
+def trip_properties(trip_data):
+    """Entity properties update_trip writes for the given trip_data
+    
+    Fields missing from trip_data are left out, and so are the KEEP_WHEN_EMPTY
+    fields when they are empty. Dates become ISO strings.
+    """
+    properties = {}
+    for name, prop in TRIP_PROPERTIES.items():
+        if name not in trip_data:
+            continue
+        value = trip_data[name]
+        if name in KEEP_WHEN_EMPTY and not value:
+            continue
+        if isinstance(value, date):
+            value = value.isoformat()
+        properties[prop] = value
+    return properties
+
+def if_match(etag):
+    """update_entity arguments that make the write fail if the entity no longer has this etag"""
+    if not etag:
+        return {}
+    return {'etag': etag, 'match_condition': MatchConditions.IfNotModified}
+
+def entity_query(partition_key=None, query_filter=None, parameters=None):
+    """Filter and parameters of a raw entity query; (None, {}) reads the whole table"""
+    parameters = dict(parameters or {})
+    clauses = [query_filter] if query_filter else []
+    if partition_key is not None:
+        clauses.insert(0, 'PartitionKey eq @pk')
+        parameters['pk'] = partition_key
+    return (' and '.join(clauses) or None), parameters
+
+# Listing decisions shared by AzureTableService and the async service in
+# aio_services; they take what the storage returned and do no I/O themselves
+
+def page_offset(token):
+    """The offset a mirror, catalog or index cursor carries; 0 for table cursors and invalid offsets"""
+    offset = (token or {}).get('offset', 0)
+    if not isinstance(offset, int) or offset < 0:
+        return 0
+    return offset
+
+def offset_cursor(offset, has_more):
+    """Cursor of the page that starts at offset, or None after the last page"""
+    return encode_cursor({'offset': offset}) if has_more else None
+
+def table_token(token):
+    """The continuation token of a table scan; catalog cursors carry an offset instead, so they start over"""
+    if token is not None and 'offset' in token:
+        return None
+    return token
+
+def table_page(trips, next_token, predicate=None):
+    """A listing page from one server page of the table
+    
+    Returns:
+        tuple or None: (list of trips, cursor for the next page or None), or
+        None when the server page held no (matching) trips and the scan goes
+        on; the service may return empty server pages mid-scan
+    """
+    if predicate is not None:
+        trips = [trip for trip in trips if predicate(trip)]
+    if trips or not next_token:
+        return trips, encode_cursor(next_token)
+    return None
+
+def catalog_page(catalog, page_size, token, predicate):
+    """Slice one page from the (already refreshed) catalog cache
+    
+    Returns:
+        tuple: (list of trips, cursor for the next page or None)
+    """
+    offset = page_offset(token)
+    trips, has_more = catalog.get_page(offset, page_size, predicate)
+    return trips, offset_cursor(offset + len(trips), has_more)
+
+def mirror_page(mirror, page_size, token, trip_filter):
+    """Read one page from the mirror; cursors carry an offset like catalog pages
+    
+    Returns:
+        tuple: (list of trips, cursor for the next page or None)
+    """
+    offset = page_offset(token)
+    entities, has_more = mirror.get_page(offset, page_size, trip_filter)
+    return summaries_from_entities(entities), offset_cursor(offset + len(entities), has_more)
+
+def facet_page(index, selection, page_size, token):
+    """One page of a facet selection from the facet index, with the facet counts
+    
+    Returns:
+        tuple: (list of trips, cursor for the next page or None, facet counts)
+    """
+    offset = page_offset(token)
+    trips, has_more, counts = index.query(selection, offset, page_size)
+    return trips, offset_cursor(offset + len(trips), has_more), counts
+
+def mirror_search_results(results, has_more):
+    """Map the (entity, title HTML, snippet HTML) results of TripMirror.search to marked up trips
+    
+    Returns:
+        tuple: (list of trips with 'search_title' and 'search_snippet' HTML, has_more)
+    """
+    trips = []
+    for entity, title_html, snippet_html in results:
+        trip = summary_from_entity(entity) if entity.get('RowKey') else None
+        if trip is not None:
+            trip.search_title = title_html
+            trip.search_snippet = snippet_html
+            trips.append(trip)
+    return trips, has_more
+
+def latest_trips(first_trips, count):
+    """The newest trips among the first trips of every partition
+    
+    Returns:
+        list or None: Up to count trips, newest first, or None while the table
+        still holds legacy row keys (which sort oldest first, see rekey_trips)
+        and every trip has to be read instead
+    """
+    if all(is_newest_first(trip.row_key) for trip in first_trips):
+        return sort_trips(first_trips)[:count]
+    logger.info("Trips table still has legacy row keys, reading all trips for the latest ones")
+    return None
+
+def indexed_page_request(selection, cursor):
+    """The (lookups, offset) of a page read through the trip index, or None when no indexed facet is selected"""
+    lookups = selection_lookups(selection)
+    if not lookups:
+        return None
+    return lookups, page_offset(decode_cursor(cursor))
+
+def indexed_page(selection, trips, has_more, offset, page_size):
+    """Apply the status facet to a page read through the trip index and build its next cursor"""
+    # Pages may hold fewer than page_size trips when the completed/future filter is applied
+    predicate = TRIP_FILTERS.get(selection.get('status'))
+    if predicate is not None:
+        trips = [trip for trip in trips if predicate(trip)]
+    return trips, offset_cursor(offset + page_size, has_more)
+
+@timed_service('table', exclude=('get_table_client', 'get_index_table_client', 'start_mirror_refresher',
+                                  'get_cached_trip', 'parse_trip_data'))
 class AzureTableService:
-    def __init__(self, connection_string=None, table_name="Trips"):
+    def __init__(self, connection_string=None, table_name="Trips", storage=None):
         # Try to get connection string from parameter, then environment, then settings
         if connection_string:
             self.connection_string = connection_string
         else:
             # Try to get from environment directly
-            env_conn = os.environ.get("BARUCHSTREKS_STORAGE_CONNECTION")
-            if env_conn:
-                self.connection_string = env_conn
-            else:
-                # No connection string available
-                self.connection_string = None
-                logger.error("No Azure Storage connection string available. Please set BARUCHSTREKS_STORAGE_CONNECTION environment variable.")
+            self.connection_string = os.environ.get("BARUCHSTREKS_STORAGE_CONNECTION")
+        
+        # Where the table lives; Azure unless another backend is passed in
+        self.storage = storage or AzureStorageBackend(self.connection_string)
+        if not self.storage.is_configured:
+            logger.error("No Azure Storage connection string available. Please set BARUCHSTREKS_STORAGE_CONNECTION environment variable.")
                 
         self.table_name = table_name
-        logger.info(f"AzureTableService initialized with table: {table_name}")
-        
-        # Log partial connection string for debugging (hide the key)
-        if self.connection_string:
-            parts = self.connection_string.split(';')
-            safe_conn = ';'.join([p for p in parts if not p.startswith('AccountKey=')])
-            logger.info(f"Connection string provided: {safe_conn}...")
-        else:
-            logger.warning("No connection string provided! Trip data will not be available.")
+        self.partitions = get_trip_partitions()
+        self.index_table_name = get_index_table_name(table_name)
+        self.catalog = get_trip_catalog(table_name)
+        self.mirror = get_trip_mirror(table_name) if self.storage.mirrored else None
+        self.facets = get_listing_index_cache(table_name, 'facets', FacetIndex)
+        self.geo = get_listing_index_cache(table_name, 'geo', TripGeoIndex)
+        logger.info(f"AzureTableService initialized with table: {table_name} ({self.storage.describe()} storage, {self.partitions} partitions)")
+    
+    @property
+    def is_configured(self):
+        """True if the storage backend can be reached (Azure needs a connection string)"""
+        return self.storage.is_configured
         
     def get_table_client(self):
-        """Get a table client for the Trips table"""
-        logger.info("Getting table client...")
+        """Get the shared table client for the Trips table"""
         try:
-            table_service_client = TableServiceClient.from_connection_string(self.connection_string)
-            table_client = table_service_client.get_table_client(table_name=self.table_name)
-            logger.info("Table client created successfully")
-            return table_client
+            return self.storage.get_table_client(self.table_name)
         except Exception as e:
             logger.error(f"Error creating table client: {str(e)}")
             raise
     
+    def get_index_table_client(self):
+        """Get the shared table client for the trip index table (see trip_index)"""
+        return self.storage.get_table_client(self.index_table_name)
+    
+    def _map_list_entity(self, entity):
+        """Map an Azure Table entity to the TripSummary used by the list pages"""
+        # Skip entries without a RowKey
+        if not entity.get('RowKey'):
+            logger.warning(f"Skipping entity without RowKey: {entity}")
+            return None
+        return summary_from_entity(entity)
+    
+    def _query_trip_entities(self, since=None):
+        """Query every trip partition, optionally only entities changed since a Timestamp"""
+        if since is None:
+            logger.info(f"Querying entities of partitions: {', '.join(self.partitions.partitions())}")
+            return self._query_partitions()
+        
+        logger.info(f"Querying entities changed since {since.isoformat()}")
+        return self._query_partitions("Timestamp ge @since", {'since': since})
+    
+    def _query_partitions(self, query_filter=None, parameters=None, select=None):
+        """Run a query on every trip partition, in parallel when there are several
+        
+        Returns:
+            iterable: The entities of all partitions, partition by partition
+        """
+        table_client = self.get_table_client()
+        
+        def query(partition):
+            partition_filter, partition_parameters = entity_query(partition, query_filter, parameters)
+            return table_client.query_entities(
+                query_filter=partition_filter,
+                parameters=partition_parameters,
+                select=select,
+            )
+        
+        partitions = self.partitions.partitions()
+        if len(partitions) == 1:
+            return query(partitions[0])
+        return [entity for entities in map_parallel(lambda partition: list(query(partition)), partitions)
+                for entity in entities]
+    
+    def get_trip_entity(self, row_key):
+        """Read a trip entity from whichever partition holds it
+        
+        Raises:
+            ResourceNotFoundError: When no partition has the trip
+        """
+        table_client = self.get_table_client()
+        return self._at_trip(row_key, lambda partition: table_client.get_entity(partition_key=partition, row_key=row_key))
+    
+    def _at_trip(self, row_key, operation):
+        """Run a point operation in the trip's partition, then in its previous one if it is not there
+        
+        Args:
+            operation (callable): Called with a partition key; raises
+                ResourceNotFoundError when the trip is not in that partition
+        """
+        locations = self.partitions.locations(row_key)
+        for partition in locations[:-1]:
+            try:
+                return operation(partition)
+            except ResourceNotFoundError:
+                logger.debug(f"Trip {row_key} is not in partition {partition}")
+        return operation(locations[-1])
+    
     def get_all_trips(self):
-        """Get all trips from the Azure Table"""
-        logger.info("Fetching all trips from Azure Table...")
+        """Get all trips, newest first.
         
-        if not self.connection_string:
+        Served from the in-process catalog cache when it is enabled, so most
+        calls cost no storage round trip at all.
+        """
+        if not self.is_configured:
             logger.warning("No connection string available, returning empty list")
             return []
+        
+        trips = self._from_mirror(lambda mirror: self._map_list_entities(mirror.get_entities()))
+        if trips is not None:
+            return trips
+        
+        if self.catalog is None:
+            return self._fetch_all_trips()
+        
+        if not self._refresh_catalog():
+            return []
+        
+        return self.catalog.get_trips()
+    
+    def _from_mirror(self, read):
+        """Serve a read from the local SQLite mirror
+        
+        Args:
+            read (callable): Called with the TripMirror
             
+        Returns:
+            The result of read, or None when the mirror is disabled, not loaded
+            yet or fails (the caller then falls back to the catalog or Azure)
+        """
+        if self.mirror is None or not self.mirror.is_ready():
+            return None
         try:
-            table_client = self.get_table_client()
-            logger.info(f"Querying entities with filter: PartitionKey eq 'Trips'")
-            entities = list(table_client.query_entities(query_filter="PartitionKey eq 'Trips'"))
+            return read(self.mirror)
+        except Exception as e:
+            logger.error(f"Error reading trip mirror: {str(e)}", exc_info=True)
+            return None
+    
+    def _map_list_entities(self, entities):
+        """Map entities to list trips, skipping the ones without a RowKey"""
+        return summaries_from_entities(entities)
+    
+    def start_mirror_refresher(self):
+        """Keep the local mirror current from a background thread, if the mirror is enabled"""
+        if self.mirror is not None and self.is_configured:
+            self.mirror.start_refresher(self._query_trip_entities)
+    
+    def sync_mirror(self, full=False):
+        """Pull changes from the table into the local mirror
+        
+        Waits while a worker's refresher is syncing, so commands that run
+        next to the site do not fail on it.
+        
+        Returns:
+            tuple: (success, message)
+        """
+        if self.mirror is None:
+            return False, "The trip mirror is disabled (TRIP_MIRROR_ENABLED)"
+        if not self.is_configured:
+            return False, "No connection string available"
+        try:
+            result = self.mirror.sync(self._query_trip_entities, full=full, wait=True)
+            if result is None:
+                return False, "Another process is still syncing the mirror"
+            mode, written, deleted = result
+            return True, f"{mode} sync wrote {written} trips and deleted {deleted}"
+        except Exception as e:
+            logger.error(f"Error syncing trip mirror: {str(e)}", exc_info=True)
+            return False, str(e)
+    
+    def _refresh_catalog(self):
+        """Refresh the catalog cache if it is stale
+        
+        Returns:
+            bool: True if the cache holds data (possibly stale after an error)
+        """
+        try:
+            self.catalog.refresh(self._query_trip_entities, self._map_list_entity)
+        except Exception as e:
+            logger.error(f"Error refreshing trip catalog from Azure: {str(e)}", exc_info=True)
+        return self.catalog.is_loaded
+    
+    def iter_trip_pages(self, page_size=20, continuation_token=None):
+        """Stream the trips from the table one server page at a time, partition by partition
+        
+        Args:
+            page_size (int): Maximum number of entities per page (results_per_page)
+            continuation_token (dict, optional): Token returned with a previous page
+            
+        Yields:
+            tuple: (list of trips on the page, continuation token for the next page or None)
+        """
+        for entities, next_token in self.iter_trip_entity_pages(page_size, continuation_token):
+            yield self._map_list_entities(entities), next_token
+    
+    def iter_trip_entity_pages(self, page_size=1000, continuation_token=None,
+                               query_filter=None, parameters=None, select=None):
+        """iter_entity_pages over every trip partition, as one ranged query"""
+        query_filter, parameters = self.partitions.scan_query(query_filter, parameters)
+        return self.iter_entity_pages(
+            page_size=page_size,
+            continuation_token=continuation_token,
+            query_filter=query_filter,
+            parameters=parameters,
+            select=select,
+        )
+    
+    def iter_entity_pages(self, partition_key=None, page_size=1000, continuation_token=None,
+                          query_filter=None, parameters=None, select=None):
+        """Stream the raw entities of the table, or of one partition, one server page at a time
+        
+        Used by the bulk exports, which need the properties as stored.
+        
+        Args:
+            partition_key (str, optional): Only read this partition
+            page_size (int): Maximum number of entities per page (results_per_page)
+            continuation_token (dict, optional): Token returned with a previous page
+            query_filter (str, optional): Extra clauses, joined to the partition with 'and'
+            parameters (dict, optional): Values of the @names in query_filter
+            select (list, optional): Only return these properties
+            
+        Yields:
+            tuple: (list of entities on the page, continuation token for the next page or None)
+        """
+        table_client = self.get_table_client()
+        query_filter, parameters = entity_query(partition_key, query_filter, parameters)
+        if query_filter is None:
+            entities = table_client.list_entities(results_per_page=page_size, select=select)
+        else:
+            entities = table_client.query_entities(
+                query_filter=query_filter,
+                parameters=parameters,
+                results_per_page=page_size,
+                select=select,
+            )
+        pager = entities.by_page(continuation_token=continuation_token)
+        
+        for page in pager:
+            yield list(page), pager.continuation_token
+    
+    def submit_batch(self, operations):
+        """Write a batch of entities of one partition in a single transaction
+        
+        Either every operation is applied or none is. The catalog cache and
+        the mirror are not patched; they pick the entities up on their next
+        delta refresh, which is cheaper than patching them one by one.
+        
+        Args:
+            operations (list): Up to 100 submit_transaction operations, e.g.
+                ('upsert', entity, {'mode': UpdateMode.REPLACE})
+            
+        Returns:
+            tuple: (success, number of entities written or error message)
+        """
+        if not self.is_configured:
+            return False, "No connection string available"
+        
+        try:
+            self.get_table_client().submit_transaction(operations)
+            return True, len(operations)
+        except Exception as e:
+            logger.error(f"Error submitting a batch of {len(operations)} entities: {str(e)}")
+            return False, str(e)
+    
+    def get_trips_page(self, page_size=20, cursor=None, trip_filter=None):
+        """Get one page of the trip listing
+        
+        With the catalog cache the page is sliced from memory; otherwise it is
+        read from the table with a continuation token, so only one page of
+        entities is ever held in memory. Without the cache, pages follow table
+        order and may hold fewer than page_size trips when a filter is applied.
+        
+        Args:
+            page_size (int): Number of trips per page
+            cursor (str, optional): Opaque cursor from the previous page
+            trip_filter (str, optional): One of the TRIP_FILTERS keys
+            
+        Returns:
+            tuple: (list of trips, cursor for the next page or None)
+        """
+        if not self.is_configured:
+            logger.warning("No connection string available, returning empty page")
+            return [], None
+        
+        predicate = TRIP_FILTERS.get(trip_filter)
+        token = decode_cursor(cursor)
+        
+        page = self._from_mirror(lambda mirror: mirror_page(mirror, page_size, token, trip_filter))
+        if page is not None:
+            return page
+        
+        if self.catalog is not None:
+            if not self._refresh_catalog():
+                return [], None
+            return catalog_page(self.catalog, page_size, token, predicate)
+        
+        try:
+            for trips, next_token in self.iter_trip_pages(page_size, table_token(token)):
+                page = table_page(trips, next_token, predicate)
+                if page is not None:
+                    return page
+            return [], None
+            
+        except Exception as e:
+            logger.error(f"Error fetching trip page from Azure: {str(e)}", exc_info=True)
+            return [], None
+    
+    def get_faceted_page(self, selection, page_size=20, cursor=None, version=None):
+        """Get one page of the trips matching a facet selection, with facet counts
+        
+        The page and all counts come from the facet index of the current
+        listing version, which is rebuilt only when the listing changes.
+        
+        Args:
+            selection (dict): Selected facets, see trip_facets.parse_selection
+            page_size (int): Number of trips per page
+            cursor (str, optional): Opaque cursor from the previous page
+            version (str, optional): Listing version the caller already read
+                with get_catalog_version
+            
+        Returns:
+            tuple or None: (list of trips, cursor for the next page or None,
+            facet name -> {value: count}), or None when neither the mirror
+            nor the catalog cache can provide a versioned listing
+        """
+        if version is None:
+            version, _ = self.get_catalog_version()
+        if version is None:
+            return None
+        
+        index = self.facets.get(version)
+        if index is None:
+            index = self.facets.build(version, self.get_all_trips())
+        return facet_page(index, selection, page_size, decode_cursor(cursor))
+    
+    def get_map_features(self, bbox, zoom, version=None):
+        """Get the trips map features within a bounding box, clustered at low zooms
+        
+        Args:
+            bbox (tuple): (west, south, east, north) in degrees
+            zoom (int): Map zoom level
+            version (str, optional): Listing version the caller already read
+                with get_catalog_version
+            
+        Returns:
+            list or None: GeoJSON point features, or None when neither the
+            mirror nor the catalog cache can provide a versioned listing
+        """
+        if version is None:
+            version, _ = self.get_catalog_version()
+        if version is None:
+            return None
+        
+        index = self.geo.get(version)
+        if index is None:
+            index = self.geo.build(version, self.get_all_trips())
+        return index.query(bbox, zoom)
+    
+    def search_trips(self, query, page_size=20, offset=0):
+        """Full-text search over the trips in the local mirror, best matches first
+        
+        Args:
+            query (str): The search text as typed
+            page_size (int): Maximum number of results
+            offset (int): Number of results to skip
+            
+        Until the mirror is loaded, the query is looked up as a participant
+        name in the trip index instead.
+        
+        Returns:
+            tuple or None: (list of trips with 'search_title' and 'search_snippet'
+            HTML, True if more results follow), or None when neither the mirror
+            nor the trip index is available
+        """
+        results = self._from_mirror(lambda mirror: mirror_search_results(*mirror.search(query, page_size, offset)))
+        if results is not None or self.index_table_name is None:
+            return results
+        
+        try:
+            trips, has_more = self.find_trips([('participant', query, None)], offset, page_size)
+        except Exception as e:
+            logger.error(f"Error looking up participant {query} in the trip index: {str(e)}", exc_info=True)
+            return None
+        return participant_results(trips, query), has_more
+    
+    def find_trip_keys(self, index, value, until=None):
+        """Row keys of the trips an index lookup finds, newest first
+        
+        One query per index partition (see trip_index.lookup_queries), run
+        in parallel; only the index entities of the matching trips are read.
+        
+        Args:
+            index (str): 'completed', 'class' or 'participant'
+            value: The class or participant name; for 'completed', the first day (date)
+            until (date, optional): For 'completed', the last day
+            
+        Returns:
+            list: Trip row keys
+        """
+        index_client = self.get_index_table_client()
+        
+        def query(lookup):
+            query_filter, parameters = lookup
+            entities = index_client.query_entities(query_filter=query_filter, parameters=parameters, select=['TripRowKey'])
+            return [entity['TripRowKey'] for entity in entities]
+        
+        return sorted({key for keys in map_parallel(query, lookup_queries(index, value, until)) for key in keys})
+    
+    def find_trips(self, lookups, offset=0, limit=20):
+        """Trips found by index lookups, newest first
+        
+        Only the trips of the requested page are read, with parallel point
+        reads; trips whose current values no longer match the lookups (an
+        index entity an interrupted write left behind) are dropped.
+        
+        Args:
+            lookups (list): (index, value, until) lookups, see find_trip_keys;
+                a trip must match all of them
+            offset (int): Number of trips to skip
+            limit (int): Maximum number of trips
+            
+        Returns:
+            tuple: (list of trips, True if more trips follow)
+        """
+        keys = intersect_keys(self.find_trip_keys(index, value, until) for index, value, until in lookups)
+        entities = map_parallel(self._read_trip_entity, keys[offset:offset + limit])
+        trips = [self._map_list_entity(entity) for entity in matching_entities(entities, lookups)]
+        return trips, len(keys) > offset + limit
+    
+    def _read_trip_entity(self, row_key):
+        """get_trip_entity, or None when the trip is gone"""
+        try:
+            return self.get_trip_entity(row_key)
+        except ResourceNotFoundError:
+            return None
+    
+    def get_indexed_page(self, selection, page_size=20, cursor=None):
+        """Get one page of the trips of a category and/or year through the trip index
+        
+        Used for the all trips page when there is no facet index (no mirror
+        and no catalog cache); other facets are not indexed and are ignored.
+        
+        Args:
+            selection (dict): Selected facets, see trip_facets.parse_selection
+            page_size (int): Number of trips per page
+            cursor (str, optional): Opaque cursor from the previous page
+            
+        Returns:
+            tuple or None: (list of trips, cursor for the next page or None),
+            or None when the index is disabled, fails or no indexed facet is selected
+        """
+        if not self.is_configured or self.index_table_name is None:
+            return None
+        request = indexed_page_request(selection, cursor)
+        if request is None:
+            return None
+        lookups, offset = request
+        try:
+            trips, has_more = self.find_trips(lookups, offset, page_size)
+        except Exception as e:
+            logger.error(f"Error reading trips through the trip index: {str(e)}", exc_info=True)
+            return None
+        return indexed_page(selection, trips, has_more, offset, page_size)
+    
+    def _update_index(self, row_key, old_properties, new_properties):
+        """Write the index entities of a trip that was created, changed or deleted
+        
+        Failures are logged, not raised: the trip itself has been written,
+        and rebuild_trip_index repairs the index.
+        
+        Args:
+            old_properties (dict or None): The trip before the write; None for a new trip
+            new_properties (dict or None): The trip after the write; None for a deleted trip
+        """
+        changes = self._index_changes(row_key, old_properties, new_properties)
+        if changes is None:
+            return
+        upserts, deletes = changes
+        try:
+            index_client = self.get_index_table_client()
+            for entity in upserts:
+                index_client.upsert_entity(entity, mode=UpdateMode.REPLACE)
+            for partition, key in deletes:
+                index_client.delete_entity(partition_key=partition, row_key=key)
+            logger.debug(f"Trip index of {row_key}: {len(upserts)} written, {len(deletes)} deleted")
+        except Exception as e:
+            logger.error(f"Error updating the trip index of {row_key} (run rebuild_trip_index): {str(e)}")
+    
+    def _index_changes(self, row_key, old_properties, new_properties):
+        """(upserts, deletes) of an index update, or None when there is nothing to write"""
+        if self.index_table_name is None:
+            return None
+        upserts, deletes = index_changes(row_key, old_properties, new_properties)
+        return (upserts, deletes) if upserts or deletes else None
+    
+    def _indexes_patch(self, patch):
+        """Whether a MERGE patch needs an index update"""
+        return self.index_table_name is not None and touches_index(patch)
+    
+    def _indexed_before(self, row_key, patch, original):
+        """The indexed properties of a trip before a MERGE, or None when the MERGE does not change them
+        
+        They come from original when the edit form sent it, else from the table.
+        """
+        if not self._indexes_patch(patch):
+            return None
+        if original is None:
+            original = self._read_trip_entity(row_key)
+        return indexed_values(original)
+    
+    def get_trip_counts(self):
+        """Get total/completed/future trip counts
+        
+        Returns:
+            dict or None: Counts from the catalog cache, or None when the cache
+            is disabled (counting would need a full partition scan)
+        """
+        if not self.is_configured:
+            return None
+        
+        counts = self._from_mirror(lambda mirror: mirror.get_counts())
+        if counts is not None or self.catalog is None:
+            return counts
+        
+        if not self._refresh_catalog():
+            return None
+        
+        return self.catalog.get_counts()
+    
+    def get_catalog_version(self):
+        """Get the version of the trip listing, for HTTP validators
+        
+        Returns:
+            tuple: (version string, last modified datetime), or (None, None)
+            when neither the mirror nor the catalog cache can provide one
+        """
+        if not self.is_configured:
+            return None, None
+        
+        version = self._from_mirror(lambda mirror: mirror.get_version())
+        if version is not None:
+            return version
+        
+        if self.catalog is None:
+            return None, None
+        
+        if not self._refresh_catalog():
+            return None, None
+        
+        return self.catalog.version, self.catalog.last_modified
+    
+    def get_trip_version(self, row_key):
+        """Get the ETag of a trip from the mirror or catalog cache, without reading the entity
+        
+        Returns:
+            str or None: The entity ETag, or None when it is not known
+        """
+        known, etag = self._mirrored_trip_version(row_key)
+        if known:
+            return etag
+        
+        # The listing version may come from the mirror, so check the catalog itself
+        if self.catalog is None or not self.is_configured or not self._refresh_catalog():
+            return None
+        return self.catalog.get_etag(row_key)
+    
+    def _mirrored_trip_version(self, row_key):
+        """The ETag of a trip in the mirror
+        
+        Returns:
+            tuple: (True, ETag or None) when the mirror is loaded and holds the
+            trip, (False, None) when the catalog cache has to answer instead
+        """
+        if self.mirror is None or not self.mirror.is_ready():
+            return False, None
+        etag = self._from_mirror(lambda mirror: mirror.get_etag(row_key))
+        return etag is not None, etag
+    
+    def _fetch_all_trips(self):
+        """Get all trips from the Azure Table, bypassing the catalog cache"""
+        logger.info("Fetching all trips from Azure Table...")
+        
+        try:
+            entities = list(self._query_trip_entities())
             logger.info(f"Retrieved {len(entities)} entities from Azure Table")
             
             # Transform the entities to match the expected format in the templates
-            trips = []
-            for entity in entities:
-                # Skip entries without a RowKey
-                if not entity.get('RowKey'):
-                    logger.warning(f"Skipping entity without RowKey: {entity}")
-                    continue
-                
-                # Map Azure Table entity to the expected format
-                trip = {
-                    'row_key': entity.get('RowKey'),
-                    'title': entity.get('Title', 'Untitled Trip'),
-                    'description': entity.get('Description', ''),
-                    'trip_completed_on': entity.get('TripCompletedOn', ''),
-                    'length_hours': entity.get('LengthHours', 0),
-                    'location': entity.get('Location', ''),
-                    'elevation_gain': entity.get('ElevationGain', 0),
-                    'difficulty': entity.get('Difficulty', ''),
-                    'map_url': entity.get('MapUrl', ''),
-                    'image_url': entity.get('ImageUrl', ''),
-                    'timestamp': entity.get('Timestamp', ''),  # Include Timestamp for sorting
-                    # Add any other fields needed by your templates
-                }
-                
-                # Debug: Log each trip's key data
-                logger.info(f"Trip: {trip['row_key']} - {trip['title']} - Completed: {trip['trip_completed_on']}")
-                
-                trips.append(trip)
+            return sort_trips(self._map_list_entities(entities))
             
-            # Try sorting by timestamp first (most reliable)
-            try:
-                trips = sorted(trips, key=lambda x: x.get('timestamp', ''), reverse=True)
-                logger.info(f"Sorted {len(trips)} trips by timestamp (newest first)")
-            except Exception as sort_error:
-                logger.error(f"Error sorting by timestamp: {str(sort_error)}")
-                # Fallback to trip_completed_on
-                try:
-                    trips = sorted(trips, key=lambda x: x.get('trip_completed_on', ''), reverse=True)
-                    logger.info(f"Sorted {len(trips)} trips by trip_completed_on (newest first)")
-                except Exception as sort_error2:
-                    logger.error(f"Error sorting by trip_completed_on: {str(sort_error2)}")
-                    # No sorting as last resort
+        except Exception as e:
+            logger.error(f"Error fetching trips from Azure: {str(e)}", exc_info=True)
+            return []
+    
+    def get_latest_trips(self, count):
+        """Get the newest trips
+        
+        Row keys sort newest first, so without the mirror or the catalog cache
+        this is one query for count entities ($top) per partition, run in
+        parallel, rather than a scan of the whole table. While the table still
+        holds legacy keys (which sort oldest first, see rekey_trips) every
+        trip is read and sorted.
+        
+        Args:
+            count (int): Number of trips
             
+        Returns:
+            list: Up to count trips, newest first
+        """
+        if not self.is_configured:
+            logger.warning("No connection string available, returning empty list")
+            return []
+        
+        trips = self._from_mirror(lambda mirror: self._map_list_entities(mirror.get_page(0, count)[0]))
+        if trips is not None:
             return trips
+        
+        if self.catalog is not None:
+            if not self._refresh_catalog():
+                return []
+            return self.catalog.get_page(0, count)[0]
+        
+        try:
+            pages = map_parallel(lambda partition: self._first_entities(partition, count), self.partitions.partitions())
+            trips = latest_trips(self._map_list_entities([entity for page in pages for entity in page]), count)
+            if trips is not None:
+                return trips
+            return self._fetch_all_trips()[:count]
             
         except Exception as e:
-            logger.error(f"Error fetching trips from Azure: {str(e)}", exc_info=True)
+            logger.error(f"Error fetching latest trips from Azure: {str(e)}", exc_info=True)
             return []
     
+    def _first_entities(self, partition, count):
+        """The first count entities of a partition, in key order"""
+        pages = self.iter_entity_pages(partition_key=partition, page_size=count)
+        # Skip empty server pages (the service may return them mid-scan)
+        entities = []
+        for entities, next_token in pages:
+            if entities or not next_token:
+                break
+        return entities
+    
+    def find_rekeyed_trip(self, row_key):
+        """Get the current row key of a trip that rekey_trips moved away from row_key
+        
+        Returns:
+            str or None: The new row key, or None when no trip came from row_key
+        """
+        if not self.is_configured or not is_legacy(row_key):
+            return None
+        
+        try:
+            entities = self._query_partitions("PreviousRowKey eq @key", {'key': row_key}, select=['RowKey'])
+            for entity in entities:
+                return entity['RowKey']
+            return None
+        except Exception as e:
+            logger.error(f"Error looking up the new row key of trip {row_key}: {str(e)}", exc_info=True)
+            return None
+    
+    def get_cached_trip(self, row_key):
+        """Get the list view of a trip from the catalog cache without any storage call
+        
+        Returns:
+            TripSummary or None: The cached trip, or None if the cache is disabled or does not hold it
+        """
+        if self.mirror is not None and self.mirror.is_ready():
+            entity, _ = self._from_mirror(lambda mirror: mirror.get_entity(row_key)) or (None, None)
+            return self._map_list_entity(entity) if entity is not None else None
+        
+        if self.catalog is None:
+            return None
+        return self.catalog.get(row_key)
+    
     def get_trip_by_id(self, row_key):
         """Get a specific trip by its row key"""
         logger.info(f"Fetching trip with row_key: {row_key}")
         
-        if not self.connection_string:
+        if not self.is_configured:
             logger.warning("No connection string available, returning None")
             return None
             
         try:
-            table_client = self.get_table_client()
-            entity = table_client.get_entity(partition_key="Trips", row_key=row_key)
+            entity = self.get_trip_entity(row_key)
             logger.info(f"Successfully retrieved trip: {entity.get('Title', 'Unknown')}")
-            
-            # Log all keys in the entity to help debug
-            logger.info(f"Entity keys: {list(entity.keys())}")
-            
-            # Transform the entity to match the expected format in the templates
-            trip = {
-                'row_key': entity.get('RowKey'),
-                'title': entity.get('Title', 'Untitled Trip'),
-                'description': entity.get('Description', ''),
-                'trip_completed_on': entity.get('TripCompletedOn', ''),
-                'length_hours': entity.get('LengthHours', 0),
-                'location': entity.get('Location', ''),
-                'elevation_gain': entity.get('ElevationGain', 0),
-                'difficulty': entity.get('Difficulty', ''),
-                'map_url': entity.get('MapUrl', ''),
-                'image_url': entity.get('ImageUrl', ''),
-                'timestamp': entity.get('Timestamp', ''),
-                'participants': entity.get('Participants', ''),
-                'meters_ascend': entity.get('MetersAscend', 0),
-                'meters_descend': entity.get('MetersDescend', 0),
-                
-                # Check for different case variations of the grade fields
-                'uiaa_grade': entity.get('UiaaGrade') or 'none',
-                'alpine_grade': entity.get('AlpineGrade') or 'none',
-                'trip_class': entity.get('TripClass') or 'none',
-                'ferata_grade': entity.get('FerataGrade') or 'none',
-                
-                'parking_json': entity.get('ParkingJson', ''),
-                'high_point_json': entity.get('HighPointJson', ''),
-            }
-            
-            # Debug: Log the transformed trip data
-            logger.info(f"Grade fields in entity: UiaaGrade={entity.get('UiaaGrade')}, AlpineGrade={entity.get('AlpineGrade')}, FerataGrade={entity.get('FerataGrade')}")
-            logger.info(f"Transformed trip data: {json.dumps(trip, default=str)}")
-            
-            return trip
+            return self._map_detail_entity(entity)
+        except ResourceNotFoundError:
+            logger.warning(f"Trip {row_key} not found in Azure")
+            return None
         except Exception as e:
             logger.error(f"Error fetching trip {row_key} from Azure: {str(e)}", exc_info=True)
+            return self.get_mirrored_trip(row_key)
+    
+    def get_mirrored_trip(self, row_key):
+        """Get the detail view of a trip from the local mirror, used when Azure cannot be read
+        
+        Returns:
+            TripRecord or None: The trip, or None when the mirror is unavailable or does not hold it
+        """
+        entity, version = self._from_mirror(lambda mirror: mirror.get_entity(row_key)) or (None, None)
+        if entity is None:
             return None
+        logger.warning(f"Serving trip {row_key} from the local mirror")
+        trip = self._map_detail_entity(entity)
+        trip.etag, trip.last_modified = version
+        return trip
+    
+    def _map_detail_entity(self, entity):
+        """Map an Azure Table entity to the TripRecord used by the detail and edit pages"""
+        logger.debug(f"Entity keys: {list(entity.keys())}")
+        return record_from_entity(entity)
 
     def parse_trip_data(self, trip_entity):
-        """Parse the trip data from Azure Table format to a more usable format"""
-        trip_data = {}
+        """Parse the trip data from Azure Table format to a more usable format (a TripRecord)"""
+        return record_from_entity(trip_entity)
         
-        for key, value in trip_entity.items():
-            # Skip metadata fields
-            if key.startswith('_') or key.endswith('@type'):
-                continue
-                
-            # Handle date fields
-            if isinstance(value, str) and len(value) > 10 and 'T' in value and 'Z' in value:
-                try:
-                    trip_data[key.lower()] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                    continue
-                except ValueError:
-                    pass
+    def _build_trip_patch(self, row_key, trip_data, original=None):
+        """Build the MERGE patch written by update_trip
+        
+        Args:
+            original (dict, optional): The trip's properties when the edit started
+                (see trip_properties); properties still equal to them are left out
             
-            # Parse JSON strings for coordinates
-            if key in ['ParkingJson', 'HighPointJson'] and value:
-                try:
-                    json_value = json.loads(value)
-                    trip_data[key.lower()] = value  # Store original string
-                    # Also store parsed values if needed
-                    if key == 'ParkingJson':
-                        trip_data['parking_coords'] = (json_value.get('Latitude'), json_value.get('Longtitude'))
-                    elif key == 'HighPointJson':
-                        trip_data['high_point_coords'] = (json_value.get('Latitude'), json_value.get('Longtitude'))
-                except json.JSONDecodeError:
-                    trip_data[key.lower()] = value
+        Returns:
+            dict or None: The patch, or None when nothing changed
+        """
+        properties = trip_properties(trip_data)
+        if original is not None:
+            properties = {prop: value for prop, value in properties.items() if original.get(prop) != value}
+            if not properties:
+                return None
+        
+        patch = {'PartitionKey': self.partitions.partition_of(row_key), 'RowKey': row_key}
+        patch.update(properties)
+        logger.debug(f"Patch to merge: {patch}")
+        return patch
+    
+    def _build_new_entity(self, trip_data):
+        """Build the entity written by create_trip
+        
+        Returns:
+            tuple: (row key, entity)
+        """
+        # Newest-first key: an inverted timestamp plus a random suffix
+        row_key = new_row_key()
+        
+        # Create a new entity with the trip data
+        new_entity = {
+            'PartitionKey': self.partitions.partition_of(row_key),
+            'RowKey': row_key,
+            'Title': trip_data.get('title', ''),
+            'Description': trip_data.get('description', ''),
+            'Location': trip_data.get('location', ''),
+            'Difficulty': trip_data.get('difficulty', ''),
+            'MapUrl': trip_data.get('map_url', ''),
+            'ImageUrl': trip_data.get('image_url', ''),
+            'Participants': trip_data.get('participants', ''),
+            'MetersAscend': trip_data.get('meters_ascend', None),
+            'MetersDescend': trip_data.get('meters_descend', None),
+            'UiaaGrade': trip_data.get('uiaa_grade', ''),
+            'AlpineGrade': trip_data.get('alpine_grade', ''),
+            'TripClass': trip_data.get('trip_class', ''),
+            'FerataGrade': trip_data.get('ferata_grade', ''),
+            'ParkingJson': trip_data.get('parking_json', ''),
+            'HighPointJson': trip_data.get('high_point_json', ''),
+            'PhotoManifest': PhotoManifest().to_json(),
+            'CoverPhoto': '',
+            'CoverVariants': '',
+            'Timestamp': datetime.now().isoformat(),  # Add current timestamp
+        }
+        
+        # Handle date fields
+        if 'trip_completed_on' in trip_data and trip_data['trip_completed_on']:
+            if isinstance(trip_data['trip_completed_on'], date):
+                # Convert to string in the format Azure Table Storage expects
+                new_entity['TripCompletedOn'] = trip_data['trip_completed_on'].isoformat()
             else:
-                trip_data[key.lower()] = value
-            
-        return trip_data
+                new_entity['TripCompletedOn'] = trip_data['trip_completed_on']
+        
+        # Handle numeric fields
+        if 'length_hours' in trip_data and trip_data['length_hours'] is not None:
+            new_entity['LengthHours'] = float(trip_data['length_hours'])
         
-    def update_trip(self, row_key, trip_data):
-        """Update a trip in the Azure Table"""
+        if 'elevation_gain' in trip_data and trip_data['elevation_gain'] is not None:
+            new_entity['ElevationGain'] = int(trip_data['elevation_gain'])
+        
+        return row_key, new_entity
+    
+    def update_trip(self, row_key, trip_data, etag=None, original=None):
+        """Update a trip in the Azure Table with a single MERGE of the changed properties
+        
+        Args:
+            row_key (str): The trip's row key
+            trip_data (dict): The new field values
+            etag (str, optional): ETag of the trip when the edit started; the
+                write is then refused if the trip has changed since (If-Match)
+            original (dict, optional): The trip's properties when the edit started,
+                so that only the changed ones are sent
+            
+        Returns:
+            tuple: (success, error message); the message is TRIP_CHANGED when
+            someone else changed the trip in the meantime
+        """
         logger.info(f"Updating trip with row_key: {row_key}")
         
-        if not self.connection_string:
+        if not self.is_configured:
             logger.warning("No connection string available, cannot update trip")
             return False, "No connection string available"
+        
+        patch = self._build_trip_patch(row_key, trip_data, original)
+        if patch is None:
+            logger.info(f"Trip {row_key} has no changes to save")
+            return True, ""
             
         try:
             table_client = self.get_table_client()
+            indexed = self._indexed_before(row_key, patch, original)
+            
+            def merge(partition):
+                written = dict(patch, PartitionKey=partition)
+                return written, table_client.update_entity(entity=written, mode=UpdateMode.MERGE, **if_match(etag))
+            
+            patch, result = self._at_trip(row_key, merge)
+            logger.info(f"Successfully updated trip with row_key: {row_key} ({len(patch) - 2} properties)")
+            
+            self._record_patch(patch, result, original)
+            if indexed is not None:
+                self._update_index(row_key, indexed, patched_values(indexed, patch))
             
-            # First, get the existing entity to preserve any fields not in the update
-            existing_entity = table_client.get_entity(partition_key="Trips", row_key=row_key)
-            
-            # Handle date conversion
-            trip_completed_on = trip_data.get('trip_completed_on')
-            if trip_completed_on and isinstance(trip_completed_on, date):
-                # Convert date to ISO format string
-                trip_completed_on = trip_completed_on.isoformat()
-            
-            # Create the entity to update
-            entity = {
-                'PartitionKey': 'Trips',
-                'RowKey': row_key,
-                'Title': trip_data.get('title', existing_entity.get('Title')),
-                'Description': trip_data.get('description', existing_entity.get('Description')),
-                'TripCompletedOn': trip_completed_on if trip_completed_on else existing_entity.get('TripCompletedOn'),
-                'LengthHours': trip_data.get('length_hours', existing_entity.get('LengthHours')),
-                'Location': trip_data.get('location', existing_entity.get('Location')),
-                'ElevationGain': trip_data.get('elevation_gain', existing_entity.get('ElevationGain')),
-                'Difficulty': trip_data.get('difficulty', existing_entity.get('Difficulty')),
-                'MapUrl': trip_data.get('map_url', existing_entity.get('MapUrl')),
-                'ImageUrl': trip_data.get('image_url', existing_entity.get('ImageUrl')),
-                'Participants': trip_data.get('participants', existing_entity.get('Participants')),
-                'MetersAscend': trip_data.get('meters_ascend', existing_entity.get('MetersAscend')),
-                'MetersDescend': trip_data.get('meters_descend', existing_entity.get('MetersDescend')),
-                'UiaaGrade': trip_data.get('uiaa_grade', existing_entity.get('UiaaGrade')),
-                'AlpineGrade': trip_data.get('alpine_grade', existing_entity.get('AlpineGrade')),
-                'TripClass': trip_data.get('trip_class', existing_entity.get('TripClass')),
-                'FerataGrade': trip_data.get('ferata_grade', existing_entity.get('FerataGrade')),
-            }
-            
-            # Debug: Print the entity being updated
-            print("Entity to update:", entity)
-            
-            # Handle coordinates if provided
-            if 'parking_json' in trip_data and trip_data['parking_json']:
-                entity['ParkingJson'] = trip_data['parking_json']
-                print(f"Setting ParkingJson: {trip_data['parking_json']}")
-            
-            if 'high_point_json' in trip_data and trip_data['high_point_json']:
-                entity['HighPointJson'] = trip_data['high_point_json']
-                print(f"Setting HighPointJson: {trip_data['high_point_json']}")
-            
-            # Update the entity in Azure Table
-            print("Calling update_entity with entity:", entity)
-            table_client.update_entity(entity=entity)
-            logger.info(f"Successfully updated trip with row_key: {row_key}")
             return True, ""
             
+        except ResourceModifiedError:
+            logger.info(f"Trip {row_key} changed since the edit started, not overwriting it")
+            return False, TRIP_CHANGED
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"Error updating trip: {error_msg}")
-            import traceback
-            logger.error(traceback.format_exc())
-            print(f"Exception: {error_msg}")
-            print(f"Traceback: {traceback.format_exc()}")
+            logger.error(f"Error updating trip: {error_msg}", exc_info=True)
             return False, error_msg
 
     def create_trip(self, trip_data):
         """Create a new trip in Azure Table Storage"""
         logger.info("Creating new trip")
         
-        if not self.connection_string:
+        if not self.is_configured:
             logger.warning("No connection string available, cannot create trip")
             return False, "No connection string available", None
         
         try:
             table_client = self.get_table_client()
             
-            # Generate a new row key based on timestamp
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            row_key = f"trip_{timestamp}"
-            
-            # Create a new entity with the trip data
-            new_entity = {
-                'PartitionKey': 'Trips',
-                'RowKey': row_key,
-                'Title': trip_data.get('title', ''),
-                'Description': trip_data.get('description', ''),
-                'Location': trip_data.get('location', ''),
-                'Difficulty': trip_data.get('difficulty', ''),
-                'MapUrl': trip_data.get('map_url', ''),
-                'ImageUrl': trip_data.get('image_url', ''),
-                'Participants': trip_data.get('participants', ''),
-                'MetersAscend': trip_data.get('meters_ascend', None),
-                'MetersDescend': trip_data.get('meters_descend', None),
-                'UiaaGrade': trip_data.get('uiaa_grade', ''),
-                'AlpineGrade': trip_data.get('alpine_grade', ''),
-                'TripClass': trip_data.get('trip_class', ''),
-                'FerataGrade': trip_data.get('ferata_grade', ''),
-                'ParkingJson': trip_data.get('parking_json', ''),
-                'HighPointJson': trip_data.get('high_point_json', ''),
-                'Timestamp': datetime.now().isoformat(),  # Add current timestamp
-            }
-            
-            # Handle date fields
-            if 'trip_completed_on' in trip_data and trip_data['trip_completed_on']:
-                if isinstance(trip_data['trip_completed_on'], date):
-                    # Convert to string in the format Azure Table Storage expects
-                    new_entity['TripCompletedOn'] = trip_data['trip_completed_on'].isoformat()
-                else:
-                    new_entity['TripCompletedOn'] = trip_data['trip_completed_on']
-            
-            # Handle numeric fields
-            if 'length_hours' in trip_data and trip_data['length_hours'] is not None:
-                new_entity['LengthHours'] = float(trip_data['length_hours'])
-            
-            if 'elevation_gain' in trip_data and trip_data['elevation_gain'] is not None:
-                new_entity['ElevationGain'] = int(trip_data['elevation_gain'])
+            row_key, new_entity = self._build_new_entity(trip_data)
             
             # Create the entity in Azure Table Storage
-            table_client.create_entity(new_entity)
+            result = table_client.create_entity(new_entity)
             logger.info(f"Successfully created trip with row key: {row_key}")
+            
+            self._record_write(new_entity, result)
+            self._update_index(row_key, None, new_entity)
+            
             return True, None, row_key
             
         except Exception as e:
@@ -327,3 +1116,264 @@ class AzureTableService:
             import traceback
             logger.error(traceback.format_exc())
             return False, error_msg, None
+
+    def delete_trip(self, row_key):
+        """Delete a trip from Azure Table Storage
+        
+        Returns:
+            tuple: (success, error message)
+        """
+        logger.info(f"Deleting trip with row_key: {row_key}")
+        
+        if not self.is_configured:
+            logger.warning("No connection string available, cannot delete trip")
+            return False, "No connection string available"
+        
+        try:
+            table_client = self.get_table_client()
+            # Read first, so the trip's index entities can be found
+            deleted = self._read_trip_entity(row_key) if self.index_table_name is not None else None
+            # Deleting a missing entity is not an error, so clear every partition the trip may be in
+            for partition in self.partitions.locations(row_key):
+                table_client.delete_entity(partition_key=partition, row_key=row_key)
+            logger.info(f"Successfully deleted trip with row_key: {row_key}")
+            
+            self._record_delete(row_key)
+            if deleted is not None:
+                self._update_index(row_key, deleted, None)
+            
+            return True, None
+            
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error deleting trip {row_key}: {error_msg}", exc_info=True)
+            return False, error_msg
+
+    def _record_write(self, entity, result):
+        """Patch the catalog cache and the mirror after this worker wrote an entity
+        
+        Args:
+            entity (dict): The full entity as now stored
+            result (dict): Response metadata of the write (holds the new etag)
+        """
+        etag = (result or {}).get('etag')
+        if self.catalog is not None:
+            self.catalog.put(self._map_list_entity(entity), etag=etag)
+        if self.mirror is not None:
+            self.mirror.put_entity(entity, etag=etag)
+    
+    def _build_rekeyed_entity(self, entity, new_key):
+        """Copy of a trip entity under a new row key, its blob names moved to the new prefix"""
+        old_key = entity['RowKey']
+        rekeyed = dict(entity)
+        rekeyed['PartitionKey'] = self.partitions.partition_of(new_key)
+        rekeyed['RowKey'] = new_key
+        rekeyed['PreviousRowKey'] = old_key
+        for prop in BLOB_PROPERTIES:
+            value = rekeyed.get(prop)
+            if isinstance(value, str):
+                # Covers photos ({key}/...) and their variants (variants/{key}/...)
+                rekeyed[prop] = value.replace(f"{old_key}/", f"{new_key}/")
+        return rekeyed
+    
+    def rekey_trip(self, entity, new_key):
+        """Move a trip entity to a new row key
+        
+        See _move_entity; a trip edited in the meantime is left alone. The
+        photo blobs are not moved here.
+        
+        Args:
+            entity (TableEntity): The trip as read from the table
+            new_key (str): Its new row key
+            
+        Returns:
+            tuple: (success, the new entity or an error message)
+        """
+        if not self.is_configured:
+            return False, "No connection string available"
+        
+        rekeyed = self._build_rekeyed_entity(entity, new_key)
+        success, result = self._move_entity(entity, rekeyed)
+        if not success:
+            return False, result
+        
+        logger.info(f"Moved trip {entity['RowKey']} to {new_key}")
+        self._record_delete(entity['RowKey'])
+        self._update_index(entity['RowKey'], entity, None)
+        self._update_index(new_key, None, rekeyed)
+        return True, rekeyed
+    
+    def move_trip_partition(self, entity):
+        """Move a trip entity to the partition the current scheme puts it in
+        
+        Used by migrate_trip_partitions while the site keeps running: until
+        the old entity is gone, reads and writes find the copy first (see
+        _at_trip), and a trip edited in the meantime is left for a rerun.
+        
+        Args:
+            entity (TableEntity): The trip as read from the table
+            
+        Returns:
+            tuple: (success, the new partition or an error message)
+        """
+        if not self.is_configured:
+            return False, "No connection string available"
+        
+        moved = dict(entity)
+        moved['PartitionKey'] = self.partitions.partition_of(entity['RowKey'])
+        success, result = self._move_entity(entity, moved)
+        if not success:
+            return False, result
+        
+        logger.info(f"Moved trip {entity['RowKey']} from partition {entity['PartitionKey']} to {moved['PartitionKey']}")
+        self._record_write(moved, result)
+        return True, moved['PartitionKey']
+    
+    def _move_entity(self, entity, moved):
+        """Replace an entity by a copy under other keys
+        
+        Within one partition the copy is written and the original deleted in
+        one transaction. Across partitions (no transaction spans them) the
+        copy is created first; if the original then turns out to have changed
+        since it was read, the copy is deleted again. A copy left over from an
+        interrupted run is kept: writes go to it first, so it is the newer one.
+        Either way the delete carries the original's etag, so edits are never lost.
+        
+        Returns:
+            tuple: (success, write result of the copy or error message)
+        """
+        table_client = self.get_table_client()
+        old = {'PartitionKey': entity['PartitionKey'], 'RowKey': entity['RowKey']}
+        condition = if_match(entity.metadata.get('etag'))
+        try:
+            if moved['PartitionKey'] == old['PartitionKey']:
+                results = table_client.submit_transaction([
+                    ('upsert', moved, {'mode': UpdateMode.REPLACE}),
+                    ('delete', old, condition),
+                ])
+                return True, results[0] if results else None
+            
+            try:
+                result = table_client.create_entity(moved)
+            except ResourceExistsError:
+                logger.info(f"Trip {moved['RowKey']} already has a copy in partition {moved['PartitionKey']}, keeping it")
+                result = None
+            try:
+                table_client.delete_entity(partition_key=old['PartitionKey'], row_key=old['RowKey'], **condition)
+            except ResourceModifiedError:
+                if result is not None:
+                    table_client.delete_entity(
+                        partition_key=moved['PartitionKey'], row_key=moved['RowKey'], **if_match(result.get('etag')),
+                    )
+                return False, "The trip changed while it was being moved"
+            return True, result
+        except Exception as e:
+            logger.error(f"Error moving trip {old['RowKey']}: {str(e)}")
+            return False, str(e)
+    
+    def _record_patch(self, patch, result, original=None):
+        """Patch the catalog cache and the mirror after this worker merged properties into a trip
+        
+        Only the written properties are known here, so the cached trip and the
+        mirrored entity are updated in place. A trip neither of them holds yet
+        is picked up by their next refresh.
+        
+        Args:
+            patch (dict): The MERGE patch as written
+            result (dict): Response metadata of the write (holds the new etag)
+            original (dict, optional): The trip's properties before the write
+        """
+        etag = (result or {}).get('etag')
+        if self.catalog is not None:
+            trip = self.catalog.get(patch['RowKey'])
+            if trip is not None:
+                properties = dict(patch)
+                if 'ParkingJson' in patch or 'HighPointJson' in patch:
+                    # The map point comes from either point, so it needs both
+                    for prop in ('ParkingJson', 'HighPointJson'):
+                        properties.setdefault(prop, (original or {}).get(prop))
+                self.catalog.put(patch_summary(trip, properties), etag=etag)
+        if self.mirror is not None:
+            self.mirror.patch_entity(patch, etag=etag)
+    
+    def _record_delete(self, row_key):
+        """Drop a trip this worker deleted from the catalog cache and the mirror"""
+        if self.catalog is not None:
+            self.catalog.remove(row_key)
+        if self.mirror is not None:
+            self.mirror.remove(row_key)
+    
+    def _manifest_of(self, entity):
+        """The PhotoManifest stored on a trip entity, or None for trips without one"""
+        return PhotoManifest.from_json(entity.get('PhotoManifest'))
+    
+    def _manifest_written(self, entity, patch):
+        """The entity as stored after a manifest patch was merged into it"""
+        merged_entity = dict(entity)
+        merged_entity.update(patch)
+        return merged_entity
+    
+    def _build_manifest_patch(self, entity, manifest):
+        """Build the MERGE patch that stores a photo manifest and its cover on the trip entity"""
+        cover_variants = manifest.cover_variants
+        return {
+            'PartitionKey': entity['PartitionKey'],
+            'RowKey': entity['RowKey'],
+            'PhotoManifest': manifest.to_json(),
+            'CoverPhoto': manifest.cover,
+            'CoverVariants': json.dumps(cover_variants, separators=(',', ':')) if cover_variants else '',
+        }
+    
+    def update_photo_manifest(self, row_key, update, seed=None):
+        """Apply a change to a trip's photo manifest
+        
+        The entity is read and then merged back with If-Match, retrying when
+        another write got in between, so concurrent uploads never drop photos.
+        
+        Args:
+            row_key (str): The trip's row key
+            update (callable): Called with the PhotoManifest to modify it in place
+            seed (callable, optional): Builds the starting manifest for trips
+                that do not have one yet (e.g. from the blob listing)
+            
+        Returns:
+            tuple: (success, PhotoManifest or error message)
+        """
+        if not self.is_configured:
+            logger.warning("No connection string available, cannot update photo manifest")
+            return False, "No connection string available"
+        
+        try:
+            table_client = self.get_table_client()
+            
+            for attempt in range(MANIFEST_UPDATE_ATTEMPTS):
+                entity = self.get_trip_entity(row_key)
+                manifest = self._manifest_of(entity)
+                if manifest is None:
+                    manifest = seed() if seed else PhotoManifest()
+                
+                update(manifest)
+                patch = self._build_manifest_patch(entity, manifest)
+                
+                try:
+                    result = table_client.update_entity(
+                        entity=patch,
+                        mode=UpdateMode.MERGE,
+                        etag=entity.metadata.get('etag'),
+                        match_condition=MatchConditions.IfNotModified,
+                    )
+                except ResourceModifiedError:
+                    logger.info(f"Trip {row_key} changed during manifest update, retrying ({attempt + 1})")
+                    continue
+                
+                self._record_write(self._manifest_written(entity, patch), result)
+                
+                logger.info(f"Updated photo manifest for trip {row_key} ({len(manifest.photos)} photos)")
+                return True, manifest
+            
+            return False, "Trip kept changing during the photo manifest update"
+            
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error updating photo manifest for trip {row_key}: {error_msg}", exc_info=True)
+            return False, error_msg
@@ -0,0 +1,376 @@
+"""Benchmarks of the trip service layer and views against in-memory storage.
+
+``manage.py benchmark_trips`` builds synthetic trip catalogs of several sizes
+in the memory storage backend (with optional per-call latency), then times
+the service functions and the pages that read them. Reports can be saved as
+JSON and compared with a saved baseline, so a change can be checked for
+regressions without an Azure account.
+"""
+import datetime
+import json
+import logging
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+from .azure_service import AzureTableService
+from .blob_service import AzureBlobService
+from .image_variants import VARIANT_WIDTHS
+from .partitions import get_trip_partitions
+from .storage_backends import MemoryStorageBackend
+from .timing import metrics
+from .trip_facets import ALPINE_GRADES, FERRATA_GRADES, TRIP_CLASS_LABELS, UIAA_GRADES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (100, 1000, 10000, 50000)
+
+# Read paths: 'catalog' serves listings from the in-process catalog cache,
+# 'table' reads the table on every call (TRIP_CATALOG_CACHE_ENABLED=False)
+READ_PATHS = ('catalog', 'table')
+
+REPORT_VERSION = 1
+
+# Changes against a baseline smaller than this are never flagged (timer and allocator noise)
+MIN_FLAGGED_CHANGE_MS = 0.1
+MIN_FLAGGED_CHANGE_KIB = 4
+
+
+def _photo_manifest(row_key, photos, rng):
+    entries = []
+    for order in range(photos):
+        stem = f'{row_key}/2024{order:010d}'
+        variants = {
+            variant: {'name': f'variants/{stem}/{variant}.webp', 'width': width, 'height': width * 3 // 4}
+            for variant, width in VARIANT_WIDTHS.items()
+        }
+        entries.append({
+            'name': f'{stem}.jpg', 'size': rng.randint(1_000_000, 6_000_000),
+            'width': 4000, 'height': 3000, 'order': order, 'variants': variants,
+        })
+    return entries
+
+
+def generate_catalog(size, photos=5, legacy_share=0.1, seed=1):
+    """Synthetic trips table: ``size`` entities with realistic field values, in the configured partitions
+
+    Args:
+        size (int): Number of trips
+        photos (int): Photos per trip
+        legacy_share (float): Share of trips without a photo manifest (their
+            photos are only found by listing blobs)
+        seed (int): Random seed, so runs with the same arguments get the same data
+
+    Returns:
+        tuple: (list of (entity, timestamp), list of (blob name, size))
+    """
+    rng = random.Random(seed)
+    classes = list(TRIP_CLASS_LABELS)
+    start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+    partitions = get_trip_partitions()
+    entities = []
+    blobs = []
+    for number in range(size):
+        row_key = f'trip_{number:07d}'
+        completed = start + datetime.timedelta(days=rng.randint(0, 3650))
+        high_point = {'Latitude': rng.uniform(45.5, 51.0), 'Longtitude': rng.uniform(6.0, 19.0)}
+        entity = {
+            'PartitionKey': partitions.partition_of(row_key),
+            'RowKey': row_key,
+            'Title': f'Trip {number} to {rng.choice(("Sněžka", "Gerlach", "Triglav", "Grossglockner", "Watzmann"))}',
+            'Description': ' '.join(rng.choice(('ridge', 'snow', 'forest', 'scramble', 'hut', 'valley')) for _ in range(40)),
+            'TripCompletedOn': completed if rng.random() > 0.1 else '',
+            'LengthHours': round(rng.uniform(2, 14), 1),
+            'Location': rng.choice(('Krkonoše', 'Tatry', 'Julian Alps', 'Hohe Tauern', 'Berchtesgaden')),
+            'ElevationGain': rng.randint(100, 2500),
+            'Difficulty': rng.choice(('easy', 'moderate', 'hard')),
+            'MapUrl': '',
+            'ImageUrl': '',
+            'Participants': 'Baruch, Ondra, Petr',
+            'MetersAscend': rng.randint(100, 2500),
+            'MetersDescend': rng.randint(100, 2500),
+            'TripClass': rng.choice(classes),
+            'UiaaGrade': rng.choice(UIAA_GRADES + ['none']),
+            'AlpineGrade': rng.choice(ALPINE_GRADES + ['none']),
+            'FerataGrade': rng.choice(FERRATA_GRADES + ['none']),
+            'HighPointJson': json.dumps(high_point),
+            'ParkingJson': json.dumps({'Latitude': high_point['Latitude'] - 0.05, 'Longtitude': high_point['Longtitude']}),
+        }
+        manifest = _photo_manifest(row_key, photos, rng)
+        blobs.extend((photo['name'], photo['size']) for photo in manifest)
+        if rng.random() >= legacy_share:
+            entity['PhotoManifest'] = json.dumps({'photos': manifest}, separators=(',', ':'))
+            entity['CoverPhoto'] = manifest[0]['name'] if manifest else ''
+            entity['CoverVariants'] = json.dumps(manifest[0]['variants']) if manifest else ''
+        entities.append((entity, start + datetime.timedelta(minutes=number)))
+    return entities, blobs
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _storage_calls():
+    return sum(summary['count'] for summary in metrics.snapshot()['storage'].values())
+
+
+def measure(fn, repeat=20, max_seconds=5.0, allocations=True):
+    """Time a call and record its allocations
+
+    The call runs once to warm up, then up to ``repeat`` times (at least three
+    times, stopping early once ``max_seconds`` have passed). Allocations are
+    traced in one extra run, so tracing does not slow down the timed runs.
+
+    Returns:
+        dict or None: Timings in ms, storage calls per run and allocations in
+        KiB, or None when the call has nothing to measure (returns None)
+    """
+    if fn() is None:
+        return None
+
+    samples = []
+    calls_before = _storage_calls()
+    deadline = time.perf_counter() + max_seconds
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+        if len(samples) >= 3 and time.perf_counter() > deadline:
+            break
+    calls = (_storage_calls() - calls_before) / len(samples)
+
+    result = {
+        'runs': len(samples),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(_percentile(samples, 0.95), 3),
+        'min_ms': round(min(samples), 3),
+        'storage_calls': round(calls, 1),
+        'peak_kib': None,
+        'allocated_kib': None,
+    }
+    if allocations:
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            after, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result['peak_kib'] = round((peak - before) / 1024, 1)
+        result['allocated_kib'] = round((after - before) / 1024, 1)
+    return result
+
+
+def _service_operations(service, blob_service, trip_id, trip_class):
+    """(name, call) pairs of the service functions the pages use"""
+    world = (-180.0, -85.0, 180.0, 85.0)
+
+    def trip_photos():
+        trip = service.get_trip_by_id(trip_id)
+        return blob_service.get_trip_photos(trip_id, trip.photo_manifest)
+
+    return [
+        ('get_all_trips', service.get_all_trips),
+        ('get_catalog_version', lambda: service.get_catalog_version()[0]),
+        ('get_trips_page', lambda: service.get_trips_page(page_size=20)),
+        ('get_trips_page(completed)', lambda: service.get_trips_page(page_size=20, trip_filter='completed')),
+        ('get_trip_counts', service.get_trip_counts),
+        ('get_faceted_page', lambda: service.get_faceted_page({'class': trip_class}, page_size=20)),
+        ('get_map_features(z5)', lambda: service.get_map_features(world, 5)),
+        ('get_trip_by_id', lambda: service.get_trip_by_id(trip_id)),
+        ('get_trip_photos', trip_photos),
+    ]
+
+
+def _view_operations(client, trip_id, trip_class, versioned=True):
+    """(name, call) pairs of the pages, requested through the full middleware stack
+
+    The map features endpoint answers 503 without a versioned listing, so it
+    is left out unless ``versioned``.
+    """
+    def get(path):
+        def request():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {path} returned {response.status_code}')
+            return response
+        return request
+
+    operations = [
+        ('view:index', get('/trips/')),
+        ('view:all_trips', get('/trips/all/')),
+        ('view:all_trips(faceted)', get(f'/trips/all/?filter=completed&class={trip_class}')),
+        ('view:trip_detail', get(f'/trips/trip/{trip_id}/')),
+    ]
+    if versioned:
+        operations.append(('view:trip_map_features', get('/trips/map/features/?bbox=12,48,19,51&zoom=8')))
+    return operations
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, read_paths=READ_PATHS, photos=5, legacy_share=0.1,
+                   table_latency_ms=0, blob_latency_ms=0, repeat=20, max_seconds=5.0,
+                   allocations=True, views=True, progress=None):
+    """Run every operation against every catalog size and read path
+
+    Args:
+        progress (callable, optional): Called with a line of text as each
+            operation finishes
+
+    Returns:
+        dict: Report with 'meta' (the run's parameters) and 'results' (one
+        dict per path, size and operation)
+    """
+    from django.test import Client, override_settings
+    from . import views as trip_views
+
+    report = {
+        'version': REPORT_VERSION,
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'photos': photos,
+            'legacy_share': legacy_share,
+            'table_latency_ms': table_latency_ms,
+            'blob_latency_ms': blob_latency_ms,
+            'repeat': repeat,
+        },
+        'results': [],
+    }
+
+    # Rendered pages are measured, not page cache hits; slow requests are expected here
+    settings_override = override_settings(
+        ALLOWED_HOSTS=['testserver'], TRIPS_PAGE_CACHE_SECONDS=0, TRIPS_SLOW_REQUEST_MS=0,
+    )
+    saved_services = trip_views._data_service, trip_views._blob_service
+    settings_override.enable()
+    logging.disable(logging.INFO)
+    try:
+        for size in sizes:
+            started = time.perf_counter()
+            entities, blobs = generate_catalog(size, photos=photos, legacy_share=legacy_share)
+            # Catalog caches are per table name, so each size gets its own table
+            table_name = f'Benchmark{size}'
+            storage = MemoryStorageBackend()
+            storage.get_table_client(table_name).load(entities)
+            # Only names count for the listings; contents stay empty to keep large catalogs cheap
+            storage.get_container_client('photos').load((name, b'') for name, _ in blobs)
+            storage.get_table_client(table_name).latency_ms = table_latency_ms
+            storage.get_container_client('photos').latency_ms = blob_latency_ms
+            trip_id = entities[size // 2][0]['RowKey']
+            trip_class = entities[size // 2][0]['TripClass']
+            del entities, blobs
+            if progress:
+                progress(f'Generated {size} trips in {time.perf_counter() - started:.1f}s')
+
+            for read_path in read_paths:
+                service = AzureTableService(table_name=table_name, storage=storage)
+                if read_path == 'table':
+                    service.catalog = None
+                blob_service = AzureBlobService(table_service=service, make_variants=False, storage=storage)
+                trip_views._data_service, trip_views._blob_service = service, blob_service
+
+                operations = _service_operations(service, blob_service, trip_id, trip_class)
+                if views:
+                    operations += _view_operations(Client(), trip_id, trip_class, versioned=service.catalog is not None)
+
+                for name, call in operations:
+                    result = measure(call, repeat=repeat, max_seconds=max_seconds, allocations=allocations)
+                    if result is None:
+                        if progress:
+                            progress(f'  {read_path:<8} {size:>6} {name}: not available on this read path')
+                        continue
+                    report['results'].append({'path': read_path, 'size': size, 'operation': name, **result})
+                    if progress:
+                        progress(f"  {read_path:<8} {size:>6} {name}: {result['p50_ms']:.2f} ms")
+    finally:
+        logging.disable(logging.NOTSET)
+        settings_override.disable()
+        trip_views._data_service, trip_views._blob_service = saved_services
+    return report
+
+
+def _result_key(result):
+    return result['path'], result['size'], result['operation']
+
+
+def _change(value, base):
+    if value is None or not base:
+        return None
+    return (value - base) / base * 100
+
+
+def _flag(change, value, base, floor, threshold):
+    if abs(value - base) < floor:
+        return ' '
+    if change > threshold:
+        return '!'
+    if change < -threshold:
+        return '*'
+    return ' '
+
+
+def format_report(report, baseline=None, threshold=10.0):
+    """Format a report as a fixed-width table, optionally against a baseline
+
+    Args:
+        baseline (dict, optional): An earlier report; p50 time and peak
+            allocation changes are shown and changes above ``threshold``
+            percent are flagged
+        threshold (float): Change (percent) flagged as a regression or improvement
+
+    Returns:
+        tuple: (list of lines, number of regressions)
+    """
+    meta = report['meta']
+    lines = [
+        f"Python {meta['python']} on {meta['platform']}",
+        f"{meta['photos']} photos per trip, {meta['legacy_share']:.0%} without a manifest, "
+        f"table latency {meta['table_latency_ms']} ms, blob latency {meta['blob_latency_ms']} ms",
+        '',
+    ]
+    base = {_result_key(result): result for result in (baseline or {}).get('results', [])}
+    header = f"{'path':<8} {'trips':>6}  {'operation':<28} {'runs':>4} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'calls':>6} {'peak KiB':>9}"
+    if baseline is not None:
+        header += f" {'p50 vs base':>12} {'peak vs base':>12}"
+    lines.append(header)
+    lines.append('-' * len(header))
+
+    regressions = 0
+    previous = None
+    for result in report['results']:
+        group = (result['path'], result['size'])
+        if previous is not None and group != previous:
+            lines.append('')
+        previous = group
+        peak = '-' if result['peak_kib'] is None else f"{result['peak_kib']:.1f}"
+        line = (
+            f"{result['path']:<8} {result['size']:>6}  {result['operation']:<28} {result['runs']:>4} "
+            f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['mean_ms']:>9.2f} "
+            f"{result['storage_calls']:>6.1f} {peak:>9}"
+        )
+        if baseline is not None:
+            earlier = base.get(_result_key(result))
+            for value, base_value, floor in (
+                (result['p50_ms'], earlier and earlier['p50_ms'], MIN_FLAGGED_CHANGE_MS),
+                (result['peak_kib'], earlier and earlier['peak_kib'], MIN_FLAGGED_CHANGE_KIB),
+            ):
+                change = _change(value, base_value)
+                if change is None:
+                    line += f" {'new' if earlier is None else '-':>12}"
+                    continue
+                mark = _flag(change, value, base_value, floor, threshold)
+                if mark == '!':
+                    regressions += 1
+                line += f" {change:>+10.1f}%{mark}"
+        lines.append(line)
+
+    if baseline is not None:
+        lines.append('')
+        lines.append(f'! slower or larger than the baseline by more than {threshold:g}%, * faster or smaller')
+    return lines, regressions
@@ -1,62 +1,97 @@
+import contextvars
+import io
 import os
+import time
+import uuid
 import logging
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from datetime import datetime
+from urllib.parse import quote, unquote, urlsplit
+from azure.storage.blob import BlobSasPermissions, ContentSettings, generate_blob_sas
+from datetime import datetime, timedelta, timezone
+
+from .fanout import StorageFanout, get_upload_executor
+from .image_variants import VARIANTS_PREFIX, VARIANT_CACHE_CONTROL, build_srcset, generate_variants, variants_prefix
+from .photo_manifest import PhotoManifest, read_image_dimensions
+from .storage_backends import AzureStorageBackend
+from .timing import timed_service
 
 logger = logging.getLogger(__name__)
 
+# Enough of a JPEG to cover the EXIF block and the frame header
+PHOTO_HEADER_BYTES = 256 * 1024
+
+# Blocks of one large photo uploaded in parallel
+DEFAULT_BLOCK_CONCURRENCY = 4
+
+# Lifetime of the SAS URLs handed to the browser for direct uploads
+DEFAULT_UPLOAD_SAS_MINUTES = 15
+# Most photos one direct-upload request may ask URLs for
+MAX_DIRECT_UPLOADS = 50
+
+@timed_service('blob', exclude=('get_blob_service_client', 'get_container_client', 'supports_direct_uploads', 'get_photo_url', 'get_photo_sources'))
 class AzureBlobService:
     """Service for interacting with Azure Blob Storage"""
     
-    def __init__(self, connection_string=None, container_name="photos"):
+    def __init__(self, connection_string=None, container_name="photos", table_service=None, make_variants=None, storage=None):
         self.connection_string = connection_string or os.environ.get("BARUCHSTREKS_STORAGE_CONNECTION")
+        # Where the photos live; Azure unless another backend is passed in
+        self.storage = storage or AzureStorageBackend(self.connection_string)
         self.container_name = container_name
-        logger.info(f"AzureBlobService initialized with container: {container_name}")
-        
-        # Log partial connection string for debugging (hide the key)
-        if self.connection_string:
-            parts = self.connection_string.split(';')
-            safe_conn = ';'.join([p for p in parts if not p.startswith('AccountKey=')])
-            logger.info(f"Connection string provided: {safe_conn}...")
-        else:
+        # When set, uploads and deletes keep the trip's photo manifest up to date
+        self.table_service = table_service
+        # Make resized variants (card/gallery/lightbox) of each uploaded photo
+        from django.conf import settings
+        if make_variants is None:
+            make_variants = getattr(settings, 'PHOTO_VARIANTS_ENABLED', True)
+        self.make_variants = make_variants
+        self.block_concurrency = getattr(settings, 'PHOTO_UPLOAD_BLOCK_CONCURRENCY', DEFAULT_BLOCK_CONCURRENCY)
+        logger.info(f"AzureBlobService initialized with container: {container_name} ({self.storage.describe()} storage)")
+        
+        if not self.storage.is_configured:
             logger.warning("No connection string provided!")
     
+    @property
+    def is_configured(self):
+        """True if the storage backend can be reached (Azure needs a connection string)"""
+        return self.storage.is_configured
+    
     def get_blob_service_client(self):
-        """Get a blob service client for Azure Blob Storage"""
-        if not self.connection_string:
+        """Get the shared blob service client for Azure Blob Storage (None on other backends)"""
+        if not self.is_configured:
             logger.warning("No connection string available")
             return None
         
         try:
-            return BlobServiceClient.from_connection_string(self.connection_string)
+            return self.storage.get_blob_service_client()
         except Exception as e:
             logger.error(f"Error creating blob service client: {str(e)}", exc_info=True)
             return None
     
     def get_container_client(self):
-        """Get a container client for the photos container"""
-        blob_service_client = self.get_blob_service_client()
-        if not blob_service_client:
+        """Get the shared container client for the photos container"""
+        if not self.is_configured:
+            logger.warning("No connection string available")
             return None
         
         try:
-            return blob_service_client.get_container_client(self.container_name)
+            return self.storage.get_container_client(self.container_name)
         except Exception as e:
             logger.error(f"Error getting container client: {str(e)}", exc_info=True)
             return None
     
-    def upload_photo(self, trip_id, photo_file, filename=None):
+    def upload_photo(self, trip_id, photo_file, filename=None, deadline=None):
         """Upload a photo to Azure Blob Storage
         
         Args:
             trip_id (str): The trip's row key
             photo_file (file): The photo file object
             filename (str, optional): Custom filename. If None, original filename is used.
+            deadline (float, optional): time.monotonic() value after which the
+                upload stops reading the file and fails
             
         Returns:
             tuple: (success, url or error message)
         """
-        if not self.connection_string:
+        if not self.is_configured:
             logger.warning("No connection string available, cannot upload photo")
             return False, "No connection string available"
         
@@ -66,13 +101,7 @@ class AzureBlobService:
         
         try:
             # Create a unique blob name
-            original_filename = filename or photo_file.name
-            # Get file extension
-            _, file_extension = os.path.splitext(original_filename)
-            # Create timestamp for unique filename
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            # Create blob name with folder structure
-            blob_name = f"{trip_id}/{timestamp}{file_extension}"
+            blob_name, file_extension = self._make_blob_name(trip_id, filename or photo_file.name)
             
             # Get container client
             container_client = self.get_container_client()
@@ -87,14 +116,38 @@ class AzureBlobService:
                 content_type=self._get_content_type(file_extension)
             )
             
-            # Upload the file
+            # Read dimensions from the image header before uploading
+            width, height = read_image_dimensions(photo_file)
+            
+            # Upload the file; large files go up as blocks read in parallel
+            # straight from Django's temporary upload file
             photo_file.seek(0)  # Ensure we're at the start of the file
-            blob_client.upload_blob(photo_file, content_settings=content_settings, overwrite=True)
+            blob_client.upload_blob(
+                upload_stream(photo_file, deadline),
+                length=getattr(photo_file, 'size', None),
+                content_settings=content_settings,
+                overwrite=True,
+                max_concurrency=self.block_concurrency,
+            )
             
             # Get the URL of the uploaded blob
             blob_url = blob_client.url
             
             logger.info(f"Successfully uploaded photo to {blob_name}")
+            
+            # Resized variants for the list, gallery and lightbox views
+            variants = self.create_variants(blob_name, photo_file) if self.make_variants else {}
+            
+            if self.table_service is not None:
+                size = getattr(photo_file, 'size', None)
+                success, result = self.table_service.update_photo_manifest(
+                    trip_id,
+                    lambda manifest: manifest.add(blob_name, size=size, width=width, height=height, variants=variants),
+                    seed=lambda: self.build_manifest(trip_id),
+                )
+                if not success:
+                    logger.warning(f"Photo {blob_name} uploaded but not added to the manifest: {result}")
+            
             return True, blob_url
             
         except Exception as e:
@@ -104,6 +157,278 @@ class AzureBlobService:
             logger.error(traceback.format_exc())
             return False, error_msg
     
+    def upload_photos(self, trip_id, photo_files):
+        """Upload several photos in parallel
+        
+        Uploads run on the bounded photo upload pool. Each gets the
+        PHOTO_UPLOAD_TIMEOUT limit from the moment it starts, not from when it
+        was queued behind the others. One failing file does not stop the others.
+        Every upload has stopped when this returns, so none of them reads the
+        request's temporary files after the request is over.
+        
+        Args:
+            trip_id (str): The trip's row key
+            photo_files (list): Uploaded photo files
+            
+        Returns:
+            list: One dict per file, in order, with 'filename', 'success' and
+            either 'url' or 'error'
+        """
+        from django.conf import settings
+        timeout = getattr(settings, 'PHOTO_UPLOAD_TIMEOUT', None)
+        
+        def upload(photo_file):
+            deadline = time.monotonic() + timeout if timeout else None
+            return self.upload_photo(trip_id, photo_file, deadline=deadline)
+        
+        executor = get_upload_executor()
+        # Run in a copy of the caller's context so the uploads' timing spans land on the request
+        futures = [executor.submit(contextvars.copy_context().run, upload, photo_file) for photo_file in photo_files]
+        results = []
+        try:
+            for photo_file, future in zip(photo_files, futures):
+                try:
+                    success, result = future.result()
+                except Exception as e:
+                    logger.error(f"Error uploading photo {photo_file.name}: {str(e)}", exc_info=True)
+                    success, result = False, str(e)
+                results.append(upload_result(photo_file.name, success, result))
+        finally:
+            for future in futures:
+                future.cancel()
+        
+        uploaded = sum(1 for result in results if result['success'])
+        logger.info(f"Uploaded {uploaded} of {len(results)} photos for trip {trip_id}")
+        return results
+    
+    def _get_account_credentials(self):
+        """Get (account name, account key) from the storage backend; either may be None"""
+        return self.storage.account_credentials()
+    
+    def supports_direct_uploads(self):
+        """True if SAS URLs can be issued (the connection string has an account key)"""
+        return all(self._get_account_credentials())
+    
+    def create_upload_urls(self, trip_id, filenames):
+        """Issue short-lived SAS URLs the browser can upload photos to directly
+        
+        Each URL is scoped to one new blob under the trip's prefix and only
+        allows creating/writing that blob. The photos are added to the trip
+        by finalize_uploads once the browser has uploaded them.
+        
+        Args:
+            trip_id (str): The trip's row key
+            filenames (list): Original file names of the photos to upload
+            
+        Returns:
+            tuple: (success, list of upload dicts or error message). Each
+            upload dict has 'filename', 'blob_name', 'url' and 'content_type'.
+        """
+        from django.conf import settings
+        
+        account_name, account_key = self._get_account_credentials()
+        if not account_name or not account_key:
+            logger.warning("Direct uploads need an account key in the connection string")
+            return False, "Direct uploads are not available"
+        
+        if not filenames or len(filenames) > MAX_DIRECT_UPLOADS:
+            return False, f"Between 1 and {MAX_DIRECT_UPLOADS} photos can be uploaded at once"
+        
+        container_client = self.get_container_client()
+        if not container_client:
+            return False, "Could not connect to blob container"
+        
+        minutes = getattr(settings, 'PHOTO_UPLOAD_SAS_MINUTES', DEFAULT_UPLOAD_SAS_MINUTES)
+        now = datetime.now(timezone.utc)
+        uploads = []
+        for filename in filenames:
+            blob_name, file_extension = self._make_blob_name(trip_id, filename)
+            content_type = self._get_content_type(file_extension)
+            if not content_type.startswith('image/'):
+                return False, f"{filename} is not a supported photo format"
+            
+            sas = generate_blob_sas(
+                account_name=account_name,
+                container_name=self.container_name,
+                blob_name=blob_name,
+                account_key=account_key,
+                permission=BlobSasPermissions(create=True, write=True),
+                start=now - timedelta(minutes=5),  # Allow for clock skew
+                expiry=now + timedelta(minutes=minutes),
+            )
+            uploads.append({
+                'filename': filename,
+                'blob_name': blob_name,
+                'url': f"{self.get_photo_url(blob_name)}?{sas}",
+                'content_type': content_type,
+            })
+        
+        logger.info(f"Issued {len(uploads)} direct upload URLs for trip {trip_id}")
+        return True, uploads
+    
+    def finalize_uploads(self, trip_id, blob_names):
+        """Add photos uploaded directly by the browser to the trip
+        
+        Blob sizes and image dimensions are read in parallel (dimensions
+        from the first bytes only), all photos are recorded in the manifest
+        in one update, and their variants are made in the background.
+        
+        Args:
+            trip_id (str): The trip's row key
+            blob_names (list): Blob names returned by create_upload_urls
+            
+        Returns:
+            list: One dict per blob, in order, with 'filename' (the blob
+            name), 'success' and either 'url' or 'error'
+        """
+        container_client = self.get_container_client()
+        if not container_client:
+            return [upload_result(name, False, "Could not connect to blob container") for name in blob_names]
+        
+        with StorageFanout() as fanout:
+            for name in blob_names:
+                if self._is_trip_photo(trip_id, name):
+                    fanout.submit(name, self._read_uploaded_photo, container_client, name)
+            
+            photos = {}
+            results = []
+            for name in blob_names:
+                if not self._is_trip_photo(trip_id, name):
+                    results.append(upload_result(name, False, "Not a photo of this trip"))
+                    continue
+                photo = fanout.result(name)
+                if photo is None:
+                    results.append(upload_result(name, False, "Photo was not uploaded"))
+                    continue
+                photos[name] = photo
+                results.append(upload_result(name, True, self.get_photo_url(name)))
+        
+        if photos and self.table_service is not None:
+            def add_photos(manifest):
+                for name in sorted(photos):
+                    manifest.add(name, **photos[name])
+            
+            success, result = self.table_service.update_photo_manifest(
+                trip_id, add_photos, seed=lambda: self.build_manifest(trip_id),
+            )
+            if not success:
+                logger.warning(f"Uploaded photos not added to the manifest of trip {trip_id}: {result}")
+                return [upload_result(r['filename'], False, result) if r['success'] else r for r in results]
+        
+        if photos and self.make_variants:
+            get_upload_executor().submit(self.create_variants_for_blobs, trip_id, sorted(photos))
+        
+        logger.info(f"Finalized {len(photos)} of {len(blob_names)} direct uploads for trip {trip_id}")
+        return results
+    
+    def _is_trip_photo(self, trip_id, blob_name):
+        """True if a client-supplied blob name is a photo directly under the trip's prefix"""
+        prefix = f"{trip_id}/"
+        return (
+            isinstance(blob_name, str)
+            and blob_name.startswith(prefix)
+            and '/' not in blob_name[len(prefix):]
+            and '..' not in blob_name
+        )
+    
+    def _read_uploaded_photo(self, container_client, blob_name):
+        """Read the size and dimensions of an uploaded blob, or None if it does not exist"""
+        try:
+            properties = container_client.get_blob_client(blob_name).get_blob_properties()
+        except Exception as e:
+            logger.warning(f"Uploaded photo {blob_name} not found: {str(e)}")
+            return None
+        width, height = self._read_blob_dimensions(container_client, blob_name)
+        return {'size': properties.size, 'width': width, 'height': height}
+    
+    def create_variants_for_blobs(self, trip_id, blob_names):
+        """Make the variants of photos already in blob storage and record them in the manifest
+        
+        Returns:
+            dict: blob name -> variants, for the photos that got variants
+        """
+        container_client = self.get_container_client()
+        if not container_client:
+            return {}
+        
+        made = {}
+        for name in blob_names:
+            try:
+                data = container_client.download_blob(name).readall()
+            except Exception as e:
+                logger.warning(f"Could not download {name} to make its variants: {str(e)}")
+                continue
+            variants = self.create_variants(name, io.BytesIO(data))
+            if variants:
+                made[name] = variants
+        
+        if made and self.table_service is not None:
+            def record(manifest):
+                for name, variants in made.items():
+                    manifest.set_variants(name, variants)
+            
+            success, result = self.table_service.update_photo_manifest(trip_id, record)
+            if not success:
+                logger.warning(f"Variants made but not recorded for trip {trip_id}: {result}")
+                return {}
+        
+        return made
+    
+    def create_variants(self, blob_name, photo_file):
+        """Make and upload the resized variants of a photo
+        
+        Args:
+            blob_name (str): Blob name of the original photo
+            photo_file (file): The original photo file
+            
+        Returns:
+            dict: variant -> {'name', 'width', 'height'} for the manifest; empty on failure
+        """
+        container_client = self.get_container_client()
+        if not container_client:
+            return {}
+        
+        variants = {}
+        try:
+            for variant, variant_name, content_type, data, width, height in generate_variants(photo_file, blob_name):
+                variants[variant] = {'name': variant_name, 'width': width, 'height': height}
+                if data is None:
+                    continue
+                container_client.get_blob_client(variant_name).upload_blob(
+                    data,
+                    content_settings=ContentSettings(content_type=content_type, cache_control=VARIANT_CACHE_CONTROL),
+                    overwrite=True,
+                )
+        except Exception as e:
+            logger.error(f"Error creating variants of {blob_name}: {str(e)}", exc_info=True)
+            return {}
+        
+        logger.info(f"Created {len(variants)} variants of {blob_name}")
+        return variants
+    
+    def _delete_variants(self, container_client, blob_name):
+        """Delete all resized variants of a photo"""
+        try:
+            for blob in container_client.list_blobs(name_starts_with=variants_prefix(blob_name)):
+                container_client.delete_blob(blob.name)
+        except Exception as e:
+            logger.warning(f"Could not delete variants of {blob_name}: {str(e)}")
+    
+    def _make_blob_name(self, trip_id, original_filename):
+        """Build the blob name for a new photo
+        
+        Returns:
+            tuple: (blob name, file extension)
+        """
+        # Get file extension
+        _, file_extension = os.path.splitext(original_filename)
+        # Timestamp keeps names in upload order; the random suffix keeps
+        # photos uploaded in parallel within the same instant apart
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        suffix = uuid.uuid4().hex[:8]
+        # Create blob name with folder structure
+        return f"{trip_id}/{timestamp}_{suffix}{file_extension}", file_extension
+    
     def list_photos(self, trip_id):
         """List all photos for a specific trip
         
@@ -113,7 +438,7 @@ class AzureBlobService:
         Returns:
             list: List of photo URLs
         """
-        if not self.connection_string:
+        if not self.is_configured:
             logger.warning("No connection string available, cannot list photos")
             return []
         
@@ -127,10 +452,7 @@ class AzureBlobService:
             blobs = container_client.list_blobs(name_starts_with=f"{trip_id}/")
             
             # Get URLs for all blobs
-            photo_urls = []
-            for blob in blobs:
-                blob_client = container_client.get_blob_client(blob.name)
-                photo_urls.append(blob_client.url)
+            photo_urls = [self.get_photo_url(blob.name) for blob in blobs]
             
             logger.info(f"Found {len(photo_urls)} photos for trip {trip_id}")
             return photo_urls
@@ -139,6 +461,63 @@ class AzureBlobService:
             logger.error(f"Error listing photos: {str(e)}", exc_info=True)
             return []
     
+    def _trip_prefixes(self, trip_id):
+        """Blob name prefixes of a trip: its photos and their variants"""
+        return [f"{trip_id}/", f"{VARIANTS_PREFIX}/{trip_id}/"]
+    
+    def copy_trip_photos(self, trip_id, new_trip_id):
+        """Copy a trip's photos and their variants to the prefix of another row key
+        
+        Blobs are read and written again (keeping their content settings), so
+        this works the same on every storage backend. Existing copies are
+        overwritten, so running it twice is harmless.
+        
+        Returns:
+            tuple: (success, number of blobs copied or error message)
+        """
+        if not self.is_configured:
+            return False, "No connection string available"
+        
+        try:
+            container_client = self.get_container_client()
+            copied = 0
+            for old_prefix, new_prefix in zip(self._trip_prefixes(trip_id), self._trip_prefixes(new_trip_id)):
+                for blob in container_client.list_blobs(name_starts_with=old_prefix):
+                    data = container_client.download_blob(blob.name).readall()
+                    new_name = new_prefix + blob.name[len(old_prefix):]
+                    container_client.get_blob_client(new_name).upload_blob(
+                        data, overwrite=True, content_settings=blob.content_settings,
+                    )
+                    copied += 1
+            logger.info(f"Copied {copied} blobs of trip {trip_id} to {new_trip_id}")
+            return True, copied
+        except Exception as e:
+            logger.error(f"Error copying the photos of trip {trip_id}: {str(e)}", exc_info=True)
+            return False, str(e)
+    
+    def delete_trip_photos(self, trip_id):
+        """Delete every photo and variant blob of a trip (the manifest is not touched)
+        
+        Returns:
+            tuple: (success, number of blobs deleted or error message)
+        """
+        if not self.is_configured:
+            return False, "No connection string available"
+        
+        try:
+            container_client = self.get_container_client()
+            deleted = 0
+            for prefix in self._trip_prefixes(trip_id):
+                # List first: deleting while the listing pages through the prefix could skip blobs
+                for blob in list(container_client.list_blobs(name_starts_with=prefix)):
+                    container_client.delete_blob(blob.name)
+                    deleted += 1
+            logger.info(f"Deleted {deleted} blobs of trip {trip_id}")
+            return True, deleted
+        except Exception as e:
+            logger.error(f"Error deleting the photos of trip {trip_id}: {str(e)}", exc_info=True)
+            return False, str(e)
+    
     def delete_photo(self, blob_url):
         """Delete a photo from Azure Blob Storage
         
@@ -148,52 +527,143 @@ class AzureBlobService:
         Returns:
             bool: True if successful, False otherwise
         """
-        if not self.connection_string:
+        if not self.is_configured:
             logger.warning("No connection string available, cannot delete photo")
             return False
         
         try:
-            # Extract blob name from URL
-            blob_service_client = self.get_blob_service_client()
-            if not blob_service_client:
-                return False
-            
-            # Get the account name from the connection string
-            account_name = None
-            for part in self.connection_string.split(';'):
-                if part.startswith('AccountName='):
-                    account_name = part.split('=')[1]
-                    break
-            
-            if not account_name:
-                logger.error("Could not extract account name from connection string")
+            # Get container client
+            container_client = self.get_container_client()
+            if not container_client:
                 return False
             
             # Extract blob name from URL
-            # URL format: https://{account}.blob.core.windows.net/{container}/{blob_name}
-            url_parts = blob_url.split(f"{account_name}.blob.core.windows.net/{self.container_name}/")
-            if len(url_parts) != 2:
+            # URL format: {container url}/{blob_name}, e.g. https://{account}.blob.core.windows.net/{container}/{blob_name}
+            blob_name = self._blob_name_from_url(container_client, blob_url)
+            if not blob_name:
                 logger.error(f"Could not extract blob name from URL: {blob_url}")
                 return False
             
-            blob_name = url_parts[1]
-            
-            # Get container client
-            container_client = self.get_container_client()
-            if not container_client:
-                return False
-            
             # Delete the blob
             blob_client = container_client.get_blob_client(blob_name)
             blob_client.delete_blob()
+            self._delete_variants(container_client, blob_name)
             
             logger.info(f"Successfully deleted photo: {blob_name}")
+            
+            if self.table_service is not None and '/' in blob_name:
+                trip_id = blob_name.split('/', 1)[0]
+                success, result = self.table_service.update_photo_manifest(
+                    trip_id,
+                    lambda manifest: manifest.remove(blob_name),
+                    seed=lambda: self.build_manifest(trip_id),
+                )
+                if not success:
+                    logger.warning(f"Photo {blob_name} deleted but not removed from the manifest: {result}")
+            
             return True
             
         except Exception as e:
             logger.error(f"Error deleting photo: {str(e)}", exc_info=True)
             return False
     
+    def _blob_name_from_url(self, container_client, blob_url):
+        """Blob name of a URL under the container, or None for any other URL
+        
+        The scheme and query string are ignored; so is the host when the
+        container URL is a path (local backends serve photos from this site).
+        """
+        container = urlsplit(container_client.url)
+        url = urlsplit(blob_url or '')
+        prefix = container.path.rstrip('/') + '/'
+        if (container.netloc and url.netloc != container.netloc) or not url.path.startswith(prefix):
+            return None
+        return unquote(url.path[len(prefix):]) or None
+    
+    def get_photo_url(self, blob_name):
+        """Build the public URL of a photo blob without a storage round trip"""
+        container_client = self.get_container_client()
+        if not container_client:
+            return None
+        return f"{container_client.url}/{quote(blob_name, safe='~/')}"
+    
+    def get_photo_sources(self, name, variants=None):
+        """Build the URLs a template needs to show one photo
+        
+        Args:
+            name (str): Blob name of the original photo
+            variants (dict, optional): The photo's variants from its manifest entry
+            
+        Returns:
+            dict: 'url' (original), 'card', 'src' (gallery) and 'lightbox' URLs,
+            each falling back to the original, and 'srcset' ('' without variants)
+        """
+        url = self.get_photo_url(name)
+        variants = variants or {}
+        
+        def variant_url(variant):
+            info = variants.get(variant)
+            return self.get_photo_url(info['name']) if info else url
+        
+        return {
+            'url': url,
+            'card': variant_url('card'),
+            'src': variant_url('gallery'),
+            'lightbox': variant_url('lightbox'),
+            'srcset': build_srcset(variants, self.get_photo_url) if variants else '',
+        }
+    
+    def get_trip_photos(self, trip_id, manifest=None):
+        """Get the photo sources of a trip, in manifest order
+        
+        Args:
+            trip_id (str): The trip's row key
+            manifest (PhotoManifest, optional): The trip's manifest; when None
+                (trip not backfilled yet) the blobs are listed instead
+            
+        Returns:
+            list: Photo source dicts, see get_photo_sources
+        """
+        if manifest is None:
+            return [photo_sources_from_url(url) for url in self.list_photos(trip_id)]
+        return [self.get_photo_sources(photo['name'], photo.get('variants')) for photo in manifest.photos]
+    
+    def build_manifest(self, trip_id, read_dimensions=False):
+        """Build a photo manifest for a trip from its blob listing
+        
+        Used to seed the manifest of trips created before manifests existed.
+        Blob names start with the upload timestamp, so name order is upload order.
+        
+        Args:
+            trip_id (str): The trip's row key
+            read_dimensions (bool): Download each blob's header to read its size in pixels
+            
+        Returns:
+            PhotoManifest: The manifest (empty if the blobs could not be listed)
+        """
+        manifest = PhotoManifest()
+        container_client = self.get_container_client()
+        if not container_client:
+            return manifest
+        
+        for blob in sorted(container_client.list_blobs(name_starts_with=f"{trip_id}/"), key=lambda b: b.name):
+            width, height = None, None
+            if read_dimensions:
+                width, height = self._read_blob_dimensions(container_client, blob.name)
+            manifest.add(blob.name, size=blob.size, width=width, height=height)
+        
+        logger.info(f"Built photo manifest for trip {trip_id} from {len(manifest.photos)} blobs")
+        return manifest
+    
+    def _read_blob_dimensions(self, container_client, blob_name):
+        """Read image dimensions from the first bytes of a blob"""
+        try:
+            header = container_client.download_blob(blob_name, offset=0, length=PHOTO_HEADER_BYTES).readall()
+            return read_image_dimensions(io.BytesIO(header))
+        except Exception as e:
+            logger.warning(f"Could not read dimensions of {blob_name}: {str(e)}")
+            return None, None
+    
     def _get_content_type(self, file_extension):
         """Get the content type based on file extension"""
         extension = file_extension.lower()
@@ -207,3 +677,61 @@ class AzureBlobService:
             '.heic': 'image/heic',
         }
         return content_types.get(extension, 'application/octet-stream')
+
+
+def photo_sources_from_url(url):
+    """Photo sources for a photo known only by its URL (no manifest, no variants)"""
+    return {'url': url, 'card': url, 'src': url, 'lightbox': url, 'srcset': ''}
+
+
+class UploadTimeout(Exception):
+    """Raised by a DeadlineStream read after its deadline"""
+
+
+class DeadlineStream:
+    """File wrapper whose reads fail once a deadline has passed
+
+    Threads cannot be cancelled, so an upload past its time limit is stopped
+    at its next read instead: the SDK's upload then fails and the file is
+    no longer touched.
+    """
+
+    def __init__(self, stream, deadline):
+        self._stream = stream
+        self._deadline = deadline
+
+    def _check(self):
+        if time.monotonic() > self._deadline:
+            raise UploadTimeout("Upload did not finish in time")
+
+    def read(self, *args):
+        self._check()
+        return self._stream.read(*args)
+
+    def readinto(self, buffer):
+        self._check()
+        return self._stream.readinto(buffer)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def upload_stream(photo_file, deadline=None):
+    """The file object to stream an upload from
+
+    Django's uploaded files wrap a temporary file (or BytesIO for small
+    uploads). Handing the SDK the underlying seekable file lets it read each
+    block directly instead of buffering the whole upload.
+
+    Args:
+        deadline (float, optional): time.monotonic() value after which reads fail
+    """
+    stream = getattr(photo_file, 'file', None) or photo_file
+    return DeadlineStream(stream, deadline) if deadline is not None else stream
+
+
+def upload_result(filename, success, result):
+    """Per-file result of a multi-photo upload"""
+    if success:
+        return {'filename': filename, 'success': True, 'url': result}
+    return {'filename': filename, 'success': False, 'error': result}
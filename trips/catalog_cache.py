@@ -0,0 +1,372 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the matching Django settings are not defined
+DEFAULT_REFRESH_SECONDS = 30
+DEFAULT_FULL_SYNC_SECONDS = 900
+
+
+class TripCatalogCache:
+    """In-memory, versioned copy of the mapped trip list for one table.
+
+    The cache is filled by a full scan once and then kept current with delta
+    queries that only return entities whose ``Timestamp`` is newer than the
+    last sync. Writes made by this worker patch the cache directly. Table
+    Storage has no tombstones, so deletes made by other workers are picked up
+    by a periodic full resync.
+
+    The cache does not talk to Azure itself: ``refresh()`` is given a fetch
+    function by the service, which keeps all storage access in
+    ``AzureTableService``.
+    """
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_SECONDS, full_sync_interval=DEFAULT_FULL_SYNC_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.full_sync_interval = full_sync_interval
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._trips = {}
+        self._etags = {}
+        # XOR of the digests of every (row key, etag), so one write updates it in O(1)
+        self._digest = 0
+        self._sorted = None
+        self._counts = None
+        self._loaded = False
+        self._sync_marker = None
+        self._last_refresh = 0.0
+        self._last_full_sync = 0.0
+
+        self.version = _format_version(0)
+        # Newest entity Timestamp seen, or the time of the last local write
+        self.last_modified = None
+
+    @property
+    def is_loaded(self):
+        return self._loaded
+
+    def _refresh_mode(self):
+        """Return 'full', 'delta' or None depending on how stale the cache is"""
+        now = time.monotonic()
+        if not self._loaded or now - self._last_full_sync >= self.full_sync_interval:
+            return 'full'
+        if now - self._last_refresh >= self.refresh_interval:
+            return 'delta'
+        return None
+
+    def refresh(self, fetch_entities, map_entity):
+        """Bring the cache up to date if it is stale.
+
+        Args:
+            fetch_entities (callable): ``fetch_entities(since)`` returns an
+                iterable of table entities; ``since`` is None for a full scan.
+            map_entity (callable): Maps an entity to its TripSummary, or None
+                to skip it.
+
+        While one thread refreshes a loaded cache, other threads keep reading
+        the current snapshot instead of waiting.
+        """
+        if self._refresh_mode() is None:
+            return
+
+        if not self._refresh_lock.acquire(blocking=not self._loaded):
+            return
+
+        try:
+            mode = self._refresh_mode()
+            if mode is None:
+                return
+
+            started = time.monotonic()
+            rows = []
+            for entity in fetch_entities(self._sync_marker if mode == 'delta' else None):
+                self._collect(rows, entity, map_entity)
+            self._finish_refresh(mode, rows, started)
+        finally:
+            self._refresh_lock.release()
+
+    async def arefresh(self, fetch_entities, map_entity):
+        """Async counterpart of ``refresh()``.
+
+        ``fetch_entities(since)`` must return an async iterable. The event
+        loop is never blocked: while another thread or task refreshes, a
+        loaded cache is served as is and an empty one is polled until ready.
+        """
+        if self._refresh_mode() is None:
+            return
+
+        while not self._refresh_lock.acquire(blocking=False):
+            if self._loaded:
+                return
+            await asyncio.sleep(0.05)
+
+        try:
+            mode = self._refresh_mode()
+            if mode is None:
+                return
+
+            started = time.monotonic()
+            rows = []
+            async for entity in fetch_entities(self._sync_marker if mode == 'delta' else None):
+                self._collect(rows, entity, map_entity)
+            self._finish_refresh(mode, rows, started)
+        finally:
+            self._refresh_lock.release()
+
+    def _collect(self, rows, entity, map_entity):
+        trip = map_entity(entity)
+        if trip is not None:
+            rows.append((trip, _entity_timestamp(entity), _entity_etag(entity)))
+
+    def _finish_refresh(self, mode, rows, started):
+        self._apply(rows, full=(mode == 'full'))
+        self._last_refresh = started
+        if mode == 'full':
+            self._last_full_sync = started
+        logger.info(f"Trip catalog {mode} refresh applied {len(rows)} entities (version {self.version[:12]})")
+
+    def _apply(self, rows, full=False):
+        marker = None
+        for _, timestamp, _ in rows:
+            if timestamp is not None and (marker is None or timestamp > marker):
+                marker = timestamp
+
+        with self._lock:
+            if full:
+                # A full scan replaces the snapshot; the same trips give the same version
+                trips = {trip.row_key: trip for trip, _, _ in rows}
+                etags = {trip.row_key: etag for trip, _, etag in rows}
+                digest = 0
+                for row_key, etag in etags.items():
+                    digest ^= _row_digest(row_key, etag)
+                if digest != self._digest or trips != self._trips:
+                    self._sorted = None
+                self._trips = trips
+                self._etags = etags
+                self._set_digest(digest)
+                self._sync_marker = marker
+            else:
+                for trip, _, etag in rows:
+                    self._set(trip, etag)
+                if marker is not None and (self._sync_marker is None or marker > self._sync_marker):
+                    self._sync_marker = marker
+            self._touch(marker)
+            self._loaded = True
+
+    def _set(self, trip, etag):
+        """Insert or replace one trip, updating the version in place. Caller holds the lock."""
+        row_key = trip.row_key
+        if row_key in self._etags:
+            if self._etags[row_key] == etag and self._trips[row_key] == trip:
+                return
+            self._set_digest(self._digest ^ _row_digest(row_key, self._etags[row_key]) ^ _row_digest(row_key, etag))
+        else:
+            self._set_digest(self._digest ^ _row_digest(row_key, etag))
+        self._trips[row_key] = trip
+        self._etags[row_key] = etag
+        self._sorted = None
+
+    def _set_digest(self, digest):
+        self._digest = digest
+        self.version = _format_version(digest)
+
+    def put(self, trip, etag=None):
+        """Insert or replace a single trip after a write made by this worker"""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._set(trip, etag)
+            self._touch(datetime.now(timezone.utc))
+
+    def remove(self, row_key):
+        """Drop a single trip after a delete made by this worker"""
+        with self._lock:
+            if not self._loaded or row_key not in self._trips:
+                return
+            self._set_digest(self._digest ^ _row_digest(row_key, self._etags.pop(row_key)))
+            del self._trips[row_key]
+            self._sorted = None
+            self._touch(datetime.now(timezone.utc))
+
+    def _touch(self, modified):
+        """Move last_modified forward (never back). Caller holds the lock."""
+        if modified is not None and (self.last_modified is None or modified > self.last_modified):
+            self.last_modified = modified
+
+    def invalidate(self):
+        """Force a full resync on the next read"""
+        with self._lock:
+            self._last_full_sync = 0.0
+            self._last_refresh = 0.0
+
+    def _ordered(self):
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sort_trips(list(self._trips.values()))
+                self._counts = None
+            return self._sorted
+
+    def get_trips(self):
+        """Return the cached trips, newest first.
+
+        Each trip is a shallow copy, so callers may annotate them (e.g. with
+        ``first_photo``) without touching the shared snapshot.
+        """
+        return [trip.copy() for trip in self._ordered()]
+
+    def get(self, row_key):
+        """Return a copy of one cached trip, or None if it is not cached"""
+        trip = self._trips.get(row_key)
+        return trip.copy() if trip is not None else None
+
+    def get_etag(self, row_key):
+        """Return the ETag of one cached trip, or None if it is not cached"""
+        return self._etags.get(row_key)
+
+    def get_page(self, offset, limit, predicate=None):
+        """Return one page of cached trips, newest first.
+
+        Only the trips on the page are copied. ``offset`` counts trips that
+        match ``predicate``.
+
+        Returns:
+            tuple: (list of trips, True if more matching trips follow)
+        """
+        page = []
+        skipped = 0
+        for trip in self._ordered():
+            if predicate is not None and not predicate(trip):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(page) == limit:
+                return page, True
+            page.append(trip.copy())
+        return page, False
+
+    def get_counts(self):
+        """Return total/completed/future trip counts, computed once per version"""
+        ordered = self._ordered()
+        counts = self._counts
+        if counts is None:
+            completed = sum(1 for trip in ordered if trip.trip_completed_on)
+            counts = {
+                'total': len(ordered),
+                'completed': completed,
+                'future': len(ordered) - completed,
+            }
+            self._counts = counts
+        return counts
+
+
+def _row_digest(row_key, etag):
+    """Digest of one cached trip's (row key, etag), as an int that XORs into the version"""
+    return int.from_bytes(hashlib.sha1(f"{row_key}:{etag}".encode('utf-8')).digest(), 'big')
+
+
+def _format_version(digest):
+    return f"{digest:040x}"
+
+
+def _entity_timestamp(entity):
+    """Server-side Timestamp of an entity returned by a query"""
+    metadata = getattr(entity, 'metadata', None) or {}
+    return metadata.get('timestamp')
+
+
+def _entity_etag(entity):
+    """ETag of an entity returned by a query"""
+    metadata = getattr(entity, 'metadata', None) or {}
+    return metadata.get('etag')
+
+
+def sort_trips(trips):
+    """Sort trips newest first, the same way get_all_trips always has
+
+    Trips with the same (or no) timestamp keep row key order, which is
+    newest first for the keys of row_keys.new_row_key.
+    """
+    try:
+        trips = sorted(trips, key=lambda x: x.row_key or '')
+        return sorted(trips, key=lambda x: x.timestamp, reverse=True)
+    except Exception as sort_error:
+        logger.error(f"Error sorting by timestamp: {str(sort_error)}")
+        try:
+            return sorted(trips, key=lambda x: x.trip_completed_on, reverse=True)
+        except Exception as sort_error2:
+            logger.error(f"Error sorting by trip_completed_on: {str(sort_error2)}")
+            return trips
+
+
+class ListingIndexCache:
+    """Holds one index built from the trip listing, for the listing version it was built from
+
+    Used for the indexes derived from the whole listing (facets, map grid),
+    which only need rebuilding when the listing version changes.
+    """
+
+    def __init__(self, build_index):
+        self._build_index = build_index
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def get(self, version):
+        """The index built for this version, or None"""
+        with self._lock:
+            if self._index is not None and version is not None and self._version == version:
+                return self._index
+        return None
+
+    def build(self, version, trips):
+        """Index a trip listing and keep it for this version"""
+        index = self._build_index(trips)
+        with self._lock:
+            self._index = index
+            self._version = version
+        logger.info(f"Built {type(index).__name__} of {len(trips)} trips")
+        return index
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+_listing_indexes = {}
+
+
+def get_trip_catalog(table_name):
+    """Get the process-wide catalog cache for a table, or None when disabled"""
+    from django.conf import settings
+    if not getattr(settings, 'TRIP_CATALOG_CACHE_ENABLED', True):
+        return None
+
+    with _catalogs_lock:
+        catalog = _catalogs.get(table_name)
+        if catalog is None:
+            catalog = TripCatalogCache(
+                refresh_interval=getattr(settings, 'TRIP_CATALOG_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS),
+                full_sync_interval=getattr(settings, 'TRIP_CATALOG_FULL_SYNC_SECONDS', DEFAULT_FULL_SYNC_SECONDS),
+            )
+            _catalogs[table_name] = catalog
+        return catalog
+
+
+def get_listing_index_cache(table_name, kind, build_index):
+    """Get the process-wide cache of one kind of listing index for a table
+
+    Args:
+        kind (str): Name of the index, e.g. 'facets'
+        build_index (callable): Builds the index from a list of trips
+    """
+    with _catalogs_lock:
+        cache = _listing_indexes.get((table_name, kind))
+        if cache is None:
+            cache = ListingIndexCache(build_index)
+            _listing_indexes[(table_name, kind)] = cache
+        return cache
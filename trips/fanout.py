@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the matching Django settings are not defined
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_TIMEOUT = 10
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_PARTITION_WORKERS = 8
+
+_executor = None
+_upload_executor = None
+_partition_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_fanout_executor():
+    """Get the bounded thread pool shared by all requests in this worker"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from django.conf import settings
+                max_workers = getattr(settings, 'STORAGE_FANOUT_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage-fanout')
+    return _executor
+
+
+def get_upload_executor():
+    """Get the bounded thread pool for photo uploads.
+
+    Uploads are long and each may use several connections for its blocks,
+    so they get their own pool and never starve the page's storage calls.
+    """
+    global _upload_executor
+    if _upload_executor is None:
+        with _executor_lock:
+            if _upload_executor is None:
+                from django.conf import settings
+                max_workers = getattr(settings, 'PHOTO_UPLOAD_MAX_WORKERS', DEFAULT_UPLOAD_WORKERS)
+                _upload_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='photo-upload')
+    return _upload_executor
+
+
+def get_partition_executor():
+    """Get the bounded thread pool for the parallel queries of one service call.
+
+    These are queries fanned out over the trip partitions and the point
+    reads of index lookups. They are often started from calls that already
+    run on the fanout pool; waiting on that same pool for them could deadlock it.
+    """
+    global _partition_executor
+    if _partition_executor is None:
+        with _executor_lock:
+            if _partition_executor is None:
+                from django.conf import settings
+                max_workers = getattr(settings, 'STORAGE_PARTITION_MAX_WORKERS', DEFAULT_PARTITION_WORKERS)
+                _partition_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='partition-query')
+    return _partition_executor
+
+
+def map_parallel(fn, items):
+    """Call fn(item) for every item (e.g. every trip partition) in parallel and return the results in order
+
+    Unlike StorageFanout calls, errors are raised: a scan that quietly
+    skipped a partition would look like its trips had been deleted.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    executor = get_partition_executor()
+    futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+class StorageFanout:
+    """Run the independent storage calls of one request in parallel.
+
+    Each call gets a name, a default value and its own timeout. A call that
+    raises or times out is logged and yields its default, so one slow or
+    failing call never takes the whole page down with it::
+
+        with StorageFanout() as fanout:
+            fanout.submit('trip', service.get_trip_by_id, trip_id)
+            fanout.submit('photos', blob_service.list_photos, trip_id, default=[])
+            trip = fanout.result('trip')
+            photos = fanout.result('photos')
+
+    Calls run on a process-wide bounded pool, so page latency is close to
+    the slowest call rather than the sum of all of them. Leaving the
+    ``with`` block cancels calls that have not started yet.
+    """
+
+    def __init__(self, timeout=None, executor=None):
+        if timeout is None:
+            from django.conf import settings
+            timeout = getattr(settings, 'STORAGE_FANOUT_TIMEOUT', DEFAULT_TIMEOUT)
+        self.timeout = timeout
+        self._executor = executor
+        self._calls = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cancel()
+
+    def submit(self, name, fn, *args, default=None, timeout=None, **kwargs):
+        """Start a call in the background under the given name"""
+        executor = self._executor or get_fanout_executor()
+        # Run in a copy of the caller's context so the call's timing spans land on the request
+        future = executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        self._calls[name] = (future, default, deadline)
+        return future
+
+    def result(self, name):
+        """Wait for a call and return its result, or its default on error or timeout"""
+        future, default, deadline = self._calls[name]
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            logger.warning(f"Storage call '{name}' timed out")
+            future.cancel()
+            return default
+        except Exception as e:
+            logger.error(f"Storage call '{name}' failed: {str(e)}", exc_info=True)
+            return default
+
+    def results(self):
+        """Wait for all calls and return a dict of name -> result"""
+        return {name: self.result(name) for name in list(self._calls)}
+
+    def cancel(self):
+        """Cancel calls that have not started yet"""
+        for future, _, _ in self._calls.values():
+            future.cancel()
+
+
+class AsyncStorageFanout:
+    """Async counterpart of StorageFanout for the aio storage services.
+
+    Calls are awaitables scheduled as tasks on the running event loop, so no
+    threads are involved; defaults and per-call timeouts work the same way::
+
+        async with AsyncStorageFanout() as fanout:
+            fanout.submit('trip', service.get_trip_by_id(trip_id))
+            fanout.submit('photos', blob_service.list_photos(trip_id), default=[])
+            trip = await fanout.result('trip')
+
+    Leaving the ``async with`` block cancels calls that are still running.
+    """
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            from django.conf import settings
+            timeout = getattr(settings, 'STORAGE_FANOUT_TIMEOUT', DEFAULT_TIMEOUT)
+        self.timeout = timeout
+        self._calls = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.cancel()
+
+    def submit(self, name, awaitable, default=None, timeout=None):
+        """Schedule an awaitable under the given name"""
+        timeout = self.timeout if timeout is None else timeout
+        task = asyncio.ensure_future(asyncio.wait_for(awaitable, timeout))
+        self._calls[name] = (task, default)
+        return task
+
+    async def result(self, name):
+        """Wait for a call and return its result, or its default on error or timeout"""
+        task, default = self._calls[name]
+        try:
+            return await task
+        except asyncio.TimeoutError:
+            logger.warning(f"Storage call '{name}' timed out")
+            return default
+        except Exception as e:
+            logger.error(f"Storage call '{name}' failed: {str(e)}", exc_info=True)
+            return default
+
+    async def results(self):
+        """Wait for all calls and return a dict of name -> result"""
+        return {name: await self.result(name) for name in list(self._calls)}
+
+    def cancel(self):
+        """Cancel calls that are still running"""
+        for task, _ in self._calls.values():
+            task.cancel()
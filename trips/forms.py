@@ -1,3 +1,5 @@
+import json
+
 from django import forms
 
 class TripEditForm(forms.Form):
@@ -121,3 +123,16 @@ class TripEditForm(forms.Form):
     # Location fields (hidden)
     parking_json = forms.CharField(required=False, widget=forms.HiddenInput())
     high_point_json = forms.CharField(required=False, widget=forms.HiddenInput())
+    
+    # Version and properties of the trip when the form was opened (hidden), so a
+    # save only writes the changes and notices edits made by someone else meanwhile
+    etag = forms.CharField(required=False, widget=forms.HiddenInput())
+    original = forms.CharField(required=False, widget=forms.HiddenInput())
+    
+    def clean_original(self):
+        """Parse the original properties; None when missing or unreadable (every field is then written)"""
+        try:
+            original = json.loads(self.cleaned_data.get('original') or 'null')
+        except ValueError:
+            return None
+        return original if isinstance(original, dict) else None
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.contrib import messages
+from django.template.utils import get_app_template_dirs
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+logger = logging.getLogger(__name__)
+
+# Seconds anonymous readers (and shared caches) may reuse a page without revalidating
+DEFAULT_PAGE_MAX_AGE = 60
+
+_templates_fingerprint = None
+_templates_lock = threading.Lock()
+
+
+def _get_templates_fingerprint():
+    """Hash of the template files' names and mtimes, so a deploy changes every page ETag"""
+    global _templates_fingerprint
+    if _templates_fingerprint is None:
+        with _templates_lock:
+            if _templates_fingerprint is None:
+                digest = hashlib.sha1()
+                template_dirs = [d for engine in settings.TEMPLATES for d in engine.get('DIRS', [])]
+                template_dirs.extend(str(d) for d in get_app_template_dirs('templates'))
+                for template_dir in sorted(set(template_dirs)):
+                    for root, _, files in os.walk(template_dir):
+                        for name in sorted(files):
+                            path = os.path.join(root, name)
+                            try:
+                                digest.update(f"{path}:{os.stat(path).st_mtime_ns}\n".encode('utf-8'))
+                            except OSError:
+                                continue
+                _templates_fingerprint = digest.hexdigest()
+    return _templates_fingerprint
+
+
+def page_etag(request, *versions):
+    """Build the ETag of a public page from the versions of the data it shows
+
+    Only anonymous GET/HEAD requests get validators: signed-in users see edit
+    buttons and CSRF tokens, and pending flash messages change the page too.
+
+    Args:
+        request (HttpRequest): The current request; its path and query are part of the tag
+        *versions (str): Catalog version and/or entity ETags the page is rendered from
+
+    Returns:
+        str or None: A weak ETag, or None when the page must not be validated
+    """
+    if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+        return None
+    if not versions or any(not version for version in versions):
+        return None
+    if len(messages.get_messages(request)):
+        return None
+
+    digest = hashlib.sha1()
+    for part in (_get_templates_fingerprint(), request.get_full_path(), *versions):
+        digest.update(f"{part}\n".encode('utf-8'))
+    # Weak, since GZipMiddleware changes the bytes but not the meaning
+    return f'W/"{digest.hexdigest()}"'
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return a 304 response if the client's copy of the page is still current
+
+    Returns:
+        HttpResponse or None: The 304 response, or None to render the page
+    """
+    if etag is None:
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=_epoch(last_modified))
+    if response is not None:
+        logger.info(f"Not modified: {request.path}")
+        response.headers['ETag'] = etag
+        _patch_public(response)
+    return response
+
+
+def finish_response(request, response, etag=None, last_modified=None):
+    """Add validators and Cache-Control headers to a rendered page
+
+    Pages with an ETag may be cached publicly for a short while; everything
+    else must be revalidated with the server on every use.
+    """
+    if etag is not None and response.status_code == 200:
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(_epoch(last_modified)))
+        _patch_public(response)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def _patch_public(response):
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'TRIPS_PAGE_MAX_AGE', DEFAULT_PAGE_MAX_AGE))
+    # Signed-in users get a different page from the same URL
+    patch_vary_headers(response, ('Cookie',))
+
+
+def _epoch(value):
+    """Seconds since the epoch for a timezone-aware datetime, or None"""
+    return int(value.timestamp()) if value is not None else None
@@ -0,0 +1,123 @@
+import io
+import logging
+import posixpath
+
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Resized variants made for every uploaded photo: name -> maximum width in pixels.
+# card: index and edit page thumbnails, gallery: detail page grid, lightbox: full screen view
+VARIANT_WIDTHS = {
+    'card': 480,
+    'gallery': 960,
+    'lightbox': 1920,
+}
+
+VARIANT_QUALITY = 80
+
+# Variant names are unique per upload and never rewritten, so browsers may cache them forever
+VARIANT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Variants live outside the "{trip_id}/" prefix so blob listings of a trip only return originals
+VARIANTS_PREFIX = 'variants'
+
+
+def variant_format():
+    """Return (Pillow format, file extension, content type) used for variants"""
+    if features.check('webp'):
+        return 'WEBP', '.webp', 'image/webp'
+    return 'JPEG', '.jpg', 'image/jpeg'
+
+
+def variant_blob_name(blob_name, variant, extension):
+    """Blob name of a variant, e.g. trip_1/20240101120000.jpg -> variants/trip_1/20240101120000/card.webp"""
+    stem, _ = posixpath.splitext(blob_name)
+    return f"{VARIANTS_PREFIX}/{stem}/{variant}{extension}"
+
+
+def variants_prefix(blob_name):
+    """Blob name prefix shared by all variants of a photo"""
+    stem, _ = posixpath.splitext(blob_name)
+    return f"{VARIANTS_PREFIX}/{stem}/"
+
+
+def generate_variants(photo_file, blob_name):
+    """Make the resized variants of a photo.
+
+    EXIF orientation is applied to the pixels, so variants display upright
+    everywhere without relying on the browser. Photos are never upscaled: a
+    variant wider than the photo reuses the next larger variant's blob (its
+    data is None). JPEG sources are decoded at a reduced scale where
+    possible, which keeps this cheap even for large phone photos.
+
+    Args:
+        photo_file (file): Seekable image file; its position is restored
+        blob_name (str): Blob name of the original, used to name the variants
+
+    Returns:
+        list: (variant, blob name, content type, data bytes or None, width,
+        height) tuples, largest first; empty if the image cannot be read
+    """
+    image_format, extension, content_type = variant_format()
+    position = photo_file.tell() if hasattr(photo_file, 'tell') else None
+    try:
+        photo_file.seek(0)
+        with Image.open(photo_file) as source:
+            # Let the JPEG decoder skip detail we would throw away anyway
+            largest = max(VARIANT_WIDTHS.values())
+            source.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            if image_format == 'JPEG' and image.mode == 'RGBA':
+                image = image.convert('RGB')
+
+            save_options = {'quality': VARIANT_QUALITY}
+            if image_format == 'WEBP':
+                save_options['method'] = 4
+            else:
+                save_options.update(optimize=True, progressive=True)
+
+            variants = []
+            # Resize from the largest variant down, each step from the previous one
+            for variant, max_width in sorted(VARIANT_WIDTHS.items(), key=lambda item: -item[1]):
+                if image.width > max_width:
+                    height = max(1, round(image.height * max_width / image.width))
+                    image = image.resize((max_width, height), Image.Resampling.LANCZOS)
+                elif variants:
+                    # Same size as the previous variant; point at its blob
+                    _, name, _, _, width, height = variants[-1]
+                    variants.append((variant, name, content_type, None, width, height))
+                    continue
+                data = io.BytesIO()
+                image.save(data, image_format, **save_options)
+                variants.append((
+                    variant,
+                    variant_blob_name(blob_name, variant, extension),
+                    content_type,
+                    data.getvalue(),
+                    image.width,
+                    image.height,
+                ))
+            return variants
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f"Could not make variants of {blob_name}: {str(e)}")
+        return []
+    finally:
+        if position is not None:
+            photo_file.seek(position)
+
+
+def build_srcset(variants, url_for):
+    """Build an ``srcset`` attribute value from a manifest entry's variants
+
+    Args:
+        variants (dict): variant -> {'name', 'width', 'height'}
+        url_for (callable): Maps a blob name to its URL
+    """
+    candidates = {}
+    for info in variants.values():
+        # Small originals make variants with identical widths; list each width once
+        candidates.setdefault(info['width'], url_for(info['name']))
+    return ', '.join(f"{url} {width}w" for width, url in sorted(candidates.items()))
@@ -0,0 +1,976 @@
+"""Table and blob clients for the local and in-memory storage backends.
+
+They implement the part of the ``azure.data.tables.TableClient`` and
+``azure.storage.blob.ContainerClient`` interfaces the services use, with the
+same entity shapes, metadata, paging and errors, so everything above the
+client (catalog cache, mirror, facets) works unchanged on every backend.
+"""
+import asyncio
+import base64
+import bisect
+import datetime
+import io
+import json
+import mimetypes
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import quote
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.data.tables import EntityProperty, TableEntity, TableTransactionError, UpdateMode
+from azure.storage.blob import BlobProperties, ContentSettings
+
+# Entities per page of a query, as Table Storage returns them
+TABLE_PAGE_SIZE = 1000
+
+# Most operations one submit_transaction call may hold, as in Table Storage
+MAX_TRANSACTION_OPERATIONS = 100
+
+# Range reads of a blob stream in chunks of this size
+BLOB_CHUNK_SIZE = 64 * 1024
+
+
+def _sleep(latency_ms):
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _new_etag(timestamp):
+    return f'W/"datetime\'{timestamp.isoformat()}\'-{uuid.uuid4().hex[:8]}"'
+
+
+# OData filters: "<property> <op> <value>" comparisons joined by "and"
+_FILTER_CLAUSE = re.compile(
+    r"\s*(\w+)\s+(eq|ne|gt|ge|lt|le)\s+"
+    r"(@\w+|'(?:[^']|'')*'|datetime'[^']*'|true|false|-?\d+(?:\.\d+)?)\s*(?:and\b|$)",
+    re.IGNORECASE,
+)
+
+_COMPARE = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'le': lambda a, b: a <= b,
+}
+
+
+def _filter_value(token, parameters):
+    if token.startswith('@'):
+        name = token[1:]
+        if name not in parameters:
+            raise ValueError(f'Missing query parameter: {name}')
+        return parameters[name]
+    if token.lower().startswith("datetime'"):
+        return datetime.datetime.fromisoformat(token[9:-1].replace('Z', '+00:00'))
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if token.lower() in ('true', 'false'):
+        return token.lower() == 'true'
+    return float(token) if '.' in token else int(token)
+
+
+def compile_filter(query_filter, parameters=None):
+    """Compile the subset of OData filters the services send
+
+    Args:
+        query_filter (str): e.g. "PartitionKey eq @pk and Timestamp ge @since"
+        parameters (dict, optional): Values of the @name placeholders
+
+    Returns:
+        tuple: (list of (property, op, value) clauses, predicate taking an
+        entity and its server timestamp)
+
+    Raises:
+        ValueError: For filters outside the supported subset (or, not, functions)
+    """
+    parameters = parameters or {}
+    clauses = []
+    position = 0
+    text = (query_filter or '').strip()
+    while position < len(text):
+        match = _FILTER_CLAUSE.match(text, position)
+        if match is None:
+            raise ValueError(f'Unsupported query filter: {query_filter}')
+        name, op, token = match.groups()
+        clauses.append((name, op.lower(), _filter_value(token, parameters)))
+        position = match.end()
+
+    def predicate(entity, timestamp):
+        for name, op, value in clauses:
+            actual = timestamp if name == 'Timestamp' else entity.get(name)
+            actual = getattr(actual, 'value', actual)
+            try:
+                if actual is None or not _COMPARE[op](actual, value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    return clauses, predicate
+
+
+def _key_bounds(clauses):
+    """PartitionKey equality and RowKey range of a filter, for narrowing a scan"""
+    partition = None
+    low = high = None
+    for name, op, value in clauses:
+        if name == 'PartitionKey' and op == 'eq':
+            partition = value
+        if name != 'RowKey':
+            continue
+        # An equality bounds the range on both sides
+        if op in ('gt', 'ge', 'eq'):
+            low = value if low is None else max(low, value)
+        if op in ('lt', 'le', 'eq'):
+            high = value if high is None else min(high, value)
+    return partition, low, high
+
+
+def _select(entity, select):
+    if not select:
+        return entity
+    names = [select] if isinstance(select, str) else select
+    selected = TableEntity({name: entity[name] for name in names if name in entity})
+    selected._metadata = entity.metadata
+    return selected
+
+
+def _entity(properties, etag, timestamp):
+    entity = TableEntity(properties)
+    entity._metadata = {'etag': etag, 'timestamp': timestamp}
+    return entity
+
+
+def _write_result(etag, timestamp):
+    return {'etag': etag, 'date': timestamp}
+
+
+def _check_etag(existing_etag, etag, match_condition):
+    if match_condition == MatchConditions.IfNotModified and etag != existing_etag:
+        raise ResourceModifiedError('The entity was modified since it was read')
+
+
+def _merge(existing, entity, mode):
+    properties = dict(existing) if mode == UpdateMode.MERGE else {}
+    properties.update(entity)
+    return {name: value for name, value in properties.items() if value is not None}
+
+
+class _QueryResult:
+    """What query_entities returns: iterate it for entities, or by_page() for pages"""
+
+    def __init__(self, read_page, page_size):
+        self._read_page = read_page
+        self._page_size = page_size
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return _Pager(self._read_page, self._page_size, continuation_token)
+
+
+class _Pager:
+    """Pages of a query; continuation_token is the key of the next entity, like Azure's"""
+
+    def __init__(self, read_page, page_size, continuation_token):
+        self._read_page = read_page
+        self._page_size = page_size
+        self._after = None
+        if continuation_token:
+            self._after = (continuation_token.get('PartitionKey'), continuation_token.get('RowKey'))
+        self.continuation_token = None
+
+    def __iter__(self):
+        start = self._after
+        while True:
+            page, next_key = self._read_page(start, self._page_size)
+            self.continuation_token = (
+                {'PartitionKey': next_key[0], 'RowKey': next_key[1]} if next_key else None
+            )
+            yield page
+            if next_key is None:
+                return
+            start = next_key
+
+
+class MemoryTableClient:
+    """Table kept in process memory, lost when the process exits.
+
+    ``latency_ms`` is added to every call (per page for queries), which makes
+    it a stand-in for a remote table in load tests and benchmarks.
+    """
+
+    def __init__(self, table_name, latency_ms=0):
+        self.table_name = table_name
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        # (PartitionKey, RowKey) -> (properties, etag, timestamp), plus the keys in order
+        self._rows = {}
+        self._keys = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _put(self, key, properties, timestamp=None):
+        timestamp = timestamp or _now()
+        etag = _new_etag(timestamp)
+        if key not in self._rows:
+            bisect.insort(self._keys, key)
+        self._rows[key] = (properties, etag, timestamp)
+        return _write_result(etag, timestamp)
+
+    def load(self, entities):
+        """Store (entity, timestamp) pairs at once, without latency (for seeding test data)"""
+        with self._lock:
+            for entity, timestamp in entities:
+                key = (entity['PartitionKey'], entity['RowKey'])
+                self._rows[key] = (dict(entity), _new_etag(timestamp), timestamp)
+            self._keys = sorted(self._rows)
+
+    def query_entities(self, query_filter, *, results_per_page=None, select=None, parameters=None, **kwargs):
+        clauses, predicate = compile_filter(query_filter, parameters)
+        partition, low, high = _key_bounds(clauses)
+
+        def read_page(start, size):
+            _sleep(self.latency_ms)
+            with self._lock:
+                if start is not None:
+                    position = bisect.bisect_left(self._keys, start)
+                elif partition is not None:
+                    position = bisect.bisect_left(self._keys, (partition, low or ''))
+                else:
+                    position = 0
+                page = []
+                next_key = None
+                while position < len(self._keys):
+                    key = self._keys[position]
+                    if partition is not None and (key[0] != partition or (high is not None and key[1] > high)):
+                        # Keys sort by partition first, so the RowKey range only ends a scan within one
+                        break
+                    if len(page) == size:
+                        # The page is full; the query goes on from this key
+                        next_key = key
+                        break
+                    properties, etag, timestamp = self._rows[key]
+                    if predicate(properties, timestamp):
+                        page.append(_select(_entity(dict(properties), etag, timestamp), select))
+                    position += 1
+            return page, next_key
+
+        return _QueryResult(read_page, results_per_page or TABLE_PAGE_SIZE)
+
+    def list_entities(self, **kwargs):
+        return self.query_entities('', **kwargs)
+
+    def get_entity(self, partition_key, row_key, **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            row = self._rows.get((partition_key, row_key))
+        if row is None:
+            raise ResourceNotFoundError(f'Entity {partition_key}/{row_key} not found')
+        properties, etag, timestamp = row
+        return _entity(dict(properties), etag, timestamp)
+
+    def _create(self, entity):
+        key = (entity['PartitionKey'], entity['RowKey'])
+        if key in self._rows:
+            raise ResourceExistsError(f'Entity {key[0]}/{key[1]} already exists')
+        return self._put(key, _merge({}, entity, UpdateMode.REPLACE))
+
+    def _update(self, entity, mode=UpdateMode.MERGE, etag=None, match_condition=None):
+        key = (entity['PartitionKey'], entity['RowKey'])
+        row = self._rows.get(key)
+        if row is None:
+            raise ResourceNotFoundError(f'Entity {key[0]}/{key[1]} not found')
+        _check_etag(row[1], etag, match_condition)
+        return self._put(key, _merge(row[0], entity, mode))
+
+    def _upsert(self, entity, mode=UpdateMode.MERGE):
+        key = (entity['PartitionKey'], entity['RowKey'])
+        row = self._rows.get(key)
+        return self._put(key, _merge(row[0] if row else {}, entity, mode))
+
+    def _delete(self, partition_key, row_key, etag=None, match_condition=None):
+        key = (partition_key, row_key)
+        row = self._rows.get(key)
+        if row is None:
+            return
+        _check_etag(row[1], etag, match_condition)
+        del self._rows[key]
+        self._keys.pop(bisect.bisect_left(self._keys, key))
+
+    def create_entity(self, entity, **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            return self._create(entity)
+
+    def update_entity(self, entity, mode=UpdateMode.MERGE, *, etag=None, match_condition=None, **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            return self._update(entity, mode, etag, match_condition)
+
+    def upsert_entity(self, entity, mode=UpdateMode.MERGE, **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            return self._upsert(entity, mode)
+
+    def delete_entity(self, partition_key, row_key, *, etag=None, match_condition=None, **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            self._delete(partition_key, row_key, etag, match_condition)
+
+    def submit_transaction(self, operations, **kwargs):
+        """Apply up to 100 operations on one partition, all or none (one round trip of latency)"""
+        operations = _transaction_operations(operations)
+        _sleep(self.latency_ms)
+        with self._lock:
+            saved_rows = dict(self._rows)
+            saved_keys = list(self._keys)
+            try:
+                return _apply_transaction(self, operations)
+            except TableTransactionError:
+                self._rows = saved_rows
+                self._keys = saved_keys
+                raise
+
+
+def _transaction_operations(operations):
+    """Check a submit_transaction batch against the Table Storage rules
+
+    Returns:
+        list: (operation name, entity, keyword arguments) tuples
+
+    Raises:
+        TableTransactionError: For more than MAX_TRANSACTION_OPERATIONS
+            operations, several partitions or the same entity twice
+    """
+    normalized = []
+    for operation in operations:
+        kind = getattr(operation[0], 'value', operation[0])
+        normalized.append((str(kind).lower(), operation[1], dict(operation[2]) if len(operation) > 2 else {}))
+    if len(normalized) > MAX_TRANSACTION_OPERATIONS:
+        raise TableTransactionError(message=f'A transaction holds at most {MAX_TRANSACTION_OPERATIONS} operations')
+    if len({entity['PartitionKey'] for _, entity, _ in normalized}) > 1:
+        raise TableTransactionError(message='All operations of a transaction must use the same PartitionKey')
+    row_keys = [entity['RowKey'] for _, entity, _ in normalized]
+    if len(set(row_keys)) != len(row_keys):
+        raise TableTransactionError(message='A transaction may not hold the same entity twice')
+    return normalized
+
+
+def _apply_transaction(client, operations, *args):
+    """Run checked operations through a client's unlocked write methods
+
+    ``args`` go first to every write method (the SQLite connection). The
+    first failing operation raises TableTransactionError with its index.
+    """
+    results = []
+    for index, (kind, entity, options) in enumerate(operations):
+        etag = options.get('etag')
+        match_condition = options.get('match_condition')
+        mode = options.get('mode', UpdateMode.MERGE)
+        try:
+            if kind == 'create':
+                results.append(client._create(*args, entity))
+            elif kind == 'update':
+                results.append(client._update(*args, entity, mode, etag, match_condition))
+            elif kind == 'upsert':
+                results.append(client._upsert(*args, entity, mode))
+            elif kind == 'delete':
+                client._delete(*args, entity['PartitionKey'], entity['RowKey'], etag, match_condition)
+                results.append({})
+            else:
+                raise ValueError(f'Unknown transaction operation: {kind}')
+        except (ResourceExistsError, ResourceNotFoundError, ResourceModifiedError, ValueError) as e:
+            raise TableTransactionError(message=f'{index}:{e}', index=index)
+    return results
+
+
+def encode_property(value):
+    """JSON-safe form of an entity property value; datetimes, bytes and GUIDs become tagged objects"""
+    value = value.value if isinstance(value, EntityProperty) else value
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'$binary': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, uuid.UUID):
+        return {'$guid': str(value)}
+    return value
+
+
+def decode_property(value):
+    """Inverse of encode_property"""
+    if isinstance(value, dict):
+        if '$datetime' in value:
+            return datetime.datetime.fromisoformat(value['$datetime'])
+        if '$binary' in value:
+            return base64.b64decode(value['$binary'])
+        if '$guid' in value:
+            return uuid.UUID(value['$guid'])
+    return value
+
+
+def _dumps(properties):
+    return json.dumps({name: encode_property(value) for name, value in properties.items()}, ensure_ascii=False)
+
+
+def _loads(text):
+    return {name: decode_property(value) for name, value in json.loads(text).items()}
+
+
+class SqliteTableClient:
+    """Table stored in a local SQLite file, one SQL table per storage table.
+
+    Rows keep the entity properties as JSON next to the keys, ETag and
+    server timestamp. Queries read one page per SQL statement in key order,
+    so a scan never holds more than a page in memory.
+    """
+
+    def __init__(self, path, table_name):
+        self.path = path
+        self.table_name = table_name
+        self._sql_table = 'entities_' + re.sub(r'\W', '_', table_name)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self._sql_table}" ('
+                'partition_key TEXT NOT NULL, row_key TEXT NOT NULL, properties TEXT NOT NULL, '
+                'etag TEXT NOT NULL, timestamp TEXT NOT NULL, PRIMARY KEY (partition_key, row_key))'
+            )
+            db.execute(
+                f'CREATE INDEX IF NOT EXISTS "{self._sql_table}_timestamp" ON "{self._sql_table}" (timestamp)'
+            )
+
+    def _connect(self, write=True):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return _Transaction(db, write)
+
+    def _row(self, db, partition_key, row_key):
+        return db.execute(
+            f'SELECT properties, etag, timestamp FROM "{self._sql_table}" WHERE partition_key = ? AND row_key = ?',
+            (partition_key, row_key),
+        ).fetchone()
+
+    def _put(self, db, entity, properties, exists):
+        timestamp = _now()
+        etag = _new_etag(timestamp)
+        values = (_dumps(properties), etag, timestamp.isoformat(), entity['PartitionKey'], entity['RowKey'])
+        if exists:
+            db.execute(
+                f'UPDATE "{self._sql_table}" SET properties = ?, etag = ?, timestamp = ? '
+                'WHERE partition_key = ? AND row_key = ?',
+                values,
+            )
+        else:
+            db.execute(
+                f'INSERT INTO "{self._sql_table}" (properties, etag, timestamp, partition_key, row_key) '
+                'VALUES (?, ?, ?, ?, ?)',
+                values,
+            )
+        return _write_result(etag, timestamp)
+
+    def query_entities(self, query_filter, *, results_per_page=None, select=None, parameters=None, **kwargs):
+        clauses, predicate = compile_filter(query_filter, parameters)
+        partition, low, high = _key_bounds(clauses)
+        conditions = []
+        arguments = []
+        if partition is not None:
+            conditions.append('partition_key = ?')
+            arguments.append(partition)
+        if low is not None:
+            conditions.append('row_key >= ?')
+            arguments.append(low)
+        if high is not None:
+            conditions.append('row_key <= ?')
+            arguments.append(high)
+
+        def read_page(start, size):
+            where = list(conditions)
+            values = list(arguments)
+            if start is not None:
+                where.append('(partition_key > ? OR (partition_key = ? AND row_key >= ?))')
+                values.extend([start[0], start[0], start[1]])
+            sql = f'SELECT partition_key, row_key, properties, etag, timestamp FROM "{self._sql_table}"'
+            if where:
+                sql += ' WHERE ' + ' AND '.join(where)
+            sql += ' ORDER BY partition_key, row_key LIMIT ?'
+            with self._connect(write=False) as db:
+                rows = db.execute(sql, values + [size + 1]).fetchall()
+            page = []
+            for _, _, properties, etag, timestamp in rows[:size]:
+                timestamp = datetime.datetime.fromisoformat(timestamp)
+                properties = _loads(properties)
+                if predicate(properties, timestamp):
+                    page.append(_select(_entity(properties, etag, timestamp), select))
+            next_key = (rows[size][0], rows[size][1]) if len(rows) > size else None
+            return page, next_key
+
+        return _QueryResult(read_page, results_per_page or TABLE_PAGE_SIZE)
+
+    def list_entities(self, **kwargs):
+        return self.query_entities('', **kwargs)
+
+    def get_entity(self, partition_key, row_key, **kwargs):
+        with self._connect(write=False) as db:
+            row = self._row(db, partition_key, row_key)
+        if row is None:
+            raise ResourceNotFoundError(f'Entity {partition_key}/{row_key} not found')
+        properties, etag, timestamp = row
+        return _entity(_loads(properties), etag, datetime.datetime.fromisoformat(timestamp))
+
+    def _create(self, db, entity):
+        if self._row(db, entity['PartitionKey'], entity['RowKey']) is not None:
+            raise ResourceExistsError(f"Entity {entity['PartitionKey']}/{entity['RowKey']} already exists")
+        return self._put(db, entity, _merge({}, entity, UpdateMode.REPLACE), exists=False)
+
+    def _update(self, db, entity, mode=UpdateMode.MERGE, etag=None, match_condition=None):
+        row = self._row(db, entity['PartitionKey'], entity['RowKey'])
+        if row is None:
+            raise ResourceNotFoundError(f"Entity {entity['PartitionKey']}/{entity['RowKey']} not found")
+        _check_etag(row[1], etag, match_condition)
+        return self._put(db, entity, _merge(_loads(row[0]), entity, mode), exists=True)
+
+    def _upsert(self, db, entity, mode=UpdateMode.MERGE):
+        row = self._row(db, entity['PartitionKey'], entity['RowKey'])
+        existing = _loads(row[0]) if row else {}
+        return self._put(db, entity, _merge(existing, entity, mode), exists=row is not None)
+
+    def _delete(self, db, partition_key, row_key, etag=None, match_condition=None):
+        row = self._row(db, partition_key, row_key)
+        if row is None:
+            return
+        _check_etag(row[1], etag, match_condition)
+        db.execute(
+            f'DELETE FROM "{self._sql_table}" WHERE partition_key = ? AND row_key = ?',
+            (partition_key, row_key),
+        )
+
+    def create_entity(self, entity, **kwargs):
+        with self._connect() as db:
+            return self._create(db, entity)
+
+    def update_entity(self, entity, mode=UpdateMode.MERGE, *, etag=None, match_condition=None, **kwargs):
+        with self._connect() as db:
+            return self._update(db, entity, mode, etag, match_condition)
+
+    def upsert_entity(self, entity, mode=UpdateMode.MERGE, **kwargs):
+        with self._connect() as db:
+            return self._upsert(db, entity, mode)
+
+    def delete_entity(self, partition_key, row_key, *, etag=None, match_condition=None, **kwargs):
+        with self._connect() as db:
+            self._delete(db, partition_key, row_key, etag, match_condition)
+
+    def submit_transaction(self, operations, **kwargs):
+        """Apply up to 100 operations on one partition in one SQLite transaction, all or none"""
+        operations = _transaction_operations(operations)
+        with self._connect() as db:
+            return _apply_transaction(self, operations, db)
+
+
+class _Transaction:
+    """``with`` block around one SQLite transaction
+
+    Writes take the write lock up front, so read-check-write is atomic. Reads
+    begin a deferred transaction, which in WAL mode reads a snapshot without
+    blocking writers or other readers.
+    """
+
+    def __init__(self, db, write=True):
+        self.db = db
+        self.write = write
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE' if self.write else 'BEGIN DEFERRED')
+        return self.db
+
+    def __exit__(self, exc_type, *exc_info):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def _read_data(data):
+    if hasattr(data, 'read'):
+        return data.read()
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    return bytes(data)
+
+
+def _blob_properties(name, size, content_settings=None, last_modified=None):
+    properties = BlobProperties()
+    properties.name = name
+    properties.size = size
+    properties.content_settings = content_settings or ContentSettings(content_type=mimetypes.guess_type(name)[0])
+    properties.last_modified = last_modified
+    return properties
+
+
+class _Download:
+    """What download_blob returns"""
+
+    def __init__(self, read):
+        self._read = read
+
+    def readall(self):
+        return self._read()
+
+
+class _BlobClient:
+    def __init__(self, container, name):
+        self._container = container
+        self.blob_name = name
+        self.container_name = container.container_name
+        self.url = f"{container.url}/{quote(name, safe='~/')}"
+
+    def upload_blob(self, data, length=None, overwrite=False, content_settings=None, **kwargs):
+        self._container._upload(self.blob_name, data, overwrite, content_settings)
+        return {'etag': _new_etag(_now()), 'last_modified': _now()}
+
+    def get_blob_properties(self, **kwargs):
+        return self._container._properties(self.blob_name)
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        return self._container.download_blob(self.blob_name, offset=offset, length=length)
+
+    def delete_blob(self, **kwargs):
+        self._container.delete_blob(self.blob_name)
+
+
+class MemoryContainerClient:
+    """Blob container kept in process memory; ``latency_ms`` is added to every call"""
+
+    def __init__(self, container_name, url, latency_ms=0):
+        self.container_name = container_name
+        self.url = url.rstrip('/')
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        # Blob name -> (data, content settings, last modified), plus the names in order
+        self._blobs = {}
+        self._names = []
+
+    def _store(self, name, data, content_settings=None):
+        if name not in self._blobs:
+            bisect.insort(self._names, name)
+        self._blobs[name] = (data, content_settings, _now())
+
+    def load(self, blobs):
+        """Store (name, data) pairs at once, without latency (for seeding test data)"""
+        with self._lock:
+            for name, data in blobs:
+                self._store(name, data)
+
+    def _upload(self, name, data, overwrite, content_settings):
+        _sleep(self.latency_ms)
+        data = _read_data(data)
+        with self._lock:
+            if not overwrite and name in self._blobs:
+                raise ResourceExistsError(f'Blob {name} already exists')
+            self._store(name, data, content_settings)
+
+    def _get(self, name):
+        with self._lock:
+            blob = self._blobs.get(name)
+        if blob is None:
+            raise ResourceNotFoundError(f'Blob {name} not found')
+        return blob
+
+    def _properties(self, name):
+        _sleep(self.latency_ms)
+        data, content_settings, last_modified = self._get(name)
+        return _blob_properties(name, len(data), content_settings, last_modified)
+
+    def get_blob_client(self, blob):
+        return _BlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        _sleep(self.latency_ms)
+        prefix = name_starts_with or ''
+        blobs = []
+        with self._lock:
+            position = bisect.bisect_left(self._names, prefix)
+            while position < len(self._names) and self._names[position].startswith(prefix):
+                name = self._names[position]
+                blobs.append((name, self._blobs[name]))
+                position += 1
+        return [_blob_properties(name, len(data), settings, modified) for name, (data, settings, modified) in blobs]
+
+    def download_blob(self, blob, offset=None, length=None, **kwargs):
+        _sleep(self.latency_ms)
+        data = self._get(blob)[0]
+        start = offset or 0
+        end = start + length if length is not None else None
+        return _Download(lambda: data[start:end])
+
+    def delete_blob(self, blob, **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            if self._blobs.pop(blob, None) is None:
+                raise ResourceNotFoundError(f'Blob {blob} not found')
+            self._names.pop(bisect.bisect_left(self._names, blob))
+
+    def open_blob(self, name):
+        """Open a blob for serving: (file object, content type)"""
+        data, content_settings, _ = self._get(name)
+        content_type = getattr(content_settings, 'content_type', None) or mimetypes.guess_type(name)[0]
+        return io.BytesIO(data), content_type
+
+
+class FilesystemContainerClient:
+    """Blob container stored as files under a directory; blob names map to relative paths"""
+
+    def __init__(self, root, container_name, url):
+        self.root = os.path.abspath(root)
+        self.container_name = container_name
+        self.url = url.rstrip('/')
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.root, *name.split('/')))
+        if not name or os.path.isabs(name) or not path.startswith(self.root + os.sep):
+            raise ResourceNotFoundError(f'Invalid blob name: {name}')
+        return path
+
+    def _upload(self, name, data, overwrite, content_settings):
+        path = self._path(name)
+        if not overwrite and os.path.exists(path):
+            raise ResourceExistsError(f'Blob {name} already exists')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and rename, so readers never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(data, 'read'):
+                    while True:
+                        chunk = data.read(BLOB_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                else:
+                    f.write(_read_data(data))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _properties(self, name):
+        path = self._path(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f'Blob {name} not found')
+        modified = datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+        return _blob_properties(name, stat.st_size, last_modified=modified)
+
+    def get_blob_client(self, blob):
+        return _BlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        prefix = name_starts_with or ''
+        # Only walk the deepest folder the prefix names
+        folder = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        top = os.path.join(self.root, *folder.split('/')) if folder else self.root
+        names = []
+        for directory, subdirectories, files in os.walk(top):
+            subdirectories.sort()
+            relative = os.path.relpath(directory, self.root)
+            for filename in files:
+                if filename.startswith('.upload-'):
+                    continue
+                name = filename if relative == '.' else f"{relative.replace(os.sep, '/')}/{filename}"
+                if name.startswith(prefix):
+                    names.append(name)
+        return [self._properties(name) for name in sorted(names)]
+
+    def download_blob(self, blob, offset=None, length=None, **kwargs):
+        path = self._path(blob)
+        if not os.path.isfile(path):
+            raise ResourceNotFoundError(f'Blob {blob} not found')
+
+        def read():
+            with open(path, 'rb') as f:
+                f.seek(offset or 0)
+                return f.read() if length is None else f.read(length)
+        return _Download(read)
+
+    def delete_blob(self, blob, **kwargs):
+        try:
+            os.remove(self._path(blob))
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f'Blob {blob} not found')
+
+    def open_blob(self, name):
+        """Open a blob for serving: (file object, content type)"""
+        path = self._path(name)
+        if not os.path.isfile(path):
+            raise ResourceNotFoundError(f'Blob {name} not found')
+        return open(path, 'rb'), mimetypes.guess_type(name)[0]
+
+
+class AsyncTableClientAdapter:
+    """Async (``azure.data.tables.aio``) interface over a local table client.
+
+    Calls run in a worker thread, so a slow SQLite write or a simulated
+    latency never blocks the event loop.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def query_entities(self, query_filter, **kwargs):
+        return _AsyncQueryResult(self._client.query_entities(query_filter, **kwargs))
+
+    def list_entities(self, **kwargs):
+        return _AsyncQueryResult(self._client.list_entities(**kwargs))
+
+    async def get_entity(self, partition_key, row_key, **kwargs):
+        return await asyncio.to_thread(self._client.get_entity, partition_key, row_key, **kwargs)
+
+    async def create_entity(self, entity, **kwargs):
+        return await asyncio.to_thread(self._client.create_entity, entity, **kwargs)
+
+    async def update_entity(self, entity, mode=UpdateMode.MERGE, **kwargs):
+        return await asyncio.to_thread(self._client.update_entity, entity, mode, **kwargs)
+
+    async def upsert_entity(self, entity, mode=UpdateMode.MERGE, **kwargs):
+        return await asyncio.to_thread(self._client.upsert_entity, entity, mode, **kwargs)
+
+    async def delete_entity(self, partition_key, row_key, **kwargs):
+        return await asyncio.to_thread(self._client.delete_entity, partition_key, row_key, **kwargs)
+
+
+class _AsyncQueryResult:
+    def __init__(self, result):
+        self._result = result
+
+    def __aiter__(self):
+        return self._entities()
+
+    async def _entities(self):
+        async for page in self.by_page():
+            async for entity in page:
+                yield entity
+
+    def by_page(self, continuation_token=None):
+        return _AsyncPager(self._result.by_page(continuation_token=continuation_token))
+
+
+class _AsyncPager:
+    def __init__(self, pager):
+        self._pager = pager
+        self._pages = iter(pager)
+
+    @property
+    def continuation_token(self):
+        return self._pager.continuation_token
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        page = await asyncio.to_thread(next, self._pages, None)
+        if page is None:
+            raise StopAsyncIteration
+        return _AsyncList(page)
+
+
+class _AsyncList:
+    def __init__(self, items):
+        self._items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _AsyncDownload:
+    def __init__(self, download):
+        self._download = download
+
+    async def readall(self):
+        return await asyncio.to_thread(self._download.readall)
+
+
+class _AsyncBlobClient:
+    def __init__(self, blob_client):
+        self._blob_client = blob_client
+        self.blob_name = blob_client.blob_name
+        self.url = blob_client.url
+
+    async def upload_blob(self, data, **kwargs):
+        if hasattr(data, '__aiter__'):
+            # Async iterables are accepted like the aio SDK does; spool them for the sync client
+            spool = tempfile.SpooledTemporaryFile(max_size=BLOB_CHUNK_SIZE)
+            async for chunk in data:
+                spool.write(chunk)
+            spool.seek(0)
+            data = spool
+        return await asyncio.to_thread(self._blob_client.upload_blob, data, **kwargs)
+
+    async def get_blob_properties(self, **kwargs):
+        return await asyncio.to_thread(self._blob_client.get_blob_properties, **kwargs)
+
+    async def delete_blob(self, **kwargs):
+        return await asyncio.to_thread(self._blob_client.delete_blob, **kwargs)
+
+
+class AsyncContainerClientAdapter:
+    """Async (``azure.storage.blob.aio``) interface over a local container client"""
+
+    def __init__(self, client):
+        self._client = client
+        self.container_name = client.container_name
+        self.url = client.url
+
+    def get_blob_client(self, blob):
+        return _AsyncBlobClient(self._client.get_blob_client(blob))
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        return _AsyncBlobList(self._client, name_starts_with, kwargs)
+
+    async def download_blob(self, blob, offset=None, length=None, **kwargs):
+        download = await asyncio.to_thread(self._client.download_blob, blob, offset=offset, length=length)
+        return _AsyncDownload(download)
+
+    async def delete_blob(self, blob, **kwargs):
+        return await asyncio.to_thread(self._client.delete_blob, blob, **kwargs)
+
+
+class _AsyncBlobList:
+    def __init__(self, client, name_starts_with, kwargs):
+        self._client = client
+        self._name_starts_with = name_starts_with
+        self._kwargs = kwargs
+
+    def __aiter__(self):
+        return self._blobs()
+
+    async def _blobs(self):
+        blobs = await asyncio.to_thread(self._client.list_blobs, name_starts_with=self._name_starts_with, **self._kwargs)
+        for blob in blobs:
+            yield blob
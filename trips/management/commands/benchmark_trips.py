@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import logging
+
+from trips.benchmark import DEFAULT_SIZES, READ_PATHS, format_report, run_benchmarks
+
+logger = logging.getLogger(__name__)
+
+def _int_list(value):
+    try:
+        sizes = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise CommandError(f'Invalid list of sizes: {value}')
+    if not sizes or min(sizes) < 1:
+        raise CommandError(f'Invalid list of sizes: {value}')
+    return sizes
+
+class Command(BaseCommand):
+    help = 'Times the trip service functions and pages against in-memory storage with synthetic catalogs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                            help='Comma-separated catalog sizes (number of trips)')
+        parser.add_argument('--paths', default=','.join(READ_PATHS),
+                            help="Comma-separated read paths: 'catalog' (catalog cache) and/or 'table' (no cache)")
+        parser.add_argument('--photos', type=int, default=5, help='Photos per trip')
+        parser.add_argument('--legacy-share', type=float, default=0.1,
+                            help='Share of trips without a photo manifest (0-1)')
+        parser.add_argument('--table-latency-ms', type=float, default=0,
+                            help='Latency added to every table call (per page for queries)')
+        parser.add_argument('--blob-latency-ms', type=float, default=0,
+                            help='Latency added to every blob call')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per operation')
+        parser.add_argument('--max-seconds', type=float, default=5.0,
+                            help='Stop repeating an operation after this long (it still runs 3 times)')
+        parser.add_argument('--no-allocations', action='store_true',
+                            help='Skip the traced run that records allocations')
+        parser.add_argument('--no-views', action='store_true', help='Only time the service functions')
+        parser.add_argument('--output', help='Save the report as JSON to this file')
+        parser.add_argument('--baseline', help='Compare with a report saved earlier with --output')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Flag changes against the baseline above this many percent')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error when a change against the baseline is flagged')
+
+    def handle(self, *args, **options):
+        sizes = _int_list(options['sizes'])
+        paths = [path.strip() for path in options['paths'].split(',') if path.strip()]
+        unknown = [path for path in paths if path not in READ_PATHS]
+        if unknown or not paths:
+            raise CommandError(f"Unknown read path(s): {', '.join(unknown) or options['paths']}")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read the baseline {options["baseline"]}: {e}')
+
+        views = not options['no_views']
+        if views and getattr(settings, 'TRIPS_ASYNC_VIEWS', False):
+            self.stdout.write(self.style.WARNING(
+                'TRIPS_ASYNC_VIEWS is on: the async views read Azure directly, so only the service functions are timed'
+            ))
+            views = False
+
+        report = run_benchmarks(
+            sizes=sizes,
+            read_paths=paths,
+            photos=options['photos'],
+            legacy_share=options['legacy_share'],
+            table_latency_ms=options['table_latency_ms'],
+            blob_latency_ms=options['blob_latency_ms'],
+            repeat=options['repeat'],
+            max_seconds=options['max_seconds'],
+            allocations=not options['no_allocations'],
+            views=views,
+            progress=self.stderr.write,
+        )
+
+        lines, regressions = format_report(report, baseline=baseline, threshold=options['threshold'])
+        self.stdout.write('\n'.join(lines))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved the report to {options['output']}"))
+
+        if baseline is not None and regressions:
+            message = f'{regressions} measurement(s) regressed by more than {options["threshold"]:g}%'
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+import logging
+
+from trips.photo_manifest import PhotoManifest
+from trips.views import get_blob_service, get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Builds the photo manifest of trips that do not have one yet from their blob listing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild manifests that already exist')
+        parser.add_argument('--dimensions', action='store_true',
+                            help='Download each photo header to record its width and height')
+
+    def handle(self, *args, **options):
+        table_service = get_data_service()
+        blob_service = get_blob_service()
+
+        trips = table_service.get_all_trips()
+        self.stdout.write(f'Checking {len(trips)} trips...')
+
+        built = 0
+        for trip in trips:
+            trip_id = trip.row_key
+            if trip.cover_photo is not None and not options['force']:
+                continue
+
+            rebuilt = blob_service.build_manifest(trip_id, read_dimensions=options['dimensions'])
+
+            def replace(manifest, rebuilt=rebuilt):
+                # Keep the chosen cover and known variants of photos that still exist
+                cover = manifest.cover
+                for photo in rebuilt.photos:
+                    existing = manifest.get(photo['name'])
+                    if existing and existing.get('variants'):
+                        photo['variants'] = existing['variants']
+                manifest.photos = rebuilt.photos
+                manifest.set_cover(cover)
+
+            success, result = table_service.update_photo_manifest(trip_id, replace, seed=PhotoManifest)
+            if success:
+                built += 1
+                self.stdout.write(f'  {trip_id}: {len(result.photos)} photos')
+            else:
+                self.stdout.write(self.style.ERROR(f'  {trip_id}: {result}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Built {built} photo manifests.'))
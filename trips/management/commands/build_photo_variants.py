@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+import logging
+
+from trips.views import get_blob_service, get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Makes the resized card/gallery/lightbox variants of photos uploaded before variants existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Remake variants that already exist')
+        parser.add_argument('--trip', help='Only process this trip (row key)')
+
+    def handle(self, *args, **options):
+        table_service = get_data_service()
+        blob_service = get_blob_service()
+
+        if options['trip']:
+            trip_ids = [options['trip']]
+        else:
+            trip_ids = [trip.row_key for trip in table_service.get_all_trips()]
+        self.stdout.write(f'Checking {len(trip_ids)} trips...')
+
+        built = 0
+        for trip_id in trip_ids:
+            trip = table_service.get_trip_by_id(trip_id)
+            manifest = trip.photo_manifest if trip else None
+            if manifest is None:
+                self.stdout.write(self.style.WARNING(
+                    f'  {trip_id}: no photo manifest, run build_photo_manifests first'
+                ))
+                continue
+
+            names = [
+                photo['name'] for photo in manifest.photos
+                if options['force'] or not photo.get('variants')
+            ]
+            if not names:
+                continue
+
+            made = blob_service.create_variants_for_blobs(trip_id, names)
+            if made:
+                built += len(made)
+                self.stdout.write(f'  {trip_id}: {len(made)} photos')
+            else:
+                self.stdout.write(self.style.ERROR(f'  {trip_id}: no variants made'))
+
+        self.stdout.write(self.style.SUCCESS(f'Made variants of {built} photos.'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+import logging
+import sys
+import time
+
+from trips.trip_transfer import FORMATS, encode_entities, guess_format
+from trips.views import get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Writes the trips table to JSON Lines or CSV, streaming it page by page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="File to write, or '-' for standard output")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Output format (default: from the file extension, else jsonl)')
+        parser.add_argument('--partition', help='Only export this partition (default: the whole table)')
+        parser.add_argument('--page-size', type=int, default=1000, help='Entities read per table query page')
+
+    def handle(self, *args, **options):
+        service = get_data_service()
+        if not service.is_configured:
+            raise CommandError('No connection string available')
+
+        fmt = options['format'] or guess_format(options['output'])
+        to_stdout = options['output'] == '-'
+        started = time.monotonic()
+        exported = 0
+
+        def entities():
+            nonlocal exported
+            for page, _ in service.iter_entity_pages(partition_key=options['partition'],
+                                                     page_size=options['page_size']):
+                for entity in page:
+                    exported += 1
+                    yield entity
+                self.stderr.write(f'  {exported} trips...')
+
+        out = sys.stdout if to_stdout else open(options['output'], 'w', encoding='utf-8', newline='')
+        try:
+            for line in encode_entities(entities(), fmt):
+                out.write(line)
+        except Exception as e:
+            raise CommandError(f'Export failed after {exported} trips: {e}')
+        finally:
+            if not to_stdout:
+                out.close()
+
+        message = f'Exported {exported} trips as {fmt} in {time.monotonic() - started:.1f}s'
+        self.stderr.write(self.style.SUCCESS(message if to_stdout else f"{message} to {options['output']}"))
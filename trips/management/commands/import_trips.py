@@ -0,0 +1,118 @@
+from django.core.management.base import BaseCommand, CommandError
+from azure.data.tables import UpdateMode
+import logging
+import sys
+import time
+
+from trips.trip_index import rebuild_index
+from trips.trip_transfer import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RETRIES,
+    FORMATS,
+    ImportCheckpoint,
+    guess_format,
+    import_entities,
+    read_entities,
+)
+from trips.views import get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Loads trips from JSON Lines or CSV in batched table transactions, resumable after a failure'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="File written by export_trips (or in the same format), or '-' for standard input")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Input format (default: from the file extension, else jsonl)')
+        parser.add_argument('--merge', action='store_true',
+                            help='Only set the properties in the input; by default existing trips are replaced')
+        parser.add_argument('--batch-size', type=int, default=100, help='Trips per transaction (at most 100)')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                            help='Transactions submitted at once')
+        parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                            help='Retries of a failing transaction before the import stops')
+        parser.add_argument('--checkpoint',
+                            help='Progress file for --resume (default: <input>.progress.json)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue after the last record the checkpoint says was written')
+
+    def handle(self, *args, **options):
+        service = get_data_service()
+        if not service.is_configured:
+            raise CommandError('No connection string available')
+        if options['concurrency'] < 1 or not 1 <= options['batch_size'] <= 100:
+            raise CommandError('--concurrency must be at least 1 and --batch-size between 1 and 100')
+
+        source = options['input']
+        from_stdin = source == '-'
+        checkpoint_path = options['checkpoint'] or (None if from_stdin else f'{source}.progress.json')
+        if options['resume'] and checkpoint_path is None:
+            raise CommandError('--resume needs --checkpoint when reading standard input')
+        checkpoint = ImportCheckpoint(checkpoint_path, source) if checkpoint_path else None
+
+        start_record = 1
+        if options['resume']:
+            try:
+                start_record = checkpoint.load()
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'Resuming at record {start_record}')
+
+        def progress(result):
+            self.stdout.write(f'  {result.imported} trips in {result.batches} batches, next record {result.next_record}')
+
+        fmt = options['format'] or guess_format(source)
+        started = time.monotonic()
+        stream = sys.stdin if from_stdin else open(source, encoding='utf-8-sig', newline='')
+        try:
+            result = import_entities(
+                service,
+                read_entities(stream, fmt),
+                mode=UpdateMode.MERGE if options['merge'] else UpdateMode.REPLACE,
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                retries=options['retries'],
+                start_record=start_record,
+                checkpoint=checkpoint,
+                progress=progress,
+            )
+        finally:
+            if not from_stdin:
+                stream.close()
+
+        for number, error in result.invalid[:20]:
+            self.stdout.write(self.style.WARNING(f'  record {number}: {error}'))
+        if len(result.invalid) > 20:
+            self.stdout.write(self.style.WARNING(f'  ...and {len(result.invalid) - 20} more'))
+
+        elapsed = time.monotonic() - started
+        if result.error is not None:
+            raise CommandError(
+                f'Import stopped after {result.imported} trips: {result.error}. '
+                f'Fix the cause and rerun with --resume to continue at record {result.next_record}.'
+            )
+
+        if checkpoint is not None:
+            checkpoint.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.imported} trips in {result.batches} batches in {elapsed:.1f}s'
+            f' ({len(result.invalid)} records skipped).'
+        ))
+
+        # Bring the local mirror up to date now rather than at its next refresh
+        if service.mirror is not None:
+            success, message = service.sync_mirror()
+            if success:
+                self.stdout.write(f'Trip mirror {message}.')
+            else:
+                self.stdout.write(self.style.WARNING(f'Trip mirror not synced: {message}'))
+
+        # Imported trips bypass the writes that keep the trip index in step
+        if service.index_table_name is not None:
+            try:
+                index = rebuild_index(service)
+                self.stdout.write(f'Trip index rebuilt: {index.written} entries written, {index.deleted} deleted.')
+            except Exception as e:
+                logger.error(f"Error rebuilding the trip index after the import: {str(e)}", exc_info=True)
+                self.stdout.write(self.style.WARNING(f'Trip index not rebuilt ({e}); run rebuild_trip_index.'))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from collections import Counter
+import logging
+
+from trips.views import get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Moves trips into the partitions of TRIPS_PARTITION_SCHEME while the site keeps running'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the trips that would move, per target partition')
+        parser.add_argument('--trip', help='Only move this trip (row key)')
+
+    def handle(self, *args, **options):
+        service = get_data_service()
+        if not service.is_configured:
+            raise CommandError('No connection string available')
+
+        partitions = service.partitions
+        self.stdout.write(f'Partition scheme: {partitions}')
+
+        # Collect first: moving trips changes the table being paged through. The
+        # whole table is read, so trips left in any older layout are found too.
+        entities = []
+        for page, _ in service.iter_entity_pages():
+            entities.extend(
+                entity for entity in page
+                if partitions.is_misplaced(entity) and options['trip'] in (None, entity['RowKey'])
+            )
+        targets = Counter(partitions.partition_of(entity['RowKey']) for entity in entities)
+        self.stdout.write(f'{len(entities)} trips to move')
+        for partition, count in sorted(targets.items()):
+            self.stdout.write(f'  {partition}: {count}')
+        if options['dry_run']:
+            return
+
+        moved = 0
+        failed = 0
+        for entity in entities:
+            success, result = service.move_trip_partition(entity)
+            if not success:
+                self.stdout.write(self.style.ERROR(f"  {entity['RowKey']}: not moved: {result}"))
+                failed += 1
+                continue
+            moved += 1
+            if moved % 100 == 0:
+                self.stdout.write(f'  {moved} trips moved...')
+
+        # The mirror keeps each trip's partition; reload it so it matches the table
+        if moved and service.mirror is not None:
+            success, message = service.sync_mirror(full=True)
+            if success:
+                self.stdout.write(f'Trip mirror {message}.')
+            else:
+                self.stdout.write(self.style.WARNING(f'Trip mirror not synced: {message}'))
+
+        summary = f'Moved {moved} trips.'
+        if failed:
+            raise CommandError(f'{summary} {failed} trips were not moved; run the command again to retry them.')
+        self.stdout.write(self.style.SUCCESS(summary))
+        if str(partitions.previous) != str(partitions.scheme) and not options['trip']:
+            self.stdout.write(
+                f'Every trip is in place; set TRIPS_PARTITION_PREVIOUS_SCHEME={partitions.scheme} '
+                'so reads stop looking in the old partitions.'
+            )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+import logging
+
+from trips.trip_index import rebuild_index
+from trips.views import get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Builds the trip index table, or brings it back in line with the trips'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the index entries that would be written or deleted')
+
+    def handle(self, *args, **options):
+        service = get_data_service()
+        if not service.is_configured:
+            raise CommandError('No connection string available')
+        if service.index_table_name is None:
+            raise CommandError('The trip index is disabled (TRIPS_INDEX_ENABLED)')
+
+        self.stdout.write(f'Index table: {service.index_table_name}')
+        try:
+            result = rebuild_index(service, dry_run=options['dry_run'])
+        except Exception as e:
+            logger.error(f"Error rebuilding the trip index: {str(e)}", exc_info=True)
+            raise CommandError(f'Trip index not rebuilt: {e}')
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'{result.trips} trips: {result.written} index entries to write, '
+                f'{result.deleted} to delete, {result.unchanged} up to date.'
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.trips} trips: {result.written} index entries written, '
+            f'{result.deleted} deleted, {result.unchanged} up to date.'
+        ))
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand, CommandError
+import logging
+
+from trips.row_keys import is_newest_first, rekeyed_row_key
+from trips.views import get_blob_service, get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Moves trips with legacy trip_YYYYmmddHHMMSS row keys, and their photos, to newest-first row keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the trips that would move and their new keys')
+        parser.add_argument('--trip', help='Only move this trip (row key)')
+        parser.add_argument('--keep-old-photos', action='store_true',
+                            help='Leave the photo blobs under the old prefix after copying them')
+
+    def handle(self, *args, **options):
+        service = get_data_service()
+        blob_service = get_blob_service()
+        if not service.is_configured:
+            raise CommandError('No connection string available')
+
+        # Collect first: moving trips changes the table being paged through
+        entities = []
+        for page, _ in service.iter_trip_entity_pages():
+            entities.extend(
+                entity for entity in page
+                if not is_newest_first(entity['RowKey']) and options['trip'] in (None, entity['RowKey'])
+            )
+        self.stdout.write(f'{len(entities)} trips to move')
+
+        moved = 0
+        failed = 0
+        for entity in entities:
+            old_key = entity['RowKey']
+            new_key = rekeyed_row_key(old_key, entity.metadata.get('timestamp'))
+            if new_key is None:
+                self.stdout.write(self.style.WARNING(f'  {old_key}: creation time unknown, skipped'))
+                failed += 1
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'  {old_key} -> {new_key}')
+                continue
+
+            # Photos first, so the moved trip never points at blobs that are not there yet
+            success, copied = blob_service.copy_trip_photos(old_key, new_key)
+            if not success:
+                self.stdout.write(self.style.ERROR(f'  {old_key}: photos not copied: {copied}'))
+                failed += 1
+                continue
+
+            success, result = service.rekey_trip(entity, new_key)
+            if not success:
+                # The trip stays where it is; drop the copies so a rerun starts clean
+                blob_service.delete_trip_photos(new_key)
+                self.stdout.write(self.style.ERROR(f'  {old_key}: not moved (changed meanwhile?): {result}'))
+                failed += 1
+                continue
+
+            if not options['keep_old_photos']:
+                success, deleted = blob_service.delete_trip_photos(old_key)
+                if not success:
+                    self.stdout.write(self.style.WARNING(f'  {old_key}: old photos not deleted: {deleted}'))
+            moved += 1
+            self.stdout.write(f'  {old_key} -> {new_key} ({copied} blobs)')
+
+        if options['dry_run']:
+            return
+
+        # The old keys are gone, which only a full sync notices
+        if moved and service.mirror is not None:
+            success, message = service.sync_mirror(full=True)
+            if success:
+                self.stdout.write(f'Trip mirror {message}.')
+            else:
+                self.stdout.write(self.style.WARNING(f'Trip mirror not synced: {message}'))
+
+        summary = f'Moved {moved} trips.'
+        if failed:
+            raise CommandError(f'{summary} {failed} trips were not moved; run the command again to retry them.')
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+import logging
+
+from trips.trip_search import rebuild_index
+from trips.views import get_data_service
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Copies the Trips table into the local SQLite mirror (incremental unless --full)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Reload every trip and drop the ones deleted from the table')
+        parser.add_argument('--rebuild-search', action='store_true',
+                            help='Rebuild the full-text search index from the mirror afterwards')
+
+    def handle(self, *args, **options):
+        success, message = get_data_service().sync_mirror(full=options['full'])
+        if not success:
+            raise CommandError(f'Trip mirror sync failed: {message}')
+        self.stdout.write(self.style.SUCCESS(f'Trip mirror {message}.'))
+
+        if options['rebuild_search']:
+            rebuild_index()
+            self.stdout.write(self.style.SUCCESS('Rebuilt the trip search index.'))
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripMirrorState',
+            fields=[
+                ('table_name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('sync_marker', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync', models.DateTimeField(blank=True, null=True)),
+                ('last_sync', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('partition_key', models.CharField(max_length=100)),
+                ('row_key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('length_hours', models.FloatField(blank=True, null=True)),
+                ('location', models.CharField(blank=True, max_length=200, null=True)),
+                ('elevation_gain', models.FloatField(blank=True, null=True)),
+                ('difficulty', models.CharField(blank=True, max_length=50, null=True)),
+                ('map_url', models.TextField(blank=True, null=True)),
+                ('image_url', models.TextField(blank=True, null=True)),
+                ('parking_json', models.TextField(blank=True, null=True)),
+                ('high_point_json', models.TextField(blank=True, null=True)),
+                ('meters_ascend', models.IntegerField(blank=True, null=True)),
+                ('meters_descend', models.IntegerField(blank=True, null=True)),
+                ('uiaa_grade', models.CharField(blank=True, max_length=50, null=True)),
+                ('alpine_grade', models.CharField(blank=True, max_length=50, null=True)),
+                ('trip_class', models.CharField(blank=True, max_length=50, null=True)),
+                ('ferata_grade', models.CharField(blank=True, max_length=50, null=True)),
+                ('participants', models.TextField(blank=True, null=True)),
+                ('trip_completed_on', models.DateField(blank=True, null=True)),
+                ('photo_manifest', models.TextField(blank=True, null=True)),
+                ('cover_photo', models.TextField(blank=True, null=True)),
+                ('cover_variants', models.TextField(blank=True, null=True)),
+                ('timestamp', models.CharField(blank=True, default='', max_length=50)),
+                ('etag', models.CharField(blank=True, default='', max_length=100)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-timestamp', 'row_key'], name='trip_listing_idx'), models.Index(fields=['trip_completed_on'], name='trip_completed_idx')],
+            },
+        ),
+    ]
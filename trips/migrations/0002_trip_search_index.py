@@ -0,0 +1,64 @@
+from django.db import migrations
+
+# Full-text index over the mirrored trips. Triggers keep it in step with
+# trips_trip, so every write to the mirror (sync or write-through) updates it.
+# Updates only touch the index when one of the indexed columns changed, which
+# keeps the periodic full syncs cheap.
+FTS_COLUMNS = "row_key, title, description, participants, location"
+FTS_VALUES = (
+    "new.row_key, new.title, coalesce(new.description, ''), "
+    "coalesce(new.participants, ''), coalesce(new.location, '')"
+)
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE trips_trip_fts USING fts5(
+        row_key UNINDEXED, title, description, participants, location,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER trips_trip_fts_insert AFTER INSERT ON trips_trip BEGIN
+        INSERT INTO trips_trip_fts ({FTS_COLUMNS}) VALUES ({FTS_VALUES});
+    END
+    """,
+    """
+    CREATE TRIGGER trips_trip_fts_delete AFTER DELETE ON trips_trip BEGIN
+        DELETE FROM trips_trip_fts WHERE row_key = old.row_key;
+    END
+    """,
+    f"""
+    CREATE TRIGGER trips_trip_fts_update AFTER UPDATE ON trips_trip
+    WHEN old.title IS NOT new.title
+        OR old.description IS NOT new.description
+        OR old.participants IS NOT new.participants
+        OR old.location IS NOT new.location
+    BEGIN
+        DELETE FROM trips_trip_fts WHERE row_key = old.row_key;
+        INSERT INTO trips_trip_fts ({FTS_COLUMNS}) VALUES ({FTS_VALUES});
+    END
+    """,
+    f"""
+    INSERT INTO trips_trip_fts ({FTS_COLUMNS})
+    SELECT row_key, title, coalesce(description, ''), coalesce(participants, ''), coalesce(location, '')
+    FROM trips_trip
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS trips_trip_fts_update",
+    "DROP TRIGGER IF EXISTS trips_trip_fts_delete",
+    "DROP TRIGGER IF EXISTS trips_trip_fts_insert",
+    "DROP TABLE IF EXISTS trips_trip_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SQL, reverse_sql=DROP_SQL),
+    ]
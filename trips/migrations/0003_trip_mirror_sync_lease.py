@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0002_trip_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripmirrorstate',
+            name='sync_lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tripmirrorstate',
+            name='sync_owner',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0003_trip_mirror_sync_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripmirrorstate',
+            name='last_modified',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tripmirrorstate',
+            name='version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
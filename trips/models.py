@@ -3,24 +3,45 @@ from django.db import models
 # Create your models here.
 
 class Trip(models.Model):
+    """Local read mirror of one entity in the Trips table, kept current by trips.trip_mirror"""
     partition_key = models.CharField(max_length=100)
     row_key = models.CharField(max_length=100, primary_key=True)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
-    length_hours = models.FloatField(default=0)
+    length_hours = models.FloatField(blank=True, null=True)
+    location = models.CharField(max_length=200, blank=True, null=True)
+    elevation_gain = models.FloatField(blank=True, null=True)
+    difficulty = models.CharField(max_length=50, blank=True, null=True)
+    map_url = models.TextField(blank=True, null=True)
+    image_url = models.TextField(blank=True, null=True)
     parking_json = models.TextField(blank=True, null=True)  # Stored as JSON string
     high_point_json = models.TextField(blank=True, null=True)  # Stored as JSON string
-    meters_ascend = models.IntegerField(default=0)
-    meters_descend = models.IntegerField(default=0)
+    meters_ascend = models.IntegerField(blank=True, null=True)
+    meters_descend = models.IntegerField(blank=True, null=True)
     uiaa_grade = models.CharField(max_length=50, blank=True, null=True)
     alpine_grade = models.CharField(max_length=50, blank=True, null=True)
     trip_class = models.CharField(max_length=50, blank=True, null=True)
     ferata_grade = models.CharField(max_length=50, blank=True, null=True)
     participants = models.TextField(blank=True, null=True)
     trip_completed_on = models.DateField(blank=True, null=True)
+    # Photo manifest, cover photo and cover variants exactly as stored on the entity
+    photo_manifest = models.TextField(blank=True, null=True)
+    cover_photo = models.TextField(blank=True, null=True)
+    cover_variants = models.TextField(blank=True, null=True)
+    # The entity's own "Timestamp" property, which the listings sort by
+    timestamp = models.CharField(max_length=50, blank=True, default='')
+    # Entity version and server-side Timestamp from Table Storage
+    etag = models.CharField(max_length=100, blank=True, default='')
+    updated_at = models.DateTimeField(blank=True, null=True)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-timestamp', 'row_key'], name='trip_listing_idx'),
+            models.Index(fields=['trip_completed_on'], name='trip_completed_idx'),
+        ]
+
     def __str__(self):
         return self.title
     
@@ -47,3 +68,21 @@ class Trip(models.Model):
             except:
                 return None
         return None
+
+
+class TripMirrorState(models.Model):
+    """Sync progress of the Trip mirror for one table"""
+    table_name = models.CharField(max_length=100, primary_key=True)
+    # Newest server Timestamp pulled so far; the next incremental pull starts here
+    sync_marker = models.DateTimeField(blank=True, null=True)
+    last_full_sync = models.DateTimeField(blank=True, null=True)
+    last_sync = models.DateTimeField(blank=True, null=True)
+    # Version of the mirrored listing (page ETags), replaced whenever a row changes
+    version = models.CharField(max_length=64, blank=True, default='')
+    last_modified = models.DateTimeField(blank=True, null=True)
+    # Lease of the process currently syncing, so only one gunicorn worker syncs at a time
+    sync_owner = models.CharField(max_length=64, blank=True, default='')
+    sync_lease_until = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.table_name
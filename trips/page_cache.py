@@ -0,0 +1,82 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the matching Django settings are not defined
+DEFAULT_PAGE_CACHE_SECONDS = 3600
+
+# Keys are derived from the catalog version, so they never need to be deleted:
+# any write to a trip changes the version and old entries just age out.
+PAGE_KEY_PREFIX = 'trips:page:'
+
+
+def _page_cache_seconds():
+    return getattr(settings, 'TRIPS_PAGE_CACHE_SECONDS', DEFAULT_PAGE_CACHE_SECONDS)
+
+
+def _page_key(etag):
+    # The ETag already covers the URL, the data version and the templates
+    return PAGE_KEY_PREFIX + etag.removeprefix('W/').strip('"')
+
+
+def fragment_cache_context(version):
+    """Template context for the ``{% cache %}`` blocks around the trip cards
+
+    The fragments are keyed by the catalog version and ``user.is_staff``, so
+    staff and everyone else get separate copies. Without a version (catalog
+    cache disabled) the timeout is 0, which turns the fragment cache off.
+    """
+    return {
+        'catalog_version': version or '',
+        'fragment_cache_seconds': _page_cache_seconds() if version else 0,
+    }
+
+
+def get_cached_page(etag):
+    """Get a whole rendered page cached for anonymous readers
+
+    Args:
+        etag (str or None): The page ETag from http_cache.page_etag
+
+    Returns:
+        HttpResponse or None: A copy of the cached page, or None on a miss
+    """
+    if etag is None or not _page_cache_seconds():
+        return None
+    return _page_response(cache.get(_page_key(etag)))
+
+
+def cache_rendered_page(etag, response):
+    """Store a rendered page for anonymous readers; the response is returned unchanged"""
+    if etag is not None and _page_cache_seconds() and response.status_code == 200:
+        cache.set(_page_key(etag), _page_entry(response), _page_cache_seconds())
+    return response
+
+
+async def aget_cached_page(etag):
+    """Async counterpart of get_cached_page"""
+    if etag is None or not _page_cache_seconds():
+        return None
+    return _page_response(await cache.aget(_page_key(etag)))
+
+
+async def acache_rendered_page(etag, response):
+    """Async counterpart of cache_rendered_page"""
+    if etag is not None and _page_cache_seconds() and response.status_code == 200:
+        await cache.aset(_page_key(etag), _page_entry(response), _page_cache_seconds())
+    return response
+
+
+def _page_entry(response):
+    return {'content': response.content, 'content_type': response['Content-Type']}
+
+
+def _page_response(entry):
+    if entry is None:
+        return None
+    logger.info("Serving page from the page cache")
+    return HttpResponse(entry['content'], content_type=entry['content_type'])
@@ -0,0 +1,177 @@
+"""Trip partitions.
+
+Table Storage serves each partition from one partition server, so a table
+with every trip in one partition is capped at that server's throughput.
+TRIPS_PARTITION_SCHEME spreads trips over several partitions instead:
+
+    single      every trip in 'Trips' (the original layout)
+    year        'Trips-<year>', the year the trip was created, read from its row key
+    hash[:N]    'Trips-<nn>', one of N buckets (default 16) picked by a hash of the row key
+
+The partition always follows from the row key, so a point read is still one
+request. Trips whose keys carry no creation time stay in 'Trips' under the
+year scheme.
+
+While migrate_trip_partitions moves trips to a new scheme, the service also
+looks for them where TRIPS_PARTITION_PREVIOUS_SCHEME put them (default:
+single), so the site keeps working during the move.
+"""
+import threading
+import zlib
+from datetime import datetime, timezone
+
+from .row_keys import row_key_created
+
+# The partition of the single scheme, and of trips the year scheme cannot place
+TRIPS_PARTITION = 'Trips'
+PARTITION_PREFIX = 'Trips-'
+
+SCHEMES = ('single', 'year', 'hash')
+DEFAULT_BUCKETS = 16
+# Year partitions scanned by the year scheme start here; older trips go into this year's partition
+DEFAULT_FIRST_YEAR = 2015
+
+
+class PartitionScheme:
+    """One way of assigning trips to partitions"""
+
+    def __init__(self, name='single', buckets=DEFAULT_BUCKETS, first_year=DEFAULT_FIRST_YEAR):
+        if name not in SCHEMES:
+            raise ValueError(f"Unknown partition scheme {name!r}: use {', '.join(SCHEMES)}")
+        if buckets < 1:
+            raise ValueError('A hash partition scheme needs at least one bucket')
+        self.name = name
+        self.buckets = buckets
+        self.first_year = first_year
+
+    @classmethod
+    def parse(cls, spec, first_year=DEFAULT_FIRST_YEAR):
+        """Parse a TRIPS_PARTITION_SCHEME value such as 'year' or 'hash:32'
+
+        Raises:
+            ValueError: For an unknown scheme or a bad bucket count
+        """
+        name, _, buckets = (spec or 'single').strip().lower().partition(':')
+        if buckets and name != 'hash':
+            raise ValueError(f"Only the hash partition scheme takes a bucket count, not {spec!r}")
+        try:
+            buckets = int(buckets) if buckets else DEFAULT_BUCKETS
+        except ValueError:
+            raise ValueError(f"Bad bucket count in partition scheme {spec!r}")
+        return cls(name, buckets=buckets, first_year=first_year)
+
+    def __str__(self):
+        return f"hash:{self.buckets}" if self.name == 'hash' else self.name
+
+    def partition_of(self, row_key):
+        """The partition a trip with this row key belongs in"""
+        if self.name == 'hash':
+            return self._bucket_partition(zlib.crc32(row_key.encode('utf-8')) % self.buckets)
+        if self.name == 'year':
+            created = row_key_created(row_key)
+            if created is None:
+                return TRIPS_PARTITION
+            return f"{PARTITION_PREFIX}{max(created.year, self.first_year)}"
+        return TRIPS_PARTITION
+
+    def partitions(self):
+        """Every partition this scheme can put a trip in"""
+        if self.name == 'hash':
+            return [self._bucket_partition(bucket) for bucket in range(self.buckets)]
+        if self.name == 'year':
+            last_year = datetime.now(timezone.utc).year
+            return [TRIPS_PARTITION] + [f"{PARTITION_PREFIX}{year}" for year in range(self.first_year, last_year + 1)]
+        return [TRIPS_PARTITION]
+
+    def _bucket_partition(self, bucket):
+        # Zero-padded, so the partitions sort in bucket order
+        return f"{PARTITION_PREFIX}{bucket:0{len(str(self.buckets - 1))}d}"
+
+
+class TripPartitions:
+    """Where trips live: the current scheme, plus the previous one while trips are being moved"""
+
+    def __init__(self, scheme=None, previous=None):
+        self.scheme = scheme or PartitionScheme()
+        self.previous = previous or PartitionScheme()
+
+    def __str__(self):
+        if str(self.previous) == str(self.scheme):
+            return str(self.scheme)
+        return f"{self.scheme} (moving from {self.previous})"
+
+    def partition_of(self, row_key):
+        """The partition a trip is written to"""
+        return self.scheme.partition_of(row_key)
+
+    def locations(self, row_key):
+        """Partitions a trip may be in, the current scheme's first"""
+        return _unique([self.scheme.partition_of(row_key), self.previous.partition_of(row_key)])
+
+    def partitions(self):
+        """Every partition that may hold trips, for queries fanned out over all of them"""
+        return _unique(self.scheme.partitions() + self.previous.partitions())
+
+    def is_misplaced(self, entity):
+        """Whether an entity is not in the partition the current scheme puts it in"""
+        return entity['PartitionKey'] != self.partition_of(entity['RowKey'])
+
+    def scan_query(self, query_filter=None, parameters=None):
+        """Filter and parameters of one query over every trip partition
+
+        A single partition is matched exactly, several by the key range
+        between the first and the last of them. Entities come back in
+        partition order, and row key order within each partition.
+        """
+        parameters = dict(parameters or {})
+        partitions = self.partitions()
+        if len(partitions) == 1:
+            clauses = ['PartitionKey eq @pk']
+            parameters['pk'] = partitions[0]
+        else:
+            clauses = ['PartitionKey ge @pk_first', 'PartitionKey le @pk_last']
+            parameters['pk_first'] = min(partitions)
+            parameters['pk_last'] = max(partitions)
+        if query_filter:
+            clauses.append(query_filter)
+        return ' and '.join(clauses), parameters
+
+
+def _unique(partitions):
+    return list(dict.fromkeys(partitions))
+
+
+_partitions = None
+_partitions_lock = threading.Lock()
+
+
+def make_trip_partitions(scheme, previous='single', first_year=DEFAULT_FIRST_YEAR):
+    """Build TripPartitions from TRIPS_PARTITION_SCHEME style values
+
+    Raises:
+        ImproperlyConfigured: For an unknown scheme or a bad bucket count
+    """
+    from django.core.exceptions import ImproperlyConfigured
+
+    try:
+        return TripPartitions(
+            PartitionScheme.parse(scheme, first_year=first_year),
+            PartitionScheme.parse(previous, first_year=first_year),
+        )
+    except ValueError as e:
+        raise ImproperlyConfigured(f"Bad trip partition settings: {e}")
+
+
+def get_trip_partitions():
+    """Get the partitioning selected by the TRIPS_PARTITION_* settings, created on first use"""
+    global _partitions
+    if _partitions is None:
+        with _partitions_lock:
+            if _partitions is None:
+                from django.conf import settings
+                _partitions = make_trip_partitions(
+                    getattr(settings, 'TRIPS_PARTITION_SCHEME', 'single'),
+                    getattr(settings, 'TRIPS_PARTITION_PREVIOUS_SCHEME', 'single'),
+                    getattr(settings, 'TRIPS_PARTITION_FIRST_YEAR', DEFAULT_FIRST_YEAR),
+                )
+    return _partitions
@@ -0,0 +1,141 @@
+import json
+import logging
+
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# EXIF orientations that rotate the image by 90 or 270 degrees
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+class PhotoManifest:
+    """Ordered list of a trip's photos, stored as JSON on the trip entity.
+
+    Each photo entry is a dict with the blob ``name``, its ``size`` in bytes,
+    display ``width``/``height`` (None when unknown) and its ``order``.
+    Entries of photos with resized variants also carry ``variants``, a dict of
+    variant -> {'name', 'width', 'height'}. The cover photo is the explicitly
+    chosen one, or the first photo by order.
+    """
+
+    def __init__(self, photos=None, cover=None):
+        self.photos = sorted(photos or [], key=lambda p: p.get('order', 0))
+        self._cover = cover
+
+    @classmethod
+    def from_json(cls, value):
+        """Load a manifest from the entity's PhotoManifest property.
+
+        Returns None when the property is missing, so callers can tell a trip
+        without a manifest (not yet backfilled) from one without photos.
+        """
+        if value is None:
+            return None
+        try:
+            data = json.loads(value) if value else {}
+        except (TypeError, ValueError):
+            logger.warning("Ignoring unreadable photo manifest")
+            return None
+        return cls(photos=data.get('photos', []), cover=data.get('cover'))
+
+    def to_json(self):
+        data = {'photos': self.photos}
+        if self._cover:
+            data['cover'] = self._cover
+        return json.dumps(data, separators=(',', ':'))
+
+    @property
+    def names(self):
+        return [photo['name'] for photo in self.photos]
+
+    @property
+    def cover(self):
+        """Blob name of the cover photo, or '' when the trip has no photos"""
+        if self._cover and self._cover in self.names:
+            return self._cover
+        return self.photos[0]['name'] if self.photos else ''
+
+    @property
+    def cover_variants(self):
+        """Variants of the cover photo, or an empty dict"""
+        entry = self.get(self.cover)
+        return (entry or {}).get('variants') or {}
+
+    def get(self, name):
+        """Return the entry of a photo, or None"""
+        return next((photo for photo in self.photos if photo['name'] == name), None)
+
+    def set_cover(self, name):
+        self._cover = name if name in self.names else None
+
+    def add(self, name, size=None, width=None, height=None, variants=None):
+        """Add or replace a photo entry, keeping its position if it already exists"""
+        existing = self.get(name)
+        if existing is not None:
+            existing.update({'size': size, 'width': width, 'height': height})
+            if variants:
+                existing['variants'] = variants
+            return existing
+
+        order = max((photo.get('order', 0) for photo in self.photos), default=-1) + 1
+        entry = {'name': name, 'size': size, 'width': width, 'height': height, 'order': order}
+        if variants:
+            entry['variants'] = variants
+        self.photos.append(entry)
+        return entry
+
+    def set_variants(self, name, variants):
+        """Record the resized variants of a photo; returns True if the photo is in the manifest"""
+        entry = self.get(name)
+        if entry is None:
+            return False
+        entry['variants'] = variants
+        return True
+
+    def remove(self, name):
+        """Remove a photo entry; returns True if it was present"""
+        before = len(self.photos)
+        self.photos = [photo for photo in self.photos if photo['name'] != name]
+        if self._cover == name:
+            self._cover = None
+        return len(self.photos) != before
+
+
+def load_cover_variants(value):
+    """Load the trip entity's CoverVariants property (variants of the cover photo)"""
+    if not value:
+        return {}
+    try:
+        variants = json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+    return variants if isinstance(variants, dict) else {}
+
+
+def read_image_dimensions(photo_file):
+    """Read the display (width, height) of an image without decoding it.
+
+    Only the image header is parsed. EXIF rotation is taken into account so
+    portrait phone photos report portrait dimensions. Returns (None, None)
+    for files Pillow cannot identify. The file position is restored.
+    """
+    position = photo_file.tell() if hasattr(photo_file, 'tell') else None
+    try:
+        photo_file.seek(0)
+        with Image.open(photo_file) as image:
+            width, height = image.size
+            try:
+                orientation = image.getexif().get(_EXIF_ORIENTATION_TAG)
+            except Exception:
+                orientation = None
+            if orientation in _ROTATED_ORIENTATIONS:
+                width, height = height, width
+            return width, height
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning(f"Could not read image dimensions: {str(e)}")
+        return None, None
+    finally:
+        if position is not None:
+            photo_file.seek(position)
@@ -0,0 +1,92 @@
+"""Trip row keys.
+
+New trips get ``trip_<inverted timestamp>_<suffix>`` keys. The inverted
+timestamp counts microseconds down from a fixed point in the future, so the
+table's natural (ascending) key order is newest first and the latest trips
+are the first entities of a query. The random suffix keeps trips created at
+the same moment apart.
+
+Trips created before that have ``trip_<YYYYmmddHHMMSS>`` keys, which sort
+oldest first; the rekey_trips command moves them to the new scheme.
+"""
+import hashlib
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ROW_KEY_PREFIX = 'trip_'
+
+# Inverted timestamps are microseconds before this instant (in the year 2286)
+INVERTED_EPOCH_US = 10 ** 16
+INVERTED_DIGITS = 16
+SUFFIX_LENGTH = 8
+
+# Format of the timestamp in legacy keys; it was taken from the server clock, which runs on UTC
+LEGACY_FORMAT = '%Y%m%d%H%M%S'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_KEY = re.compile(rf'^{ROW_KEY_PREFIX}(\d{{{INVERTED_DIGITS}}})_[0-9a-f]{{{SUFFIX_LENGTH}}}$')
+_LEGACY_KEY = re.compile(rf'^{ROW_KEY_PREFIX}(\d{{14}})$')
+
+
+def _inverted(created):
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return INVERTED_EPOCH_US - (created - _EPOCH) // timedelta(microseconds=1)
+
+
+def new_row_key(created=None, suffix=None):
+    """Row key for a trip created at ``created`` (default: now)
+
+    Args:
+        created (datetime, optional): Creation time; naive values are taken as UTC
+        suffix (str, optional): The unique part; random unless given
+    """
+    created = created or datetime.now(timezone.utc)
+    suffix = suffix or uuid.uuid4().hex[:SUFFIX_LENGTH]
+    return f"{ROW_KEY_PREFIX}{_inverted(created):0{INVERTED_DIGITS}d}_{suffix}"
+
+
+def is_newest_first(row_key):
+    """Whether a row key uses the newest-first scheme"""
+    return bool(_KEY.match(row_key or ''))
+
+
+def is_legacy(row_key):
+    """Whether a row key is a ``trip_<YYYYmmddHHMMSS>`` key from before the newest-first scheme"""
+    return bool(_LEGACY_KEY.match(row_key or ''))
+
+
+def row_key_created(row_key):
+    """Creation time encoded in a row key of either scheme, or None for other keys"""
+    match = _KEY.match(row_key or '')
+    if match:
+        return _EPOCH + timedelta(microseconds=INVERTED_EPOCH_US - int(match.group(1)))
+    match = _LEGACY_KEY.match(row_key or '')
+    if match:
+        try:
+            return datetime.strptime(match.group(1), LEGACY_FORMAT).replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+    return None
+
+
+def rekeyed_row_key(row_key, created=None):
+    """The newest-first key an existing trip moves to
+
+    The suffix is derived from the old key, so a migration that is run again
+    after a failure picks the same new key.
+
+    Args:
+        row_key (str): The current key
+        created (datetime, optional): Used when the key has no timestamp in it
+            (e.g. the entity's Timestamp)
+
+    Returns:
+        str or None: The new key, or None when the creation time is unknown
+    """
+    created = row_key_created(row_key) or created
+    if created is None:
+        return None
+    suffix = hashlib.sha1(row_key.encode('utf-8')).hexdigest()[:SUFFIX_LENGTH]
+    return new_row_key(created, suffix)
@@ -0,0 +1,277 @@
+"""Storage backends: where the trip table and the photo container live.
+
+The services talk to table and container clients with the Azure SDK
+interface; a backend decides which clients those are. Pick one with
+TRIPS_STORAGE_BACKEND:
+
+- 'azure': Azure Table Storage and Blob Storage (the connection string)
+- 'local': a SQLite file and a folder of photos under TRIPS_LOCAL_STORAGE_DIR
+- 'memory': process memory, for tests and benchmarks
+- or the dotted path of a StorageBackend subclass
+"""
+import logging
+import os
+import threading
+
+from azure.core.exceptions import ResourceExistsError
+from django.utils.module_loading import import_string
+
+from .azure_clients import get_async_client_registry, get_client_registry
+from .local_storage import (
+    AsyncContainerClientAdapter,
+    AsyncTableClientAdapter,
+    FilesystemContainerClient,
+    MemoryContainerClient,
+    MemoryTableClient,
+    SqliteTableClient,
+)
+
+logger = logging.getLogger(__name__)
+
+# File holding the tables of the local backend, inside TRIPS_LOCAL_STORAGE_DIR
+LOCAL_TABLES_FILE = 'tables.sqlite3'
+
+# Folder holding the blob containers of the local backend, inside TRIPS_LOCAL_STORAGE_DIR
+LOCAL_BLOBS_FOLDER = 'blobs'
+
+# URL path the local and memory backends serve photos from (see the storage_media view)
+DEFAULT_MEDIA_URL = '/trips/media/'
+
+
+class StorageBackend:
+    """Hands out the table and container clients the services use"""
+
+    name = None
+    # Whether the local trip mirror may copy this backend's data; it is not
+    # worth it for data that lives in the same process
+    mirrored = True
+
+    def __init__(self):
+        # Reentrant: an async client is made from the sync client, under the same lock
+        self._lock = threading.RLock()
+        self._async_clients = {}
+
+    @property
+    def is_configured(self):
+        return True
+
+    def get_table_client(self, table_name):
+        raise NotImplementedError
+
+    def get_container_client(self, container_name):
+        raise NotImplementedError
+
+    def ensure_table(self, table_name):
+        """Create a table if it does not exist yet (local and memory tables appear on first use)"""
+
+    def get_blob_service_client(self):
+        """Account-level blob client, only the Azure backend has one"""
+        return None
+
+    def get_async_table_client(self, table_name):
+        return self._async_client('table', table_name, AsyncTableClientAdapter, self.get_table_client)
+
+    def get_async_container_client(self, container_name):
+        return self._async_client('container', container_name, AsyncContainerClientAdapter, self.get_container_client)
+
+    def _async_client(self, kind, name, adapter, get_client):
+        with self._lock:
+            client = self._async_clients.get((kind, name))
+            if client is None:
+                client = self._async_clients[(kind, name)] = adapter(get_client(name))
+            return client
+
+    def account_credentials(self):
+        """(account name, account key) for signing upload URLs; either may be None"""
+        return None, None
+
+    def open_blob(self, container_name, blob_name):
+        """Open a blob for the storage_media view
+
+        Returns:
+            tuple or None: (file object, content type), or None when the
+            backend's blobs are not served by this app
+
+        Raises:
+            ResourceNotFoundError: If the blob does not exist
+        """
+        return None
+
+    def describe(self):
+        """Short description for logs and the debug page, without secrets"""
+        return self.name
+
+
+class AzureStorageBackend(StorageBackend):
+    """Azure Table Storage and Blob Storage, through the shared client registries"""
+
+    name = 'azure'
+
+    def __init__(self, connection_string=None):
+        super().__init__()
+        self.connection_string = connection_string or os.environ.get("BARUCHSTREKS_STORAGE_CONNECTION")
+
+    @property
+    def is_configured(self):
+        return bool(self.connection_string)
+
+    def get_table_client(self, table_name):
+        return get_client_registry().get_table_client(self.connection_string, table_name)
+
+    def get_container_client(self, container_name):
+        return get_client_registry().get_container_client(self.connection_string, container_name)
+
+    def ensure_table(self, table_name):
+        try:
+            self.get_table_client(table_name).create_table()
+            logger.info(f"Created table {table_name}")
+        except ResourceExistsError:
+            pass
+
+    def get_blob_service_client(self):
+        return get_client_registry().get_blob_service_client(self.connection_string)
+
+    def get_async_table_client(self, table_name):
+        # The aio clients belong to the running event loop, so they are not kept here
+        return get_async_client_registry().get_table_client(self.connection_string, table_name)
+
+    def get_async_container_client(self, container_name):
+        return get_async_client_registry().get_container_client(self.connection_string, container_name)
+
+    def account_credentials(self):
+        account_name = None
+        account_key = None
+        for part in (self.connection_string or '').split(';'):
+            if part.startswith('AccountName='):
+                account_name = part.split('=', 1)[1]
+            elif part.startswith('AccountKey='):
+                account_key = part.split('=', 1)[1]
+        return account_name, account_key
+
+    def describe(self):
+        account_name, _ = self.account_credentials()
+        return f"azure ({account_name or 'no connection string'})"
+
+
+class LocalStorageBackend(StorageBackend):
+    """Tables in one SQLite file and blobs as files, for running without an Azure account"""
+
+    name = 'local'
+
+    def __init__(self, directory, media_url=DEFAULT_MEDIA_URL):
+        super().__init__()
+        self.directory = os.path.abspath(directory)
+        self.media_url = media_url
+        self._clients = {}
+
+    def _client(self, key, make):
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = make()
+            return client
+
+    def get_table_client(self, table_name):
+        path = os.path.join(self.directory, LOCAL_TABLES_FILE)
+        return self._client(('table', table_name), lambda: SqliteTableClient(path, table_name))
+
+    def get_container_client(self, container_name):
+        root = os.path.join(self.directory, LOCAL_BLOBS_FOLDER, container_name)
+        url = f"{self.media_url}{container_name}"
+        return self._client(('container', container_name), lambda: FilesystemContainerClient(root, container_name, url))
+
+    def open_blob(self, container_name, blob_name):
+        return self.get_container_client(container_name).open_blob(blob_name)
+
+    def describe(self):
+        return f"local ({self.directory})"
+
+
+class MemoryStorageBackend(StorageBackend):
+    """Tables and blobs in process memory; everything is lost when the process exits
+
+    Args:
+        table_latency_ms (float): Added to every table call, per page for queries
+        blob_latency_ms (float): Added to every blob call
+    """
+
+    name = 'memory'
+    mirrored = False
+
+    def __init__(self, media_url=DEFAULT_MEDIA_URL, table_latency_ms=0, blob_latency_ms=0):
+        super().__init__()
+        self.media_url = media_url
+        self.table_latency_ms = table_latency_ms
+        self.blob_latency_ms = blob_latency_ms
+        self._tables = {}
+        self._containers = {}
+
+    def get_table_client(self, table_name):
+        with self._lock:
+            client = self._tables.get(table_name)
+            if client is None:
+                client = self._tables[table_name] = MemoryTableClient(table_name, latency_ms=self.table_latency_ms)
+            return client
+
+    def get_container_client(self, container_name):
+        with self._lock:
+            client = self._containers.get(container_name)
+            if client is None:
+                client = self._containers[container_name] = MemoryContainerClient(
+                    container_name, f"{self.media_url}{container_name}", latency_ms=self.blob_latency_ms,
+                )
+            return client
+
+    def open_blob(self, container_name, blob_name):
+        return self.get_container_client(container_name).open_blob(blob_name)
+
+
+BACKENDS = {
+    'azure': AzureStorageBackend,
+    'local': LocalStorageBackend,
+    'memory': MemoryStorageBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def make_storage_backend(name):
+    """Create the backend named by a TRIPS_STORAGE_BACKEND value
+
+    Raises:
+        ImproperlyConfigured: For an unknown name or a class that is not a StorageBackend
+    """
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+
+    media_url = getattr(settings, 'TRIPS_STORAGE_MEDIA_URL', DEFAULT_MEDIA_URL)
+    if name == 'azure':
+        return AzureStorageBackend(getattr(settings, 'AZURE_STORAGE_CONNECTION_STRING', None))
+    if name == 'local':
+        directory = getattr(settings, 'TRIPS_LOCAL_STORAGE_DIR', None) or os.path.join(settings.BASE_DIR, 'local_storage')
+        return LocalStorageBackend(directory, media_url=media_url)
+    if name == 'memory':
+        return MemoryStorageBackend(media_url=media_url)
+
+    try:
+        backend_class = import_string(name)
+    except ImportError:
+        raise ImproperlyConfigured(
+            f"Unknown TRIPS_STORAGE_BACKEND {name!r}: use {', '.join(BACKENDS)} or the dotted path of a StorageBackend"
+        )
+    if not (isinstance(backend_class, type) and issubclass(backend_class, StorageBackend)):
+        raise ImproperlyConfigured(f"TRIPS_STORAGE_BACKEND {name!r} is not a StorageBackend subclass")
+    return backend_class()
+
+
+def get_storage_backend():
+    """Get the backend selected by TRIPS_STORAGE_BACKEND, creating it on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                from django.conf import settings
+                _backend = make_storage_backend(getattr(settings, 'TRIPS_STORAGE_BACKEND', 'azure'))
+                logger.info(f"Using the {_backend.describe()} storage backend")
+    return _backend
@@ -1,3 +1,842 @@
-from django.test import TestCase
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from . import views
+from .azure_service import (
+    AzureTableService, TRIP_CHANGED, decode_cursor, encode_cursor, latest_trips, page_offset, table_page, table_token,
+)
+from .blob_service import AzureBlobService
+from .catalog_cache import ListingIndexCache, TripCatalogCache
+from .forms import TripEditForm
+from .local_storage import MemoryTableClient, SqliteTableClient, _key_bounds, compile_filter
+from .partitions import PARTITION_PREFIX, TRIPS_PARTITION, make_trip_partitions
+from .trip_record import summaries_from_entities
+from .trip_transfer import ImportCheckpoint, _Watermark, import_entities, read_entities
+from .row_keys import is_legacy, is_newest_first, new_row_key, rekeyed_row_key, row_key_created
+from .models import Trip
+from .storage_backends import MemoryStorageBackend
+from .trip_facets import UIAA_GRADES, FacetIndex, parse_selection, selection_query
+from .trip_index import index_changes, rebuild_index as rebuild_trip_index
+from .trip_mirror import TripMirror
+from .trip_pages import form_value, trip_edit_initial, trip_form_values
+from .trip_search import build_match_query, rebuild_index, search
+
+
+@override_settings(TRIPS_STORAGE_BACKEND='memory', TRIP_CATALOG_CACHE_ENABLED=False, TRIP_MIRROR_ENABLED=False)
+class MemoryStorageTestCase(TestCase):
+    """Runs each test against fresh in-memory table and blob services"""
+
+    def setUp(self):
+        self.storage = MemoryStorageBackend()
+        self.service = AzureTableService(table_name='Trips', storage=self.storage)
+        self.blob_service = AzureBlobService(table_service=self.service, storage=self.storage)
+        for name, value in (('_data_service', self.service), ('_blob_service', self.blob_service)):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_trip(self, title='Ridge walk'):
+        success, message, row_key = self.service.create_trip({'title': title, 'participants': 'Ann'})
+        self.assertTrue(success, message)
+        return row_key
+
+    def seed_trips(self, count, **properties):
+        """Write trips created a day apart straight to the table; 'Trip 0' is the oldest
+
+        Returns:
+            list: The titles, newest first
+        """
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for number in range(count):
+            self.service.get_table_client().create_entity({
+                'PartitionKey': TRIPS_PARTITION,
+                'RowKey': new_row_key(start + timedelta(days=number)),
+                'Title': f"Trip {number}",
+                **{name: value(number) if callable(value) else value for name, value in properties.items()},
+            })
+        return [f"Trip {number}" for number in reversed(range(count))]
+
+    def read_entity(self, partition, row_key):
+        return self.service.get_table_client().get_entity(partition_key=partition, row_key=row_key)
+
+    def assert_missing(self, partition, row_key):
+        entities = self.service.get_table_client().query_entities(
+            "PartitionKey eq @partition and RowKey eq @row_key",
+            parameters={'partition': partition, 'row_key': row_key},
+        )
+        self.assertEqual(list(entities), [])
+
+    def photo_names(self, row_key):
+        return self.service._manifest_of(self.service.get_trip_entity(row_key)).names
+
+    def add_photo(self, row_key, name='a.jpg'):
+        """Record a photo in the trip's manifest, as a finalized direct upload does"""
+        success, manifest = self.service.update_photo_manifest(
+            row_key,
+            lambda manifest: manifest.photos.append({'name': f"{row_key}/{name}", 'size': 1, 'order': 0}),
+        )
+        self.assertTrue(success, manifest)
+
+
+class TripEditConflictTests(MemoryStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.row_key = self.create_trip()
+
+    def open_form(self):
+        """The values the edit form posts back unchanged, as it was rendered now"""
+        trip = self.service.get_trip_by_id(self.row_key)
+        initial = trip_edit_initial(trip)
+        data = {name: form_value(value) for name, value in trip_form_values(trip).items()}
+        data.update(etag=initial['etag'], original=initial['original'])
+        return data
+
+    def save(self, data):
+        return self.client.post(reverse('trips:trip_edit', args=[self.row_key]), data)
+
+    def test_edit_page_without_sas_urls_uploads_through_the_form(self):
+        response = self.client.get(reverse('trips:trip_edit', args=[self.row_key]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['direct_uploads'])
+
+    def test_edit_saves(self):
+        data = self.open_form()
+        data['title'] = 'Ridge walk in fog'
+
+        response = self.save(data)
+
+        self.assertRedirects(response, reverse('trips:trip_detail', args=[self.row_key]), fetch_redirect_response=False)
+        self.assertEqual(self.service.get_trip_by_id(self.row_key).title, 'Ridge walk in fog')
+
+    def test_edit_and_upload_in_one_save_succeeds(self):
+        data = self.open_form()
+        data['title'] = 'Ridge walk in fog'
+        # The form's direct uploads are finalized before it is submitted
+        self.add_photo(self.row_key)
+
+        response = self.save(data)
+
+        self.assertRedirects(response, reverse('trips:trip_detail', args=[self.row_key]), fetch_redirect_response=False)
+        trip = self.service.get_trip_by_id(self.row_key)
+        self.assertEqual(trip.title, 'Ridge walk in fog')
+        self.assertEqual(self.photo_names(self.row_key), [f"{self.row_key}/a.jpg"])
+
+    def test_save_over_another_edit_is_a_conflict(self):
+        data = self.open_form()
+        data['title'] = 'Ridge walk in fog'
+        other = self.open_form()
+        success, message = self.service.update_trip(
+            self.row_key, {'title': 'Ridge walk in rain'}, etag=other['etag'],
+        )
+        self.assertTrue(success, message)
+
+        response = self.save(data)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertTemplateUsed(response, 'trips/edit_conflict.html')
+        self.assertEqual(self.service.get_trip_by_id(self.row_key).title, 'Ridge walk in rain')
+
+    def test_service_rejects_a_stale_etag(self):
+        etag = self.open_form()['etag']
+        self.add_photo(self.row_key)
+
+        success, message = self.service.update_trip(self.row_key, {'title': 'Ridge walk in fog'}, etag=etag)
+
+        self.assertFalse(success)
+        self.assertEqual(message, TRIP_CHANGED)
+
+
+
+
+class TripCatalogCacheTests(MemoryStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.row_keys = [self.create_trip(f"Trip {number}") for number in range(3)]
+        self.service.catalog = TripCatalogCache(refresh_interval=0)
+
+    def titles(self):
+        return sorted(trip.title for trip in self.service.get_all_trips())
+
+    def test_full_refresh_loads_every_trip(self):
+        self.assertEqual(self.titles(), ['Trip 0', 'Trip 1', 'Trip 2'])
+        self.assertEqual(self.service.catalog.get_etag(self.row_keys[0]), self.service.get_trip_entity(self.row_keys[0]).metadata['etag'])
+
+    def test_delta_refresh_picks_up_other_workers_writes(self):
+        self.titles()
+        version = self.service.catalog.version
+        # Straight to the table, as another worker would
+        self.service.get_table_client().update_entity({'PartitionKey': TRIPS_PARTITION, 'RowKey': self.row_keys[1], 'Title': 'Renamed'})
+
+        self.assertEqual(self.titles(), ['Renamed', 'Trip 0', 'Trip 2'])
+        self.assertNotEqual(self.service.catalog.version, version)
+
+    def test_deletes_elsewhere_wait_for_a_full_refresh(self):
+        self.titles()
+        self.service.get_table_client().delete_entity(partition_key=TRIPS_PARTITION, row_key=self.row_keys[0])
+
+        self.assertEqual(self.titles(), ['Trip 0', 'Trip 1', 'Trip 2'])
+        self.service.catalog.invalidate()
+        self.assertEqual(self.titles(), ['Trip 1', 'Trip 2'])
+
+    def test_version_follows_the_trips(self):
+        self.titles()
+        version = self.service.catalog.version
+        self.titles()
+        self.assertEqual(self.service.catalog.version, version)
+
+        other = TripCatalogCache()
+        other.refresh(self.service._query_trip_entities, self.service._map_list_entity)
+        self.assertEqual(other.version, version)
+
+    def test_local_writes_change_the_version(self):
+        self.titles()
+        catalog = self.service.catalog
+        version = catalog.version
+        trip, etag = catalog.get(self.row_keys[0]), catalog.get_etag(self.row_keys[0])
+
+        catalog.put(trip, etag='W/"other"')
+        self.assertNotEqual(catalog.version, version)
+        catalog.remove(self.row_keys[0])
+        self.assertEqual(len(catalog.get_trips()), 2)
+        catalog.put(trip, etag=etag)
+        self.assertEqual(catalog.version, version)
+
+    def test_own_edits_are_written_through(self):
+        self.titles()
+        version = self.service.catalog.version
+
+        success, message = self.service.update_trip(self.row_keys[2], {'title': 'Edited'})
+
+        self.assertTrue(success, message)
+        self.assertNotEqual(self.service.catalog.version, version)
+        self.assertEqual(self.service.get_cached_trip(self.row_keys[2]).title, 'Edited')
+
+
+class TripPagingTests(MemoryStorageTestCase):
+    def read_pages(self, page_size, trip_filter=None):
+        pages = []
+        cursor = None
+        while True:
+            trips, cursor = self.service.get_trips_page(page_size, cursor, trip_filter)
+            pages.append([trip.title for trip in trips])
+            if cursor is None:
+                return pages
+            self.assertLess(len(pages), 20, 'paging does not end')
+
+    def test_cursors_page_through_the_table(self):
+        titles = self.seed_trips(7)
+
+        pages = self.read_pages(3)
+
+        self.assertEqual(pages, [titles[0:3], titles[3:6], titles[6:7]])
+
+    def test_filtered_pages_cover_every_match(self):
+        self.seed_trips(7, TripCompletedOn=lambda number: '2024-06-01' if number % 2 else '')
+
+        pages = self.read_pages(2, 'completed')
+
+        self.assertEqual([title for page in pages for title in page], ['Trip 5', 'Trip 3', 'Trip 1'])
+
+    def test_catalog_pages_slice_the_cached_listing(self):
+        titles = self.seed_trips(5)
+        self.service.catalog = TripCatalogCache()
+
+        pages = self.read_pages(2)
+
+        self.assertEqual(pages, [titles[0:2], titles[2:4], titles[4:5]])
+        self.assertEqual(decode_cursor(self.service.get_trips_page(2)[1]), {'offset': 2})
+
+    def test_bad_cursors_restart_the_listing(self):
+        titles = self.seed_trips(3)
+
+        for cursor in ('not a cursor', encode_cursor({'offset': 2})):
+            trips, _ = self.service.get_trips_page(2, cursor)
+            self.assertEqual([trip.title for trip in trips], titles[0:2])
+
+
+class HttpCachingTests(MemoryStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.row_key = self.create_trip()
+        self.service.catalog = TripCatalogCache()
+
+    def test_detail_page_is_not_modified_while_the_trip_is_unchanged(self):
+        url = reverse('trips:trip_detail', args=[self.row_key])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('max-age=', response.headers['Cache-Control'])
+
+    def test_an_edit_changes_the_detail_page_etag(self):
+        url = reverse('trips:trip_detail', args=[self.row_key])
+        etag = self.client.get(url).headers['ETag']
+        self.service.update_trip(self.row_key, {'title': 'Edited'})
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_index_is_not_modified_until_the_catalog_changes(self):
+        url = reverse('trips:index')
+        etag = self.client.get(url).headers['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.create_trip('Another trip')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_signed_in_users_always_get_the_page(self):
+        url = reverse('trips:trip_detail', args=[self.row_key])
+        etag = self.client.get(url).headers['ETag']
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+
+class TripFacetTests(MemoryStorageTestCase):
+    GRADES = ['III+', 'IV-', 'IV', 'IV+', 'V-', 'V', 'V+']
+
+    def index(self):
+        entities = [
+            {
+                'RowKey': f"trip_{number}",
+                'Title': grade,
+                'UiaaGrade': grade,
+                'TripClass': 'Climb' if number % 2 else 'Trail',
+                'TripCompletedOn': '2024-06-01' if number < 4 else '',
+            }
+            for number, grade in enumerate(self.GRADES)
+        ]
+        return FacetIndex(summaries_from_entities(entities))
+
+    def test_grades_follow_the_edit_form(self):
+        self.assertEqual(UIAA_GRADES, [value for value, _ in TripEditForm.UIAA_GRADE_CHOICES if value])
+        self.assertLess(UIAA_GRADES.index('IV+'), UIAA_GRADES.index('V-'))
+
+    def test_grade_ranges_cover_the_grades_between(self):
+        selection = parse_selection({'uiaa_min': 'IV-', 'uiaa_max': 'V-'})
+        trips, _, _ = self.index().query(selection)
+
+        self.assertEqual([trip.title for trip in trips], ['IV-', 'IV', 'IV+', 'V-'])
+        self.assertEqual(parse_selection({'uiaa_min': 'V-', 'uiaa_max': 'IV-'}), selection)
+        self.assertEqual(selection_query(selection), 'uiaa_min=IV-&uiaa_max=V-')
+
+    def test_open_ranges_and_unknown_values(self):
+        self.assertEqual(parse_selection({'uiaa_min': 'V'})['uiaa'], (UIAA_GRADES.index('V'), len(UIAA_GRADES) - 1))
+        self.assertEqual(parse_selection({'uiaa_min': '5c', 'class': 'Bike', 'year': 'last', 'filter': 'x'}), {})
+
+    def test_counts_ignore_the_facets_own_selection(self):
+        trips, has_more, counts = self.index().query({'class': 'Climb', 'status': 'completed'}, limit=1)
+
+        self.assertEqual([trip.title for trip in trips], ['IV-'])
+        self.assertTrue(has_more)
+        self.assertEqual(counts['class'], {'Climb': 2, 'Trail': 2})
+        self.assertEqual(counts['status'], {'completed': 2, 'future': 1})
+        uiaa = {UIAA_GRADES[rank]: count for rank, count in counts['uiaa'].items() if count}
+        self.assertEqual(uiaa, {'IV-': 1, 'IV+': 1})
+
+    def test_service_pages_follow_the_listing_version(self):
+        self.service.catalog = TripCatalogCache()
+        self.service.facets = ListingIndexCache(FacetIndex)
+        self.seed_trips(3, UiaaGrade=lambda number: self.GRADES[number])
+
+        trips, cursor, counts = self.service.get_faceted_page(parse_selection({'uiaa_min': 'IV-'}), page_size=1)
+        self.assertEqual([trip.title for trip in trips], ['Trip 2'])
+        self.assertEqual(sum(counts['status'].values()), 2)
+
+        trips, cursor, _ = self.service.get_faceted_page(parse_selection({'uiaa_min': 'IV-'}), page_size=1, cursor=cursor)
+        self.assertEqual([trip.title for trip in trips], ['Trip 1'])
+        self.assertIsNone(cursor)
+
+        self.create_trip('New trip')
+        _, _, counts = self.service.get_faceted_page({})
+        self.assertEqual(counts['status'], {'future': 4})
+
+
+class TripImportTests(MemoryStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.source = os.path.join(directory.name, 'trips.jsonl')
+        lines = [json.dumps({'RowKey': f"trip_{number:02d}", 'Title': f"Trip {number}"}) for number in range(1, 11)]
+        lines[3] = '{not json'
+        with open(self.source, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.checkpoint = ImportCheckpoint(f"{self.source}.progress.json", self.source)
+
+    def stored_titles(self):
+        return sorted(entity['Title'] for entity in self.service.get_table_client().list_entities())
+
+    def records(self):
+        with open(self.source, encoding='utf-8') as f:
+            return list(read_entities(f, 'jsonl'))
+
+    def failing_after(self, batches):
+        """submit_batch that fails once this many batches went through"""
+        submit_batch = self.service.submit_batch
+        calls = []
+
+        def submit(operations):
+            calls.append(operations)
+            if len(calls) > batches:
+                return False, 'service unavailable'
+            return submit_batch(operations)
+        return submit
+
+    def test_watermark_waits_for_the_lowest_record(self):
+        watermark = _Watermark(1)
+        watermark.done([3, 4])
+        self.assertEqual(watermark.next_record, 1)
+        watermark.done([1])
+        self.assertEqual(watermark.next_record, 2)
+        watermark.done([2])
+        self.assertEqual(watermark.next_record, 5)
+
+    def test_failed_import_resumes_at_the_checkpoint(self):
+        with mock.patch.object(self.service, 'submit_batch', self.failing_after(2)):
+            result = import_entities(self.service, self.records(), batch_size=3, concurrency=1, retries=0, checkpoint=self.checkpoint)
+
+        self.assertEqual(result.error, 'service unavailable')
+        self.assertEqual(result.invalid[0][0], 4)
+        # Records 1-3 and 5-7 are written; record 4 was unreadable
+        self.assertEqual(result.next_record, 8)
+        self.assertEqual(self.checkpoint.load(), 8)
+
+        result = import_entities(self.service, self.records(), batch_size=3, concurrency=1,
+                                 start_record=self.checkpoint.load(), checkpoint=self.checkpoint)
+
+        self.assertIsNone(result.error)
+        self.assertEqual(result.imported, 3)
+        self.assertEqual(result.next_record, 11)
+        self.assertEqual(self.stored_titles(), sorted(f"Trip {number}" for number in range(1, 11) if number != 4))
+
+    def test_checkpoints_belong_to_their_input(self):
+        self.checkpoint.save(import_entities(self.service, [], start_record=5))
+
+        self.assertEqual(self.checkpoint.load(), 5)
+        with self.assertRaises(ValueError):
+            ImportCheckpoint(self.checkpoint.path, 'other.jsonl').load()
+        self.checkpoint.clear()
+        self.assertEqual(self.checkpoint.load(), 1)
+
+    def test_command_resumes(self):
+        with mock.patch.object(self.service, 'submit_batch', self.failing_after(1)):
+            with self.assertRaises(CommandError):
+                call_command('import_trips', self.source, batch_size=3, concurrency=1, retries=0, stdout=io.StringIO())
+        # Record 4 is unreadable, so it counts as done
+        self.assertEqual(self.checkpoint.load(), 5)
+
+        output = io.StringIO()
+        call_command('import_trips', self.source, resume=True, stdout=output)
+
+        self.assertIn('Resuming at record 5', output.getvalue())
+        self.assertEqual(len(self.stored_titles()), 9)
+        self.assertFalse(os.path.exists(self.checkpoint.path))
+
+
+class TripIndexTests(MemoryStorageTestCase):
+    def index_keys(self):
+        return sorted((entity['PartitionKey'], entity['RowKey']) for entity in self.service.get_index_table_client().list_entities())
+
+    def test_index_changes(self):
+        old = {'TripClass': 'Skialp', 'Participants': 'Ann, Bob', 'TripCompletedOn': '2024-05-03'}
+
+        upserts, deletes = index_changes('t', None, old)
+        self.assertEqual(sorted((entity['PartitionKey'], entity['RowKey']) for entity in upserts), [
+            ('class-skialp', 't'), ('completed-2024', '2024-05-03_t'), ('participant-ann', 't'), ('participant-bob', 't'),
+        ])
+        self.assertEqual(deletes, [])
+
+        upserts, deletes = index_changes('t', old, dict(old, Participants='Ann, Cyril', Title='Renamed'))
+        self.assertEqual([(entity['PartitionKey'], entity['RowKey']) for entity in upserts], [('participant-cyril', 't')])
+        self.assertEqual(deletes, [('participant-bob', 't')])
+
+        self.assertEqual(index_changes('t', old, dict(old, Title='Renamed')), ([], []))
+        self.assertEqual(len(index_changes('t', old, None)[1]), 4)
+
+    def test_trip_writes_keep_the_index_current(self):
+        success, message, row_key = self.service.create_trip({'title': 'Ridge', 'trip_class': 'Skialp', 'participants': 'Ann'})
+        self.assertTrue(success, message)
+        self.assertEqual(self.index_keys(), [('class-skialp', row_key), ('participant-ann', row_key)])
+
+        success, message = self.service.update_trip(row_key, {'trip_class': 'Climb'})
+        self.assertTrue(success, message)
+        self.assertEqual(self.index_keys(), [('class-climb', row_key), ('participant-ann', row_key)])
+        trips, _ = self.service.get_indexed_page({'class': 'Climb'})
+        self.assertEqual([trip.row_key for trip in trips], [row_key])
+
+        success, message = self.service.delete_trip(row_key)
+        self.assertTrue(success, message)
+        self.assertEqual(self.index_keys(), [])
+
+    def test_rebuild_converges(self):
+        row_keys = [
+            self.service.create_trip({'title': f"Trip {number}", 'trip_class': 'Skialp', 'participants': 'Ann'})[2]
+            for number in range(3)
+        ]
+        expected = self.index_keys()
+        index_client = self.service.get_index_table_client()
+        index_client.delete_entity(partition_key='class-skialp', row_key=row_keys[0])
+        index_client.upsert_entity({'PartitionKey': 'class-climb', 'RowKey': row_keys[1], 'TripRowKey': row_keys[1], 'Value': 'Climb'})
+        index_client.upsert_entity({'PartitionKey': 'participant-ann', 'RowKey': row_keys[2], 'TripRowKey': row_keys[2], 'Value': 'Someone'})
+
+        self.assertEqual(rebuild_trip_index(self.service, dry_run=True).written, 2)
+        result = rebuild_trip_index(self.service)
+
+        self.assertEqual((result.trips, result.written, result.deleted), (3, 2, 1))
+        self.assertEqual(self.index_keys(), expected)
+        result = rebuild_trip_index(self.service)
+        self.assertEqual((result.written, result.deleted, result.unchanged), (0, 0, len(expected)))
+
+class TripMirrorTests(MemoryStorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.row_key = self.create_trip()
+        self.service.mirror = TripMirror('Trips')
+        success, message = self.service.sync_mirror(full=True)
+        self.assertTrue(success, message)
+
+    def test_trip_version_comes_from_the_mirror(self):
+        self.assertEqual(self.service.get_trip_version(self.row_key), self.service.get_trip_entity(self.row_key).metadata['etag'])
+
+    def test_missing_trip_without_the_catalog(self):
+        self.assertIsNone(self.service.catalog)
+        self.assertIsNone(self.service.get_trip_version('trip_missing'))
+
+        response = self.client.get(reverse('trips:trip_detail', args=['trip_missing']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'trips/not_found.html')
+
+
+class TripSearchTests(TestCase):
+    def add_trip(self, row_key, title, **fields):
+        return Trip.objects.create(partition_key=TRIPS_PARTITION, row_key=row_key, title=title, **fields)
+
+    def found(self, text):
+        return [trip.row_key for trip, _, _ in search(text, 10)[0]]
+
+    def test_writes_keep_the_index_current(self):
+        trip = self.add_trip('a', 'Ridge walk')
+        self.assertEqual(self.found('ridge'), ['a'])
+
+        trip.title = 'Gully climb'
+        trip.save()
+        self.assertEqual(self.found('ridge'), [])
+        self.assertEqual(self.found('gully'), ['a'])
+
+        trip.delete()
+        self.assertEqual(self.found('gully'), [])
+
+    def test_title_matches_rank_first(self):
+        self.add_trip('a', 'Gully climb', description='Back down over the ridge')
+        self.add_trip('b', 'Ridge walk')
+        self.add_trip('c', 'Lake swim', location='Ridge hut')
+
+        self.assertEqual(self.found('ridge'), ['b', 'c', 'a'])
+
+    def test_last_word_matches_as_a_prefix_and_diacritics_are_ignored(self):
+        self.add_trip('a', 'Sněžka traverse', participants='Ann, Bob')
+
+        self.assertEqual(self.found('snezka tra'), ['a'])
+        self.assertEqual(self.found('ann'), ['a'])
+        self.assertEqual(self.found('tra snezka'), [])
+
+    def test_matches_are_marked_in_escaped_html(self):
+        self.add_trip('a', 'Ridge <b>walk</b>', description='A long day on the ridge above the valley')
+
+        (_, title, _), = search('ridge', 10)[0]
+        self.assertEqual(title, '<mark>Ridge</mark> &lt;b&gt;walk&lt;/b&gt;')
+
+        (_, title, snippet), = search('valley', 10)[0]
+        self.assertEqual(title, 'Ridge &lt;b&gt;walk&lt;/b&gt;')
+        self.assertIn('the <mark>valley</mark>', snippet)
+
+    def test_query_syntax_is_never_interpreted(self):
+        self.assertEqual(build_match_query('ridge OR "gully" -lake'), '"ridge" "OR" "gully" "lake"*')
+        self.assertIsNone(build_match_query(' -- '))
+
+    def test_paging_and_rebuild(self):
+        for number in range(3):
+            self.add_trip(f"t{number}", f"Ridge walk {number}")
+        self.assertTrue(search('ridge', 2)[1])
+        self.assertFalse(search('ridge', 2, offset=2)[1])
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM trips_trip_fts")
+        self.assertEqual(self.found('ridge'), [])
+        rebuild_index()
+        self.assertEqual(sorted(self.found('ridge')), ['t0', 't1', 't2'])
+
+class ListingPageTests(SimpleTestCase):
+    def test_table_pages(self):
+        trips = summaries_from_entities([{'RowKey': 'a', 'TripCompletedOn': '2024-01-01'}, {'RowKey': 'b'}])
+        completed = lambda trip: bool(trip.trip_completed_on)
+
+        self.assertIsNone(table_page([], {'nextrk': 'b'}))
+        self.assertIsNone(table_page(trips[1:], {'nextrk': 'c'}, completed))
+        self.assertEqual(table_page([], None), ([], None))
+        page, cursor = table_page(trips, {'nextrk': 'c'}, completed)
+        self.assertEqual(([trip.row_key for trip in page], decode_cursor(cursor)), (['a'], {'nextrk': 'c'}))
+
+    def test_offset_cursors(self):
+        self.assertEqual(page_offset({'offset': 40}), 40)
+        self.assertEqual(page_offset({'offset': -1}), 0)
+        self.assertEqual(page_offset({'nextrk': 'b'}), 0)
+        self.assertIsNone(table_token({'offset': 40}))
+        self.assertEqual(table_token({'nextrk': 'b'}), {'nextrk': 'b'})
+
+    def test_latest_trips_need_newest_first_keys(self):
+        newest_first = [new_row_key(datetime(2024, 1, day, tzinfo=timezone.utc)) for day in (1, 3, 2)]
+        trips = summaries_from_entities({'RowKey': row_key} for row_key in newest_first)
+
+        self.assertEqual([trip.row_key for trip in latest_trips(trips, 2)], sorted(newest_first)[:2])
+        self.assertIsNone(latest_trips(trips + summaries_from_entities([{'RowKey': 'legacy1'}]), 2))
+
+
+class RowKeyTests(SimpleTestCase):
+    def test_newer_trips_sort_first(self):
+        created = datetime(2024, 5, 3, 12, 0, tzinfo=timezone.utc)
+        keys = [new_row_key(created + timedelta(microseconds=step)) for step in (0, 1, 86400 * 10 ** 6)]
+
+        self.assertEqual(sorted(keys), keys[::-1])
+
+    def test_creation_time_round_trips(self):
+        created = datetime(2024, 5, 3, 12, 0, 0, 123456, tzinfo=timezone.utc)
+        row_key = new_row_key(created)
+
+        self.assertTrue(is_newest_first(row_key))
+        self.assertEqual(row_key_created(row_key), created)
+
+    def test_legacy_keys_rekey_to_the_same_key(self):
+        self.assertTrue(is_legacy('trip_20240503120000'))
+        new_key = rekeyed_row_key('trip_20240503120000')
+
+        self.assertEqual(new_key, rekeyed_row_key('trip_20240503120000'))
+        self.assertEqual(row_key_created(new_key), datetime(2024, 5, 3, 12, 0, tzinfo=timezone.utc))
+        self.assertIsNone(rekeyed_row_key('trip_unknown'))
+
+
+class TripRekeyTests(MemoryStorageTestCase):
+    def test_latest_trips_are_the_first_keys(self):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for day in (3, 1, 2):
+            row_key = new_row_key(start + timedelta(days=day))
+            self.service.get_table_client().create_entity(
+                {'PartitionKey': TRIPS_PARTITION, 'RowKey': row_key, 'Title': f"Day {day}"},
+            )
+
+        self.assertEqual([trip.title for trip in self.service.get_latest_trips(2)], ['Day 3', 'Day 2'])
+
+    def test_rekey_moves_the_trip(self):
+        row_key = self.create_trip()
+        entity = self.read_entity(TRIPS_PARTITION, row_key)
+
+        success, rekeyed = self.service.rekey_trip(entity, 'new-key')
+
+        self.assertTrue(success, rekeyed)
+        self.assertEqual(self.read_entity(TRIPS_PARTITION, 'new-key')['PreviousRowKey'], row_key)
+        self.assert_missing(TRIPS_PARTITION, row_key)
+
+    def test_rekey_leaves_a_trip_edited_meanwhile(self):
+        row_key = self.create_trip()
+        entity = self.read_entity(TRIPS_PARTITION, row_key)
+        self.add_photo(row_key)
+
+        success, message = self.service.rekey_trip(entity, 'new-key')
+
+        self.assertFalse(success)
+        self.assertEqual(self.photo_names(row_key), [f"{row_key}/a.jpg"])
+        self.assert_missing(TRIPS_PARTITION, 'new-key')
+
+
+class PartitionTests(SimpleTestCase):
+    row_key = new_row_key(datetime(2021, 6, 1, tzinfo=timezone.utc))
+
+    def test_single_puts_every_trip_in_one_partition(self):
+        partitions = make_trip_partitions('single')
+
+        self.assertEqual(partitions.partition_of(self.row_key), TRIPS_PARTITION)
+        self.assertEqual(partitions.partitions(), [TRIPS_PARTITION])
+        self.assertEqual(partitions.scan_query(), ('PartitionKey eq @pk', {'pk': TRIPS_PARTITION}))
+
+    def test_year_follows_the_creation_time(self):
+        partitions = make_trip_partitions('year', 'year', first_year=2020)
+
+        self.assertEqual(partitions.partition_of(self.row_key), 'Trips-2021')
+        self.assertEqual(partitions.partition_of(new_row_key(datetime(2010, 1, 1))), 'Trips-2020')
+        self.assertEqual(partitions.partition_of('trip_unknown'), TRIPS_PARTITION)
+        self.assertEqual(partitions.partitions()[:3], [TRIPS_PARTITION, 'Trips-2020', 'Trips-2021'])
+
+    def test_hash_spreads_over_the_buckets(self):
+        partitions = make_trip_partitions('hash:4', 'hash:4')
+        keys = [new_row_key() for _ in range(200)]
+
+        self.assertEqual(partitions.partitions(), ['Trips-0', 'Trips-1', 'Trips-2', 'Trips-3'])
+        self.assertEqual({partitions.partition_of(key) for key in keys}, set(partitions.partitions()))
+        self.assertEqual(partitions.partition_of(keys[0]), partitions.partition_of(keys[0]))
+
+    def test_a_move_scans_both_schemes(self):
+        partitions = make_trip_partitions('hash:2')
+
+        self.assertEqual(partitions.partitions(), ['Trips-0', 'Trips-1', TRIPS_PARTITION])
+        self.assertEqual(partitions.locations(self.row_key)[-1], TRIPS_PARTITION)
+        self.assertEqual(
+            partitions.scan_query('Title eq @title', {'title': 'A'}),
+            ('PartitionKey ge @pk_first and PartitionKey le @pk_last and Title eq @title',
+             {'title': 'A', 'pk_first': TRIPS_PARTITION, 'pk_last': 'Trips-1'}),
+        )
+
+    def test_bad_schemes_are_rejected(self):
+        for scheme in ('month', 'year:4', 'hash:x', 'hash:0'):
+            with self.assertRaises(ImproperlyConfigured):
+                make_trip_partitions(scheme)
+
+
+class TripPartitionMoveTests(MemoryStorageTestCase):
+    def test_trips_are_listed_from_every_partition(self):
+        self.service.partitions = make_trip_partitions('hash:4', 'hash:4')
+        titles = {f"Trip {number}" for number in range(12)}
+        for title in titles:
+            self.create_trip(title)
+
+        self.assertEqual({trip.title for trip in self.service.get_all_trips()}, titles)
+
+    def test_partition_move_moves_the_trip(self):
+        row_key = self.create_trip()
+        entity = self.read_entity(TRIPS_PARTITION, row_key)
+        self.service.partitions = make_trip_partitions('year', 'single')
+        partition = self.service.partitions.partition_of(row_key)
+        self.assertTrue(partition.startswith(PARTITION_PREFIX))
+
+        success, moved_to = self.service.move_trip_partition(entity)
+
+        self.assertTrue(success, moved_to)
+        self.assertEqual(moved_to, partition)
+        self.assertEqual(self.read_entity(partition, row_key)['Title'], 'Ridge walk')
+        self.assert_missing(TRIPS_PARTITION, row_key)
+
+    def test_partition_move_leaves_a_trip_edited_meanwhile(self):
+        row_key = self.create_trip()
+        entity = self.read_entity(TRIPS_PARTITION, row_key)
+        self.add_photo(row_key)
+        self.service.partitions = make_trip_partitions('year', 'single')
+        partition = self.service.partitions.partition_of(row_key)
+
+        success, message = self.service.move_trip_partition(entity)
+
+        self.assertFalse(success)
+        self.assertEqual(self.read_entity(TRIPS_PARTITION, row_key)['Title'], 'Ridge walk')
+        self.assert_missing(partition, row_key)
+
+
+
+class TableFilterTests(SimpleTestCase):
+    def test_literals_and_parameters(self):
+        clauses, _ = compile_filter(
+            "PartitionKey eq 'It''s' and Count ge 2 and Length lt 1.5 and Done eq true "
+            "and Timestamp gt datetime'2024-01-01T00:00:00Z' and RowKey le @key",
+            {'key': 'b'},
+        )
+
+        self.assertEqual(clauses, [
+            ('PartitionKey', 'eq', "It's"),
+            ('Count', 'ge', 2),
+            ('Length', 'lt', 1.5),
+            ('Done', 'eq', True),
+            ('Timestamp', 'gt', datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            ('RowKey', 'le', 'b'),
+        ])
+
+    def test_unsupported_filters_are_rejected(self):
+        for query_filter, parameters in (("Title eq 'a' or Title eq 'b'", None), ("not Done", None), ("RowKey eq @key", {})):
+            with self.assertRaises(ValueError):
+                compile_filter(query_filter, parameters)
+
+    def test_predicate(self):
+        _, predicate = compile_filter("Count gt 2 and Timestamp ge @since", {'since': datetime(2024, 1, 1, tzinfo=timezone.utc)})
+        later = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+        self.assertTrue(predicate({'Count': 3}, later))
+        self.assertFalse(predicate({'Count': 2}, later))
+        self.assertFalse(predicate({'Count': 3}, datetime(2023, 6, 1, tzinfo=timezone.utc)))
+        # Missing and incomparable properties never match
+        self.assertFalse(predicate({}, later))
+        self.assertFalse(predicate({'Count': 'many'}, later))
+
+    def test_key_bounds(self):
+        def bounds(query_filter):
+            return _key_bounds(compile_filter(query_filter)[0])
+
+        self.assertEqual(bounds("PartitionKey eq 'T' and RowKey eq 'b'"), ('T', 'b', 'b'))
+        self.assertEqual(bounds("RowKey ge 'b' and RowKey gt 'c' and RowKey lt 'f' and RowKey le 'e'"), (None, 'c', 'e'))
+        self.assertEqual(bounds("PartitionKey ge 'A' and Title eq 'x'"), (None, None, None))
+
+    def test_tables_answer_alike(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        tables = [MemoryTableClient('Trips'), SqliteTableClient(os.path.join(directory.name, 'tables.sqlite3'), 'Trips')]
+        for table in tables:
+            for partition in ('A', 'B'):
+                for row_key in 'abcde':
+                    table.create_entity({'PartitionKey': partition, 'RowKey': row_key, 'Number': ord(row_key)})
+
+        filters = [
+            "RowKey eq 'c'",
+            "RowKey eq 'x'",
+            "PartitionKey eq 'A' and RowKey eq 'c'",
+            "PartitionKey eq 'B' and RowKey ge 'b' and RowKey lt 'e'",
+            "RowKey le 'b'",
+            "Number gt 99",
+        ]
+        for query_filter in filters:
+            results = [
+                [(entity['PartitionKey'], entity['RowKey']) for entity in table.query_entities(query_filter, results_per_page=2)]
+                for table in tables
+            ]
+            self.assertEqual(results[0], results[1], query_filter)
+        self.assertEqual(results[0], [('A', 'd'), ('A', 'e'), ('B', 'd'), ('B', 'e')])
+
+class SqliteTableTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'tables.sqlite3')
+        self.table = SqliteTableClient(self.path, 'Trips')
+        self.table.create_entity({'PartitionKey': 'Trips', 'RowKey': 'a', 'Title': 'A'})
+
+    def test_reads_do_not_wait_for_writers(self):
+        # Fail at once instead of waiting out the busy timeout
+        self.table._local.db.execute('PRAGMA busy_timeout = 0')
+        writer = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(writer.close)
+        writer.execute('BEGIN IMMEDIATE')
+
+        self.assertEqual(self.table.get_entity('Trips', 'a')['Title'], 'A')
+        self.assertEqual([entity['RowKey'] for entity in self.table.query_entities("PartitionKey eq 'Trips'")], ['a'])
+        writer.execute('ROLLBACK')
@@ -0,0 +1,271 @@
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; one more bucket holds everything slower
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Defaults used when the matching Django settings are not defined
+DEFAULT_SLOW_REQUEST_MS = 1000
+
+# At most this many spans go into the Server-Timing header, slowest first
+MAX_SERVER_TIMING_ENTRIES = 20
+
+# The timing of the request being served; asgiref and StorageFanout copy the
+# context, so spans from sync_to_async and fanout threads land here too
+_request_timing = contextvars.ContextVar('trips_request_timing', default=None)
+
+
+class LatencyHistogram:
+    """Bucketed latencies of one view or storage operation"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        self.buckets[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations (capped at the max)"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                bound = BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+                return round(min(bound, self.max_ms), 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self):
+        labels = [f'<={bound}' for bound in BUCKET_BOUNDS_MS] + [f'>{BUCKET_BOUNDS_MS[-1]}']
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 2) if self.count else None,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 2),
+            'buckets': {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class LatencyMetrics:
+    """Latency histograms of this worker process, per view and per storage operation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self.since = datetime.now(timezone.utc)
+
+    def observe(self, kind, name, ms):
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if histogram is None:
+                histogram = self._histograms[(kind, name)] = LatencyHistogram()
+            histogram.observe(ms)
+
+    def snapshot(self):
+        """kind -> name -> histogram summary, slowest p99 first"""
+        with self._lock:
+            summaries = [(kind, name, histogram.snapshot()) for (kind, name), histogram in self._histograms.items()]
+        result = {'since': self.since.isoformat(), 'views': {}, 'storage': {}}
+        for kind, name, summary in sorted(summaries, key=lambda item: -(item[2]['p99_ms'] or 0)):
+            result['views' if kind == 'view' else 'storage'][name] = summary
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self.since = datetime.now(timezone.utc)
+
+
+metrics = LatencyMetrics()
+
+
+class RequestTiming:
+    """Spans recorded while serving one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, ms):
+        self.spans.append((name, ms))
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self):
+        """name -> (total ms, number of calls), slowest first"""
+        totals = {}
+        for name, ms in list(self.spans):
+            total, calls = totals.get(name, (0.0, 0))
+            totals[name] = (total + ms, calls + 1)
+        return dict(sorted(totals.items(), key=lambda item: -item[1][0]))
+
+    def server_timing(self, total_ms):
+        """Server-Timing header value: the whole request, then the spans added up per operation"""
+        entries = [f'total;dur={total_ms:.1f}']
+        for name, (ms, calls) in list(self.summary().items())[:MAX_SERVER_TIMING_ENTRIES]:
+            entry = f'{name};dur={ms:.1f}'
+            if calls > 1:
+                entry += f';desc="{calls} calls"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+def _record(name, started):
+    ms = (time.perf_counter() - started) * 1000
+    metrics.observe('storage', name, ms)
+    timing = _request_timing.get()
+    if timing is not None:
+        timing.add(name, ms)
+
+
+@contextmanager
+def span(name):
+    """Time a block as a named span of the current request (and of the worker's metrics)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, started)
+
+
+def timed(name, fn):
+    """Wrap a function, coroutine function or (async) generator function in a span"""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def timed_coroutine(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _record(name, started)
+        return timed_coroutine
+
+    if inspect.isgeneratorfunction(fn):
+        # Only the time spent producing items counts, not the caller's work between them
+        @functools.wraps(fn)
+        def timed_generator(*args, **kwargs):
+            generator = fn(*args, **kwargs)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    _record(name, started)
+                    return
+                _record(name, started)
+                yield item
+        return timed_generator
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def timed_async_generator(*args, **kwargs):
+            generator = fn(*args, **kwargs)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    _record(name, started)
+                    return
+                _record(name, started)
+                yield item
+        return timed_async_generator
+
+    @functools.wraps(fn)
+    def timed_function(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _record(name, started)
+    return timed_function
+
+
+def timed_service(prefix, exclude=()):
+    """Class decorator: time every public method of a storage service as ``prefix.method``
+
+    Args:
+        prefix (str): Span name prefix, e.g. 'table'
+        exclude (tuple): Public methods that do no I/O (client getters, URL builders)
+    """
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_') or attr in exclude or not inspect.isfunction(value):
+                continue
+            setattr(cls, attr, timed(f'{prefix}.{attr}', value))
+        return cls
+    return decorate
+
+
+class RequestTimingMiddleware:
+    """Time each request, add a Server-Timing header and record per-view latencies
+
+    Put it first in MIDDLEWARE so the total covers the other middleware too.
+    Requests slower than TRIPS_SLOW_REQUEST_MS are logged with their spans.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        from django.conf import settings
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'TRIPS_SERVER_TIMING', True)
+        self.slow_request_ms = getattr(settings, 'TRIPS_SLOW_REQUEST_MS', DEFAULT_SLOW_REQUEST_MS)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = _request_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timing.reset(token)
+        return self._finish(request, response, timing)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = _request_timing.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timing.reset(token)
+        return self._finish(request, response, timing)
+
+    def _finish(self, request, response, timing):
+        total_ms = timing.elapsed_ms()
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            metrics.observe('view', match.view_name, total_ms)
+
+        if self.server_timing:
+            response['Server-Timing'] = timing.server_timing(total_ms)
+        if self.slow_request_ms and total_ms >= self.slow_request_ms:
+            spans = ', '.join(f"{name} {ms:.0f}ms x{calls}" for name, (ms, calls) in timing.summary().items())
+            logger.warning(f"Slow request {request.method} {request.path}: {total_ms:.0f}ms ({spans or 'no storage calls'})")
+        return response
@@ -0,0 +1,280 @@
+import logging
+from urllib.parse import urlencode
+
+from .forms import TripEditForm
+
+logger = logging.getLogger(__name__)
+
+
+def _grade_order(choices):
+    return [value for value, _ in choices if value]
+
+
+# Grades from easiest to hardest, in the order the edit form offers them
+UIAA_GRADES = _grade_order(TripEditForm.UIAA_GRADE_CHOICES)
+ALPINE_GRADES = _grade_order(TripEditForm.ALPINE_GRADE_CHOICES)
+FERRATA_GRADES = _grade_order(TripEditForm.FERRATA_GRADE_CHOICES)
+
+# Range facets: facet name -> (label, trip key, ordered grades)
+GRADE_FACETS = {
+    'uiaa': ('UIAA grade', 'uiaa_grade', UIAA_GRADES),
+    'alpine': ('Alpine grade', 'alpine_grade', ALPINE_GRADES),
+    'ferrata': ('Via ferrata grade', 'ferata_grade', FERRATA_GRADES),
+}
+
+TRIP_CLASS_LABELS = {value: label for value, label in TripEditForm.TRIP_CLASS_CHOICES if value}
+
+# Ascent buckets: (key, label, lowest meters_ascend in the bucket), lowest first
+ASCENT_BUCKETS = [
+    ('0-499', 'Under 500 m', 0),
+    ('500-999', '500–999 m', 500),
+    ('1000-1499', '1000–1499 m', 1000),
+    ('1500-1999', '1500–1999 m', 1500),
+    ('2000+', '2000 m and more', 2000),
+]
+ASCENT_LABELS = {key: label for key, label, _ in ASCENT_BUCKETS}
+
+# Single-choice facets: facet name -> (label, ?query parameter)
+CHOICE_FACETS = {
+    'class': ('Category', 'class'),
+    'year': ('Year', 'year'),
+    'ascent': ('Ascent', 'ascent'),
+}
+
+# The completed/future filter of the listing is a facet too, read from ?filter=
+STATUS_VALUES = ('completed', 'future')
+
+FACETS = ('status',) + tuple(CHOICE_FACETS) + tuple(GRADE_FACETS)
+
+
+def _property_value(value):
+    return getattr(value, 'value', value)
+
+
+def _trip_year(value):
+    if hasattr(value, 'year'):
+        return value.year
+    text = str(value or '')[:4]
+    return int(text) if text.isdigit() else None
+
+
+def _ascent_bucket(value):
+    try:
+        meters = int(_property_value(value))
+    except (TypeError, ValueError):
+        return None
+    bucket = None
+    for key, _, lowest in ASCENT_BUCKETS:
+        if meters >= lowest:
+            bucket = key
+    return bucket
+
+
+def facet_values(trip):
+    """Facet name -> value of one TripSummary; facets the trip has no value for are left out
+
+    Grade facets hold the grade's rank (its position in the grade order).
+    """
+    values = {
+        'status': 'completed' if trip.trip_completed_on else 'future',
+        'year': _trip_year(trip.trip_completed_on),
+        'ascent': _ascent_bucket(trip.meters_ascend),
+    }
+    if trip.trip_class in TRIP_CLASS_LABELS:
+        values['class'] = trip.trip_class
+    for facet, (_, key, grades) in GRADE_FACETS.items():
+        grade = getattr(trip, key)
+        if grade in grades:
+            values[facet] = grades.index(grade)
+    return {facet: value for facet, value in values.items() if value is not None}
+
+
+def parse_selection(params):
+    """Read the selected facets from the query parameters
+
+    Unknown values are ignored, so a stale or hand-edited URL just shows a
+    wider listing.
+
+    Returns:
+        dict: Facet name -> value, and (lowest rank, highest rank) for grade facets
+    """
+    selection = {}
+    status = params.get('filter')
+    if status in STATUS_VALUES:
+        selection['status'] = status
+
+    trip_class = params.get('class')
+    if trip_class in TRIP_CLASS_LABELS:
+        selection['class'] = trip_class
+
+    year = params.get('year', '')
+    if year.isdigit():
+        selection['year'] = int(year)
+
+    ascent = params.get('ascent')
+    if ascent in ASCENT_LABELS:
+        selection['ascent'] = ascent
+
+    for facet, (_, _, grades) in GRADE_FACETS.items():
+        lowest = params.get(f'{facet}_min')
+        highest = params.get(f'{facet}_max')
+        if lowest not in grades and highest not in grades:
+            continue
+        low = grades.index(lowest) if lowest in grades else 0
+        high = grades.index(highest) if highest in grades else len(grades) - 1
+        selection[facet] = (min(low, high), max(low, high))
+    return selection
+
+
+def selection_query(selection):
+    """Query string of the selected facets, except the completed/future filter"""
+    params = []
+    for facet, (_, param) in CHOICE_FACETS.items():
+        if facet in selection:
+            params.append((param, selection[facet]))
+    for facet, (_, _, grades) in GRADE_FACETS.items():
+        if facet in selection:
+            low, high = selection[facet]
+            params.append((f'{facet}_min', grades[low]))
+            params.append((f'{facet}_max', grades[high]))
+    return urlencode(params)
+
+
+class FacetIndex:
+    """Bitmap index of one snapshot of the trip listing.
+
+    Every trip gets a bit (its position in the listing) and every facet value
+    a mask of the trips that have it. Grade facets also keep cumulative "at
+    least" and "at most" masks, so any grade range is one AND. A filtered page
+    is the AND of the selected masks; the count of a facet value is the size
+    of its mask ANDed with the other selected facets.
+    """
+
+    def __init__(self, trips):
+        self._trips = list(trips)
+        self._all = (1 << len(self._trips)) - 1
+        self._masks = {facet: {} for facet in FACETS}
+
+        for position, trip in enumerate(self._trips):
+            bit = 1 << position
+            for facet, value in facet_values(trip).items():
+                masks = self._masks[facet]
+                masks[value] = masks.get(value, 0) | bit
+
+        self._at_least = {}
+        self._at_most = {}
+        for facet, (_, _, grades) in GRADE_FACETS.items():
+            masks = self._masks[facet]
+            at_most = []
+            mask = 0
+            for rank in range(len(grades)):
+                mask |= masks.get(rank, 0)
+                at_most.append(mask)
+            at_least = []
+            mask = 0
+            for rank in reversed(range(len(grades))):
+                mask |= masks.get(rank, 0)
+                at_least.append(mask)
+            self._at_most[facet] = at_most
+            self._at_least[facet] = at_least[::-1]
+
+    def __len__(self):
+        return len(self._trips)
+
+    def _mask(self, facet, value):
+        if facet in GRADE_FACETS:
+            low, high = value
+            return self._at_least[facet][low] & self._at_most[facet][high]
+        return self._masks[facet].get(value, 0)
+
+    def query(self, selection, offset=0, limit=20):
+        """One page of the trips matching a selection, with the facet counts
+
+        Args:
+            selection (dict): Selected facets, see parse_selection
+            offset (int): Number of matching trips to skip
+            limit (int): Maximum number of trips to return
+
+        Returns:
+            tuple: (list of trips (copies), True if more matching trips follow,
+            facet name -> {value: count})
+        """
+        masks = {facet: self._mask(facet, value) for facet, value in selection.items() if facet in FACETS}
+        matching = self._all
+        for mask in masks.values():
+            matching &= mask
+
+        trips = []
+        has_more = False
+        skipped = 0
+        remaining = matching
+        while remaining:
+            low_bit = remaining & -remaining
+            remaining ^= low_bit
+            if skipped < offset:
+                skipped += 1
+                continue
+            if len(trips) == limit:
+                has_more = True
+                break
+            trips.append(self._trips[low_bit.bit_length() - 1].copy())
+
+        return trips, has_more, self._counts(masks)
+
+    def _counts(self, masks):
+        # Each facet is counted against the other facets only, so its own
+        # alternatives keep their counts while one of them is selected
+        counts = {}
+        for facet in FACETS:
+            base = self._all
+            for other, mask in masks.items():
+                if other != facet:
+                    base &= mask
+            counts[facet] = {
+                value: (mask & base).bit_count()
+                for value, mask in self._masks[facet].items()
+            }
+        return counts
+
+
+def describe_facets(counts, selection):
+    """Facet options with counts for the listing template
+
+    Returns:
+        list: One dict per facet with 'name', 'label', 'kind' ('choice' or
+        'range'), 'options' as (value, label, count) and the selected value(s)
+    """
+    facets = []
+    for facet, (label, param) in CHOICE_FACETS.items():
+        facet_counts = counts.get(facet, {})
+        if facet == 'class':
+            values = [value for value in TRIP_CLASS_LABELS if value in facet_counts]
+            labels = TRIP_CLASS_LABELS
+        elif facet == 'year':
+            values = sorted(facet_counts, reverse=True)
+            labels = {}
+        else:
+            values = [key for key, _, _ in ASCENT_BUCKETS if key in facet_counts]
+            labels = ASCENT_LABELS
+        facets.append({
+            'name': param,
+            'label': label,
+            'kind': 'choice',
+            'options': [(str(value), labels.get(value, str(value)), facet_counts[value]) for value in values],
+            'selected': str(selection.get(facet, '')),
+        })
+
+    for facet, (label, _, grades) in GRADE_FACETS.items():
+        facet_counts = counts.get(facet, {})
+        if not facet_counts and facet not in selection:
+            continue
+        low, high = selection.get(facet, (None, None))
+        facets.append({
+            'name': facet,
+            'label': label,
+            'kind': 'range',
+            'options': [(grade, grade, facet_counts.get(rank, 0)) for rank, grade in enumerate(grades)],
+            'selected_min': grades[low] if low is not None else '',
+            'selected_max': grades[high] if high is not None else '',
+        })
+    return facets
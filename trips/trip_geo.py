@@ -0,0 +1,216 @@
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Up to this zoom, nearby trips are merged into clusters; above it every trip is its own marker
+CLUSTER_MAX_ZOOM = 13
+
+# Size of a clustering cell in screen pixels (256 px map tiles)
+CLUSTER_CELL_PX = 64
+
+MAX_ZOOM = 19
+
+# Web Mercator stops at this latitude
+MAX_LATITUDE = 85.05112878
+
+# Decimal places of the coordinates in the GeoJSON (about 1 m)
+COORDINATE_DIGITS = 5
+
+
+def parse_point(value):
+    """Read a ParkingJson/HighPointJson value
+
+    The stored JSON spells the longitude "Longtitude"; "Longitude" is accepted too.
+
+    Returns:
+        tuple or None: (latitude, longitude), or None if the value holds no valid point
+    """
+    if not value:
+        return None
+    try:
+        data = json.loads(value) if isinstance(value, str) else value
+        lat = float(data.get('Latitude'))
+        lng = float(data.get('Longtitude', data.get('Longitude')))
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+        return None
+    return lat, lng
+
+
+def entity_map_point(entity):
+    """Map position of a trip entity: the high point, else the parking spot"""
+    return parse_point(entity.get('HighPointJson')) or parse_point(entity.get('ParkingJson'))
+
+
+def _project(lat, lng):
+    """Web Mercator position in the unit square, y growing southwards"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    sin_lat = math.sin(math.radians(lat))
+    x = (lng + 180) / 360
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+
+
+def _cells_per_axis(zoom):
+    return max(1, (256 << zoom) // CLUSTER_CELL_PX)
+
+
+def _round(value):
+    return round(value, COORDINATE_DIGITS)
+
+
+def _point_feature(lat, lng, properties, feature_id=None):
+    feature = {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [_round(lng), _round(lat)]},
+        'properties': properties,
+    }
+    if feature_id is not None:
+        feature['id'] = feature_id
+    return feature
+
+
+class TripGeoIndex:
+    """Grid index of the trips' map positions, one grid per zoom level.
+
+    Each zoom level up to CLUSTER_MAX_ZOOM has a grid of CLUSTER_CELL_PX-sized
+    cells in Web Mercator space, precomputed as cell -> (count, mean position,
+    first trip). A bounding box query at that zoom reads only the cells the box
+    covers, so the answer is at most one feature per cell no matter how many
+    trips there are. Above CLUSTER_MAX_ZOOM, the finest grid also keeps the
+    trips of each cell, which are returned one by one.
+    """
+
+    def __init__(self, trips):
+        self._points = []
+        for trip in trips:
+            if trip.map_point is None:
+                continue
+            lat, lng = trip.map_point
+            x, y = _project(lat, lng)
+            self._points.append((x, y, lat, lng, trip.row_key, trip.title or ''))
+
+        self._clusters = []
+        self._members = {}
+        for zoom in range(CLUSTER_MAX_ZOOM + 1):
+            cells = _cells_per_axis(zoom)
+            sums = {}
+            for position, (x, y, lat, lng, _, _) in enumerate(self._points):
+                cell = (min(int(x * cells), cells - 1), min(int(y * cells), cells - 1))
+                total = sums.get(cell)
+                if total is None:
+                    sums[cell] = [1, lat, lng, position]
+                else:
+                    total[0] += 1
+                    total[1] += lat
+                    total[2] += lng
+                if zoom == CLUSTER_MAX_ZOOM:
+                    self._members.setdefault(cell, []).append(position)
+            self._clusters.append({
+                cell: (count, lat_sum / count, lng_sum / count, first)
+                for cell, (count, lat_sum, lng_sum, first) in sums.items()
+            })
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell_ranges(self, bbox, zoom):
+        """Cell column and row ranges covered by (west, south, east, north)"""
+        west, south, east, north = bbox
+        cells = _cells_per_axis(zoom)
+
+        def column(lng):
+            return min(int(_project(0, lng)[0] * cells), cells - 1)
+
+        def row(lat):
+            return min(int(_project(lat, 0)[1] * cells), cells - 1)
+
+        if east - west >= 360:
+            columns = [(0, cells - 1)]
+        elif west <= east:
+            columns = [(column(west), column(east))]
+        else:
+            # The box crosses the antimeridian
+            columns = [(column(west), cells - 1), (0, column(east))]
+        return columns, (row(north), row(south))
+
+    def _cells_in(self, grid, columns, rows):
+        """Occupied cells of a grid within the column and row ranges"""
+        covered = sum(last - first + 1 for first, last in columns) * (rows[1] - rows[0] + 1)
+        if covered <= len(grid):
+            for first, last in columns:
+                for cx in range(first, last + 1):
+                    for cy in range(rows[0], rows[1] + 1):
+                        if (cx, cy) in grid:
+                            yield (cx, cy), grid[(cx, cy)]
+        else:
+            for cell, value in grid.items():
+                cx, cy = cell
+                if rows[0] <= cy <= rows[1] and any(first <= cx <= last for first, last in columns):
+                    yield cell, value
+
+    def query(self, bbox, zoom):
+        """GeoJSON features of the trips within a bounding box
+
+        Args:
+            bbox (tuple): (west, south, east, north) in degrees
+            zoom (int): Map zoom level
+
+        Returns:
+            list: Point features; trips that share a cell at this zoom are
+            merged into one feature with a 'count' property
+        """
+        zoom = max(0, min(zoom, MAX_ZOOM))
+        level = min(zoom, CLUSTER_MAX_ZOOM)
+        columns, rows = self._cell_ranges(bbox, level)
+
+        features = []
+        if zoom <= CLUSTER_MAX_ZOOM:
+            for _, (count, lat, lng, first) in self._cells_in(self._clusters[level], columns, rows):
+                if count == 1:
+                    features.append(self._trip_feature(first))
+                else:
+                    features.append(_point_feature(lat, lng, {'count': count}))
+            return features
+
+        west, south, east, north = bbox
+        crosses = west > east
+        for _, members in self._cells_in(self._members, columns, rows):
+            for position in members:
+                _, _, lat, lng, _, _ = self._points[position]
+                inside_lng = (lng >= west or lng <= east) if crosses else west <= lng <= east
+                if south <= lat <= north and inside_lng:
+                    features.append(self._trip_feature(position))
+        return features
+
+    def _trip_feature(self, position):
+        _, _, lat, lng, row_key, title = self._points[position]
+        return _point_feature(lat, lng, {'title': title}, feature_id=row_key)
+
+
+def parse_bbox(value):
+    """Parse ?bbox=west,south,east,north
+
+    Returns:
+        tuple or None: (west, south, east, north), or None if the value is invalid
+    """
+    try:
+        west, south, east, north = (float(part) for part in (value or '').split(','))
+    except ValueError:
+        return None
+    if not all(math.isfinite(v) for v in (west, south, east, north)) or south > north:
+        return None
+    south, north = max(south, -90.0), min(north, 90.0)
+    if east - west >= 360:
+        return -180.0, south, 180.0, north
+    return _wrap(west), south, _wrap(east), north
+
+
+def _wrap(lng):
+    # Leaflet keeps counting past ±180 when the map is panned around the world
+    if -180 <= lng <= 180:
+        return lng
+    return (lng + 180) % 360 - 180
@@ -0,0 +1,288 @@
+"""Secondary index of trips, kept in its own table.
+
+Table Storage only queries efficiently by PartitionKey and RowKey, so each
+trip gets one index entity per indexed value, in the usual index table
+layout (the trip table name plus 'Index', e.g. TripsIndex):
+
+    PartitionKey            RowKey                          TripRowKey
+    completed-2024          2024-05-03_<trip row key>       <trip row key>
+    class-skialp            <trip row key>                  <trip row key>
+    participant-petr        <trip row key>                  <trip row key>
+
+"Trips completed in 2024" is one partition query, a date range one RowKey
+range query per year, and "Skialp trips" or "trips with Petr" one
+partition query each, in newest-first trip key order. The service writes
+the index entities next to every trip write; rebuild_index (the
+rebuild_trip_index command) brings the whole index back in line with the
+trips. Lookups read the trips they find and check them, so an index entity
+left behind by an interrupted write never shows a wrong trip.
+"""
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from azure.data.tables import UpdateMode
+
+from .local_storage import MAX_TRANSACTION_OPERATIONS
+
+logger = logging.getLogger(__name__)
+
+# Index name -> entity property it indexes
+INDEXES = {
+    'completed': 'TripCompletedOn',
+    'class': 'TripClass',
+    'participant': 'Participants',
+}
+INDEXED_PROPERTIES = tuple(INDEXES.values())
+
+# Suffix of the index table's name, after the trip table's
+INDEX_TABLE_SUFFIX = 'Index'
+
+# Characters Table Storage does not allow in keys, replaced in indexed values
+_INVALID_KEY = re.compile(r'[/\\#?\x00-\x1f\x7f-\x9f]')
+MAX_VALUE_LENGTH = 200
+
+# Participants are written as "Baruch, Ondra, Petr"
+_PARTICIPANT_SEPARATORS = re.compile(r'[,;]')
+
+
+def get_index_table_name(table_name):
+    """Name of the index table of a trip table, or None when TRIPS_INDEX_ENABLED is off"""
+    from django.conf import settings
+    if not getattr(settings, 'TRIPS_INDEX_ENABLED', True):
+        return None
+    return f"{table_name}{INDEX_TABLE_SUFFIX}"
+
+
+def _property_value(value):
+    return getattr(value, 'value', value)
+
+
+def _key_value(value):
+    """An indexed value as it appears in keys: trimmed, case-folded, key-safe"""
+    text = ' '.join(str(value).split()).casefold()
+    return _INVALID_KEY.sub('_', text)[:MAX_VALUE_LENGTH]
+
+
+def completed_day(value):
+    """ISO date (YYYY-MM-DD) of a TripCompletedOn value, or None when it holds no date"""
+    value = _property_value(value)
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value or '')[:10]
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        return None
+
+
+def participant_names(value):
+    """The names in a Participants value"""
+    names = (' '.join(name.split()) for name in _PARTICIPANT_SEPARATORS.split(str(_property_value(value) or '')))
+    return [name for name in names if name]
+
+
+def index_entities(row_key, properties):
+    """Index entities of one trip
+
+    Args:
+        row_key (str): The trip's row key
+        properties (dict): The trip's entity properties; only INDEXED_PROPERTIES are read
+
+    Returns:
+        dict: (PartitionKey, RowKey) -> index entity
+    """
+    entities = {}
+
+    def add(partition, key, value):
+        entities[(partition, key)] = {
+            'PartitionKey': partition,
+            'RowKey': key,
+            'TripRowKey': row_key,
+            'Value': value,
+        }
+
+    day = completed_day(properties.get('TripCompletedOn'))
+    if day is not None:
+        add(f"completed-{day[:4]}", f"{day}_{row_key}", day)
+
+    trip_class = _property_value(properties.get('TripClass'))
+    if trip_class:
+        add(f"class-{_key_value(trip_class)}", row_key, trip_class)
+
+    for name in participant_names(properties.get('Participants')):
+        add(f"participant-{_key_value(name)}", row_key, name)
+    return entities
+
+
+def index_changes(row_key, old_properties, new_properties):
+    """Index writes that take a trip from its old properties to its new ones
+
+    Args:
+        old_properties (dict or None): None for a new trip
+        new_properties (dict or None): None for a deleted trip
+
+    Returns:
+        tuple: (index entities to upsert, (PartitionKey, RowKey) pairs to delete)
+    """
+    old = index_entities(row_key, old_properties) if old_properties is not None else {}
+    new = index_entities(row_key, new_properties) if new_properties is not None else {}
+    upserts = [entity for key, entity in new.items() if old.get(key) != entity]
+    deletes = [key for key in old if key not in new]
+    return upserts, deletes
+
+
+def touches_index(patch):
+    """Whether a MERGE patch writes any indexed property"""
+    return any(prop in patch for prop in INDEXED_PROPERTIES)
+
+
+def indexed_values(properties):
+    """The indexed properties of a trip; missing ones count as empty"""
+    properties = properties or {}
+    return {prop: properties.get(prop) for prop in INDEXED_PROPERTIES}
+
+
+def patched_values(values, patch):
+    """Indexed values after a MERGE patch was applied to them"""
+    return dict(values, **{prop: patch[prop] for prop in INDEXED_PROPERTIES if prop in patch})
+
+
+def lookup_queries(index, value, until=None):
+    """Queries that find the index entities of a lookup
+
+    Args:
+        index (str): One of INDEXES
+        value: The class or participant name; for 'completed', the first day (date)
+        until (date, optional): For 'completed', the last day (default: value)
+
+    Returns:
+        list: (query filter, parameters) pairs, one per index partition
+    """
+    if index == 'completed':
+        until = until or value
+        return [
+            (
+                "PartitionKey eq @pk and RowKey ge @first and RowKey lt @after",
+                # Keys of a day are '<day>_<trip row key>', and '~' sorts after '_'
+                {'pk': f"completed-{year:04d}", 'first': value.isoformat(), 'after': f"{until.isoformat()}~"},
+            )
+            for year in range(value.year, until.year + 1)
+        ]
+    if index in INDEXES:
+        return [("PartitionKey eq @pk", {'pk': f"{index}-{_key_value(value)}"})]
+    raise ValueError(f"Unknown trip index {index!r}: use {', '.join(INDEXES)}")
+
+
+def matches(index, properties, value, until=None):
+    """Whether a trip (its entity properties) still has the value a lookup found it by"""
+    if index == 'completed':
+        day = completed_day(properties.get('TripCompletedOn'))
+        return day is not None and value.isoformat() <= day <= (until or value).isoformat()
+    if index == 'class':
+        return _key_value(_property_value(properties.get('TripClass')) or '') == _key_value(value)
+    return _key_value(value) in {_key_value(name) for name in participant_names(properties.get('Participants'))}
+
+
+def intersect_keys(found):
+    """Row keys found by every lookup, newest first
+
+    Args:
+        found (iterable): The row keys of each lookup
+    """
+    keys = None
+    for row_keys in found:
+        keys = set(row_keys) if keys is None else keys & set(row_keys)
+    return sorted(keys or ())
+
+
+def matching_entities(entities, lookups):
+    """The entities that were read (not None) and still match every lookup"""
+    return [
+        entity for entity in entities
+        if entity is not None and all(matches(index, entity, value, until) for index, value, until in lookups)
+    ]
+
+
+def selection_lookups(selection):
+    """Index lookups for the indexed facets of an all trips selection (see trip_facets.parse_selection)
+
+    Returns:
+        list: (index, value, until) lookups; empty when no selected facet is indexed
+    """
+    lookups = []
+    if 'class' in selection:
+        lookups.append(('class', selection['class'], None))
+    if 'year' in selection:
+        year = selection['year']
+        if 1 <= year <= 9999:
+            lookups.append(('completed', date(year, 1, 1), date(year, 12, 31)))
+    return lookups
+
+
+@dataclass
+class RebuildResult:
+    trips: int = 0
+    written: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+
+def _submit(table_client, operations):
+    """Submit operations of one partition in transactions of up to 100"""
+    for start in range(0, len(operations), MAX_TRANSACTION_OPERATIONS):
+        table_client.submit_transaction(operations[start:start + MAX_TRANSACTION_OPERATIONS])
+
+
+def rebuild_index(service, dry_run=False):
+    """Bring the index table in line with the trips
+
+    The index table is created if needed. Every trip is read, then the
+    whole index table; missing or outdated index entities are written and
+    the ones of deleted trips or old values removed, in per-partition
+    transactions.
+
+    Args:
+        service (AzureTableService): Service of the trip table
+        dry_run (bool): Only count the changes
+
+    Returns:
+        RebuildResult
+    """
+    service.storage.ensure_table(service.index_table_name)
+    result = RebuildResult()
+    expected = {}
+    select = ['RowKey'] + list(INDEXED_PROPERTIES)
+    for page, _ in service.iter_trip_entity_pages(select=select):
+        for entity in page:
+            result.trips += 1
+            expected.update(index_entities(entity['RowKey'], entity))
+
+    index_client = service.get_index_table_client()
+    upserts = defaultdict(list)
+    deletes = defaultdict(list)
+    for entity in index_client.list_entities():
+        key = (entity['PartitionKey'], entity['RowKey'])
+        wanted = expected.pop(key, None)
+        if wanted is None:
+            deletes[key[0]].append(('delete', {'PartitionKey': key[0], 'RowKey': key[1]}))
+        elif {name: entity.get(name) for name in wanted} != wanted:
+            upserts[key[0]].append(('upsert', wanted, {'mode': UpdateMode.REPLACE}))
+        else:
+            result.unchanged += 1
+    for key, entity in expected.items():
+        upserts[key[0]].append(('upsert', entity, {'mode': UpdateMode.REPLACE}))
+
+    result.written = sum(len(operations) for operations in upserts.values())
+    result.deleted = sum(len(operations) for operations in deletes.values())
+    if dry_run:
+        return result
+
+    for partition in sorted(set(upserts) | set(deletes)):
+        _submit(index_client, upserts.get(partition, []) + deletes.get(partition, []))
+    logger.info(f"Rebuilt the trip index of {result.trips} trips: {result.written} written, {result.deleted} deleted")
+    return result
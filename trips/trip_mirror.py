@@ -0,0 +1,474 @@
+import logging
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Defaults used when the matching Django settings are not defined
+DEFAULT_REFRESH_SECONDS = 60
+DEFAULT_FULL_SYNC_SECONDS = 900
+
+# Rows written per transaction during a sync
+SYNC_BATCH_SIZE = 500
+
+# How often a mirror that is not loaded yet checks whether a sync has finished
+READY_CHECK_SECONDS = 30
+
+# A sync holds the sync lease this long, renewed after every batch; a crashed
+# syncer's lease runs out and another process takes over
+SYNC_LEASE_SECONDS = 300
+# How long sync(wait=True) waits for another process's sync to finish
+SYNC_WAIT_SECONDS = 600
+SYNC_WAIT_POLL_SECONDS = 2
+
+def _text(value):
+    return str(value)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        logger.warning(f"Ignoring unparseable TripCompletedOn value: {value}")
+        return None
+
+
+# Entity property -> (Trip field, converter from the entity value)
+ENTITY_FIELDS = {
+    'Title': ('title', _text),
+    'Description': ('description', _text),
+    'TripCompletedOn': ('trip_completed_on', _date),
+    'LengthHours': ('length_hours', _float),
+    'Location': ('location', _text),
+    'ElevationGain': ('elevation_gain', _float),
+    'Difficulty': ('difficulty', _text),
+    'MapUrl': ('map_url', _text),
+    'ImageUrl': ('image_url', _text),
+    'Participants': ('participants', _text),
+    'MetersAscend': ('meters_ascend', _int),
+    'MetersDescend': ('meters_descend', _int),
+    'UiaaGrade': ('uiaa_grade', _text),
+    'AlpineGrade': ('alpine_grade', _text),
+    'TripClass': ('trip_class', _text),
+    'FerataGrade': ('ferata_grade', _text),
+    'ParkingJson': ('parking_json', _text),
+    'HighPointJson': ('high_point_json', _text),
+    'PhotoManifest': ('photo_manifest', _text),
+    'CoverPhoto': ('cover_photo', _text),
+    'CoverVariants': ('cover_variants', _text),
+}
+
+# Fields rewritten when a mirrored row is upserted
+SYNCED_FIELDS = [field for field, _ in ENTITY_FIELDS.values()] + [
+    'partition_key', 'timestamp', 'etag', 'updated_at', 'modified',
+]
+
+# Listing filters (same meaning as azure_service.TRIP_FILTERS)
+MIRROR_FILTERS = {
+    'completed': Q(trip_completed_on__isnull=False),
+    'future': Q(trip_completed_on__isnull=True),
+}
+
+
+def _property_value(value):
+    # Int64 and other typed properties come back as EntityProperty(value, edm_type)
+    return getattr(value, 'value', value)
+
+
+def trip_from_entity(entity, etag=None, updated_at=None):
+    """Build an (unsaved) Trip row from a table entity"""
+    from .models import Trip
+
+    metadata = getattr(entity, 'metadata', None) or {}
+    values = {
+        'partition_key': entity.get('PartitionKey', 'Trips'),
+        'row_key': entity['RowKey'],
+        'timestamp': str(entity.get('Timestamp') or ''),
+        'etag': etag or metadata.get('etag') or '',
+        'updated_at': updated_at or metadata.get('timestamp'),
+    }
+    for prop, (field, convert) in ENTITY_FIELDS.items():
+        value = _property_value(entity.get(prop))
+        values[field] = convert(value) if value is not None else None
+    if values['title'] is None:
+        values['title'] = ''
+    return Trip(**values)
+
+
+def entity_from_trip(trip):
+    """Rebuild the entity properties of a mirrored row
+
+    Missing (NULL) values are left out, the same way Table Storage omits
+    them, so the service's entity mappers apply their usual defaults.
+    """
+    entity = {
+        'PartitionKey': trip.partition_key,
+        'RowKey': trip.row_key,
+    }
+    if trip.timestamp:
+        entity['Timestamp'] = trip.timestamp
+    for prop, (field, _) in ENTITY_FIELDS.items():
+        value = getattr(trip, field)
+        if value is None:
+            continue
+        entity[prop] = value.isoformat() if isinstance(value, date) else value
+    return entity
+
+
+class TripMirror:
+    """SQLite copy of the trips in the table, read instead of Table Storage.
+
+    Filled by a bulk load and then kept current with incremental pulls of
+    entities whose server ``Timestamp`` is at or after the last sync marker.
+    Writes made through AzureTableService are written through immediately.
+    Deletes made elsewhere are picked up by the periodic full sync.
+
+    Like the catalog cache, the mirror does not talk to Azure: ``sync()`` is
+    given a fetch function by the service.
+
+    Every gunicorn worker runs a refresher, but syncs take a lease on the
+    TripMirrorState row first, so only one process writes a sync into the
+    SQLite file at a time; the others skip their turn.
+    """
+
+    def __init__(self, table_name, refresh_interval=DEFAULT_REFRESH_SECONDS,
+                 full_sync_interval=DEFAULT_FULL_SYNC_SECONDS):
+        self.table_name = table_name
+        self.refresh_interval = refresh_interval
+        self.full_sync_interval = full_sync_interval
+
+        self._sync_lock = threading.Lock()
+        self._owner = uuid.uuid4().hex
+        self._ready = False
+        self._ready_checked = 0.0
+        self._refresher = None
+
+    def is_ready(self):
+        """True once a full sync has completed, so reads can be served locally"""
+        if self._ready:
+            return True
+        now = time.monotonic()
+        if now - self._ready_checked < READY_CHECK_SECONDS and self._ready_checked:
+            return False
+        self._ready_checked = now
+        try:
+            state = self._get_state()
+            self._ready = state is not None and state.last_full_sync is not None
+        except DatabaseError as e:
+            logger.warning(f"Trip mirror is not available: {str(e)}")
+            self._ready = False
+        return self._ready
+
+    def _get_state(self):
+        from .models import TripMirrorState
+        return TripMirrorState.objects.filter(table_name=self.table_name).first()
+
+    def _acquire_lease(self):
+        """Take (or renew) the sync lease; False while another process holds it
+
+        The conditional UPDATE is atomic, so two processes cannot both win.
+        """
+        from .models import TripMirrorState
+
+        TripMirrorState.objects.get_or_create(table_name=self.table_name)
+        now = timezone.now()
+        free = Q(sync_owner='') | Q(sync_owner=self._owner) | Q(sync_lease_until__isnull=True) | Q(sync_lease_until__lt=now)
+        return TripMirrorState.objects.filter(free, table_name=self.table_name).update(
+            sync_owner=self._owner,
+            sync_lease_until=now + timedelta(seconds=SYNC_LEASE_SECONDS),
+        ) == 1
+
+    def _release_lease(self):
+        from .models import TripMirrorState
+
+        TripMirrorState.objects.filter(table_name=self.table_name, sync_owner=self._owner).update(
+            sync_owner='',
+            sync_lease_until=None,
+        )
+
+    def sync(self, fetch_entities, full=False, wait=False):
+        """Pull changes from the table into the mirror
+
+        Args:
+            fetch_entities (callable): ``fetch_entities(since)`` returns an
+                iterable of table entities; ``since`` is None for a full scan
+            full (bool): Force a full sync even if the last one is recent
+            wait (bool): While another process is syncing, wait for it to
+                finish (up to SYNC_WAIT_SECONDS) instead of skipping the sync
+
+        Returns:
+            tuple or None: ('full' or 'delta', number of entities written,
+            number of rows deleted), or None when another process was syncing
+        """
+        with self._sync_lock:
+            deadline = time.monotonic() + SYNC_WAIT_SECONDS
+            while not self._acquire_lease():
+                if not wait or time.monotonic() >= deadline:
+                    logger.debug("Trip mirror sync skipped, another process is syncing")
+                    return None
+                time.sleep(SYNC_WAIT_POLL_SECONDS)
+            try:
+                return self._sync(fetch_entities, full)
+            finally:
+                self._release_lease()
+
+    def _sync(self, fetch_entities, full):
+        from .models import Trip, TripMirrorState
+
+        state = TripMirrorState.objects.get(table_name=self.table_name)
+        started = timezone.now()
+        if not full and state.last_full_sync is not None and state.sync_marker is not None:
+            full = started - state.last_full_sync >= timedelta(seconds=self.full_sync_interval)
+        else:
+            full = True
+
+        marker = None if full else state.sync_marker
+        seen = set()
+        batch = []
+        written = 0
+        changed = False
+        for entity in fetch_entities(None if full else state.sync_marker):
+            if not entity.get('RowKey'):
+                continue
+            trip = trip_from_entity(entity)
+            seen.add(trip.row_key)
+            if trip.updated_at is not None and (marker is None or trip.updated_at > marker):
+                marker = trip.updated_at
+            batch.append(trip)
+            if len(batch) >= SYNC_BATCH_SIZE:
+                changed = self._has_changes(batch) or changed
+                written += self._upsert(batch)
+                batch = []
+                # Long full syncs keep the lease
+                self._acquire_lease()
+        if batch:
+            changed = self._has_changes(batch) or changed
+            written += self._upsert(batch)
+
+        deleted = 0
+        if full:
+            # Table Storage has no tombstones; drop whatever the scan did not return,
+            # except rows written through by a worker while the scan was running
+            existing = Trip.objects.filter(modified__lt=started).values_list('row_key', flat=True)
+            stale = set(existing) - seen
+            stale_keys = list(stale)
+            for start in range(0, len(stale_keys), SYNC_BATCH_SIZE):
+                deleted += Trip.objects.filter(row_key__in=stale_keys[start:start + SYNC_BATCH_SIZE]).delete()[0]
+            state.last_full_sync = started
+        state.sync_marker = marker
+        state.last_sync = started
+        # Leave the lease columns to _acquire_lease/_release_lease
+        state.save(update_fields=['sync_marker', 'last_full_sync', 'last_sync'])
+        # Pulls re-read unchanged trips too; only real changes make a new version
+        if changed or deleted or not state.version:
+            self._bump_version()
+
+        mode = 'full' if full else 'delta'
+        self._ready = True
+        logger.info(f"Trip mirror {mode} sync wrote {written} trips and deleted {deleted}")
+        return mode, written, deleted
+
+    def _has_changes(self, trips):
+        """Whether any of these trips is new to the mirror or has a different ETag"""
+        from .models import Trip
+
+        etags = dict(Trip.objects.filter(row_key__in=[trip.row_key for trip in trips]).values_list('row_key', 'etag'))
+        return any(etags.get(trip.row_key) != trip.etag for trip in trips)
+
+    def _bump_version(self):
+        """Give the mirrored listing a new version, after any change to its rows"""
+        from .models import TripMirrorState
+
+        TripMirrorState.objects.filter(table_name=self.table_name).update(
+            version=uuid.uuid4().hex,
+            last_modified=timezone.now(),
+        )
+
+    def _upsert(self, trips):
+        from .models import Trip
+
+        with transaction.atomic():
+            Trip.objects.bulk_create(
+                trips,
+                update_conflicts=True,
+                unique_fields=['row_key'],
+                update_fields=SYNCED_FIELDS,
+            )
+        return len(trips)
+
+    def put_entity(self, entity, etag=None):
+        """Write through a trip just written to the table by this worker
+
+        The server Timestamp is not known here, so the sync marker is left
+        alone and the next incremental pull replaces the row with the real one.
+        """
+        try:
+            self._upsert([trip_from_entity(entity, etag=etag, updated_at=timezone.now())])
+            self._bump_version()
+        except DatabaseError as e:
+            logger.warning(f"Could not write trip {entity.get('RowKey')} to the mirror: {str(e)}")
+
+    def patch_entity(self, patch, etag=None):
+        """Write through properties this worker merged into a trip
+
+        A trip that is not mirrored yet is left for the next pull.
+        """
+        try:
+            entity, _ = self.get_entity(patch['RowKey'])
+        except DatabaseError as e:
+            logger.warning(f"Could not read trip {patch['RowKey']} from the mirror: {str(e)}")
+            return
+        if entity is not None:
+            entity.update(patch)
+            self.put_entity(entity, etag=etag)
+
+    def remove(self, row_key):
+        """Drop a trip deleted by this worker"""
+        from .models import Trip
+        try:
+            if Trip.objects.filter(row_key=row_key).delete()[0]:
+                self._bump_version()
+        except DatabaseError as e:
+            logger.warning(f"Could not remove trip {row_key} from the mirror: {str(e)}")
+
+    def _listing(self, trip_filter=None):
+        from .models import Trip
+        trips = Trip.objects.order_by('-timestamp', 'row_key')
+        condition = MIRROR_FILTERS.get(trip_filter)
+        return trips.filter(condition) if condition is not None else trips
+
+    def get_entities(self, trip_filter=None):
+        """Entity dicts of all mirrored trips, newest first"""
+        return [entity_from_trip(trip) for trip in self._listing(trip_filter)]
+
+    def get_page(self, offset, limit, trip_filter=None):
+        """Entity dicts of one page of trips
+
+        Returns:
+            tuple: (list of entity dicts, True if more matching trips follow)
+        """
+        trips = list(self._listing(trip_filter)[offset:offset + limit + 1])
+        return [entity_from_trip(trip) for trip in trips[:limit]], len(trips) > limit
+
+    def get_counts(self):
+        """Return total/completed/future trip counts"""
+        from .models import Trip
+        total = Trip.objects.count()
+        completed = Trip.objects.filter(MIRROR_FILTERS['completed']).count()
+        return {
+            'total': total,
+            'completed': completed,
+            'future': total - completed,
+        }
+
+    def get_entity(self, row_key):
+        """Entity dict and (etag, updated_at) of one trip, or (None, None)"""
+        from .models import Trip
+        trip = Trip.objects.filter(row_key=row_key).first()
+        if trip is None:
+            return None, None
+        return entity_from_trip(trip), (trip.etag, trip.updated_at)
+
+    def search(self, text, limit, offset=0):
+        """Full-text search over the mirrored trips, see trip_search.search
+
+        Returns:
+            tuple: (list of (entity dict, title HTML, snippet HTML), True if more results follow)
+        """
+        from .trip_search import search
+
+        results, has_more = search(text, limit, offset)
+        return [(entity_from_trip(trip), title, snippet) for trip, title, snippet in results], has_more
+
+    def get_etag(self, row_key):
+        """ETag of one mirrored trip, or None"""
+        from .models import Trip
+        return Trip.objects.filter(row_key=row_key).values_list('etag', flat=True).first()
+
+    def get_version(self):
+        """Version of the mirrored listing and the time it last changed
+
+        Both are kept on the TripMirrorState row: syncs that change a row and
+        every write-through replace the version, so reading it is one query.
+        """
+        state = self._get_state()
+        if state is None:
+            return None
+        if not state.version:
+            # Mirrors loaded before versions were stored get one on first use
+            self._bump_version()
+            state = self._get_state()
+        return state.version, state.last_modified
+
+    def start_refresher(self, fetch_entities):
+        """Start the background thread that keeps the mirror current (once per process)"""
+        if self._refresher is not None or not self.refresh_interval:
+            return
+        self._refresher = threading.Thread(
+            target=self._refresh_forever,
+            args=(fetch_entities,),
+            name=f"trip-mirror-{self.table_name}",
+            daemon=True,
+        )
+        self._refresher.start()
+        logger.info(f"Started trip mirror refresher (every {self.refresh_interval}s)")
+
+    def _refresh_forever(self, fetch_entities):
+        while True:
+            close_old_connections()
+            try:
+                self.sync(fetch_entities)
+            except Exception as e:
+                logger.error(f"Trip mirror sync failed: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+            time.sleep(self.refresh_interval)
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_trip_mirror(table_name):
+    """Get the process-wide mirror of a table, or None when disabled
+
+    The Trip model holds a single table, so only AZURE_TABLE_NAME is mirrored.
+    """
+    from django.conf import settings
+    if not getattr(settings, 'TRIP_MIRROR_ENABLED', False) or table_name != settings.AZURE_TABLE_NAME:
+        return None
+
+    with _mirrors_lock:
+        mirror = _mirrors.get(table_name)
+        if mirror is None:
+            mirror = TripMirror(
+                table_name,
+                refresh_interval=getattr(settings, 'TRIP_MIRROR_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS),
+                full_sync_interval=getattr(settings, 'TRIP_MIRROR_FULL_SYNC_SECONDS', DEFAULT_FULL_SYNC_SECONDS),
+            )
+            _mirrors[table_name] = mirror
+        return mirror
@@ -0,0 +1,466 @@
+"""Request parsing, page contexts and edit decisions shared by the views
+
+Both the sync views (views.py) and the async views (async_views.py) build
+their pages from these functions, so they only differ in how they await
+storage. Nothing here reads or writes storage.
+"""
+import datetime
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.contrib import messages
+from django.forms import ChoiceField
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+
+from .azure_service import TRIP_CHANGED, TRIP_PROPERTIES, trip_properties
+from .forms import TripEditForm
+from .trip_facets import describe_facets, selection_query
+from .trip_geo import parse_bbox
+from .trip_transfer import export_filter
+
+logger = logging.getLogger(__name__)
+
+# Trips shown on the landing page
+INDEX_TRIP_COUNT = 6
+
+def set_first_photo(trip, blob_service):
+    """Set the card image of a listed trip from its cover photo and cover variants"""
+    if not trip.cover_photo:
+        trip.first_photo = None
+        trip.first_photo_srcset = ''
+        return
+    sources = blob_service.get_photo_sources(trip.cover_photo, trip.cover_variants)
+    trip.first_photo = sources['card']
+    trip.first_photo_srcset = sources['srcset']
+
+def set_cover_photos(trips, blob_service):
+    """Set the card images of listed trips that have a cover photo
+    
+    Returns:
+        list: The trips without a photo manifest yet, whose card image needs
+        a blob listing (see set_listed_photo)
+    """
+    unlisted = []
+    for trip in trips:
+        if trip.cover_photo is not None:
+            set_first_photo(trip, blob_service)
+        else:
+            unlisted.append(trip)
+    return unlisted
+
+def set_listed_photo(trip, photo_urls):
+    """Set the card image of a listed trip from the URLs of its blobs"""
+    trip.first_photo = photo_urls[0] if photo_urls else None
+    trip.first_photo_srcset = ''
+
+def lists_photos_with_trip(cached_trip):
+    """Whether a trip's blobs are listed while the trip itself is read
+    
+    Photos normally come from the trip's manifest. When the catalog cache
+    already tells that the trip has none, the listing runs in parallel with
+    the trip lookup.
+    """
+    return cached_trip is not None and cached_trip.cover_photo is None
+
+def _coords_json(point):
+    """JSON {lat, lng} of a parsed (latitude, longitude) point, or None"""
+    if not point:
+        return None
+    lat, lng = point
+    return json.dumps({'lat': lat, 'lng': lng})
+
+def trip_detail_context(trip, trip_photos):
+    """Build the detail page context with the coordinates parsed by the service for map display"""
+    return {
+        'trip': trip,
+        'parking_coords': _coords_json(trip.parking_coords),
+        'high_point_coords': _coords_json(trip.high_point_coords),
+        'mapy_cz_api_key': settings.MAPY_CZ_API_KEY,
+        'trip_photos': trip_photos
+    }
+
+def trip_data_from_form(form):
+    """Build the trip data written by create_trip/update_trip from a valid edit form
+    
+    Fields the form does not edit (location, difficulty) are left out;
+    update_trip merges, so their stored values stay.
+    """
+    return {
+        'title': form.cleaned_data['title'],
+        'description': form.cleaned_data['description'],
+        'trip_completed_on': form.cleaned_data['trip_completed_on'],
+        'length_hours': form.cleaned_data['length_hours'],
+        'participants': form.cleaned_data['participants'],
+        'meters_ascend': form.cleaned_data['meters_ascend'],
+        'meters_descend': form.cleaned_data['meters_descend'],
+        'uiaa_grade': form.cleaned_data['uiaa_grade'],
+        'alpine_grade': form.cleaned_data['alpine_grade'],
+        'trip_class': form.cleaned_data['trip_class'],
+        'ferata_grade': form.cleaned_data['ferata_grade'],
+        'parking_json': form.cleaned_data['parking_json'],
+        'high_point_json': form.cleaned_data['high_point_json'],
+    }
+
+def trip_initial_data(trip):
+    """Initial edit form values for an existing trip"""
+    return {
+        'title': trip.title,
+        'description': trip.description,
+        'trip_completed_on': trip.trip_completed_on,
+        'length_hours': trip.length_hours,
+        'participants': trip.participants,
+        'meters_ascend': trip.meters_ascend,
+        'meters_descend': trip.meters_descend,
+        'uiaa_grade': trip.uiaa_grade,
+        'alpine_grade': trip.alpine_grade,
+        'trip_class': trip.trip_class,
+        'ferata_grade': trip.ferata_grade,
+        'parking_json': trip.parking_json,
+        'high_point_json': trip.high_point_json,
+    }
+
+def trip_form_values(trip):
+    """Edit form values of a trip as an unchanged form posts them back
+    
+    Selects show their first (empty) option for values they do not offer,
+    like the 'none' of an unset grade, so those come back empty.
+    """
+    values = trip_initial_data(trip)
+    for name, field in TripEditForm.base_fields.items():
+        if isinstance(field, ChoiceField) and name in values and not field.valid_value(values[name]):
+            values[name] = ''
+    return values
+
+def trip_edit_initial(trip):
+    """Initial edit form values, plus the trip's etag and properties the save is checked against"""
+    initial = trip_initial_data(trip)
+    initial['etag'] = trip.etag or ''
+    initial['original'] = json.dumps(trip_properties(trip_form_values(trip)), default=str)
+    return initial
+
+# Edit form fields compared on the conflict page, with their labels
+TRIP_FIELD_LABELS = {
+    'title': 'Title',
+    'trip_completed_on': 'Completion Date',
+    'description': 'Description',
+    'length_hours': 'Length (hours)',
+    'participants': 'Participants',
+    'meters_ascend': 'Elevation Gain (m)',
+    'meters_descend': 'Meters Descend',
+    'trip_class': 'Trip Class',
+    'uiaa_grade': 'UIAA Grade',
+    'alpine_grade': 'Alpine Grade',
+    'ferata_grade': 'Ferrata Grade',
+    'parking_json': 'Parking',
+    'high_point_json': 'High Point',
+}
+
+def form_value(value):
+    """A trip value the way the edit form posts it"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+def trip_conflict_context(form, current):
+    """Context of the conflict page, shown when someone else saved the trip during an edit
+    
+    A field changed on one side only keeps that change, whichever side it
+    was. Fields both sides changed to different values are left for the
+    user to choose. Saving the page writes against the current version.
+    
+    Args:
+        form (TripEditForm): The user's valid edit form
+        current (TripRecord): The trip as it is stored now
+    """
+    original = form.cleaned_data['original'] or {}
+    mine = trip_properties(trip_data_from_form(form))
+    current_values = trip_form_values(current)
+    theirs = trip_properties(current_values)
+    
+    fields = []
+    for name, label in TRIP_FIELD_LABELS.items():
+        prop = TRIP_PROPERTIES[name]
+        mine_changed = prop in mine and mine[prop] != original.get(prop)
+        theirs_changed = theirs.get(prop) != original.get(prop)
+        if mine_changed and theirs_changed and mine[prop] != theirs.get(prop):
+            status = 'conflict'
+        elif mine_changed:
+            status = 'mine'
+        else:
+            status = 'theirs' if theirs_changed else 'unchanged'
+        mine_value = form.data.get(name, '')
+        theirs_value = form_value(current_values.get(name))
+        fields.append({
+            'name': name,
+            'label': label,
+            'status': status,
+            'mine': mine_value,
+            'theirs': theirs_value,
+            'value': mine_value if status == 'mine' else theirs_value,
+        })
+    
+    return {
+        'trip': current,
+        'conflicts': [field for field in fields if field['status'] == 'conflict'],
+        'settled': [field for field in fields if field['status'] != 'conflict'],
+        'mine_changed': [field['label'] for field in fields if field['status'] == 'mine'],
+        'theirs_changed': [field['label'] for field in fields if field['status'] == 'theirs'],
+        'etag': current.etag or '',
+        'original': json.dumps(theirs, default=str),
+    }
+
+# Saves of an edit retried when only properties the form does not edit changed meanwhile
+EDIT_SAVE_ATTEMPTS = 3
+
+def may_retry_save(message, attempts):
+    """Whether an edit's save that failed with message after attempts tries is tried again
+    
+    Only conflicts are retried, and only while edited_fields_changed finds the
+    form's fields as they were in the current trip.
+    """
+    return message == TRIP_CHANGED and attempts < EDIT_SAVE_ATTEMPTS
+
+def edited_fields_changed(form, current):
+    """Whether anyone changed a field of the edit form since the form was opened
+    
+    Photo uploads rewrite the trip's manifest and cover, which changes its
+    etag too. The direct uploads of the same edit finish before the form is
+    submitted, so on their own they must not count as a conflicting save.
+    
+    Args:
+        form (TripEditForm): The user's valid edit form
+        current (TripRecord): The trip as it is stored now
+    """
+    original = form.cleaned_data['original']
+    if original is None:
+        return True
+    theirs = trip_properties(trip_form_values(current))
+    return any(theirs.get(prop) != original.get(prop) for prop in set(theirs) | set(original))
+
+def direct_uploads_enabled(blob_service, is_new_trip):
+    """Whether the edit page uploads photos straight from the browser to blob storage
+    
+    Only existing trips can take direct uploads, and only storage that can
+    issue SAS URLs supports them. The local and memory backends cannot.
+    """
+    return settings.PHOTO_DIRECT_UPLOADS and not is_new_trip and blob_service.supports_direct_uploads()
+
+def edit_context(form, is_new, trip=None, trip_photos=None, error=None, direct_uploads=False):
+    """Build the edit page context; trip and trip_photos are shown for existing trips"""
+    context = {
+        'form': form,
+        'is_new': is_new,
+        'mapy_cz_api_key': settings.MAPY_CZ_API_KEY,
+        'direct_uploads': direct_uploads,
+    }
+    if not is_new:
+        context.update({
+            'trip': trip,
+            'trip_photos': trip_photos,
+        })
+    if error:
+        context['error'] = error
+    return context
+
+def report_uploads(request, upload_results):
+    """Tell the user which photos were uploaded and which failed"""
+    uploaded = [result for result in upload_results if result['success']]
+    if uploaded:
+        messages.success(request, f"Uploaded {len(uploaded)} photo{'s' if len(uploaded) != 1 else ''}.")
+    for result in upload_results:
+        if not result['success']:
+            logger.warning(f"Error uploading photo {result['filename']}: {result['error']}")
+            messages.error(request, f"Could not upload {result['filename']}: {result['error']}")
+
+def upload_results_response(trip_id, results):
+    """JSON response with per-file upload results; 207 when some files failed"""
+    failed = sum(1 for result in results if not result['success'])
+    return JsonResponse({
+        'trip_id': trip_id,
+        'uploaded': len(results) - failed,
+        'failed': failed,
+        'results': results,
+    }, status=207 if failed else 200)
+
+def parse_page_size(value):
+    """Parse the ?page_size= parameter, falling back to the configured default"""
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return settings.TRIPS_PAGE_SIZE
+    return max(1, min(page_size, settings.TRIPS_MAX_PAGE_SIZE))
+
+def all_trips_params(request):
+    """Read the filter and paging parameters of the all trips page
+    
+    Returns:
+        tuple: (filter, page size, cursor, page number)
+    """
+    trip_filter = request.GET.get('filter', 'all')
+    page_size = parse_page_size(request.GET.get('page_size'))
+    cursor = request.GET.get('cursor') or None
+    try:
+        page_number = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page_number = 1
+    if not cursor:
+        page_number = 1
+    return trip_filter, page_size, cursor, page_number
+
+def all_trips_context(trips, next_cursor, counts, trip_filter, page_size, page_number, selection=None, facet_counts=None):
+    """Build the all trips page context
+    
+    Args:
+        counts (dict or None): total/completed/future counts, used without facet counts
+        selection (dict, optional): Selected facets, see trip_facets.parse_selection
+        facet_counts (dict, optional): Facet counts from get_faceted_page; None
+            when the listing has no facet index (the facet form is then hidden)
+    """
+    logger.info(f"Filter: {trip_filter}, page {page_number}: {len(trips)} trips")
+    selection = selection or {}
+    
+    if facet_counts is not None:
+        completed = facet_counts['status'].get('completed', 0)
+        future = facet_counts['status'].get('future', 0)
+        counts = {'total': completed + future, 'completed': completed, 'future': future}
+    
+    return {
+        'trips': trips,
+        'current_filter': trip_filter,
+        'completed_count': counts['completed'] if counts else None,
+        'future_count': counts['future'] if counts else None,
+        'total_count': counts['total'] if counts else None,
+        'facets': describe_facets(facet_counts, selection) if facet_counts is not None else None,
+        'facet_query': selection_query(selection),
+        'page_number': page_number,
+        'page_size': page_size,
+        'next_cursor': next_cursor,
+        'next_page_number': page_number + 1,
+    }
+
+def search_params(request):
+    """Read the search text and paging parameters of the search page
+    
+    Returns:
+        tuple: (search text, page size, page number)
+    """
+    query = request.GET.get('q', '').strip()
+    page_size = parse_page_size(request.GET.get('page_size'))
+    try:
+        page_number = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page_number = 1
+    return query, page_size, page_number
+
+def search_json(query, results, page_number):
+    """Search results as JSON, for ?format=json
+    
+    Args:
+        results (tuple or None): (trips, has more) from search_trips, None if search is unavailable
+    """
+    if results is None:
+        return JsonResponse({'error': 'Search is not available yet'}, status=503)
+    trips, has_more = results
+    return JsonResponse({
+        'query': query,
+        'page': page_number,
+        'has_more': has_more,
+        'results': [{
+            'row_key': trip.row_key,
+            'title': trip.title,
+            'title_html': trip.search_title,
+            'snippet_html': trip.search_snippet,
+            'url': reverse('trips:trip_detail', args=[trip.row_key]),
+        } for trip in trips],
+    })
+
+def search_context(query, results, page_size, page_number):
+    """Build the search page context; results is None when search is unavailable"""
+    trips, has_more = results if results is not None else ([], False)
+    return {
+        'query': query,
+        'trips': trips,
+        'search_available': results is not None,
+        'page_number': page_number,
+        'page_size': page_size,
+        'has_more': has_more,
+    }
+
+def map_params(request):
+    """Read the bounding box and zoom of a map features request
+    
+    Returns:
+        tuple: ((west, south, east, north) or None if missing/invalid, zoom)
+    """
+    try:
+        zoom = int(request.GET.get('zoom', 0))
+    except ValueError:
+        zoom = 0
+    return parse_bbox(request.GET.get('bbox')), zoom
+
+def map_features_response(features):
+    """Compact GeoJSON FeatureCollection; features is None when the map index is unavailable"""
+    if features is None:
+        return JsonResponse({'error': 'The trips map is not available yet'}, status=503)
+    return JsonResponse(
+        {'type': 'FeatureCollection', 'features': features},
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False},
+    )
+
+# ?format= values of the export and the trip_transfer format each one writes
+EXPORT_FORMATS = {
+    'ndjson': 'jsonl',
+    'jsonl': 'jsonl',
+    'csv': 'csv',
+}
+
+EXPORT_CONTENT_TYPES = {
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+_FIELD_NAME = re.compile(r'^\w+$')
+
+def export_params(request):
+    """Read the format, field and date parameters of the export
+    
+    ?fields= is a comma separated list of properties, ?from= and ?to= are
+    ISO dates (inclusive) matched against TripCompletedOn.
+    
+    Returns:
+        tuple: (format, fields or None, filter, filter parameters)
+        
+    Raises:
+        ValueError: With a message for the client if a parameter is invalid
+    """
+    fmt = EXPORT_FORMATS.get(request.GET.get('format', 'ndjson'))
+    if fmt is None:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    
+    fields = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()] or None
+    if fields and not all(_FIELD_NAME.match(name) for name in fields):
+        raise ValueError('fields must be a comma separated list of property names')
+    
+    dates = {}
+    for param in ('from', 'to'):
+        value = request.GET.get(param)
+        try:
+            dates[param] = datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            raise ValueError(f"{param} must be a date (YYYY-MM-DD)")
+    query_filter, parameters = export_filter(dates['from'], dates['to'])
+    return fmt, fields, query_filter, parameters
+
+def export_response(chunks, fmt):
+    """Streaming attachment response around the chunks of an export"""
+    content_type, extension = EXPORT_CONTENT_TYPES[fmt]
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    filename = f"trips-{datetime.date.today():%Y%m%d}.{extension}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,181 @@
+from dataclasses import MISSING, dataclass, fields, replace
+
+from .photo_manifest import PhotoManifest, load_cover_variants
+from .trip_geo import entity_map_point, parse_point
+
+
+@dataclass(slots=True)
+class TripSummary:
+    """The fields of a trip the listings, facets and map need.
+
+    This is what the catalog cache holds for every trip, so it stays small:
+    no participants, photo manifest or raw coordinate JSON.
+    """
+    row_key: str
+    title: str = 'Untitled Trip'
+    description: str = ''
+    trip_completed_on: object = ''
+    length_hours: object = 0
+    location: str = ''
+    elevation_gain: object = 0
+    difficulty: str = ''
+    map_url: str = ''
+    image_url: str = ''
+    meters_ascend: object = None
+    trip_class: str = ''
+    uiaa_grade: str = ''
+    alpine_grade: str = ''
+    ferata_grade: str = ''
+    # (latitude, longitude) of the high point or parking spot, for the trips map
+    map_point: tuple = None
+    # The entity's own Timestamp property, which the listings sort by
+    timestamp: object = ''
+    # Blob name of the cover photo; None until the trip has a photo manifest
+    cover_photo: str = None
+    # Resized variants of the cover photo (variant -> name/width/height)
+    cover_variants: dict = None
+
+    # Filled in by the views: card image and search highlights
+    first_photo: str = None
+    first_photo_srcset: str = ''
+    search_title: str = None
+    search_snippet: str = None
+
+    def copy(self):
+        """Shallow copy, so a view can annotate a trip without touching the cached one"""
+        return replace(self)
+
+
+@dataclass(slots=True)
+class TripRecord(TripSummary):
+    """The full trip shown on the detail and edit pages"""
+    participants: str = ''
+    meters_descend: object = 0
+    parking_json: str = ''
+    high_point_json: str = ''
+    # Parsed (latitude, longitude) of the two points, None when missing or invalid
+    parking_coords: tuple = None
+    high_point_coords: tuple = None
+    photo_manifest: PhotoManifest = None
+    # Entity version, used for the detail page's ETag/Last-Modified headers
+    etag: str = None
+    last_modified: object = None
+
+    def as_trip_data(self):
+        """The editable fields as the trip_data dict create_trip/update_trip take"""
+        return {name: getattr(self, name) for name in EDITABLE_FIELDS}
+
+
+# Fields copied by as_trip_data (e.g. when a trip is duplicated)
+EDITABLE_FIELDS = (
+    'title', 'description', 'trip_completed_on', 'length_hours', 'location',
+    'elevation_gain', 'difficulty', 'map_url', 'image_url', 'participants',
+    'meters_ascend', 'meters_descend', 'uiaa_grade', 'alpine_grade', 'trip_class',
+    'ferata_grade', 'parking_json', 'high_point_json',
+)
+
+
+def _or_none(value):
+    return value or 'none'
+
+
+def _metadata(key):
+    def read(entity):
+        metadata = getattr(entity, 'metadata', None) or {}
+        return metadata.get(key)
+    return read
+
+
+# Field -> (entity property, default, converter). With no property, the
+# converter is called with the whole entity.
+SUMMARY_FIELDS = {
+    'row_key': ('RowKey', None, None),
+    'title': ('Title', 'Untitled Trip', None),
+    'description': ('Description', '', None),
+    'trip_completed_on': ('TripCompletedOn', '', None),
+    'length_hours': ('LengthHours', 0, None),
+    'location': ('Location', '', None),
+    'elevation_gain': ('ElevationGain', 0, None),
+    'difficulty': ('Difficulty', '', None),
+    'map_url': ('MapUrl', '', None),
+    'image_url': ('ImageUrl', '', None),
+    'meters_ascend': ('MetersAscend', None, None),
+    'trip_class': ('TripClass', '', None),
+    'uiaa_grade': ('UiaaGrade', '', None),
+    'alpine_grade': ('AlpineGrade', '', None),
+    'ferata_grade': ('FerataGrade', '', None),
+    'map_point': (None, None, entity_map_point),
+    'timestamp': ('Timestamp', '', None),
+    'cover_photo': ('CoverPhoto', None, None),
+    'cover_variants': ('CoverVariants', None, load_cover_variants),
+}
+
+RECORD_FIELDS = {
+    **SUMMARY_FIELDS,
+    'meters_ascend': ('MetersAscend', 0, None),
+    'trip_class': ('TripClass', None, _or_none),
+    'uiaa_grade': ('UiaaGrade', None, _or_none),
+    'alpine_grade': ('AlpineGrade', None, _or_none),
+    'ferata_grade': ('FerataGrade', None, _or_none),
+    # The detail page reads the two points itself
+    'map_point': (None, None, None),
+    'cover_variants': (None, None, None),
+    'participants': ('Participants', '', None),
+    'meters_descend': ('MetersDescend', 0, None),
+    'parking_json': ('ParkingJson', '', None),
+    'high_point_json': ('HighPointJson', '', None),
+    'parking_coords': ('ParkingJson', None, parse_point),
+    'high_point_coords': ('HighPointJson', None, parse_point),
+    'photo_manifest': ('PhotoManifest', None, PhotoManifest.from_json),
+    'etag': (None, None, _metadata('etag')),
+    'last_modified': (None, None, _metadata('timestamp')),
+}
+
+
+def _compile(cls, spec):
+    """Build the entity -> cls mapper once, as a plan in the dataclass' field order
+
+    The mapper passes every value positionally, so mapping a trip is one
+    list build and one constructor call.
+    """
+    plan = []
+    for field in fields(cls):
+        if field.name in spec:
+            plan.append(spec[field.name])
+        else:
+            plan.append((None, None if field.default is MISSING else field.default, None))
+    plan = tuple(plan)
+
+    def from_entity(entity):
+        get = entity.get
+        return cls(*[
+            (convert(get(prop, default)) if convert else get(prop, default)) if prop
+            else (convert(entity) if convert else default)
+            for prop, default, convert in plan
+        ])
+    return from_entity
+
+
+summary_from_entity = _compile(TripSummary, SUMMARY_FIELDS)
+record_from_entity = _compile(TripRecord, RECORD_FIELDS)
+
+
+def patch_summary(summary, properties):
+    """Copy of a summary with the fields of the given entity properties replaced
+
+    Used after a MERGE, when only the written properties are known. The map
+    point is recomputed when either point is among them.
+    """
+    changes = {}
+    for name, (prop, default, convert) in SUMMARY_FIELDS.items():
+        if prop is not None and prop in properties:
+            value = properties[prop]
+            changes[name] = convert(value) if convert else value
+    if 'ParkingJson' in properties or 'HighPointJson' in properties:
+        changes['map_point'] = entity_map_point(properties)
+    return replace(summary, **changes)
+
+
+def summaries_from_entities(entities):
+    """Map entities to TripSummary objects, skipping entities without a RowKey"""
+    return [summary_from_entity(entity) for entity in entities if entity.get('RowKey')]
@@ -0,0 +1,95 @@
+import logging
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+logger = logging.getLogger(__name__)
+
+# Relevance weights of the indexed columns: row_key (not indexed), title,
+# description, participants, location
+BM25_WEIGHTS = '0.0, 10.0, 1.0, 2.0, 4.0'
+
+# Words of context around the matches in a snippet
+SNIPPET_TOKENS = 16
+
+# Longer queries are cut to this many words
+MAX_QUERY_TERMS = 8
+
+# FTS5 wraps matches in these; they are swapped for <mark> after escaping the text
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+SEARCH_SQL = f"""
+    SELECT trip.*,
+           highlight(trips_trip_fts, 1, '{_MATCH_START}', '{_MATCH_END}') AS search_title,
+           snippet(trips_trip_fts, -1, '{_MATCH_START}', '{_MATCH_END}', '…', {SNIPPET_TOKENS}) AS search_snippet
+    FROM trips_trip_fts
+    JOIN trips_trip AS trip ON trip.row_key = trips_trip_fts.row_key
+    WHERE trips_trip_fts MATCH %s
+    ORDER BY bm25(trips_trip_fts, {BM25_WEIGHTS})
+    LIMIT %s OFFSET %s
+"""
+
+
+def build_match_query(text):
+    """Turn what the user typed into an FTS5 query
+
+    Every word must match; the last one also matches as a prefix, so results
+    show up while a word is still being typed. Words are quoted, so FTS5
+    operators and punctuation in the input are never interpreted.
+
+    Returns:
+        str or None: The MATCH expression, or None if the text has no words
+    """
+    terms = re.findall(r'\w+', text or '')[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight_html(text):
+    """Escape FTS5 highlight/snippet output and mark the matched words"""
+    html = escape(text or '')
+    return mark_safe(html.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>'))
+
+
+def search(text, limit, offset=0):
+    """Search the mirrored trips, best matches first
+
+    Args:
+        text (str): The search text as typed
+        limit (int): Maximum number of results
+        offset (int): Number of results to skip
+
+    Returns:
+        tuple: (list of (Trip, title HTML, snippet HTML), True if more results follow)
+    """
+    from .models import Trip
+
+    match = build_match_query(text)
+    if match is None:
+        return [], False
+
+    rows = list(Trip.objects.raw(SEARCH_SQL, [match, limit + 1, offset]))
+    logger.info(f"Search {match!r} found {len(rows)} trips (offset {offset})")
+    results = [
+        (row, highlight_html(row.search_title), highlight_html(row.search_snippet))
+        for row in rows[:limit]
+    ]
+    return results, len(rows) > limit
+
+
+def rebuild_index():
+    """Rebuild the search index from the mirrored trips"""
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM trips_trip_fts")
+        cursor.execute(
+            "INSERT INTO trips_trip_fts (row_key, title, description, participants, location) "
+            "SELECT row_key, title, coalesce(description, ''), coalesce(participants, ''), coalesce(location, '') "
+            "FROM trips_trip"
+        )
+        cursor.execute("INSERT INTO trips_trip_fts (trips_trip_fts) VALUES ('optimize')")
@@ -0,0 +1,429 @@
+"""Bulk import and export of trip entities as JSON Lines or CSV.
+
+Exports stream the table page by page. Imports stream the input, group the
+entities into transactions of up to 100 per partition and submit several
+transactions at once. A checkpoint file records how far the input has been
+written, so a failed import can be resumed without starting over.
+"""
+import contextvars
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from azure.data.tables import UpdateMode
+
+from .local_storage import MAX_TRANSACTION_OPERATIONS, decode_property, encode_property
+from .partitions import TRIPS_PARTITION, get_trip_partitions
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('jsonl', 'csv')
+
+# Columns of a CSV export. JSON Lines keeps every property; CSV keeps these
+CSV_FIELDS = (
+    'PartitionKey', 'RowKey', 'Title', 'Description', 'TripCompletedOn', 'LengthHours',
+    'Location', 'ElevationGain', 'Difficulty', 'MapUrl', 'ImageUrl', 'Participants',
+    'MetersAscend', 'MetersDescend', 'TripClass', 'UiaaGrade', 'AlpineGrade', 'FerataGrade',
+    'ParkingJson', 'HighPointJson', 'PhotoManifest', 'CoverPhoto', 'CoverVariants',
+)
+
+# CSV cells are text; these properties are converted back to numbers on import
+NUMERIC_PROPERTIES = {
+    'LengthHours': float,
+    'ElevationGain': int,
+    'MetersAscend': int,
+    'MetersDescend': int,
+}
+
+# Entities per table page of a streamed export, and so per chunk of the response
+EXPORT_PAGE_SIZE = 500
+
+# Table Storage rejects transactions over 4 MiB; batches are cut well below that
+MAX_BATCH_BYTES = 3 * 1024 * 1024
+
+# Defaults of the import_trips options
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRIES = 3
+
+# Characters Table Storage does not allow in PartitionKey and RowKey
+_INVALID_KEY = re.compile(r'[/\\#?\x00-\x1f\x7f-\x9f]')
+
+
+def guess_format(path):
+    """'csv' for .csv files, else 'jsonl'"""
+    return 'csv' if str(path).lower().endswith('.csv') else 'jsonl'
+
+
+def _csv_value(value):
+    value = getattr(value, 'value', value)
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def iter_jsonl(entities):
+    """Encode entities as JSON Lines, one line per entity"""
+    for entity in entities:
+        properties = {name: encode_property(value) for name, value in entity.items()}
+        yield json.dumps(properties, ensure_ascii=False) + '\n'
+
+
+def iter_csv(entities, fields=CSV_FIELDS, header=True):
+    """Encode entities as CSV: a header line (unless ``header`` is False), then one row per entity"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    if header:
+        writer.writerow(fields)
+        yield flush()
+    for entity in entities:
+        writer.writerow([_csv_value(entity.get(name)) for name in fields])
+        yield flush()
+
+
+def encode_entities(entities, fmt, fields=CSV_FIELDS):
+    """Lines of an export in the given format"""
+    if fmt == 'csv':
+        return iter_csv(entities, fields)
+    return iter_jsonl(entities)
+
+
+def export_filter(completed_from=None, completed_until=None):
+    """Table query clauses for a completion date range
+
+    TripCompletedOn holds ISO date strings, so the range is a string
+    comparison the table evaluates; trips without a date are left out.
+
+    Args:
+        completed_from (date, optional): First day to include
+        completed_until (date, optional): Last day to include
+
+    Returns:
+        tuple: (filter string or None, parameters)
+    """
+    clauses = []
+    parameters = {}
+    if completed_from is not None:
+        clauses.append('TripCompletedOn ge @completed_from')
+        parameters['completed_from'] = completed_from.isoformat()
+    if completed_until is not None:
+        # Dates with a time part sort after the bare date, so compare with the next day
+        clauses.append('TripCompletedOn lt @completed_before')
+        parameters['completed_before'] = (completed_until + datetime.timedelta(days=1)).isoformat()
+    return (' and '.join(clauses) or None), parameters
+
+
+def _export_chunk(entities, fmt, fields, first):
+    if fmt == 'csv':
+        return ''.join(iter_csv(entities, fields or CSV_FIELDS, header=first))
+    if fields:
+        entities = ({name: entity[name] for name in fields if name in entity} for entity in entities)
+    return ''.join(iter_jsonl(entities))
+
+
+def iter_export_chunks(pages, fmt, fields=None):
+    """Encode table pages as export text, one chunk per page
+
+    Only one page is held at a time, so memory stays flat however large the
+    table is. A CSV export starts with its header before the first page is read.
+
+    Args:
+        pages (iterable): (entities, continuation token) pairs, as from iter_entity_pages
+        fmt (str): 'jsonl' or 'csv'
+        fields (list, optional): Properties to write, in order (default:
+            every property for JSON Lines, CSV_FIELDS for CSV)
+    """
+    if fmt == 'csv':
+        yield _export_chunk([], fmt, fields, first=True)
+    for entities, _ in pages:
+        yield _export_chunk(entities, fmt, fields, first=False)
+
+
+async def aiter_export_chunks(pages, fmt, fields=None):
+    """Async version of iter_export_chunks, for pages from the aio table service"""
+    if fmt == 'csv':
+        yield _export_chunk([], fmt, fields, first=True)
+    async for entities, _ in pages:
+        yield _export_chunk(entities, fmt, fields, first=False)
+
+
+def _check_entity(entity):
+    """Put the trip in its partition and check the keys; returns an error message or None"""
+    row_key = entity.get('RowKey')
+    # Whatever partition the trip was exported from, it goes where the current scheme puts it
+    if isinstance(row_key, str) and row_key:
+        entity['PartitionKey'] = get_trip_partitions().partition_of(row_key)
+    else:
+        entity.setdefault('PartitionKey', TRIPS_PARTITION)
+    for key in ('PartitionKey', 'RowKey'):
+        value = entity.get(key)
+        if not isinstance(value, str) or not value:
+            return f'{key} is missing'
+        if _INVALID_KEY.search(value) or len(value.encode('utf-8')) > 1024:
+            return f'{key} {value!r} is not a valid key'
+    return None
+
+
+def _read_jsonl(stream):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            yield number, None, None
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield number, None, f'invalid JSON: {e}'
+            continue
+        if not isinstance(data, dict):
+            yield number, None, 'not a JSON object'
+            continue
+        entity = {name: decode_property(value) for name, value in data.items() if value is not None}
+        yield number, entity, _check_entity(entity)
+
+
+def _read_csv(stream):
+    for number, row in enumerate(csv.DictReader(stream), 1):
+        entity = {}
+        error = None
+        for name, value in row.items():
+            if name is None or value in (None, ''):
+                continue
+            convert = NUMERIC_PROPERTIES.get(name)
+            if convert is not None:
+                try:
+                    value = convert(value)
+                except ValueError:
+                    error = f'{name} {value!r} is not a number'
+                    break
+            entity[name] = value
+        yield number, entity, error or _check_entity(entity)
+
+
+def read_entities(stream, fmt):
+    """Parse an import stream
+
+    Yields:
+        tuple: (record number, entity, error message or None). Records are
+        lines for JSON Lines and rows for CSV, numbered from 1; blank lines
+        yield a None entity without an error.
+    """
+    if fmt == 'csv':
+        return _read_csv(stream)
+    return _read_jsonl(stream)
+
+
+@dataclass
+class ImportResult:
+    """Outcome of import_entities"""
+    imported: int = 0
+    batches: int = 0
+    # (record number, error) of the records that could not be read
+    invalid: list = field(default_factory=list)
+    # Set when a batch still failed after its retries; the import stopped there
+    error: str = None
+    # Every record before this one is written (or invalid), see ImportCheckpoint
+    next_record: int = 1
+
+
+class ImportCheckpoint:
+    """JSON file recording how far an import got
+
+    Batches finish out of order, so the file holds a low-water mark: every
+    record before ``next_record`` is written. Records after it may be
+    written again on resume, which is harmless because imports upsert.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+
+    def load(self):
+        """Record to resume from (1 without a checkpoint)
+
+        Raises:
+            ValueError: If the checkpoint belongs to another input
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 1
+        if data.get('source') != self.source:
+            raise ValueError(f"{self.path} is the checkpoint of {data.get('source')}, not {self.source}")
+        return int(data.get('next_record', 1))
+
+    def save(self, result):
+        data = {
+            'source': self.source,
+            'next_record': result.next_record,
+            'imported': result.imported,
+            'updated': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        # Write next to the file and rename, so a crash never leaves half a checkpoint
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _Watermark:
+    """Lowest record number not yet done, given records that finish in any order"""
+
+    def __init__(self, start):
+        self.next_record = start
+        self._done = set()
+
+    def done(self, numbers):
+        self._done.update(numbers)
+        while self.next_record in self._done:
+            self._done.discard(self.next_record)
+            self.next_record += 1
+
+
+class _Batch:
+    """Entities of one partition waiting to be submitted, keyed by RowKey"""
+
+    def __init__(self):
+        self.entities = {}
+        self.numbers = []
+        self.size = 0
+
+    def add(self, number, entity, size):
+        # The same entity twice in one transaction is rejected; the later record wins
+        self.entities[entity['RowKey']] = entity
+        self.numbers.append(number)
+        self.size += size
+
+
+def _submit(service, operations, retries):
+    """Submit one batch, retrying with backoff; returns (success, count or message)"""
+    for attempt in range(retries + 1):
+        success, result = service.submit_batch(operations)
+        if success or attempt == retries:
+            return success, result
+        delay = min(0.5 * 2 ** attempt, 10)
+        logger.warning(f"Batch of {len(operations)} entities failed ({result}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def import_entities(service, records, mode=UpdateMode.REPLACE, batch_size=MAX_TRANSACTION_OPERATIONS,
+                    concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES, start_record=1,
+                    checkpoint=None, progress=None):
+    """Write entities to the table in concurrent per-partition transactions
+
+    Args:
+        service (AzureTableService): Table to write to (via submit_batch)
+        records (iterable): (record number, entity, error) as from read_entities
+        mode (UpdateMode): REPLACE overwrites existing trips, MERGE only sets
+            the properties the records have
+        batch_size (int): Entities per transaction, at most 100
+        concurrency (int): Transactions in flight at once
+        retries (int): Attempts after the first for a failing transaction
+        start_record (int): Skip the records before this one (resuming)
+        checkpoint (ImportCheckpoint, optional): Saved after every transaction
+        progress (callable, optional): Called with the ImportResult, at most
+            once a second
+
+    Returns:
+        ImportResult: Counts, unreadable records and the first error, if any
+    """
+    batch_size = max(1, min(batch_size, MAX_TRANSACTION_OPERATIONS))
+    result = ImportResult(next_record=start_record)
+    watermark = _Watermark(start_record)
+    buffers = {}
+    pending = {}
+    last_progress = 0.0
+
+    def report(force=False):
+        nonlocal last_progress
+        result.next_record = watermark.next_record
+        if checkpoint is not None:
+            checkpoint.save(result)
+        if progress is not None and (force or time.monotonic() - last_progress >= 1):
+            last_progress = time.monotonic()
+            progress(result)
+
+    def submit(executor, partition):
+        batch = buffers.pop(partition)
+        operations = [('upsert', entity, {'mode': mode}) for entity in batch.entities.values()]
+        future = executor.submit(contextvars.copy_context().run, _submit, service, operations, retries)
+        pending[future] = batch
+
+    def collect(block):
+        if block:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in pending if future.done()]
+        for future in done:
+            batch = pending.pop(future)
+            success, outcome = future.result()
+            if success:
+                result.imported += outcome
+                result.batches += 1
+                watermark.done(batch.numbers)
+            elif result.error is None:
+                result.error = outcome
+        if done:
+            report()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='trip-import') as executor:
+        try:
+            for number, entity, error in records:
+                if number < start_record:
+                    continue
+                if error is not None or entity is None:
+                    if error is not None:
+                        result.invalid.append((number, error))
+                        logger.warning(f"Skipping record {number}: {error}")
+                    watermark.done([number])
+                    continue
+
+                size = len(json.dumps({name: encode_property(value) for name, value in entity.items()}))
+                partition = entity['PartitionKey']
+                batch = buffers.get(partition)
+                if batch is not None and batch.size + size > MAX_BATCH_BYTES:
+                    submit(executor, partition)
+                batch = buffers.setdefault(partition, _Batch())
+                batch.add(number, entity, size)
+                if len(batch.entities) >= batch_size:
+                    submit(executor, partition)
+
+                collect(block=len(pending) >= concurrency * 2)
+                if result.error is not None:
+                    break
+
+            if result.error is None:
+                for partition in list(buffers):
+                    submit(executor, partition)
+            while pending:
+                collect(block=True)
+        finally:
+            # Interrupted: drop what has not started, keep what finishes
+            for future in pending:
+                future.cancel()
+            for future in [future for future in pending if future.cancelled()]:
+                pending.pop(future)
+            while pending:
+                collect(block=True)
+            report(force=True)
+
+    return result
@@ -1,16 +1,32 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI the storage-heavy pages can use the async view stack
+if settings.TRIPS_ASYNC_VIEWS:
+    from . import async_views as page_views
+else:
+    page_views = views
+
 app_name = 'trips'
 
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('all/', views.all_trips, name='all_trips'),
-    path('trip/new/', views.trip_edit, name='trip_create'),
-    path('trip/<str:trip_id>/', views.trip_detail, name='trip_detail'),
-    path('trip/<str:trip_id>/edit/', views.trip_edit, name='trip_edit'),
+    path('', page_views.index, name='index'),
+    path('all/', page_views.all_trips, name='all_trips'),
+    path('search/', page_views.trip_search, name='trip_search'),
+    path('map/', views.trip_map, name='trip_map'),
+    path('map/features/', page_views.trip_map_features, name='trip_map_features'),
+    path('trip/new/', page_views.trip_edit, name='trip_create'),
+    path('trip/<str:trip_id>/', page_views.trip_detail, name='trip_detail'),
+    path('trip/<str:trip_id>/edit/', page_views.trip_edit, name='trip_edit'),
+    path('trip/<str:trip_id>/photos/', page_views.trip_photos_upload, name='trip_photos_upload'),
+    path('trip/<str:trip_id>/photos/upload-urls/', views.trip_photo_upload_urls, name='trip_photo_upload_urls'),
+    path('trip/<str:trip_id>/photos/finalize/', views.trip_photos_finalize, name='trip_photos_finalize'),
     path('trip/<str:trip_id>/copy/', views.trip_copy, name='trip_copy'),
     path('trip/<str:trip_id>/delete/', views.trip_delete, name='trip_delete'),
+    path('export/', page_views.trip_export, name='trip_export'),
+    path('metrics/', views.trip_metrics, name='trip_metrics'),
+    path('media/<str:container_name>/<path:blob_name>', views.storage_media, name='storage_media'),
     path('debug/', views.debug_azure, name='debug_azure'),
     path('debug-logging/', views.debug_logging, name='debug_logging'),
 ]
@@ -4,13 +4,47 @@ from django.conf import settings
 import json
 import traceback
 import logging
-from django.http import HttpResponse, HttpResponseServerError
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseServerError, JsonResponse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.urls import reverse
 
-from .azure_service import AzureTableService
-from .blob_service import AzureBlobService
+from azure.core.exceptions import ResourceNotFoundError
+
+from .azure_service import TRIP_CHANGED, AzureTableService
+from .blob_service import AzureBlobService, photo_sources_from_url
+from .fanout import StorageFanout
 from .forms import TripEditForm
+from .http_cache import finish_response, not_modified, page_etag
+from .page_cache import cache_rendered_page, fragment_cache_context, get_cached_page
+from .storage_backends import get_storage_backend
+from .timing import metrics
+from .trip_facets import parse_selection
+from .trip_pages import (
+    INDEX_TRIP_COUNT,
+    all_trips_context,
+    all_trips_params,
+    direct_uploads_enabled,
+    edit_context,
+    edited_fields_changed,
+    export_params,
+    export_response,
+    lists_photos_with_trip,
+    map_features_response,
+    map_params,
+    may_retry_save,
+    report_uploads,
+    search_context,
+    search_json,
+    search_params,
+    set_cover_photos,
+    set_listed_photo,
+    trip_conflict_context,
+    trip_data_from_form,
+    trip_detail_context,
+    trip_edit_initial,
+    upload_results_response,
+)
+from .trip_transfer import EXPORT_PAGE_SIZE, iter_export_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +54,11 @@ def trip_delete(request, trip_id):
     """Delete a trip and redirect to all trips with a message."""
     if request.method == 'POST':
         service = get_data_service()
-        try:
-            table_client = service.get_table_client()
-            table_client.delete_entity(partition_key='Trips', row_key=trip_id)
+        success, error_msg = service.delete_trip(trip_id)
+        if success:
             messages.success(request, 'Trip deleted successfully.')
-        except Exception as e:
-            logger.error(f"Error deleting trip {trip_id}: {str(e)}", exc_info=True)
-            messages.error(request, f'Failed to delete trip: {str(e)}')
+        else:
+            messages.error(request, f'Failed to delete trip: {error_msg}')
         return redirect('trips:all_trips')
     else:
         # Show confirmation page or redirect if GET
@@ -42,10 +74,8 @@ def trip_copy(request, trip_id):
         return HttpResponse('Original trip not found.', status=404)
 
     # Prepare new trip data (exclude photos, add ' (copy)' to title)
-    new_trip_data = trip.copy()
-    new_trip_data['title'] = f"{trip.get('title', '')} (copy)"
-    new_trip_data.pop('row_key', None)
-    new_trip_data.pop('partition_key', None)
+    new_trip_data = trip.as_trip_data()
+    new_trip_data['title'] = f"{trip.title or ''} (copy)"
     # Remove or reset any fields you do not want to copy (e.g., completion date, etc.)
     # Optionally, clear trip_completed_on or other fields if needed
     # new_trip_data['trip_completed_on'] = None
@@ -58,99 +88,121 @@ def trip_copy(request, trip_id):
     # Redirect to edit page for the new trip
     return redirect(reverse('trips:trip_edit', kwargs={'trip_id': new_row_key}))
 
+# Services are stateless wrappers around the clients of the storage backend,
+# so one instance per worker process is shared by all requests.
+_data_service = None
+_blob_service = None
+
 def get_data_service():
-    """Get the Azure Table service"""
-    print("Creating AzureTableService...")
-    connection_string = settings.AZURE_STORAGE_CONNECTION_STRING
-    print(f"Connection string (first 20 chars): {connection_string[:20]}...")
-    return AzureTableService(
-        connection_string=connection_string,
-        table_name=settings.AZURE_TABLE_NAME
-    )
+    """Get the shared Azure Table service"""
+    global _data_service
+    if _data_service is None:
+        _data_service = AzureTableService(
+            connection_string=settings.AZURE_STORAGE_CONNECTION_STRING,
+            table_name=settings.AZURE_TABLE_NAME,
+            storage=get_storage_backend(),
+        )
+    return _data_service
+
+def get_blob_service():
+    """Get the shared Azure Blob service"""
+    global _blob_service
+    if _blob_service is None:
+        _blob_service = AzureBlobService(table_service=get_data_service(), storage=get_storage_backend())
+    return _blob_service
 
 def index(request):
     """Landing page with trip previews"""
     try:
-        print("Index view called")
-        print(f"AZURE_STORAGE_CONNECTION_STRING: {settings.AZURE_STORAGE_CONNECTION_STRING[:20]}...")
-        print(f"AZURE_TABLE_NAME: {settings.AZURE_TABLE_NAME}")
-        
         service = get_data_service()
-        blob_service = AzureBlobService()
-        trips = service.get_all_trips()
-        
-        if trips and len(trips) > 0:
-            print(f"Retrieved {len(trips)} trips")
-            print("First trip values:")
-            for key, value in trips[0].items():
-                print(f"  {key}: {value}")
+        blob_service = get_blob_service()
         
-        # Note: Trips are already sorted by timestamp (newest first) in the AzureTableService
+        # The landing page only changes when the trip catalog does
+        version, last_modified = service.get_catalog_version()
+        etag = page_etag(request, version)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = get_cached_page(etag)
+        if response is not None:
+            return finish_response(request, response, etag, last_modified)
         
-        # Take only the first 6 trips for the landing page
-        featured_trips = trips[:6]
-        print(f"Selected {len(featured_trips)} featured trips")
+        # Only the newest trips are read: row keys sort newest first, so this is a $top query
+        featured_trips = service.get_latest_trips(INDEX_TRIP_COUNT)
+        logger.debug(f"Selected {len(featured_trips)} trips for the landing page")
         
-        # Get the first photo for each trip
-        for trip in featured_trips:
-            photos = blob_service.list_photos(trip['row_key'])
-            trip['first_photo'] = photos[0] if photos else None
+        # Get the first photo for each trip from its manifest; only trips
+        # without a manifest yet need a blob listing, and those run in parallel
+        with StorageFanout() as fanout:
+            unlisted = set_cover_photos(featured_trips, blob_service)
+            for trip in unlisted:
+                fanout.submit(trip.row_key, blob_service.list_photos, trip.row_key, default=[])
+            
+            for trip in unlisted:
+                set_listed_photo(trip, fanout.result(trip.row_key))
         
-        return render(request, 'trips/index.html', {
+        response = render(request, 'trips/index.html', {
             'trips': featured_trips,
+            **fragment_cache_context(version),
         })
+        return finish_response(request, cache_rendered_page(etag, response), etag, last_modified)
     except Exception as e:
-        print(f"Error in index view: {e}")
-        print(traceback.format_exc())
+        logger.error(f"Error in index view: {e}", exc_info=True)
         # Return a simple error page instead of crashing
         return render(request, 'trips/error.html', {
             'error': str(e),
             'traceback': traceback.format_exc()
         })
 
-def trip_detail(request, trip_id):
-    """Detail page for a specific trip"""
-    service = get_data_service()
-    trip = service.get_trip_by_id(trip_id)
+def _load_trip_with_photos(trip_id):
+    """Load a trip and its photos
     
-    if not trip:
-        return render(request, 'trips/not_found.html')
+    Photos normally come from the trip's manifest; trips without one need a
+    blob listing too (see trip_pages.lists_photos_with_trip).
     
-    # Parse JSON coordinates for map display
-    parking_coords = None
-    high_point_coords = None
+    Returns:
+        tuple: (TripRecord or None, list of photo source dicts)
+    """
+    service = get_data_service()
+    blob_service = get_blob_service()
+    list_in_parallel = lists_photos_with_trip(service.get_cached_trip(trip_id))
     
-    if trip.get('parking_json'):
-        try:
-            parking_data = json.loads(trip['parking_json'])
-            parking_coords = {
-                'lat': parking_data.get('Latitude'),
-                'lng': parking_data.get('Longtitude')  # Match the spelling in the database
-            }
-        except:
-            pass
+    with StorageFanout() as fanout:
+        fanout.submit('trip', service.get_trip_by_id, trip_id)
+        if list_in_parallel:
+            fanout.submit('photos', blob_service.list_photos, trip_id, default=[])
+        
+        trip = fanout.result('trip')
+        if not trip:
+            return None, []
+        
+        if trip.photo_manifest is None and list_in_parallel:
+            return trip, [photo_sources_from_url(url) for url in fanout.result('photos')]
+        return trip, blob_service.get_trip_photos(trip_id, trip.photo_manifest)
+
+def trip_detail(request, trip_id):
+    """Detail page for a specific trip"""
+    # The catalog knows the trip's ETag, so a current copy costs no entity read at all
+    etag = page_etag(request, get_data_service().get_trip_version(trip_id))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    response = get_cached_page(etag)
+    if response is not None:
+        return finish_response(request, response, etag)
     
-    if trip.get('high_point_json'):
-        try:
-            high_point_data = json.loads(trip['high_point_json'])
-            high_point_coords = {
-                'lat': high_point_data.get('Latitude'),
-                'lng': high_point_data.get('Longtitude')  # Match the spelling in the database
-            }
-        except:
-            pass
+    trip, trip_photos = _load_trip_with_photos(trip_id)
     
-    # Get trip photos
-    blob_service = AzureBlobService()
-    trip_photos = blob_service.list_photos(trip_id)
+    if not trip:
+        # Links to trips from before the newest-first row keys still work
+        new_trip_id = get_data_service().find_rekeyed_trip(trip_id)
+        if new_trip_id:
+            return redirect('trips:trip_detail', trip_id=new_trip_id, permanent=True)
+        return finish_response(request, render(request, 'trips/not_found.html'))
     
-    return render(request, 'trips/detail.html', {
-        'trip': trip,
-        'parking_coords': json.dumps(parking_coords) if parking_coords else None,
-        'high_point_coords': json.dumps(high_point_coords) if high_point_coords else None,
-        'mapy_cz_api_key': settings.MAPY_CZ_API_KEY,
-        'trip_photos': trip_photos
-    })
+    etag = page_etag(request, trip.etag)
+    response = render(request, 'trips/detail.html', trip_detail_context(trip, trip_photos))
+    return finish_response(request, cache_rendered_page(etag, response), etag, trip.last_modified)
 
 def admin_required(view_func):
     """
@@ -171,23 +223,21 @@ def trip_edit(request, trip_id=None):
     try:
         # Get Azure services
         azure_service = get_data_service()
-        blob_service = AzureBlobService()
+        blob_service = get_blob_service()
         
         # Check if we're editing an existing trip or creating a new one
         is_new_trip = trip_id is None
         trip = None
         trip_photos = []
         
-        if not is_new_trip:
-            # Get existing trip from Azure Table Storage
-            trip = azure_service.get_trip_by_id(trip_id)
+        # A save does not read the trip: the form carries its etag and original values
+        if not is_new_trip and request.method != 'POST':
+            # Get existing trip and its photos from Azure Storage
+            trip, trip_photos = _load_trip_with_photos(trip_id)
             
             if not trip:
                 logger.warning(f"Trip with ID {trip_id} not found")
                 return HttpResponse("Trip not found", status=404)
-            
-            # Get trip photos
-            trip_photos = blob_service.list_photos(trip_id)
         
         # Process form submission
         if request.method == 'POST':
@@ -195,21 +245,9 @@ def trip_edit(request, trip_id=None):
             
             if form.is_valid():
                 # Get form data
-                trip_data = {
-                    'title': form.cleaned_data['title'],
-                    'description': form.cleaned_data['description'],
-                    'trip_completed_on': form.cleaned_data['trip_completed_on'],
-                    'length_hours': form.cleaned_data['length_hours'],
-                    'participants': form.cleaned_data['participants'],
-                    'meters_ascend': form.cleaned_data['meters_ascend'],
-                    'meters_descend': form.cleaned_data['meters_descend'],
-                    'uiaa_grade': form.cleaned_data['uiaa_grade'],
-                    'alpine_grade': form.cleaned_data['alpine_grade'],
-                    'trip_class': form.cleaned_data['trip_class'],
-                    'ferata_grade': form.cleaned_data['ferata_grade'],
-                    'parking_json': form.cleaned_data['parking_json'],
-                    'high_point_json': form.cleaned_data['high_point_json'],
-                }
+                trip_data = trip_data_from_form(form)
+                
+                photo_files = request.FILES.getlist('photos')
                 
                 if is_new_trip:
                     # Create new trip in Azure Table Storage
@@ -217,86 +255,77 @@ def trip_edit(request, trip_id=None):
                     
                     if not success:
                         logger.error(f"Error creating trip: {message}")
-                        return render(request, 'trips/edit.html', {
-                            'form': form,
-                            'is_new': True,
-                            'error': f"Error creating trip: {message}",
-                            'mapy_cz_api_key': settings.MAPY_CZ_API_KEY,
-                        })
+                        return render(request, 'trips/edit.html', edit_context(
+                            form, True, error=f"Error creating trip: {message}",
+                        ))
                     
                     # Set trip_id to the newly created trip's ID
                     trip_id = new_trip_id
                 else:
-                    # Preserve existing location and difficulty values
-                    if 'location' in trip and trip['location']:
-                        trip_data['location'] = trip['location']
-                    
-                    if 'difficulty' in trip and trip['difficulty']:
-                        trip_data['difficulty'] = trip['difficulty']
-                    
-                    # Update trip in Azure Table Storage
-                    success, message = azure_service.update_trip(trip_id, trip_data)
-                    
-                    if not success:
-                        logger.error(f"Error updating trip {trip_id}: {message}")
-                        return render(request, 'trips/edit.html', {
-                            'form': form,
-                            'trip': trip,
-                            'trip_photos': trip_photos,
-                            'is_new': False,
-                            'error': f"Error updating trip: {message}",
-                            'mapy_cz_api_key': settings.MAPY_CZ_API_KEY,
-                        })
+                    # Save the fields first, on this thread: the photo uploads below
+                    # write the trip's manifest, and the user must see the real outcome
+                    success, message = azure_service.update_trip(
+                        trip_id, trip_data,
+                        etag=form.cleaned_data['etag'] or None,
+                        original=form.cleaned_data['original'],
+                    )
+                    attempts = 1
+                    while may_retry_save(message, attempts):
+                        current = azure_service.get_trip_by_id(trip_id)
+                        if not current or edited_fields_changed(form, current):
+                            break
+                        # Only the manifest or cover changed, e.g. by this edit's own uploads
+                        attempts += 1
+                        success, message = azure_service.update_trip(
+                            trip_id, trip_data,
+                            etag=current.etag,
+                            original=form.cleaned_data['original'],
+                        )
+                
+                # Upload the photos in parallel, reporting each file's outcome
+                upload_results = blob_service.upload_photos(trip_id, photo_files)
+                
+                report_uploads(request, upload_results)
                 
-                # Handle photo uploads
-                if request.FILES.getlist('photos'):
-                    for photo_file in request.FILES.getlist('photos'):
-                        success, result = blob_service.upload_photo(trip_id, photo_file)
-                        if not success:
-                            logger.warning(f"Error uploading photo: {result}")
+                if message == TRIP_CHANGED:
+                    # Someone else saved the trip since the form was opened
+                    current = azure_service.get_trip_by_id(trip_id)
+                    if not current:
+                        return HttpResponse("Trip not found", status=404)
+                    return render(request, 'trips/edit_conflict.html', trip_conflict_context(form, current), status=409)
+                
+                if not success:
+                    logger.error(f"Error updating trip {trip_id}: {message}")
+                    trip, trip_photos = _load_trip_with_photos(trip_id)
+                    if not trip:
+                        return HttpResponse("Trip not found", status=404)
+                    return render(request, 'trips/edit.html', edit_context(
+                        form, False, trip, trip_photos, error=f"Error updating trip: {message}",
+                    ))
                 
                 # Redirect to trip detail page
                 return redirect('trips:trip_detail', trip_id=trip_id)
             else:
                 logger.warning(f"Form validation failed: {form.errors}")
+                if not is_new_trip:
+                    trip, trip_photos = _load_trip_with_photos(trip_id)
+                    if not trip:
+                        return HttpResponse("Trip not found", status=404)
         else:
             # Create form with initial values
             initial_data = {}
             
             if not is_new_trip:
                 # Pre-populate form with existing trip data
-                initial_data = {
-                    'title': trip.get('title', ''),
-                    'description': trip.get('description', ''),
-                    'trip_completed_on': trip.get('trip_completed_on', ''),
-                    'length_hours': trip.get('length_hours', ''),
-                    'participants': trip.get('participants', ''),
-                    'meters_ascend': trip.get('meters_ascend', ''),
-                    'meters_descend': trip.get('meters_descend', ''),
-                    'uiaa_grade': trip.get('uiaa_grade', ''),
-                    'alpine_grade': trip.get('alpine_grade', ''),
-                    'trip_class': trip.get('trip_class', ''),
-                    'ferata_grade': trip.get('ferata_grade', ''),
-                    'parking_json': trip.get('parking_json', ''),
-                    'high_point_json': trip.get('high_point_json', ''),
-                }
+                initial_data = trip_edit_initial(trip)
             
             form = TripEditForm(initial=initial_data)
         
         # Render the edit template with the form and trip data
-        context = {
-            'form': form,
-            'is_new': is_new_trip,
-            'mapy_cz_api_key': settings.MAPY_CZ_API_KEY,
-        }
-        
-        if not is_new_trip:
-            context.update({
-                'trip': trip,
-                'trip_photos': trip_photos,
-            })
-        
-        return render(request, 'trips/edit.html', context)
+        return render(request, 'trips/edit.html', edit_context(
+            form, is_new_trip, trip, trip_photos,
+            direct_uploads=direct_uploads_enabled(blob_service, is_new_trip),
+        ))
     except Exception as e:
         # Log the error
         logger.error(f"Error editing trip: {str(e)}")
@@ -304,31 +333,180 @@ def trip_edit(request, trip_id=None):
         logger.error(traceback.format_exc())
         return HttpResponseServerError("An error occurred while editing the trip.")
 
+@admin_required
+def trip_photos_upload(request, trip_id):
+    """Upload several photos to a trip and report the outcome of each file as JSON"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST photos as multipart form data'}, status=405)
+    
+    photo_files = request.FILES.getlist('photos')
+    if not photo_files:
+        return JsonResponse({'error': 'No photos provided'}, status=400)
+    
+    return upload_results_response(trip_id, get_blob_service().upload_photos(trip_id, photo_files))
+
+def _read_json_list(request, key):
+    """Read a list of strings from a JSON request body, or None if the body is invalid"""
+    try:
+        values = json.loads(request.body or b'{}').get(key)
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        return None
+    return values
+
+@admin_required
+def trip_photo_upload_urls(request, trip_id):
+    """Issue SAS URLs so the browser can upload a trip's photos straight to blob storage"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST a JSON body with filenames'}, status=405)
+    blob_service = get_blob_service()
+    if not settings.PHOTO_DIRECT_UPLOADS or not blob_service.supports_direct_uploads():
+        return JsonResponse({'error': 'Direct uploads are not available'}, status=503)
+    
+    filenames = _read_json_list(request, 'filenames')
+    if filenames is None:
+        return JsonResponse({'error': 'Expected {"filenames": [...]}'}, status=400)
+    
+    service = get_data_service()
+    if service.get_cached_trip(trip_id) is None and service.get_trip_by_id(trip_id) is None:
+        return JsonResponse({'error': 'Trip not found'}, status=404)
+    
+    success, result = blob_service.create_upload_urls(trip_id, filenames)
+    if not success:
+        return JsonResponse({'error': result}, status=400)
+    return JsonResponse({'trip_id': trip_id, 'uploads': result})
+
+@admin_required
+def trip_photos_finalize(request, trip_id):
+    """Add photos the browser uploaded with SAS URLs to the trip"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST a JSON body with blob_names'}, status=405)
+    
+    blob_names = _read_json_list(request, 'blob_names')
+    if not blob_names:
+        return JsonResponse({'error': 'Expected {"blob_names": [...]}'}, status=400)
+    
+    return upload_results_response(trip_id, get_blob_service().finalize_uploads(trip_id, blob_names))
+
 def all_trips(request):
-    """Page showing all trips"""
+    """Page showing all trips, one page at a time"""
     service = get_data_service()
-    all_trips = service.get_all_trips()
     
-    # Get filter parameter from request
-    trip_filter = request.GET.get('filter', 'all')
+    # Get filter and paging parameters from request
+    trip_filter, page_size, cursor, page_number = all_trips_params(request)
     
-    # Filter trips based on completion status
-    if trip_filter == 'completed':
-        filtered_trips = [trip for trip in all_trips if trip.get('trip_completed_on')]
-    elif trip_filter == 'future':
-        filtered_trips = [trip for trip in all_trips if not trip.get('trip_completed_on')]
+    version, last_modified = service.get_catalog_version()
+    etag = page_etag(request, version)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+    response = get_cached_page(etag)
+    if response is not None:
+        return finish_response(request, response, etag, last_modified)
+    
+    # One lookup in the facet index gives the page and every count
+    selection = parse_selection(request.GET)
+    counts = facet_counts = None
+    page = service.get_faceted_page(selection, page_size=page_size, cursor=cursor, version=version)
+    if page is not None:
+        trips, next_cursor, facet_counts = page
     else:
-        filtered_trips = all_trips
+        # Without a facet index, a class or year is still looked up in the trip index
+        page = service.get_indexed_page(selection, page_size=page_size, cursor=cursor)
+        if page is None:
+            page = service.get_trips_page(
+                page_size=page_size,
+                cursor=cursor,
+                trip_filter=trip_filter,
+            )
+        trips, next_cursor = page
+        counts = service.get_trip_counts()
     
-    print(f"Filter: {trip_filter}, Total trips: {len(all_trips)}, Filtered trips: {len(filtered_trips)}")
+    context = all_trips_context(trips, next_cursor, counts, trip_filter, page_size, page_number,
+                                 selection, facet_counts)
+    context.update(fragment_cache_context(version))
+    response = render(request, 'trips/all_trips.html', context)
+    return finish_response(request, cache_rendered_page(etag, response), etag, last_modified)
+
+def trip_search(request):
+    """Full-text search over trip titles, descriptions, participants and locations"""
+    query, page_size, page_number = search_params(request)
+    results = ([], False)
+    if query:
+        results = get_data_service().search_trips(query, page_size, (page_number - 1) * page_size)
     
-    return render(request, 'trips/all_trips.html', {
-        'trips': filtered_trips,
-        'current_filter': trip_filter,
-        'completed_count': len([trip for trip in all_trips if trip.get('trip_completed_on')]),
-        'future_count': len([trip for trip in all_trips if not trip.get('trip_completed_on')]),
-        'total_count': len(all_trips),
-    })
+    if request.GET.get('format') == 'json':
+        return search_json(query, results, page_number)
+    return render(request, 'trips/search.html', search_context(query, results, page_size, page_number))
+
+def trip_map(request):
+    """Map of all trips; the markers are loaded from trip_map_features as the map moves"""
+    return render(request, 'trips/map.html', {'mapy_cz_api_key': settings.MAPY_CZ_API_KEY})
+
+def trip_map_features(request):
+    """Trips within ?bbox=west,south,east,north as GeoJSON, clustered at low ?zoom= levels"""
+    bbox, zoom = map_params(request)
+    if bbox is None:
+        return JsonResponse({'error': 'bbox must be west,south,east,north'}, status=400)
+    
+    service = get_data_service()
+    version, last_modified = service.get_catalog_version()
+    etag = page_etag(request, version)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+    
+    response = map_features_response(service.get_map_features(bbox, zoom, version=version))
+    return finish_response(request, response, etag, last_modified)
+
+@admin_required
+def trip_metrics(request):
+    """Latency histograms of this worker, per view and per storage call (JSON)
+    
+    POST with reset=1 clears them, e.g. before a load test.
+    """
+    if request.method == 'POST' and request.POST.get('reset') == '1':
+        metrics.reset()
+    response = JsonResponse(metrics.snapshot())
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@admin_required
+def trip_export(request):
+    """Download every trip as NDJSON or CSV, streamed one table page at a time
+    
+    Takes ?format=ndjson|csv, ?fields=Title,TripCompletedOn,... and the
+    ?from= / ?to= completion dates. Rows go out as the pages arrive, so the
+    first byte comes after one page and memory does not grow with the table.
+    """
+    try:
+        fmt, fields, query_filter, parameters = export_params(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    pages = get_data_service().iter_trip_entity_pages(
+        page_size=EXPORT_PAGE_SIZE,
+        query_filter=query_filter,
+        parameters=parameters,
+        select=fields,
+    )
+    logger.info(f"Exporting trips as {fmt} (fields: {fields or 'all'}, filter: {query_filter or 'none'})")
+    return export_response(iter_export_chunks(pages, fmt, fields), fmt)
+
+def storage_media(request, container_name, blob_name):
+    """Serve a photo of the local or in-memory storage backend (Azure serves its own)"""
+    try:
+        opened = get_storage_backend().open_blob(container_name, blob_name)
+    except ResourceNotFoundError:
+        opened = None
+    if opened is None:
+        raise Http404('Photo not found')
+    
+    stream, content_type = opened
+    response = FileResponse(stream, content_type=content_type or 'application/octet-stream')
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
 
 def debug_azure(request):
     """Debug view to test Azure connection"""
@@ -338,23 +516,23 @@ def debug_azure(request):
     try:
         # Get the raw connection string from settings
         connection_string = settings.AZURE_STORAGE_CONNECTION_STRING
-        print(f"Connection string (first 20 chars): {connection_string[:20]}...")
+        logger.debug(f"Connection string (first 20 chars): {connection_string[:20]}...")
         
         # Get a specific trip to see all available attributes
         service = get_data_service()
+        backend = service.storage.describe()
         
         # Get all trips first
         all_trips = service.get_all_trips()
-        print(f"Retrieved {len(all_trips)} trips")
+        logger.debug(f"Retrieved {len(all_trips)} trips")
         
         if all_trips:
             # Get the first trip's row_key
-            first_trip_id = all_trips[0]['row_key']
-            print(f"Getting details for trip: {first_trip_id}")
+            first_trip_id = all_trips[0].row_key
+            logger.debug(f"Getting details for trip: {first_trip_id}")
             
             # Get the raw entity from Azure Table
-            table_client = service.get_table_client()
-            raw_entity = table_client.get_entity(partition_key="Trips", row_key=first_trip_id)
+            raw_entity = service.get_trip_entity(first_trip_id)
             
             # Convert to a dictionary with all attributes
             trip_data = {}
@@ -365,6 +543,8 @@ def debug_azure(request):
             return JsonResponse({
                 'status': 'success',
                 'message': 'Azure connection successful',
+                'storage_backend': backend,
+                'partitions': str(service.partitions),
                 'trip_count': len(all_trips),
                 'sample_trip_id': first_trip_id,
                 'sample_trip_data': trip_data
@@ -373,6 +553,8 @@ def debug_azure(request):
             return JsonResponse({
                 'status': 'warning',
                 'message': 'Azure connection successful but no trips found',
+                'storage_backend': backend,
+                'partitions': str(service.partitions),
                 'trip_count': 0
             })
     except Exception as e: